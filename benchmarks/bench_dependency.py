@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Dependency graph lookup microbenchmark
+
+Builds sheets of 1k/10k/100k lines forming one long dependency chain
+(line i defines v{i} and uses v{i-1}) and times graph construction,
+transitive affected-line lookup from the head and middle of the chain,
+and direct dependents lookup. Run it on two checkouts to compare:
+
+    python benchmarks/bench_dependency.py [--sizes 1000,10000] [--repeat R]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_incremental import DependencyGraph, LineResult
+
+
+def _make_chain(count: int) -> list[LineResult]:
+    """Build count line results forming a single chain v0 <- v1 <- ... <- v{count-1}."""
+    results = []
+    for i in range(count):
+        used = [f'v{i - 1}'] if i else []
+        results.append(LineResult(i, f'v{i} = v{i - 1} + 1', '', i,
+                                  variables_defined=[f'v{i}'], variables_used=used))
+    return results
+
+
+def _best_ms(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CalcPaper dependency graph lookup cost')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated sheet sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions (best is reported)')
+    parser.add_argument('--max-quadratic', type=int, default=10000,
+                        help='skip chain walks above this size on trees without a reverse index')
+    args = parser.parse_args()
+
+    for count in (int(s) for s in args.sizes.split(',')):
+        results = _make_chain(count)
+        graph = DependencyGraph()
+        graph.build(results)
+        indexed = hasattr(graph, '_var_users')
+
+        print(f'{count} lines, best of {args.repeat}')
+        print(f'  {"build":<28} {_best_ms(lambda: graph.build(results), args.repeat):10.2f} ms')
+        if indexed or count <= args.max_quadratic:
+            head = _best_ms(lambda: graph.get_affected_lines([0]), args.repeat)
+            middle = _best_ms(lambda: graph.get_affected_lines([count // 2]), args.repeat)
+            print(f'  {"get_affected_lines (head)":<28} {head:10.2f} ms')
+            print(f'  {"get_affected_lines (middle)":<28} {middle:10.2f} ms')
+        else:
+            print(f'  {"get_affected_lines":<28} {"skipped":>10}')
+        users = _best_ms(lambda: graph.get_users({f'v{count // 2}'}), args.repeat)
+        print(f'  {"get_users (one var)":<28} {users:10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
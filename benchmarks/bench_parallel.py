@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Parallel evaluation benchmark
+
+Builds a sheet of independent chains (each chain only references its own
+variables) and times a full process_text serially and on a process pool.
+Speedup requires more than one CPU core:
+
+    python benchmarks/bench_parallel.py [--chains 8] [--length 500] [--workers 1,2,4]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_paper import CalculatorPaperAdvanced
+from calc_parallel import shutdown_executors
+
+
+def _make_sheet(chains: int, length: int) -> str:
+    """Build chains x length lines; chain c is c0_0 <- c0_1 <- ... with some arithmetic per line."""
+    lines = []
+    for c in range(chains):
+        lines.append(f'c{c}_0 = {c + 1} * 3.5')
+        for i in range(1, length):
+            lines.append(f'c{c}_{i} = (c{c}_{i - 1} * 1.0001 + {i}) / 2 + sqrt({i})')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CalcPaper parallel evaluation cost')
+    parser.add_argument('--chains', type=int, default=8, help='number of independent chains')
+    parser.add_argument('--length', type=int, default=500, help='lines per chain')
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    text = _make_sheet(args.chains, args.length)
+    print(f'{args.chains} chains x {args.length} lines, {os.cpu_count()} CPU(s), best of {args.repeat}')
+    expected = None
+    for workers in (int(w) for w in args.workers.split(',')):
+        calc = CalculatorPaperAdvanced()
+        calc.parallel_workers = workers
+        calc.parallel_min_lines = 0
+        calc.process_text(text)  # Warm up the pool
+        best = min(timeit.repeat(lambda: calc.process_text(text), number=1, repeat=args.repeat))
+        if expected is None:
+            expected = calc.results
+        status = 'ok' if calc.results == expected else 'MISMATCH'
+        print(f'  workers={workers:<3} {best * 1e3:10.2f} ms  {status}')
+    shutdown_executors()
+
+
+if __name__ == '__main__':
+    main()
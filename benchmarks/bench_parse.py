@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Per-line parse cost microbenchmark
+
+Measures the text analysis done for every input line by the parser, the
+incremental engine, the syntax highlighter and the GUI autocomplete scan.
+Run it on two checkouts to compare before/after:
+
+    python benchmarks/bench_parse.py [--lines N] [--repeat R]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_paper import CalculatorPaperAdvanced
+from calc_syntax import SyntaxHighlighter
+from calc_incremental import IncrementalCalcEngine
+from calc_session import GlobalVariableStore
+
+try:
+    from calc_parser import compile_line
+except ImportError:  # Older trees without the compiled line cache
+    compile_line = None
+
+
+SAMPLE_LINES = [
+    '# Monthly budget',
+    'rent = 3,500',
+    'food = 1200 * 1.05',
+    'total = rent + food  # inline comment',
+    'tax = total * 8%',
+    'mask = 0xFF00 | 0b1010',
+    'hex(mask >> 4)',
+    'bitmap(swap(0x1234), 1, 16)',
+    'start = Y20260410',
+    'end = start + D10',
+    'f(x, y) = 3x + 5y',
+    '(total - tax) / 12',
+    '',
+]
+
+
+def _make_lines(count: int) -> list[str]:
+    """Build count input lines with unique text (defeats per-text caches)."""
+    lines = []
+    for i in range(count):
+        line = SAMPLE_LINES[i % len(SAMPLE_LINES)]
+        if line and not line.startswith('#'):
+            line = f'{line} + {i}'
+        lines.append(line)
+    return lines
+
+
+def _per_line_us(func, lines, repeat):
+    seconds = min(timeit.repeat(lambda: func(lines), number=1, repeat=repeat))
+    return seconds / len(lines) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CalcPaper per-line parse cost')
+    parser.add_argument('--lines', type=int, default=2000, help='number of input lines')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    lines = _make_lines(args.lines)
+    calc = CalculatorPaperAdvanced()
+    highlighter = SyntaxHighlighter(cache_size=0)  # measure tokenization, not cache hits
+
+    def collect(lines):
+        calc._collect_definitions(lines)
+
+    def highlight(lines):
+        for line in lines:
+            highlighter.tokenize_line(line)
+
+    def process(lines):
+        CalculatorPaperAdvanced().process_text('\n'.join(lines))
+
+    engine = IncrementalCalcEngine(CalculatorPaperAdvanced(), GlobalVariableStore())
+
+    def incremental_full(lines):
+        engine.process_full('\n'.join(lines))
+
+    benches = [
+        ('_collect_definitions', collect),
+        ('tokenize_line', highlight),
+        ('process_text', process),
+        ('process_full (engine)', incremental_full),
+    ]
+    if compile_line is not None:
+        uncached = compile_line.__wrapped__
+
+        def compile_uncached(lines):
+            for line in lines:
+                uncached(line)
+
+        benches.append(('compile_line (uncached)', compile_uncached))
+
+    print(f'{len(lines)} lines, best of {args.repeat}')
+    for name, func in benches:
+        print(f'  {name:<26} {_per_line_us(func, lines, args.repeat):8.2f} us/line')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Syntax highlighter tokenizer throughput
+
+Tokenizes long expression lines with the token cache disabled and reports
+tokens per second for each line length. Run it on two checkouts to compare
+before/after:
+
+    python benchmarks/bench_tokenize.py [--lengths 80,1000,10000] [--repeat R]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_syntax import SyntaxHighlighter
+
+TERMS = ['price1', '0xFF', 'rate', '12.5', 'Y20260410', 'hex(mask)', 'D3', '(a - b)', '价格', '0b1010']
+OPERATORS = [' + ', ' * ', ' << ', ' - ', ' / ', ' | ']
+
+
+def _make_line(length: int) -> str:
+    """Build an assignment whose expression is about length characters long."""
+    parts = ['total = ']
+    size = len(parts[0])
+    i = 0
+    while size < length:
+        part = TERMS[i % len(TERMS)] + OPERATORS[i % len(OPERATORS)]
+        parts.append(part)
+        size += len(part)
+        i += 1
+    parts.append('1  # end')
+    return ''.join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CalcPaper tokenizer throughput')
+    parser.add_argument('--lengths', default='80,1000,10000', help='comma-separated line lengths')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions (best is reported)')
+    args = parser.parse_args()
+
+    highlighter = SyntaxHighlighter(global_vars={'rate'}, cache_size=0)
+    print(f'best of {args.repeat}')
+    for length in (int(n) for n in args.lengths.split(',')):
+        line = _make_line(length)
+        tokens = len(highlighter.tokenize_line(line))
+        number = max(1, 20000 // len(line))
+        seconds = min(timeit.repeat(lambda: highlighter.tokenize_line(line), number=number, repeat=args.repeat))
+        seconds /= number
+        print(f'  {len(line):>6} chars {tokens:>6} tokens  {seconds * 1e6:10.1f} us/line'
+              f'  {tokens / seconds / 1e6:6.2f} M tokens/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Bounded Result Caches
+
+This module provides:
+- LRUCache: A least-recently-used table with hit/miss counters.
+- LineResultCache: Per-session memo of line results across recalculations,
+  keyed by the normalized line text and the values of the variables it uses.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any
+
+# Default number of line results kept per session
+DEFAULT_LINE_CACHE_SIZE = 16384
+
+_MISSING = object()
+
+
+class LRUCache:
+    """带命中/未命中计数的 LRU 表
+
+    A maxsize of 0 disables caching (put() stores nothing).
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Any, default: Any = _MISSING) -> Any:
+        """Return the cached value for key, or default (counted as a miss)"""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Any, value: Any) -> None:
+        """Store a value, evicting the least recently used entries"""
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def resize(self, maxsize: int) -> None:
+        """Change the capacity, evicting entries if it shrank"""
+        self.maxsize = maxsize
+        while len(self._entries) > max(maxsize, 0):
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries (counters are kept)"""
+        self._entries.clear()
+
+
+class LineResultCache(LRUCache):
+    """跨重算的行结果缓存
+
+    Keys are (language, normalized line text, values of the used variables);
+    values are the 6-tuple returned by CalculatorPaperAdvanced._evaluate_line().
+    Only lines whose result depends on nothing else are stored: function
+    definitions, global() declarations and lines referring to user functions
+    are always evaluated.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_LINE_CACHE_SIZE):
+        super().__init__(maxsize)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Compiled User-Defined Functions
+
+This module provides:
+- UserFunction: A user function f(x, y) = body compiled once into an
+  expression program, plus the display template used for the expanded
+  expression shown in the output comment.
+- compile_function: Compiles (name, params, body), cached by definition.
+- FunctionCallCache: Bounded LRU of call results keyed by function and
+  argument values (and the values of the global variables it reads).
+- split_call: Locates the argument texts of a call in an expression string.
+- CallBudgetExceeded: Raised when a line exceeds its call depth or step budget.
+
+Functions are called by value: arguments are evaluated once in the caller
+and bound to the parameters, so repeated calls never re-expand the body text.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Optional
+
+from calc_cache import LRUCache
+from calc_grammar import BITWISE_OPERATORS, DISPLAY_RE, BUILTIN_FUNCTIONS, is_reserved_keyword, whole_word_re
+from calc_parser import CalcError, Call, compile_expression, parse_expression, walk, add_implicit_multiplication
+
+# Default number of memoized call results per calculator
+DEFAULT_FUNCTION_CACHE_SIZE = 256
+
+# Default call budget per evaluated line: nesting depth of user function
+# frames (recursion guard) and total number of user function calls
+DEFAULT_MAX_CALL_DEPTH = 20
+DEFAULT_MAX_CALL_STEPS = 10000
+
+# Longest expanded expression shown in the output comment; longer
+# expansions fall back to showing the calls themselves
+MAX_EXPANSION_LENGTH = 2000
+
+@dataclass(frozen=True)
+class UserFunction:
+    """A compiled user function definition (shared through the compile_function() cache)"""
+    name: str
+    params: tuple
+    body: str
+    program: Optional[Callable] = None     # compile_expression() closure of the body
+    error: Optional[str] = None            # Parse error of the body, raised when called
+    call_names: frozenset = frozenset()    # Functions called by the body
+    names: tuple = ()                      # Identifiers read by the body, parameters excluded
+    has_bitwise: bool = False              # Body text contains bitwise operators
+    display: tuple = ()                    # ((literal, name or None), ...) for rendering
+
+
+@lru_cache(maxsize=1024)
+def compile_function(name: str, params: tuple, body: str) -> UserFunction:
+    """编译用户函数，按定义缓存
+
+    Parameters are wrapped in parentheses before implicit multiplication is
+    applied, which is what textual substitution of (arg) for each parameter
+    used to produce, e.g. f(x) = x(2) multiplies its argument by 2.
+    """
+    text = body
+    for param in sorted(params, key=len, reverse=True):
+        text = whole_word_re(param).sub(f'({param})', text)
+    text = add_implicit_multiplication(text)
+
+    display = []
+    names = []
+    last = 0
+    for m in DISPLAY_RE.finditer(text):
+        word = m.group(1)
+        if word is None or word.lower() in BUILTIN_FUNCTIONS or is_reserved_keyword(word):
+            continue
+        display.append((text[last:m.start()], word))
+        if word not in params and word not in names:
+            names.append(word)
+        last = m.end()
+    display.append((text[last:], None))
+
+    program = error = None
+    call_names = frozenset()
+    try:
+        tree = parse_expression(text.replace(' ', ''))
+    except CalcError as e:
+        error = str(e)
+    else:
+        program = compile_expression(tree)
+        call_names = frozenset(n.name for n in walk(tree) if isinstance(n, Call))
+    return UserFunction(name=name, params=params, body=body, program=program, error=error,
+                        call_names=call_names, names=tuple(names),
+                        has_bitwise=any(op in text for op in BITWISE_OPERATORS),
+                        display=tuple(display))
+
+
+class CallBudgetExceeded(CalcError):
+    """用户函数调用超过递归深度或调用次数限制"""
+
+
+class FunctionCallCache(LRUCache):
+    """用户函数调用结果的 LRU 缓存
+
+    Keys are built by the calculator from the function name, the argument
+    values and the values of the global variables the function reads; the
+    expanded text shown in the output comment is cached the same way.
+    A maxsize of 0 disables memoization.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_FUNCTION_CACHE_SIZE):
+        super().__init__(maxsize)
+
+
+def split_call(expr: str, open_paren: int) -> tuple[list[str], int]:
+    """Split the arguments of a call whose '(' is at expr[open_paren]
+
+    Returns:
+        (stripped argument texts, index after the closing parenthesis),
+        or ([], -1) if the parentheses are unbalanced.
+    """
+    args = []
+    depth = 0
+    start = open_paren + 1
+    for pos in range(open_paren, len(expr)):
+        ch = expr[pos]
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+            if depth == 0:
+                last = expr[start:pos].strip()
+                if last:
+                    args.append(last)
+                return args, pos + 1
+        elif ch == ',' and depth == 1:
+            args.append(expr[start:pos].strip())
+            start = pos + 1
+    return [], -1
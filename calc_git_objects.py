@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Git Object Store Module
+
+Reads and writes a Git repository's object database in-process, so the
+history store can create blobs, trees and commits without spawning git.
+New objects are written as zlib-compressed loose objects; objects that
+only exist in packfiles are read through one long-lived
+`git cat-file --batch` process.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import zlib
+import hashlib
+import subprocess
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+# Hide console window on Windows when calling git
+_SUBPROCESS_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+TREE_MODE = "40000"
+FILE_MODE = "100644"
+# Parsed trees kept in memory (trees are immutable, keyed by SHA-1)
+TREE_CACHE_SIZE = 1024
+
+
+@dataclass
+class CommitInfo:
+    """A parsed Git commit object."""
+    tree: str
+    parents: list[str]
+    timestamp: datetime
+    message: str
+
+
+def object_sha(obj_type: str, data: bytes) -> str:
+    """SHA-1 Git assigns to an object of obj_type with data (nothing is written)."""
+    return hashlib.sha1(f"{obj_type} {len(data)}\0".encode() + data).hexdigest()
+
+
+def _git_time(timestamp: datetime) -> str:
+    """Format a datetime as Git's '<epoch> <+hhmm>' (naive times are local)."""
+    aware = timestamp if timestamp.tzinfo else timestamp.astimezone()
+    minutes = int(aware.utcoffset().total_seconds()) // 60
+    sign = "+" if minutes >= 0 else "-"
+    minutes = abs(minutes)
+    return f"{int(aware.timestamp())} {sign}{minutes // 60:02d}{minutes % 60:02d}"
+
+
+def _parse_git_time(epoch: str, offset: str) -> datetime:
+    """Parse Git's '<epoch> <+hhmm>' into an aware datetime."""
+    sign = -1 if offset.startswith("-") else 1
+    delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])) * sign
+    return datetime.fromtimestamp(int(epoch), timezone(delta))
+
+
+class GitObjectStore:
+    """In-process access to a Git repository's objects and HEAD.
+
+    Writes never spawn git. Reads use the loose object files and fall back
+    to a `git cat-file --batch` pipe for packed objects. Methods may be
+    called from several threads.
+    """
+
+    def __init__(self, repo_path: Path, name: str = "CalcPaper", email: str = "calcpaper@local"):
+        """Open the repository at repo_path (its .git directory must exist).
+
+        Args:
+            repo_path: Working tree path of the repository.
+            name: Author/committer name for new commits.
+            email: Author/committer email for new commits.
+        """
+        self._repo_path = Path(repo_path)
+        self._git_dir = self._repo_path / ".git"
+        self._objects_dir = str(self._git_dir / "objects")
+        self._fanout_dirs: set[str] = set()  # objects/xx directories known to exist
+        self._head_ref_name: Optional[str] = None
+        self._identity = f"{name} <{email}>"
+        self._lock = threading.RLock()
+        self._cat_file: Optional[subprocess.Popen] = None
+        self._trees: dict[str, dict[str, tuple[str, str]]] = {}
+        # Root tree of HEAD as {name: (mode, sha)}, loaded on first commit
+        self._root: Optional[dict[str, tuple[str, str]]] = None
+        self._root_commit: Optional[str] = None
+
+    # -------------------------------------------------------------------------
+    # Objects
+    # -------------------------------------------------------------------------
+
+    def write_object(self, obj_type: str, data: bytes) -> str:
+        """Write an object as a loose object and return its SHA-1."""
+        raw = f"{obj_type} {len(data)}\0".encode() + data
+        sha = hashlib.sha1(raw).hexdigest()
+        fanout = os.path.join(self._objects_dir, sha[:2])
+        path = os.path.join(fanout, sha[2:])
+        if fanout not in self._fanout_dirs:
+            os.makedirs(fanout, exist_ok=True)
+            self._fanout_dirs.add(fanout)
+        elif os.path.exists(path):
+            return sha
+        tmp = os.path.join(fanout, f"tmp_obj_{os.getpid()}_{threading.get_ident()}")
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(raw, 1))
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Another writer created the same object; content is identical
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            if not os.path.exists(path):
+                raise
+        return sha
+
+    def write_blob(self, data: bytes) -> str:
+        """Write a blob and return its SHA-1."""
+        return self.write_object("blob", data)
+
+    def write_tree(self, entries: dict[str, tuple[str, str]]) -> str:
+        """Write a tree from {name: (mode, sha)} and return its SHA-1."""
+        # Git orders tree entries by name, with directories compared as 'name/'
+        def sort_key(name):
+            return name + "/" if entries[name][0] == TREE_MODE else name
+        data = b"".join(
+            f"{entries[name][0]} {name}\0".encode() + bytes.fromhex(entries[name][1])
+            for name in sorted(entries, key=sort_key)
+        )
+        sha = self.write_object("tree", data)
+        self._cache_tree(sha, dict(entries))
+        return sha
+
+    def write_commit(self, tree: str, parents: list[str], message: str, timestamp: datetime) -> str:
+        """Write a commit object and return its SHA-1."""
+        signature = f"{self._identity} {_git_time(timestamp)}"
+        lines = [f"tree {tree}"]
+        lines += [f"parent {parent}" for parent in parents]
+        lines += [f"author {signature}", f"committer {signature}", "", message.rstrip("\n"), ""]
+        return self.write_object("commit", "\n".join(lines).encode("utf-8"))
+
+    def read_object(self, sha: str) -> tuple[str, bytes]:
+        """Read an object and return (type, data).
+
+        Raises:
+            KeyError: If the object does not exist.
+        """
+        try:
+            with open(os.path.join(self._objects_dir, sha[:2], sha[2:]), "rb") as f:
+                raw = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return self._read_packed(sha)
+        header, _, data = raw.partition(b"\0")
+        return header.split(b" ", 1)[0].decode(), data
+
+    def read_tree(self, sha: str) -> dict[str, tuple[str, str]]:
+        """Read a tree object as {name: (mode, sha)} (do not modify the result)."""
+        cached = self._trees.get(sha)
+        if cached is not None:
+            return cached
+        obj_type, data = self.read_object(sha)
+        if obj_type != "tree":
+            raise KeyError(f"{sha} is a {obj_type}, not a tree")
+        entries = {}
+        pos = 0
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            nul = data.index(b"\0", space)
+            name = data[space + 1:nul].decode("utf-8", "surrogateescape")
+            entries[name] = (data[pos:space].decode(), data[nul + 1:nul + 21].hex())
+            pos = nul + 21
+        self._cache_tree(sha, entries)
+        return entries
+
+    def read_commit(self, sha: str) -> CommitInfo:
+        """Read and parse a commit object."""
+        obj_type, data = self.read_object(sha)
+        if obj_type != "commit":
+            raise KeyError(f"{sha} is a {obj_type}, not a commit")
+        header, _, message = data.decode("utf-8", "replace").partition("\n\n")
+        tree, parents, timestamp = "", [], datetime.now()
+        for line in header.split("\n"):
+            key, _, value = line.partition(" ")
+            if key == "tree":
+                tree = value
+            elif key == "parent":
+                parents.append(value)
+            elif key == "author":
+                epoch, offset = value.rsplit(" ", 2)[1:]
+                timestamp = _parse_git_time(epoch, offset)
+        return CommitInfo(tree=tree, parents=parents, timestamp=timestamp, message=message)
+
+    def read_path(self, commit: str, path: str) -> Optional[bytes]:
+        """Read the blob at path ('dir/file') in a commit, or None if absent."""
+        sha = self.path_sha(commit, path)
+        if sha is None:
+            return None
+        return self.read_object(sha)[1]
+
+    def path_sha(self, commit: str, path: str) -> Optional[str]:
+        """SHA-1 of the entry at path ('dir/file') in a commit, or None if absent."""
+        tree = self.read_commit(commit).tree
+        *dirs, name = path.split("/")
+        try:
+            for part in dirs:
+                mode, tree = self.read_tree(tree)[part]
+            return self.read_tree(tree)[name][1]
+        except KeyError:
+            return None
+
+    # -------------------------------------------------------------------------
+    # Refs and commits
+    # -------------------------------------------------------------------------
+
+    def head(self) -> Optional[str]:
+        """Return the commit HEAD points to, or None for an unborn branch."""
+        ref = self._head_ref()
+        try:
+            with open(os.path.join(self._git_dir, ref)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            pass
+        try:
+            for line in (self._git_dir / "packed-refs").read_text().splitlines():
+                sha, _, name = line.partition(" ")
+                if name == ref:
+                    return sha
+        except FileNotFoundError:
+            pass
+        return None
+
+    def commit_directory(self, directory: str, files: dict[str, bytes], message: str,
+                         timestamp: datetime) -> str:
+        """Commit files into directory on top of HEAD and advance HEAD.
+
+        Other top-level entries of HEAD's tree are kept, so each call costs
+        a few small object writes regardless of how many sessions exist.
+
+        Returns:
+            The new commit's SHA-1.
+        """
+        with self._lock:
+            parent = self.head()
+            root = self._root_tree(parent)
+            subtree = {}
+            if directory in root and root[directory][0] == TREE_MODE:
+                subtree = dict(self.read_tree(root[directory][1]))
+            for name, data in files.items():
+                subtree[name] = (FILE_MODE, self.write_blob(data))
+            root = dict(root)
+            root[directory] = (TREE_MODE, self.write_tree(subtree))
+            commit = self.write_commit(self.write_tree(root), [parent] if parent else [],
+                                       message, timestamp)
+            self._update_head(commit, parent)
+            self._root, self._root_commit = root, commit
+            return commit
+
+    def close(self) -> None:
+        """Stop the cat-file process, if one was started."""
+        with self._lock:
+            if self._cat_file is not None:
+                try:
+                    self._cat_file.stdin.close()
+                    self._cat_file.wait(timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._cat_file.kill()
+                self._cat_file = None
+
+    def _cache_tree(self, sha: str, entries: dict[str, tuple[str, str]]) -> None:
+        if len(self._trees) >= TREE_CACHE_SIZE:
+            self._trees.clear()
+        self._trees[sha] = entries
+
+    def _head_ref(self) -> str:
+        """Ref HEAD points to ('refs/heads/master'), or 'HEAD' if detached (read once)."""
+        if self._head_ref_name is None:
+            head = (self._git_dir / "HEAD").read_text().strip()
+            self._head_ref_name = head[5:] if head.startswith("ref: ") else "HEAD"
+        return self._head_ref_name
+
+    def _root_tree(self, commit: Optional[str]) -> dict[str, tuple[str, str]]:
+        """Top-level tree entries of commit (cached for the last commit written)."""
+        if commit is None:
+            return {}
+        if commit != self._root_commit:
+            self._root = self.read_tree(self.read_commit(commit).tree)
+            self._root_commit = commit
+        return self._root
+
+    def _update_head(self, new: str, old: Optional[str]) -> None:
+        """Point HEAD's branch at new, using a .lock file like git does."""
+        ref = self._head_ref()
+        path = os.path.join(self._git_dir, ref)
+        lock = path + ".lock"
+        try:
+            fd = os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(new + "\n")
+            if self.head() != old:
+                raise OSError(f"{ref} moved while committing")
+            os.replace(lock, path)
+        except BaseException:
+            os.unlink(lock)
+            raise
+
+    def _read_packed(self, sha: str) -> tuple[str, bytes]:
+        """Read an object through the long-lived `git cat-file --batch` process."""
+        with self._lock:
+            if self._cat_file is None:
+                self._cat_file = subprocess.Popen(
+                    ["git", "cat-file", "--batch"],
+                    cwd=str(self._repo_path),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    creationflags=_SUBPROCESS_FLAGS,
+                )
+            proc = self._cat_file
+            proc.stdin.write(sha.encode() + b"\n")
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                raise KeyError(sha)
+            data = proc.stdout.read(int(header[2]) + 1)[:-1]
+            return header[1].decode(), data
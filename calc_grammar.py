@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Shared Lexical Grammar
+
+Precompiled regular expressions and small lexical helpers used by the
+parser (calc_parser / calc_paper), the incremental engine, the syntax
+highlighter and the GUI. Keeping a single compiled copy of each pattern
+avoids repeating the identifier grammar in every module and skips the
+re module's pattern-cache lookup on every call.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+
+# ========== Identifiers ==========
+
+# Identifier: Chinese, English letters, digits and underscores, not starting with a digit
+IDENT_START_CHARS = r'a-zA-Z_\u4e00-\u9fa5'
+IDENT_CHARS = r'a-zA-Z0-9_\u4e00-\u9fa5'
+IDENT = r'[' + IDENT_START_CHARS + r'][' + IDENT_CHARS + r']*'
+
+IDENT_RE = re.compile(r'^' + IDENT + r'$')
+IDENT_SEARCH_RE = re.compile(IDENT)
+WORD_RE = re.compile(r'\b(' + IDENT + r')\b')
+IDENT_CHAR_RE = re.compile(r'[' + IDENT_CHARS + r']')
+IDENT_START_RE = re.compile(r'[' + IDENT_START_CHARS + r']')
+
+# Names of built-in functions (compared lower-case); never looked up as variables
+BUILTIN_FUNCTIONS = frozenset(['swap', 'bitmap', 'hex', 'comma', 'global', 'workday'])
+# Reserved keywords and function names that should not be treated as variable references
+RESERVED_NAMES = frozenset([
+    'swap', 'bitmap', 'hex', 'comma', 'workday', 'global',
+    'True', 'False', 'None',
+])
+
+# ========== Numbers ==========
+
+HEX_BIN_RE = re.compile(r'0[xXbB][0-9a-fA-F]+')
+HEX_BIN_PREFIX_RE = re.compile(r'^0[xXbB]')
+HEX_LITERAL_RE = re.compile(r'0[xX][0-9a-fA-F]+')
+BIN_LITERAL_RE = re.compile(r'0[bB][01]+')
+HEX_NUMBER_RE = re.compile(r'^0[xX]([0-9a-fA-F]+)$')
+BIN_NUMBER_RE = re.compile(r'^0[bB]([01]+)$')
+DECIMAL_RE = re.compile(r'^\d+(\.\d+)?$')
+# Comma-separated numbers like 1,000 or 1,234,567 but not standalone commas
+COMMA_NUMBER_RE = re.compile(r'(\d{1,3}(?:,\d{3})+)(?!\w)')
+
+# ========== Date/time literals ==========
+
+RESERVED_KEYWORD_RE = re.compile(r'^[YTMWDhms]\d+$')
+DATE_LITERAL_RE = re.compile(r'^Y(\d{8})$')
+TIME_LITERAL_RE = re.compile(r'^T(\d{6})$')
+DATE_DURATION_RE = re.compile(r'^([MWD])(\d+)$')
+TIME_DURATION_RE = re.compile(r'^([hms])(\d+)$')
+DATE_TIME_SEARCH_RE = re.compile(
+    r'Y\d{8}|T\d{6}'
+    r'|(?<![' + IDENT_CHARS + r'])[MWD]\d+(?![' + IDENT_CHARS + r'])'
+    r'|(?<![' + IDENT_CHARS + r'])[hms]\d+(?![' + IDENT_CHARS + r'])'
+)
+TIME_SEARCH_RE = re.compile(r'T\d{6}')
+# Split a date/time expression by + and - while keeping the operators
+DATE_TIME_SPLIT_RE = re.compile(r'\s*(\+|\-)\s*')
+
+# ========== Line structure ==========
+
+ASSIGNMENT_RE = re.compile(r'^(' + IDENT + r')\s*=\s*(.+)$')
+FUNC_DEF_RE = re.compile(
+    r'^(' + IDENT + r')\s*\(\s*(' + IDENT + r'(?:\s*,\s*' + IDENT + r')*)\s*\)\s*=\s*(.+)$')
+FUNC_CALL_RE = re.compile(r'(' + IDENT + r')\s*\(')
+GLOBAL_DECL_RE = re.compile(r'^global\s*\(\s*(' + IDENT + r')\s*\)$')
+GLOBAL_CALL_RE = re.compile(r'\bglobal\s*\(\s*(' + IDENT + r')\s*\)')
+HEX_FUNC_RE = re.compile(r'^hex\s*\(\s*(.+)\s*\)$', re.IGNORECASE)
+# Support nested parentheses, e.g. bitmap(swap(x), 1); 3rd parameter is optional width
+BITMAP_RE = re.compile(
+    r'^bitmap\s*\(\s*(.+?)(?:\s*,\s*([01]))?(?:\s*,\s*(\d+))?\s*\)$', re.IGNORECASE)
+COMMA_FUNC_RE = re.compile(r'^comma\s*\(\s*(.+)\s*\)$', re.IGNORECASE)
+WORKDAY_RE = re.compile(r'^workday\s*\(\s*(.+)\s*\)$', re.IGNORECASE)
+# Standalone built-in calls (hex(...), bitmap(...), ...) that never define a variable
+BUILTIN_CALL_RE = re.compile(r'^(hex|bitmap|comma|workday|global)\s*\(', re.IGNORECASE)
+# First argument of a wrapper call, e.g. bitmap(x, 1) → x
+WRAPPER_ARG_RE = re.compile(
+    r'^(hex|bitmap|comma|workday)\s*\(\s*(.+?)\s*(?:,\s*[^)]+)?\s*\)$', re.IGNORECASE)
+
+# Multi-line scans over the whole input text (GUI completion)
+LINE_ASSIGNMENT_RE = re.compile(r'^(' + IDENT + r')\s*=', re.MULTILINE)
+LINE_FUNC_DEF_RE = re.compile(r'^(' + IDENT + r')\s*\([^)]+\)\s*=', re.MULTILINE)
+# Expression part of a formatted output line: "expr  = result"
+OUTPUT_EXPR_RE = re.compile(r'^(.+?)\s{2,}=\s')
+
+# ========== Expressions ==========
+
+# One token of an arithmetic expression (see calc_parser.tokenize)
+EXPR_TOKEN_RE = re.compile(
+    r'(?P<ws>\s+)'
+    r'|(?P<hex>0[xX][0-9a-fA-F]+)'
+    r'|(?P<bin>0[bB][01]+)'
+    r'|(?P<num>\d+\.\d*|\.\d+|\d+)'
+    r'|(?P<ident>' + IDENT + r')'
+    r'|(?P<op>\*\*|//|<<|>>|[-+*/%&|^~(),])'
+)
+# Hex/binary literals are matched first so their digits never look like names
+DISPLAY_RE = re.compile(r'0[xXbB][0-9a-fA-F]+|\b(' + IDENT + r')\b')
+BITWISE_OPERATORS = ('<<', '>>', '&', '|', '^', '~')
+
+# ========== Syntax highlighting ==========
+
+HIGHLIGHT_FUNC_DEF_RE = re.compile(
+    r'^(\s*)(' + IDENT + r')\s*\(\s*(' + IDENT + r'(?:\s*,\s*' + IDENT + r')*)\s*\)\s*=')
+HIGHLIGHT_ASSIGNMENT_RE = re.compile(r'^(\s*)(' + IDENT + r')\s*=(?!=)')
+HIGHLIGHT_DATETIME_RE = re.compile(
+    r'(?<![' + IDENT_CHARS + r'])([YT]\d+|[MWDhms]\d+)(?![' + IDENT_CHARS + r'])')
+# One highlighted token of an expression, alternatives in priority order
+# (see SyntaxHighlighter._tokenize_input_line). Identifiers are matched as a
+# whole, so digits inside a name are never highlighted as numbers.
+HIGHLIGHT_TOKEN_RE = re.compile(
+    r'(?P<datetime>' + HIGHLIGHT_DATETIME_RE.pattern + r')'
+    r'|(?P<function>\b(?i:' + '|'.join(sorted(BUILTIN_FUNCTIONS)) + r')(?=\s*\())'
+    r'|(?P<number>0[xX][0-9a-fA-F]+|0[bB][01]+|\d+\.?\d*)'
+    r'|(?P<ident>' + IDENT + r')'
+    r'|(?P<operator><<|>>|[+\-*/%=&|^~])'
+)
+
+
+def is_identifier(text: str) -> bool:
+    """Check if text is a single identifier"""
+    return IDENT_RE.match(text) is not None
+
+
+def is_reserved_keyword(name: str) -> bool:
+    """Check if identifier is a reserved keyword (Y/T/M/W/D/h/m/s followed by digits, or function names)"""
+    if name.lower() in ('workday', 'comma'):
+        return True
+    return RESERVED_KEYWORD_RE.match(name) is not None
+
+
+@lru_cache(maxsize=1024)
+def whole_word_re(name: str) -> re.Pattern:
+    """Compiled pattern matching name as a whole identifier (not inside a longer one)"""
+    return re.compile(r'(?<![' + IDENT_CHARS + r'])' + re.escape(name) + r'(?![' + IDENT_CHARS + r'])')
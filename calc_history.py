@@ -20,16 +20,32 @@ import os
 import sys
 import subprocess
 import logging
+import sqlite3
+import threading
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
+from calc_git_objects import GitObjectStore, TREE_MODE, object_sha
+from calc_history_index import HistoryIndex, IndexedCommit, INDEX_FILE_NAME
+from calc_snapshot_store import SnapshotStore, DEFAULT_BYTE_BUDGET
+
 logger = logging.getLogger(__name__)
 
 # Hide console window on Windows when calling git
 _SUBPROCESS_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
 
+# History backends: "objects" writes Git objects in-process, "cli" runs git commands
+HISTORY_BACKENDS = ("objects", "cli")
+
+# Commit queue: a session's snapshot is written once it has been quiet for
+# COMMIT_COALESCE_SECONDS, and at the latest COMMIT_MAX_DELAY_SECONDS after
+# the first snapshot that is still waiting
+COMMIT_COALESCE_SECONDS = 0.5
+COMMIT_MAX_DELAY_SECONDS = 5.0
+
 
 @dataclass
 class HistoryEntry:
@@ -38,6 +54,33 @@ class HistoryEntry:
     timestamp: datetime
     message: str
     session_id: str
+    input_size: Optional[int] = None   # UTF-8 bytes, when known
+    output_size: Optional[int] = None
+
+
+@dataclass
+class PendingSnapshot:
+    """A snapshot waiting in the commit queue (latest one per session)."""
+    input_text: str
+    output_text: str
+    message: Optional[str]
+    timestamp: datetime
+    first_queued: float  # time.monotonic() of the oldest coalesced snapshot
+    last_queued: float   # time.monotonic() of this snapshot
+
+
+@dataclass
+class CommitQueueStats:
+    """Commit queue metrics."""
+    depth: int = 0               # snapshots waiting or being written
+    committed: int = 0           # commits written by the queue
+    skipped: int = 0             # snapshots identical to the last commit
+    coalesced: int = 0           # snapshots replaced by a newer one before writing
+    failed: int = 0
+    last_latency_ms: float = 0.0  # queue + write time of the last snapshot
+    max_latency_ms: float = 0.0
+    last_write_ms: float = 0.0    # time spent in commit() for the last snapshot
+    avg_write_ms: float = 0.0
 
 
 @dataclass
@@ -63,24 +106,54 @@ class GitHistoryStore:
     Stores input/output snapshots as Git commits, enabling version history,
     diff viewing, and content restoration. Falls back to in-memory mode
     when Git is unavailable.
+
+    With the default "objects" backend, commits, diffs and restores read and
+    write the object database in-process (GitObjectStore) instead of
+    spawning git add/commit/rev-parse for every snapshot. That backend only
+    writes objects and moves HEAD: the work tree and .git/index are left as
+    they are on purpose, so git status in the history repository lists the
+    committed sessions as deleted (git reset brings the index up to date).
+    History is always read from the commits.
     """
 
-    def __init__(self, repo_path: str = "~/.calcpaper/history"):
+    def __init__(self, repo_path: str = "~/.calcpaper/history", backend: str = "objects",
+                 memory_budget: int = DEFAULT_BYTE_BUDGET):
         """Initialize or open a Git repository for history storage.
 
         Args:
             repo_path: Path to the Git repository. Defaults to ~/.calcpaper/history.
+            backend: "objects" (in-process object writer) or "cli" (git subprocesses).
+            memory_budget: Approximate bytes in-memory snapshots may use when
+                Git is unavailable; the oldest are evicted beyond it.
         """
+        if backend not in HISTORY_BACKENDS:
+            raise ValueError(f"未知的历史后端: {backend}")
         self._repo_path = Path(os.path.expanduser(repo_path))
+        self._backend = backend
+        self._objects: Optional[GitObjectStore] = None
+        self._index: Optional[HistoryIndex] = None
         self._git_available = False
         self._git_ready = False  # True once async init completes
         self._warning_message: Optional[str] = None
-        self._memory_history: list[HistoryEntry] = []
-        self._memory_snapshots: dict[str, tuple[str, str]] = {}  # commit_hash -> (input, output)
+        self._memory_history: dict[str, HistoryEntry] = {}  # commit_hash -> entry, oldest first
+        self._memory_snapshots = SnapshotStore(memory_budget)
         self._memory_counter = 0
+        # session_id -> blob SHA-1s of the last committed (input, output), or
+        # None when the session has no commit; seeded from HEAD on first use
+        self._committed_digests: dict[str, Optional[tuple[str, str]]] = {}
+
+        # Serializes commits from the writer thread and direct commit() calls
+        self._commit_lock = threading.RLock()
+        # Commit queue: session_id -> latest pending snapshot
+        self._queue_cond = threading.Condition()
+        self._pending: dict[str, PendingSnapshot] = {}
+        self._writing = 0
+        self._flushing = 0
+        self._closed = False
+        self._writer: Optional[threading.Thread] = None
+        self._stats = CommitQueueStats()
 
         # Start git check and init in background thread to avoid blocking UI
-        import threading
         self._init_thread = threading.Thread(target=self._async_init, daemon=True)
         self._init_thread.start()
 
@@ -89,6 +162,14 @@ class GitHistoryStore:
         self._git_available = self._check_git_available()
         if self._git_available:
             self._init_repo()
+            if self._git_available and self._backend == "objects":
+                if (self._repo_path / ".git").is_dir():
+                    self._objects = GitObjectStore(self._repo_path)
+                else:
+                    # Repo path inside another work tree: keep using git commands
+                    self._backend = "cli"
+            if self._git_available and (self._repo_path / ".git").is_dir():
+                self._open_index()
             self._git_ready = True
         else:
             self._warning_message = (
@@ -129,17 +210,68 @@ class GitHistoryStore:
         Returns:
             The commit hash string, or None if content is unchanged.
         """
-        if not self.has_changes(session_id, input_text, output_text):
-            return None
+        return self._commit_snapshot(session_id, input_text, output_text, message, datetime.now())
 
-        timestamp = datetime.now()
-        if message is None:
-            message = self._generate_commit_message(timestamp, input_text)
+    def submit(self, session_id: str, input_text: str, output_text: str,
+               message: str = None) -> None:
+        """Queue a calculation snapshot for a background commit.
 
-        if self._git_available and self._git_ready:
-            return self._git_commit(session_id, input_text, output_text, message, timestamp)
-        else:
-            return self._memory_commit(session_id, input_text, output_text, message, timestamp)
+        Returns immediately. A newer snapshot of the same session replaces
+        one that is still waiting, so a burst of recalculations produces a
+        single commit of its final state. Use flush() to wait for the queue.
+
+        Args:
+            session_id: Identifier for the session.
+            input_text: The input text content.
+            output_text: The output/result text content.
+            message: Optional commit message. Auto-generated if not provided.
+        """
+        now = time.monotonic()
+        with self._queue_cond:
+            if self._closed:
+                raise ValueError("历史存储已关闭")
+            previous = self._pending.get(session_id)
+            first_queued = now
+            if previous is not None:
+                first_queued = previous.first_queued
+                self._stats.coalesced += 1
+            self._pending[session_id] = PendingSnapshot(
+                input_text, output_text, message, datetime.now(), first_queued, now)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+                self._writer.start()
+            self._queue_cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write all queued snapshots now and wait for the writer to finish.
+
+        Args:
+            timeout: Maximum seconds to wait, or None to wait until done.
+
+        Returns:
+            True if the queue is empty, False if the timeout expired first.
+        """
+        with self._queue_cond:
+            self._flushing += 1
+            self._queue_cond.notify_all()
+            try:
+                return self._queue_cond.wait_for(
+                    lambda: not self._pending and not self._writing, timeout)
+            finally:
+                self._flushing -= 1
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of snapshots waiting in the commit queue or being written."""
+        with self._queue_cond:
+            return len(self._pending) + self._writing
+
+    def queue_stats(self) -> CommitQueueStats:
+        """Get a copy of the commit queue metrics."""
+        with self._queue_cond:
+            stats = CommitQueueStats(**vars(self._stats))
+            stats.depth = len(self._pending) + self._writing
+            return stats
 
     def has_changes(self, session_id: str, input_text: str, output_text: str) -> bool:
         """Check if content differs from the last commit for this session.
@@ -157,20 +289,34 @@ class GitHistoryStore:
         else:
             return self._memory_has_changes(session_id, input_text, output_text)
 
-    def get_history(self, session_id: str, limit: int = 100) -> list[HistoryEntry]:
+    def get_history(self, session_id: str, limit: int = 100, offset: int = 0) -> list[HistoryEntry]:
         """Get history entries for a session in reverse chronological order.
 
         Args:
             session_id: Identifier for the session.
             limit: Maximum number of entries to return.
+            offset: Number of newest entries to skip (for paging).
 
         Returns:
             List of HistoryEntry objects, newest first.
         """
         if self._git_available and self._git_ready:
-            return self._git_get_history(session_id, limit)
+            return self._git_get_history(session_id, limit, offset)
         else:
-            return self._memory_get_history(session_id, limit)
+            return self._memory_get_history(session_id, limit, offset)
+
+    def count_history(self, session_id: str) -> int:
+        """Get the number of history entries of a session.
+
+        Args:
+            session_id: Identifier for the session.
+
+        Returns:
+            Number of entries get_history() can page through.
+        """
+        if self._git_available and self._git_ready:
+            return self._git_count_history(session_id)
+        return sum(1 for e in self._memory_history.values() if e.session_id == session_id)
 
     def get_diff(self, commit_hash: str) -> DiffResult:
         """Get the diff for a specific commit relative to its parent.
@@ -200,6 +346,103 @@ class GitHistoryStore:
         else:
             return self._memory_restore(commit_hash)
 
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Flush the commit queue and release background resources.
+
+        Args:
+            timeout: Maximum seconds to wait for queued snapshots.
+        """
+        self.flush(timeout)
+        with self._queue_cond:
+            self._closed = True
+            self._queue_cond.notify_all()
+        if self._writer is not None:
+            self._writer.join(timeout)
+        if self._objects is not None:
+            self._objects.close()
+        if self._index is not None:
+            self._index.close()
+
+    # -------------------------------------------------------------------------
+    # Private: Commit queue
+    # -------------------------------------------------------------------------
+
+    def _commit_snapshot(self, session_id: str, input_text: str, output_text: str,
+                         message: Optional[str], timestamp: datetime) -> Optional[str]:
+        """Commit one snapshot taken at timestamp (see commit())."""
+        with self._commit_lock:
+            if not self.has_changes(session_id, input_text, output_text):
+                return None
+
+            if message is None:
+                message = self._generate_commit_message(timestamp, input_text)
+
+            if self._git_available and self._git_ready:
+                return self._git_commit(session_id, input_text, output_text, message, timestamp)
+            else:
+                return self._memory_commit(session_id, input_text, output_text, message, timestamp)
+
+    def _due_snapshots(self, now: float) -> tuple[list[tuple[str, PendingSnapshot]], Optional[float]]:
+        """Pop the pending snapshots that are due; also return seconds until the next one."""
+        due = []
+        wait = None
+        for session_id, snapshot in list(self._pending.items()):
+            ready_at = min(snapshot.last_queued + COMMIT_COALESCE_SECONDS,
+                           snapshot.first_queued + COMMIT_MAX_DELAY_SECONDS)
+            if self._flushing or self._closed or ready_at <= now:
+                due.append((session_id, self._pending.pop(session_id)))
+            elif wait is None or ready_at - now < wait:
+                wait = ready_at - now
+        return due, wait
+
+    def _writer_loop(self) -> None:
+        """Background writer: commit queued snapshots once their session goes idle."""
+        # Commits made before init finishes would land in the memory fallback
+        self._init_thread.join()
+        while True:
+            with self._queue_cond:
+                while True:
+                    due, wait = self._due_snapshots(time.monotonic())
+                    if due:
+                        self._writing = len(due)
+                        break
+                    if self._closed:
+                        return
+                    self._queue_cond.wait(wait)
+
+            for session_id, snapshot in due:
+                started = time.monotonic()
+                try:
+                    result = self._commit_snapshot(session_id, snapshot.input_text,
+                                                   snapshot.output_text, snapshot.message,
+                                                   snapshot.timestamp)
+                except Exception as e:
+                    logger.warning(f"Queued commit for session {session_id} failed: {e}")
+                    result = e
+                finished = time.monotonic()
+                with self._queue_cond:
+                    self._record_commit(result, snapshot, started, finished)
+                    self._writing -= 1
+                    self._queue_cond.notify_all()
+
+    def _record_commit(self, result, snapshot: PendingSnapshot,
+                       started: float, finished: float) -> None:
+        """Update the queue metrics for one written snapshot (holds _queue_cond)."""
+        stats = self._stats
+        if isinstance(result, Exception):
+            stats.failed += 1
+            return
+        if result is None:
+            stats.skipped += 1
+            return
+        write_ms = (finished - started) * 1000
+        latency_ms = (finished - snapshot.last_queued) * 1000
+        stats.committed += 1
+        stats.last_write_ms = write_ms
+        stats.avg_write_ms += (write_ms - stats.avg_write_ms) / stats.committed
+        stats.last_latency_ms = latency_ms
+        stats.max_latency_ms = max(stats.max_latency_ms, latency_ms)
+
     # -------------------------------------------------------------------------
     # Private: Git availability and initialization
     # -------------------------------------------------------------------------
@@ -271,6 +514,18 @@ class GitHistoryStore:
                     message: str, timestamp: datetime) -> Optional[str]:
         """Create a Git commit with the session content."""
         try:
+            # The objects backend writes neither the work tree nor the index
+            if self._objects is not None:
+                commit_hash = self._objects.commit_directory(
+                    session_id,
+                    {"session.txt": input_text.encode("utf-8"),
+                     "output.txt": output_text.encode("utf-8")},
+                    message, timestamp)
+                self._committed_digests[session_id] = self._snapshot_digest(input_text, output_text)
+                self._index_commit(session_id, commit_hash, self._objects.read_commit(commit_hash).parents,
+                                   timestamp, message, input_text, output_text)
+                return commit_hash
+
             # Create session subdirectory
             session_dir = self._repo_path / session_id
             session_dir.mkdir(parents=True, exist_ok=True)
@@ -282,14 +537,15 @@ class GitHistoryStore:
             output_file.write_text(output_text, encoding="utf-8")
 
             # Stage files
-            self._run_git(["add", str(session_dir / "session.txt"),
-                          str(session_dir / "output.txt")])
+            paths = [str(session_file), str(output_file)]
+            self._run_git(["add"] + paths)
 
-            # Commit with timestamp in environment for reproducibility
+            # Commit only these paths (other sessions come from HEAD, not the
+            # index, which the objects backend does not update)
             env_date = timestamp.isoformat()
             result = subprocess.run(
                 ["git", "commit", "-m", message,
-                 "--allow-empty-message"],
+                 "--allow-empty-message", "--"] + paths,
                 cwd=str(self._repo_path),
                 capture_output=True,
                 text=True,
@@ -302,43 +558,84 @@ class GitHistoryStore:
 
             if result.returncode != 0:
                 logger.warning("Git commit failed: %s", result.stderr)
+                # HEAD may already hold this content; look it up again next time
+                self._committed_digests.pop(session_id, None)
                 return None
 
-            # Get the commit hash
-            hash_result = self._run_git(["rev-parse", "HEAD"])
+            # Get the commit hash (and its parent, for the history index)
+            hash_result = self._run_git(["log", "-1", "--format=%H %P"])
             if hash_result.returncode == 0:
-                return hash_result.stdout.strip()
+                commit_hash, *parents = hash_result.stdout.split()
+                self._committed_digests[session_id] = self._snapshot_digest(input_text, output_text)
+                self._index_commit(session_id, commit_hash, parents,
+                                   timestamp, message, input_text, output_text)
+                return commit_hash
             return None
 
-        except (OSError, subprocess.TimeoutExpired) as e:
+        except (OSError, subprocess.TimeoutExpired, KeyError) as e:
             logger.warning("Git commit error: %s", e)
+            self._committed_digests.pop(session_id, None)
             return None
 
     def _git_has_changes(self, session_id: str, input_text: str, output_text: str) -> bool:
-        """Check if content differs from last commit using Git."""
-        session_dir = self._repo_path / session_id
-        session_file = session_dir / "session.txt"
-        output_file = session_dir / "output.txt"
+        """Check if content differs from the last commit by comparing blob digests."""
+        return self._snapshot_digest(input_text, output_text) != self._committed_digest(session_id)
 
-        # If files don't exist yet, there are changes
-        if not session_file.exists() or not output_file.exists():
-            return True
+    @staticmethod
+    def _snapshot_digest(input_text: str, output_text: str) -> tuple[str, str]:
+        """Blob SHA-1s the session files of a snapshot have in Git."""
+        return (object_sha("blob", input_text.encode("utf-8")),
+                object_sha("blob", output_text.encode("utf-8")))
 
+    def _committed_digest(self, session_id: str) -> Optional[tuple[str, str]]:
+        """Blob SHA-1s of the session's files at HEAD (cached after the first lookup)."""
         try:
-            existing_input = session_file.read_text(encoding="utf-8")
-            existing_output = output_file.read_text(encoding="utf-8")
-            return existing_input != input_text or existing_output != output_text
-        except OSError:
-            return True
-
-    def _git_get_history(self, session_id: str, limit: int) -> list[HistoryEntry]:
-        """Get commit history for a session from Git log."""
+            return self._committed_digests[session_id]
+        except KeyError:
+            pass
+        # Seed under the commit lock so a concurrent commit cannot be overwritten
+        with self._commit_lock:
+            if session_id not in self._committed_digests:
+                self._committed_digests[session_id] = self._read_committed_digest(session_id)
+            return self._committed_digests[session_id]
+
+    def _read_committed_digest(self, session_id: str) -> Optional[tuple[str, str]]:
+        """Look up the blob SHA-1s of session.txt and output.txt at HEAD."""
+        paths = [f"{session_id}/session.txt", f"{session_id}/output.txt"]
+        try:
+            if self._objects is not None:
+                head = self._objects.head()
+                if head is None:
+                    return None
+                shas = [self._objects.path_sha(head, path) for path in paths]
+            else:
+                result = self._run_git(["rev-parse"] + [f"HEAD:./{path}" for path in paths])
+                if result.returncode != 0:
+                    return None
+                shas = result.stdout.split()
+        except (OSError, ValueError, KeyError, subprocess.TimeoutExpired) as e:
+            logger.warning("Reading committed session %s failed: %s", session_id, e)
+            return None
+        if len(shas) != 2 or None in shas:
+            return None
+        return tuple(shas)
+
+    def _git_get_history(self, session_id: str, limit: int, offset: int = 0) -> list[HistoryEntry]:
+        """Get commit history for a session from the index, or from Git log without one."""
+        if self._index is not None:
+            try:
+                return [HistoryEntry(c.commit_hash, c.timestamp, c.message, c.session_id,
+                                     c.input_size, c.output_size)
+                        for c in self._index.page(session_id, limit, offset)]
+            except sqlite3.Error as e:
+                logger.warning("History index query failed: %s", e)
         try:
             # Use git log with format to get commit info, filtered by path
             session_dir = session_id
             result = self._run_git([
                 "log",
                 f"--max-count={limit}",
+                f"--skip={offset}",
                 "--format=%H|%aI|%s",
                 "--",
                 session_dir,
@@ -372,8 +669,115 @@ class GitHistoryStore:
         except (subprocess.TimeoutExpired, OSError):
             return []
 
+    def _git_count_history(self, session_id: str) -> int:
+        """Count the commits of a session."""
+        if self._index is not None:
+            try:
+                return self._index.count(session_id)
+            except sqlite3.Error as e:
+                logger.warning("History index query failed: %s", e)
+        try:
+            result = self._run_git(["rev-list", "--count", "HEAD", "--", session_id])
+        except (subprocess.TimeoutExpired, OSError):
+            return 0
+        return int(result.stdout) if result.returncode == 0 else 0
+
+    # -------------------------------------------------------------------------
+    # Private: History index
+    # -------------------------------------------------------------------------
+
+    def _open_index(self) -> None:
+        """Open the commit index in .git and bring it up to date with HEAD."""
+        try:
+            self._index = HistoryIndex(str(self._repo_path / ".git" / INDEX_FILE_NAME))
+            self._sync_index()
+        except (sqlite3.Error, OSError, ValueError, subprocess.TimeoutExpired) as e:
+            logger.warning("History index unavailable, using git log: %s", e)
+            if self._index is not None:
+                self._index.close()
+            self._index = None
+
+    def _sync_index(self) -> None:
+        """Index the commits between the index head and HEAD (all of them if unrelated)."""
+        result = self._run_git(["rev-parse", "--verify", "-q", "HEAD"])
+        head = result.stdout.strip() if result.returncode == 0 else None
+        indexed = self._index.head
+        if head is None or head == indexed:
+            return
+        reset = True
+        rev_range = head
+        if indexed is not None and self._run_git(
+                ["merge-base", "--is-ancestor", indexed, head]).returncode == 0:
+            reset = False
+            rev_range = f"{indexed}..{head}"
+        self._index.add(self._read_log_entries(rev_range), head, reset=reset)
+
+    def _read_log_entries(self, rev_range: str) -> list[IndexedCommit]:
+        """Read the session commits in rev_range from Git, oldest first, with file sizes."""
+        result = self._run_git([
+            "-c", "core.quotePath=false", "log", "--reverse", "--root", "--no-renames",
+            "--raw", "--no-abbrev", "--format=%x1e%H%x1f%aI%x1f%s", rev_range, "--",
+        ])
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip())
+
+        commits = []  # (hash, timestamp, message, {session_id: {file name: blob sha}})
+        for record in result.stdout.split("\x1e"):
+            if not record.strip():
+                continue
+            header, *raw_lines = record.split("\n")
+            commit_hash, timestamp_str, message = header.split("\x1f", 2)
+            sessions: dict[str, dict[str, str]] = {}
+            for line in raw_lines:
+                if not line.startswith(":"):
+                    continue
+                info, _, path = line.partition("\t")
+                session_id, _, name = path.partition("/")
+                if name in ("session.txt", "output.txt"):
+                    sessions.setdefault(session_id, {})[name] = info.split()[3]
+            commits.append((commit_hash, datetime.fromisoformat(timestamp_str), message, sessions))
+
+        blobs = {sha for _, _, _, sessions in commits
+                 for files in sessions.values() for sha in files.values() if sha.strip("0")}
+        sizes: dict[str, int] = {}
+        if blobs:
+            result = self._run_git(["cat-file", "--batch-check"], input_text="\n".join(blobs) + "\n")
+            for line in result.stdout.splitlines():
+                parts = line.split()
+                if len(parts) == 3 and parts[2].isdigit():
+                    sizes[parts[0]] = int(parts[2])
+
+        return [IndexedCommit(session_id, commit_hash, timestamp, message,
+                              sizes.get(files.get("session.txt", "")),
+                              sizes.get(files.get("output.txt", "")))
+                for commit_hash, timestamp, message, sessions in commits
+                for session_id, files in sessions.items()]
+
+    def _index_commit(self, session_id: str, commit_hash: str, parents: list[str],
+                      timestamp: datetime, message: str, input_text: str, output_text: str) -> None:
+        """Record a new commit in the index, re-syncing if other commits came in between."""
+        if self._index is None:
+            return
+        try:
+            if self._index.head != (parents[0] if parents else None):
+                self._sync_index()
+                return
+            # Match what git log reports: whole seconds, and the subject
+            # (first paragraph on one line) of the message
+            subject = " ".join(line.strip() for line in message.strip().split("\n\n", 1)[0].splitlines())
+            self._index.add([IndexedCommit(session_id, commit_hash, timestamp.astimezone().replace(microsecond=0), subject,
+                                           len(input_text.encode("utf-8")),
+                                           len(output_text.encode("utf-8")))],
+                            commit_hash)
+        except (sqlite3.Error, OSError, ValueError, subprocess.TimeoutExpired) as e:
+            logger.warning("History index update failed, using git log: %s", e)
+            self._index.close()
+            self._index = None
+
     def _git_get_diff(self, commit_hash: str) -> DiffResult:
         """Get diff for a commit relative to its parent."""
+        if self._objects is not None:
+            return self._objects_get_diff(commit_hash)
         try:
             # Get parent hash
             parent_result = self._run_git(["rev-parse", f"{commit_hash}^"])
@@ -409,6 +813,8 @@ class GitHistoryStore:
 
     def _git_restore(self, commit_hash: str) -> tuple[str, str]:
         """Restore content from a specific Git commit."""
+        if self._objects is not None:
+            return self._objects_restore(commit_hash)
         try:
             # Find session files in the commit
             # List files in the commit
@@ -435,6 +841,62 @@ class GitHistoryStore:
         except (subprocess.TimeoutExpired, OSError):
             return ("", "")
 
+    # -------------------------------------------------------------------------
+    # Private: In-process object store operations
+    # -------------------------------------------------------------------------
+
+    def _objects_session_files(self, commit_hash: str):
+        """Session files of a commit and of its parent.
+
+        Returns:
+            (parent_hash, {name: new_text}, {name: old_text}) for the session
+            directory the commit changed (the last one if it changed none).
+        """
+        store = self._objects
+        info = store.read_commit(commit_hash)
+        root = store.read_tree(info.tree)
+        parent_hash = info.parents[0] if info.parents else None
+        parent_root = store.read_tree(store.read_commit(parent_hash).tree) if parent_hash else {}
+
+        dirs = [name for name, (mode, _) in root.items() if mode == TREE_MODE]
+        changed = [name for name in dirs if parent_root.get(name) != root[name]]
+        if not (changed or dirs):
+            return parent_hash, {}, {}
+        session_dir = (changed or dirs)[-1]
+
+        def read_files(tree_root):
+            entry = tree_root.get(session_dir)
+            if entry is None or entry[0] != TREE_MODE:
+                return {}
+            return {name: store.read_object(sha)[1].decode("utf-8", "replace")
+                    for name, (mode, sha) in store.read_tree(entry[1]).items()
+                    if mode != TREE_MODE}
+
+        return parent_hash, read_files(root), read_files(parent_root)
+
+    def _objects_get_diff(self, commit_hash: str) -> DiffResult:
+        """Get diff for a commit from the object store (changed files in path order)."""
+        try:
+            parent_hash, files, parent_files = self._objects_session_files(commit_hash)
+        except (KeyError, OSError, ValueError):
+            return DiffResult(commit_hash=commit_hash, parent_hash=None)
+
+        lines = []
+        for name in sorted(set(files) | set(parent_files)):
+            old_text = parent_files.get(name, "")
+            new_text = files.get(name, "")
+            if old_text != new_text:
+                lines.extend(self._compute_diff_lines(old_text, new_text))
+        return DiffResult(commit_hash=commit_hash, parent_hash=parent_hash, lines=lines)
+
+    def _objects_restore(self, commit_hash: str) -> tuple[str, str]:
+        """Restore content of a commit from the object store."""
+        try:
+            _, files, _ = self._objects_session_files(commit_hash)
+        except (KeyError, OSError, ValueError):
+            return ("", "")
+        return (files.get("session.txt", ""), files.get("output.txt", ""))
+
     # -------------------------------------------------------------------------
     # Private: In-memory fallback operations
     # -------------------------------------------------------------------------
@@ -450,30 +912,25 @@ class GitHistoryStore:
             timestamp=timestamp,
             message=message,
             session_id=session_id,
+            input_size=len(input_text.encode("utf-8")),
+            output_size=len(output_text.encode("utf-8")),
         )
-        self._memory_history.append(entry)
-        self._memory_snapshots[commit_hash] = (input_text, output_text)
+        self._memory_history[commit_hash] = entry
+        for evicted in self._memory_snapshots.add(commit_hash, session_id, input_text, output_text):
+            del self._memory_history[evicted]
 
         return commit_hash
 
     def _memory_has_changes(self, session_id: str, input_text: str, output_text: str) -> bool:
         """Check if content differs from last in-memory entry."""
-        # Find the most recent entry for this session
-        for entry in reversed(self._memory_history):
-            if entry.session_id == session_id:
-                snapshot = self._memory_snapshots.get(entry.commit_hash)
-                if snapshot:
-                    return snapshot != (input_text, output_text)
-                return True
-        # No previous entry means there are changes
-        return True
-
-    def _memory_get_history(self, session_id: str, limit: int) -> list[HistoryEntry]:
+        return self._memory_snapshots.latest(session_id) != (input_text, output_text)
+
+    def _memory_get_history(self, session_id: str, limit: int, offset: int = 0) -> list[HistoryEntry]:
         """Get in-memory history entries in reverse chronological order."""
-        entries = [e for e in self._memory_history if e.session_id == session_id]
+        entries = [e for e in self._memory_history.values() if e.session_id == session_id]
         # Reverse for newest-first order
         entries = list(reversed(entries))
-        return entries[:limit]
+        return entries[offset:offset + limit]
 
     def _memory_get_diff(self, commit_hash: str) -> DiffResult:
         """Get diff for an in-memory commit."""
@@ -483,28 +940,11 @@ class GitHistoryStore:
 
         current_input, current_output = current_snapshot
 
-        # Find the entry and its predecessor
-        entry_index = None
-        session_id = None
-        for i, entry in enumerate(self._memory_history):
-            if entry.commit_hash == commit_hash:
-                entry_index = i
-                session_id = entry.session_id
-                break
-
-        if entry_index is None:
-            return DiffResult(commit_hash=commit_hash, parent_hash=None)
-
-        # Find previous entry for same session
-        parent_hash = None
+        # Previous stored snapshot of the same session (None once evicted)
+        parent_hash = self._memory_snapshots.previous(commit_hash)
         prev_input = ""
-        prev_output = ""
-        for i in range(entry_index - 1, -1, -1):
-            if self._memory_history[i].session_id == session_id:
-                parent_hash = self._memory_history[i].commit_hash
-                prev_snapshot = self._memory_snapshots.get(parent_hash, ("", ""))
-                prev_input, prev_output = prev_snapshot
-                break
+        if parent_hash is not None:
+            prev_input, prev_output = self._memory_snapshots.get(parent_hash)
 
         # Generate diff lines for session.txt
         lines = self._compute_diff_lines(prev_input, current_input)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - History Commit Index Module
+
+SQLite index of history commits (session, commit, time, message, sizes),
+so the history of a session is paged without running git log.
+
+The index is derived data: GitHistoryStore records each commit it makes
+and re-syncs the index from Git when it finds the index behind HEAD.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+INDEX_FILE_NAME = "calcpaper-history.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    commit_hash TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    message TEXT NOT NULL,
+    input_size INTEGER,
+    output_size INTEGER,
+    UNIQUE (session_id, commit_hash)
+);
+CREATE INDEX IF NOT EXISTS commits_by_session ON commits (session_id, seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class IndexedCommit:
+    """One indexed commit of a session (sizes in UTF-8 bytes, None if unknown)."""
+    session_id: str
+    commit_hash: str
+    timestamp: datetime
+    message: str
+    input_size: Optional[int] = None
+    output_size: Optional[int] = None
+
+
+class HistoryIndex:
+    """Commit index stored in a SQLite file.
+
+    Rows are kept in commit order; page() returns them newest first. The
+    "head" value records the commit the index is complete up to. Safe to
+    use from several threads.
+    """
+
+    def __init__(self, path: str):
+        """Open or create the index at path."""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Losing the tail of the index only costs a re-sync from Git
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    @property
+    def head(self) -> Optional[str]:
+        """Commit the index is complete up to, or None if never synced."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'head'").fetchone()
+        return row[0] if row else None
+
+    def add(self, entries: Iterable[IndexedCommit], head: str, reset: bool = False) -> None:
+        """Append entries (oldest first) and move the index head, in one transaction.
+
+        Args:
+            entries: Commits to index, in commit order.
+            head: The commit the index is complete up to afterwards.
+            reset: Drop all existing rows first (full rebuild).
+        """
+        rows = [(e.session_id, e.commit_hash, e.timestamp.isoformat(), e.message,
+                 e.input_size, e.output_size) for e in entries]
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                if reset:
+                    conn.execute("DELETE FROM commits")
+                conn.executemany(
+                    "INSERT OR IGNORE INTO commits (session_id, commit_hash, timestamp,"
+                    " message, input_size, output_size) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('head', ?)", (head,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+    def page(self, session_id: str, limit: int, offset: int = 0) -> list[IndexedCommit]:
+        """Get up to limit commits of a session, newest first, skipping offset."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT commit_hash, timestamp, message, input_size, output_size"
+                " FROM commits WHERE session_id = ? ORDER BY seq DESC LIMIT ? OFFSET ?",
+                (session_id, limit, offset)).fetchall()
+        return [IndexedCommit(session_id, commit_hash, datetime.fromisoformat(timestamp),
+                              message, input_size, output_size)
+                for commit_hash, timestamp, message, input_size, output_size in rows]
+
+    def count(self, session_id: str) -> int:
+        """Number of indexed commits of a session."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM commits WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
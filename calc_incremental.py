@@ -5,6 +5,10 @@ CalcPaper - Incremental Calculation Engine and Dependency Graph
 
 This module provides:
 - LineResult: Data class representing the result of calculating a single line.
+- LineEdit: One step of an edit script (insert/delete/replace a range of lines).
+- LineChangeTracker: Records editor insert/delete operations and turns them
+  into an edit script.
+- CalculationCancelled: Raised when an incremental pass is cancelled.
 - DependencyGraph: Line-level dependency graph for tracking variable definitions
   and usages across lines, supporting transitive dependency resolution.
 - IncrementalCalcEngine: Wraps CalculatorPaperAdvanced to provide incremental
@@ -20,15 +24,21 @@ the Free Software Foundation, either version 3 of the License, or
 
 from __future__ import annotations
 
-import re
 import copy
+from collections import deque
 from dataclasses import dataclass, field
+import threading
 from typing import Any, Optional
 
 from calc_paper import CalculatorPaperAdvanced
+from calc_parser import CompiledLine, compile_line
 from calc_session import GlobalVariableStore
 
 
+class CalculationCancelled(Exception):
+    """增量计算被取消（例如出现了更新的编辑）"""
+
+
 @dataclass
 class LineResult:
     """行计算结果"""
@@ -42,6 +52,58 @@ class LineResult:
     error_message: Optional[str] = None
 
 
+@dataclass(frozen=True)
+class LineEdit:
+    """行编辑：从 start 行起删除 delete_count 行，并在该位置插入 new_lines
+
+    An edit script is a list of LineEdits, each relative to the lines left
+    by the previous one. Replacing one line is LineEdit(i, 1, (text,)).
+    """
+    start: int
+    delete_count: int = 0
+    new_lines: tuple[str, ...] = ()
+
+    @classmethod
+    def insert(cls, at: int, lines) -> LineEdit:
+        """在 at 行之前插入若干行"""
+        return cls(at, 0, tuple(lines))
+
+    @classmethod
+    def delete(cls, start: int, count: int = 1) -> LineEdit:
+        """删除从 start 行起的 count 行"""
+        return cls(start, count)
+
+
+def _moved_result(result: LineResult, line_index: int) -> LineResult:
+    """Copy of result at a new line index (cheaper than dataclasses.replace)"""
+    return LineResult(line_index, result.input_line, result.output_line, result.result_value,
+                      result.variables_defined, result.variables_used,
+                      result.is_error, result.error_message)
+
+
+def _trim_edit(lines: list[str], edit: LineEdit) -> Optional[LineEdit]:
+    """Drop the leading/trailing lines an edit leaves unchanged (None if it changes nothing)"""
+    start, end = edit.start, edit.start + edit.delete_count
+    new_lines = edit.new_lines
+    head, tail = 0, len(new_lines)
+    while start < end and head < tail and lines[start] == new_lines[head]:
+        start += 1
+        head += 1
+    while start < end and head < tail and lines[end - 1] == new_lines[tail - 1]:
+        end -= 1
+        tail -= 1
+    if start == end and head == tail:
+        return None
+    if head == 0 and tail == len(new_lines):
+        return edit
+    return LineEdit(start, end - start, new_lines[head:tail])
+
+
+def _split_lines(text: str) -> list[str]:
+    """Split text into calculation lines (surrounding blank lines are dropped)"""
+    return text.strip().split('\n') if text.strip() else []
+
+
 class DependencyGraph:
     """行级别依赖关系图
     
@@ -49,12 +111,26 @@ class DependencyGraph:
     determination of which lines need recalculation when a line changes.
     Supports transitive dependency resolution: if line A defines x, line B
     uses x and defines y, and line C uses y, then changing A affects B and C.
+
+    A reverse index (variable -> lines using it) is maintained alongside
+    the forward maps, so dependents are found in O(edges) rather than by
+    scanning every line.
+
+    Internally every line has a stable line id that survives insertions
+    and deletions above it; only the position list is spliced on a
+    structural edit. The public methods take and return line indices
+    (positions); line_id() and index_of() convert between the two.
     """
 
     def __init__(self):
-        self._defines: dict[int, set[str]] = {}      # line_index -> set of defined variable names
-        self._uses: dict[int, set[str]] = {}          # line_index -> set of used variable names
-        self._var_to_line: dict[str, int] = {}        # variable_name -> line_index that defines it
+        self._line_ids: list[int] = []               # line_index -> line_id
+        self._positions: Optional[dict[int, int]] = {}  # line_id -> line_index (rebuilt lazily)
+        self._next_id = 0
+        self._defines: dict[int, set[str]] = {}      # line_id -> set of defined variable names
+        self._uses: dict[int, set[str]] = {}          # line_id -> set of used variable names
+        self._var_to_line: dict[str, int] = {}        # variable_name -> line_id that defines it
+        self._define_count: dict[str, int] = {}       # variable_name -> number of lines defining it
+        self._var_users: dict[str, set[int]] = {}     # variable_name -> line ids that use it
 
     def build(self, line_results: list[LineResult]) -> None:
         """从 LineResult 列表构建依赖图
@@ -65,16 +141,54 @@ class DependencyGraph:
         Args:
             line_results: List of LineResult objects from a full calculation.
         """
+        self._line_ids = []
+        self._positions = {}
         self._defines.clear()
         self._uses.clear()
         self._var_to_line.clear()
+        self._define_count.clear()
+        self._var_users.clear()
 
         for result in line_results:
-            idx = result.line_index
-            self._defines[idx] = set(result.variables_defined)
-            self._uses[idx] = set(result.variables_used)
-            for var_name in result.variables_defined:
-                self._var_to_line[var_name] = idx
+            self._add_line(self._ensure_line(result.line_index),
+                           result.variables_defined, result.variables_used)
+
+    def __len__(self) -> int:
+        return len(self._line_ids)
+
+    def line_id(self, line_index: int) -> int:
+        """获取指定行的稳定行 ID（插入/删除其他行后保持不变）"""
+        return self._line_ids[line_index]
+
+    def index_of(self, line_id: int) -> Optional[int]:
+        """获取稳定行 ID 当前所在的行号，行已被删除时返回 None"""
+        if self._positions is None:
+            self._positions = {lid: idx for idx, lid in enumerate(self._line_ids)}
+        return self._positions.get(line_id)
+
+    def _ensure_line(self, line_index: int) -> int:
+        """Return the id of line_index, allocating ids up to it if needed"""
+        while len(self._line_ids) <= line_index:
+            self._new_line_id(len(self._line_ids))
+        return self._line_ids[line_index]
+
+    def _new_line_id(self, line_index: int) -> int:
+        """Allocate a fresh id for a line appended at line_index"""
+        line_id = self._next_id
+        self._next_id += 1
+        self._line_ids.append(line_id)
+        if self._positions is not None:
+            self._positions[line_id] = line_index
+        return line_id
+
+    def _id_at(self, line_index: int) -> Optional[int]:
+        if 0 <= line_index < len(self._line_ids):
+            return self._line_ids[line_index]
+        return None
+
+    def _indices(self, line_ids) -> set[int]:
+        index_of = self.index_of
+        return {index_of(line_id) for line_id in line_ids}
 
     def get_affected_lines(self, changed_lines: list[int]) -> list[int]:
         """给定变化行，返回所有需要重算的行（含传递依赖），按行号排序
@@ -90,23 +204,20 @@ class DependencyGraph:
             Sorted list of all line indices that need recalculation,
             including the changed lines themselves.
         """
-        affected = set(changed_lines)
-        queue = list(changed_lines)
+        affected = {idx for idx in changed_lines if self._id_at(idx) is None}
+        affected_ids = {self._line_ids[idx] for idx in changed_lines if self._id_at(idx) is not None}
+        queue = deque(affected_ids)
 
         while queue:
-            current_line = queue.pop(0)
-            # Find variables defined by this line
-            defined_vars = self._defines.get(current_line, set())
-            if not defined_vars:
-                continue
-
-            # Find all lines that use any of these variables
-            for line_idx, used_vars in self._uses.items():
-                if line_idx not in affected:
-                    if used_vars & defined_vars:
-                        affected.add(line_idx)
-                        queue.append(line_idx)
-
+            current_id = queue.popleft()
+            # Lines using any variable defined by this line (reverse index)
+            for var_name in self._defines.get(current_id, ()):
+                for line_id in self._var_users.get(var_name, ()):
+                    if line_id not in affected_ids:
+                        affected_ids.add(line_id)
+                        queue.append(line_id)
+
+        affected.update(self._indices(affected_ids))
         return sorted(affected)
 
     def update_line(self, line_index: int, result: LineResult) -> None:
@@ -119,131 +230,193 @@ class DependencyGraph:
             line_index: The line index to update.
             result: The new LineResult for this line.
         """
-        # Remove old variable-to-line mappings for this line
-        old_defines = self._defines.get(line_index, set())
+        self.set_line(line_index, result.variables_defined, result.variables_used)
+
+    def set_line(self, line_index: int, defines, uses) -> None:
+        """设置单行定义和使用的变量（替换该行原有信息）"""
+        line_id = self._ensure_line(line_index)
+        self._remove_line(line_id)
+        self._add_line(line_id, defines, uses)
+
+    def _add_line(self, line_id: int, defines, uses) -> None:
+        """Add a line's definitions and usages (line must not be in the graph)"""
+        self._defines[line_id] = set(defines)
+        self._uses[line_id] = set(uses)
+        for var_name in defines:
+            self._var_to_line[var_name] = line_id
+            self._define_count[var_name] = self._define_count.get(var_name, 0) + 1
+        for var_name in uses:
+            users = self._var_users.get(var_name)
+            if users is None:
+                self._var_users[var_name] = {line_id}
+            else:
+                users.add(line_id)
+
+    def _remove_line(self, line_id: int) -> None:
+        """Remove a line's definitions and usages from the graph"""
+        old_defines = self._defines.pop(line_id, set())
+        for var_name in self._uses.pop(line_id, ()):
+            users = self._var_users.get(var_name)
+            if users is not None:
+                users.discard(line_id)
+                if not users:
+                    del self._var_users[var_name]
         for var_name in old_defines:
-            if self._var_to_line.get(var_name) == line_index:
+            if self._var_to_line.get(var_name) == line_id:
                 del self._var_to_line[var_name]
+            count = self._define_count.get(var_name, 0) - 1
+            if count > 0:
+                self._define_count[var_name] = count
+            else:
+                self._define_count.pop(var_name, None)
+
+    def splice(self, start: int, old_count: int, new_count: int) -> list[int]:
+        """替换一段行：删除 [start, start + old_count)，为 new_count 行腾出位置
+
+        Lines after the replaced range move by new_count - old_count but
+        keep their line ids, so only the removed and inserted lines are
+        touched. The new lines start with no definitions or usages; fill
+        them in with set_line().
+
+        Args:
+            start: First line index of the replaced range.
+            old_count: Number of lines removed.
+            new_count: Number of lines inserted in their place.
+
+        Returns:
+            The line ids allocated for the inserted lines.
+        """
+        if old_count:
+            self._ensure_line(start + old_count - 1)
+        removed_ids = self._line_ids[start:start + old_count]
+        for line_id in removed_ids:
+            self._remove_line(line_id)
+        new_ids = list(range(self._next_id, self._next_id + new_count))
+        self._next_id += new_count
+        self._line_ids[start:start + old_count] = new_ids
+        if new_count == old_count and self._positions is not None:
+            for line_id in removed_ids:
+                del self._positions[line_id]
+            self._positions.update((line_id, start + i) for i, line_id in enumerate(new_ids))
+        else:
+            self._positions = None
+        return new_ids
+
+    def get_users(self, var_names: set[str]) -> set[int]:
+        """获取使用了任一指定变量的行号集合"""
+        line_ids = set()
+        for var_name in var_names:
+            line_ids.update(self._var_users.get(var_name, ()))
+        return self._indices(line_ids)
+
+    def get_dependents(self, line_index: int) -> set[int]:
+        """获取直接使用了指定行所定义变量的行号集合（不含该行自身）"""
+        dependents = self.get_users(self.get_line_defines(line_index))
+        dependents.discard(line_index)
+        return dependents
 
-        # Update with new data
-        self._defines[line_index] = set(result.variables_defined)
-        self._uses[line_index] = set(result.variables_used)
-        for var_name in result.variables_defined:
-            self._var_to_line[var_name] = line_index
+    def get_define_count(self, var_name: str) -> int:
+        """获取定义指定变量的行数（重复定义时大于 1）"""
+        return self._define_count.get(var_name, 0)
 
     def get_line_defines(self, line_index: int) -> set[str]:
         """获取指定行定义的变量集合"""
-        return self._defines.get(line_index, set())
+        return self._defines.get(self._id_at(line_index), set())
 
     def get_line_uses(self, line_index: int) -> set[str]:
         """获取指定行使用的变量集合"""
-        return self._uses.get(line_index, set())
+        return self._uses.get(self._id_at(line_index), set())
 
     def get_var_definition_line(self, var_name: str) -> Optional[int]:
         """获取定义指定变量的行号"""
-        return self._var_to_line.get(var_name)
+        line_id = self._var_to_line.get(var_name)
+        return None if line_id is None else self.index_of(line_id)
 
 
-# Regex patterns for variable detection
-_ASSIGNMENT_PATTERN = re.compile(
-    r'^([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*=\s*(.+)$'
-)
-_VARIABLE_REF_PATTERN = re.compile(
-    r'\b([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\b'
-)
-# Reserved keywords and function names that should not be treated as variable references
-_RESERVED_NAMES = frozenset([
-    'swap', 'bitmap', 'hex', 'comma', 'workday', 'global',
-    'True', 'False', 'None',
-])
-
-
-def _detect_variables_defined(line: str) -> list[str]:
-    """Detect variables defined (assigned) in a line.
-    
-    Looks for patterns like `variable_name = expression`.
+class LineChangeTracker:
+    """编辑器行变化跟踪器
     
-    Args:
-        line: The input line text (stripped).
-        
-    Returns:
-        List of variable names defined in this line (usually 0 or 1).
+    Records the edits made to an editor buffer since the last calculation
+    (fed from the text widget's insert/delete hooks) as structural line
+    splices plus the set of lines whose content changed, and turns them
+    into an edit script for IncrementalCalcEngine.process_edits(). Line
+    numbers are 0-based widget lines.
     """
-    if not line or line.startswith('#'):
-        return []
-
-    # Remove inline comments
-    if '#' in line:
-        line = line.split('#')[0].strip()
-
-    # Skip function-style calls (hex(...), bitmap(...), comma(...), workday(...), global(...))
-    func_pattern = r'^(hex|bitmap|comma|workday|global)\s*\('
-    if re.match(func_pattern, line, re.IGNORECASE):
-        return []
-
-    match = _ASSIGNMENT_PATTERN.match(line.strip())
-    if match:
-        var_name = match.group(1)
-        # Check it's not a reserved keyword
-        if var_name not in _RESERVED_NAMES and not re.match(r'^[YTMWDhms]\d+$', var_name):
-            return [var_name]
-    return []
 
+    def __init__(self):
+        self._splices: Optional[list[tuple[int, int, int]]] = []  # (start, delete_count, insert_count)
+        self._dirty: set[int] = set()                            # Changed lines, current numbering
 
-def _detect_variables_used(line: str, defined_vars: list[str] = None) -> list[str]:
-    """Detect variables referenced (used) in a line.
-    
-    Scans the expression part of the line for variable references,
-    excluding the variable being defined (if any) and reserved names.
-    
-    Args:
-        line: The input line text (stripped).
-        defined_vars: Variables defined in this line (to exclude from usage).
+    @property
+    def has_changes(self) -> bool:
+        """Whether any edit was recorded since the last reset()"""
+        return self._splices is None or bool(self._splices) or bool(self._dirty)
+
+    def reset(self) -> None:
+        """Forget recorded edits (after a calculation)"""
+        self._splices = []
+        self._dirty = set()
+
+    def invalidate(self) -> None:
+        """Mark the recorded edits as unknown; edit_script() returns None until reset()"""
+        self._splices = None
+        self._dirty = set()
+
+    def insert(self, line: int, newline_count: int = 0) -> None:
+        """记录在 line 行内插入了包含 newline_count 个换行符的文本"""
+        if self._splices is None:
+            return
+        if newline_count:
+            self._splice(line + 1, 0, newline_count)
+        self._dirty.update(range(line, line + newline_count + 1))
+
+    def delete(self, first_line: int, last_line: int) -> None:
+        """记录删除了从 first_line 行到 last_line 行之间的文本（两行合并为一行）"""
+        if self._splices is None:
+            return
+        if last_line > first_line:
+            self._splice(first_line + 1, last_line - first_line, 0)
+        self._dirty.add(first_line)
+
+    def _splice(self, start: int, delete_count: int, insert_count: int) -> None:
+        self._splices.append((start, delete_count, insert_count))
+        end = start + delete_count
+        delta = insert_count - delete_count
+        self._dirty = {idx if idx < start else idx + delta for idx in self._dirty if not start <= idx < end}
+
+    def edit_script(self, old_lines: list[str], new_lines: list[str]) -> Optional[list[LineEdit]]:
+        """生成把 old_lines 变为 new_lines 的编辑脚本
         
-    Returns:
-        List of variable names used in this line.
-    """
-    if not line or line.startswith('#'):
-        return []
-
-    if defined_vars is None:
-        defined_vars = []
-
-    # Remove inline comments
-    if '#' in line:
-        line = line.split('#')[0].strip()
-
-    # Get the expression part (right side of assignment, or the whole line)
-    expr = line
-    match = _ASSIGNMENT_PATTERN.match(line.strip())
-    if match:
-        expr = match.group(2)
-
-    # Strip function wrappers (hex(...), bitmap(...), comma(...))
-    func_pattern = r'^(hex|bitmap|comma)\s*\(\s*(.+?)\s*(?:,\s*[^)]+)?\s*\)$'
-    func_match = re.match(func_pattern, expr.strip(), re.IGNORECASE)
-    if func_match:
-        expr = func_match.group(2)
-
-    # Also handle the case where the whole line is a function call
-    if not match:
-        func_line_pattern = r'^(hex|bitmap|comma|workday)\s*\(\s*(.+?)\s*(?:,\s*[^)]+)?\s*\)$'
-        func_line_match = re.match(func_line_pattern, line.strip(), re.IGNORECASE)
-        if func_line_match:
-            expr = func_line_match.group(2)
-
-    # Find all variable references in the expression
-    used = []
-    defined_set = set(defined_vars)
-    for m in _VARIABLE_REF_PATTERN.finditer(expr):
-        var_name = m.group(1)
-        if (var_name not in _RESERVED_NAMES and
-                var_name not in defined_set and
-                not re.match(r'^[YTMWDhms]\d+$', var_name) and
-                not re.match(r'^0[xXbB]', var_name)):
-            if var_name not in used:
-                used.append(var_name)
-    return used
+        Structural splices insert blank placeholder lines, then each run of
+        changed lines is replaced with its text from new_lines. Returns
+        None when the recorded edits do not explain new_lines (edits that
+        bypassed the hooks), so the caller can fall back to a text diff.
+        """
+        if self._splices is None:
+            return None
+        lines = list(old_lines)
+        script = []
+        for start, delete_count, insert_count in self._splices:
+            if start + delete_count > len(lines):
+                return None
+            placeholder = ('',) * insert_count
+            lines[start:start + delete_count] = placeholder
+            script.append(LineEdit(start, delete_count, placeholder))
+        if len(lines) != len(new_lines) or any(idx >= len(lines) for idx in self._dirty):
+            return None
+
+        dirty = sorted(self._dirty)
+        run_start = 0
+        for pos, idx in enumerate(dirty):
+            if pos + 1 < len(dirty) and dirty[pos + 1] == idx + 1:
+                continue
+            first = dirty[run_start]
+            lines[first:idx + 1] = new_lines[first:idx + 1]
+            script.append(LineEdit(first, idx + 1 - first, tuple(new_lines[first:idx + 1])))
+            run_start = pos + 1
+        if lines != new_lines:
+            return None
+        return script
 
 
 class IncrementalCalcEngine:
@@ -262,6 +435,8 @@ class IncrementalCalcEngine:
         results = engine.process_full("a = 1\\nb = a + 1")
         # After editing line 0:
         new_results = engine.process_incremental(old_text, new_text, [0])
+        # Or, when the editor knows the structural edits:
+        new_results = engine.process_edits([LineEdit.insert(0, ["x = 2"])])
     """
 
     def __init__(self, calculator: CalculatorPaperAdvanced, global_store: GlobalVariableStore):
@@ -276,6 +451,27 @@ class IncrementalCalcEngine:
         self._dep_graph = DependencyGraph()
         self._last_results: list[LineResult] = []
         self._last_text: str = ""
+        self._lines: list[str] = []              # Lines of _last_text, as split for calculation
+        self._records: list[CompiledLine] = []   # Line records matching _last_results
+        self._preset_vars: dict[str, Any] = {}   # Global variables the last calculation started from
+        self._preset_funcs: dict[str, tuple] = {}  # Global functions the last calculation started from
+        self._pending_ids: set[int] = set()      # Lines left unevaluated by a cancelled pass (line ids)
+        self._circular_ids: set[int] = set()     # Lines with circular dependencies (line ids)
+
+    @property
+    def calculator(self) -> CalculatorPaperAdvanced:
+        """Access the wrapped calculator."""
+        return self._calculator
+
+    @property
+    def last_text(self) -> str:
+        """The text of the last calculation."""
+        return self._last_text
+
+    @property
+    def lines(self) -> list[str]:
+        """Lines of the last calculated text (indices used by LineResult and LineEdit)."""
+        return self._lines
 
     @property
     def dependency_graph(self) -> DependencyGraph:
@@ -302,189 +498,311 @@ class IncrementalCalcEngine:
         self._last_text = text
         
         # Use the existing calculator to process all text
-        # Pass global variables as preset so they're available during calculation
+        # Pass global variables/functions as preset so they're available during calculation
         global_vars = self._global_store.get_all()
-        self._calculator.process_text(text, preset_variables=global_vars if global_vars else None)
-        
-        # Build LineResult list from calculator state
-        lines = text.strip().split('\n') if text.strip() else []
-        line_results = []
-
-        for i, input_line in enumerate(lines):
-            input_line_stripped = input_line.strip()
-            
-            # Detect variables
-            vars_defined = _detect_variables_defined(input_line_stripped)
-            vars_used = _detect_variables_used(input_line_stripped, vars_defined)
-
-            # Get result from calculator
-            result_value = None
-            is_error = False
-            error_message = None
-            output_line = input_line_stripped
-
-            if i < len(self._calculator.results):
-                result_info = self._calculator.results[i]
-                if result_info is not None:
-                    result, label, extra_info, bit_info, use_bitmap, hex_info = result_info
-                    result_value = result
-                    if result is None and extra_info and ('错误' in str(extra_info) or '变量未定义' in str(extra_info)):
-                        is_error = True
-                        error_message = extra_info
-                        output_line = f"{input_line_stripped}  # {extra_info}"
-                    elif result is not None:
-                        # Format output line
-                        if hex_info:
-                            result_str = hex_info
-                        elif isinstance(result, int):
-                            result_str = str(result)
-                        elif isinstance(result, float):
-                            if result == int(result):
-                                result_str = str(int(result))
-                            else:
-                                result_str = f"{result:.2f}"
-                        else:
-                            result_str = str(result)
-                        
-                        if extra_info and not is_error:
-                            output_line = f"{input_line_stripped}  = {result_str}  # {extra_info}"
-                        else:
-                            output_line = f"{input_line_stripped}  = {result_str}"
-
-            lr = LineResult(
-                line_index=i,
-                input_line=input_line_stripped,
-                output_line=output_line,
-                result_value=result_value,
-                variables_defined=vars_defined,
-                variables_used=vars_used,
-                is_error=is_error,
-                error_message=error_message,
-            )
-            line_results.append(lr)
+        global_funcs = self._global_store.get_all_functions()
+        self._calculator.process_text(text, preset_variables=global_vars if global_vars else None,
+                                      preset_functions=global_funcs if global_funcs else None)
+        self._preset_vars = dict(global_vars) if global_vars else {}
+        self._preset_funcs = global_funcs
+        self._pending_ids = set()
+
+        # Build LineResult list from calculator state, reusing the line
+        # records classified by process_text()
+        lines = _split_lines(text)
+        self._lines = lines
+        self._records = list(self._calculator.line_records[:len(lines)])
+        line_results = self._build_line_results(lines, self._records)
 
         # Build dependency graph
         self._dep_graph.build(line_results)
+        self._circular_ids = {self._dep_graph.line_id(idx) for idx in self._calculator.circular_lines}
         self._last_results = line_results
         return line_results
 
-    def process_incremental(self, old_text: str, new_text: str, changed_lines: list[int]) -> list[LineResult]:
+    def process_incremental(self, old_text: str, new_text: str, changed_lines: list[int],
+                            cancel_event: Optional[threading.Event] = None) -> list[LineResult]:
         """增量计算：仅重算变化行及其依赖行
         
-        Identifies which lines need recalculation based on the dependency
-        graph, then recalculates only those lines. Falls back to full
-        calculation if the number of lines changed.
+        Finds the edited range by comparing old_text and new_text (common
+        prefix/suffix) and applies it as a single LineEdit; see
+        process_edits() for how the edit is applied.
         
         Args:
             old_text: The previous text content.
             new_text: The new text content after editing.
-            changed_lines: List of line indices that were directly modified.
+            changed_lines: List of line indices (in new_text) that were directly modified.
+            cancel_event: Optional event; see process_edits().
             
         Returns:
             Complete list of LineResult objects for all lines in new_text.
         """
-        old_lines = old_text.strip().split('\n') if old_text.strip() else []
-        new_lines = new_text.strip().split('\n') if new_text.strip() else []
+        if old_text != self._last_text or len(self._records) != len(self._last_results):
+            return self.process_full(new_text)
 
-        # If line count changed, fall back to full calculation
-        if len(old_lines) != len(new_lines):
+        old_lines = self._lines
+        new_lines = _split_lines(new_text)
+        if not old_lines or not new_lines:
             return self.process_full(new_text)
 
-        # Get all affected lines (changed + transitive dependents)
-        affected_lines = self._dep_graph.get_affected_lines(changed_lines)
+        # Edited range: lines outside the common prefix/suffix
+        limit = min(len(old_lines), len(new_lines))
+        prefix = 0
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < limit - prefix and
+               old_lines[len(old_lines) - 1 - suffix] == new_lines[len(new_lines) - 1 - suffix]):
+            suffix += 1
+        edit = LineEdit(prefix, len(old_lines) - prefix - suffix,
+                        tuple(new_lines[prefix:len(new_lines) - suffix]))
+        dirty = [i for i in changed_lines if 0 <= i < len(new_lines)]
+        return self._apply_edits([edit] if edit.delete_count or edit.new_lines else [], dirty, new_text,
+                                 cancel_event)
+
+    def process_edits(self, edits: list[LineEdit], changed_lines: Optional[list[int]] = None,
+                      cancel_event: Optional[threading.Event] = None) -> list[LineResult]:
+        """按编辑脚本增量计算：依次应用插入/删除/替换行的编辑
+        
+        Each LineEdit is applied to the lines left by the previous one.
+        The cached results of untouched lines are kept (moved, not
+        re-evaluated) and the dependency graph is spliced by stable line
+        id, so an insertion at the top of a large sheet only evaluates the
+        inserted lines and the lines depending on what they define.
+        
+        Falls back to process_full() when the edit cannot be applied
+        locally: no previous calculation, changed function definitions,
+        variables defined on more than one line, or leading/trailing blank
+        lines (which the full calculation strips). Circular dependencies
+        are found as in a full calculation (including lines depending on
+        an untouched circular line).
+        
+        Setting cancel_event stops the pass between two line evaluations
+        with CalculationCancelled. The edits are then already applied
+        (last_text and lines describe the edited text) and the lines not
+        yet evaluated are re-evaluated by the next incremental call. A
+        fallback to process_full() is not interruptible.
+        
+        Args:
+            edits: The edit script, relative to the last calculated text.
+            changed_lines: Extra line indices (after the edits) to re-evaluate.
+            cancel_event: Optional event checked between line evaluations.
+            
+        Returns:
+            Complete list of LineResult objects for all lines of the edited text.
+            
+        Raises:
+            ValueError: If an edit lies outside the current lines.
+            CalculationCancelled: If cancel_event was set during evaluation.
+        """
+        lines = list(self._lines)
+        applied = []
+        for edit in edits:
+            if edit.start < 0 or edit.delete_count < 0 or edit.start + edit.delete_count > len(lines):
+                raise ValueError(f"编辑超出范围: 第 {edit.start + 1} 行起删除 {edit.delete_count} 行 (共 {len(lines)} 行)")
+            edit = _trim_edit(lines, edit)
+            if edit is not None:
+                lines[edit.start:edit.start + edit.delete_count] = edit.new_lines
+                applied.append(edit)
+        new_text = '\n'.join(lines)
+        if (len(self._records) != len(self._last_results) or not self._lines or not lines
+                or not lines[0] or lines[0][0].isspace() or not lines[-1] or lines[-1][-1].isspace()):
+            return self.process_full(new_text)
+        dirty = [i for i in changed_lines or () if 0 <= i < len(lines)]
+        return self._apply_edits(applied, dirty, new_text, cancel_event)
 
-        # Recalculate by processing the full text with the calculator
-        # (since the calculator maintains variable state sequentially)
-        # We need to re-process from the beginning to maintain correct variable state
-        self._calculator.lines = []
-        self._calculator.results = []
-        # Start with global variables as base (local assignments will override)
-        global_vars = self._global_store.get_all()
-        self._calculator.variables = dict(global_vars) if global_vars else {}
+    def _apply_edits(self, edits: list[LineEdit], changed_lines: list[int], new_text: str,
+                     cancel_event: Optional[threading.Event] = None) -> list[LineResult]:
+        """Apply an edit script to the cached state and re-evaluate what it affects
 
-        all_lines = new_text.strip().split('\n') if new_text.strip() else []
-        
-        for line in all_lines:
-            original_line = line.strip()
-            if not original_line:
-                self._calculator.lines.append('')
-                self._calculator.results.append(None)
-                continue
-            if original_line.startswith('#'):
-                self._calculator.lines.append(original_line)
-                self._calculator.results.append(None)
-                continue
-            result, label, extra_info, bit_info, use_bitmap, hex_info = self._calculator.parse_line(line)
-            self._calculator.lines.append(original_line)
-            if result is not None:
-                self._calculator.results.append((result, label, extra_info, bit_info, use_bitmap, hex_info))
+        Splices the cached lines, records, results and calculator state,
+        then re-evaluates only the dirty lines and their transitive
+        dependents in dependency order. All other lines keep their cached
+        LineResult and variable values.
+        """
+        graph = self._dep_graph
+        removed_records = []
+        inserted_records = []
+        compiled_edits = []
+        for edit in edits:
+            records = [compile_line(line) for line in edit.new_lines]
+            inserted_records.extend(records)
+            compiled_edits.append((edit, records))
+
+        # Function definitions change every caller - recalculate everything
+        if (any(r.is_func_def for r in inserted_records)
+                or self._global_store.get_all_functions() != self._preset_funcs):
+            return self.process_full(new_text)
+
+        # Splice the cached state: untouched lines keep their results and line ids
+        calc = self._calculator
+        # New list object: results returned by earlier calls stay unchanged
+        self._last_results = list(self._last_results)
+        dirty_ids = set()
+        first_moved = None
+        for edit, records in compiled_edits:
+            start, end, new_count = edit.start, edit.start + edit.delete_count, len(edit.new_lines)
+            removed_records.extend(self._records[start:end])
+            self._lines[start:end] = edit.new_lines
+            self._records[start:end] = records
+            self._last_results[start:end] = [None] * new_count
+            calc.lines[start:end] = [line.strip() for line in edit.new_lines]
+            calc.results[start:end] = [None] * new_count
+            dirty_ids.update(graph.splice(start, edit.delete_count, new_count))
+            if new_count != edit.delete_count and (first_moved is None or start < first_moved):
+                first_moved = start
+        calc.line_records = self._records
+        self._last_text = new_text
+
+        # Variables whose definition disappeared or changed
+        stale_vars = {r.defines for r in removed_records if r.defines}
+        if any(r.is_func_def for r in removed_records):
+            return self.process_full(new_text)
+
+        # Moved results get their new line index
+        if first_moved is not None:
+            for idx in range(first_moved, len(self._last_results)):
+                result = self._last_results[idx]
+                if result is not None and result.line_index != idx:
+                    self._last_results[idx] = _moved_result(result, idx)
+
+        # Register the new definitions/usages of dirty lines (inserted lines
+        # removed again by a later edit of the script have no index)
+        dirty = {graph.index_of(line_id) for line_id in dirty_ids}
+        dirty.discard(None)
+        dirty.update(changed_lines)
+        for idx in dirty:
+            record = self._records[idx]
+            vars_defined = [record.defines] if record.defines else []
+            graph.set_line(idx, vars_defined, calc._line_uses(record) - set(vars_defined))
+            if record.defines and graph.get_define_count(record.defines) > 1:
+                return self.process_full(new_text)
+        # A removed definition whose variable is still defined by an untouched
+        # line means it was defined more than once
+        redefined = {self._records[idx].defines for idx in dirty}
+        for var_name in stale_vars:
+            if graph.get_define_count(var_name) and var_name not in redefined:
+                return self.process_full(new_text)
+
+        # Global variables that changed since the last calculation
+        global_vars = self._global_store.get_all()
+        for var_name in set(global_vars) | set(self._preset_vars):
+            if global_vars.get(var_name) != self._preset_vars.get(var_name):
+                stale_vars.add(var_name)
+        self._preset_vars = dict(global_vars) if global_vars else {}
+
+        # Dirty lines + users of stale variables, then their transitive dependents
+        seeds = dirty | graph.get_users(stale_vars)
+        # Lines a cancelled pass did not get to
+        seeds.update(idx for idx in map(graph.index_of, self._pending_ids) if idx is not None)
+        affected_lines = graph.get_affected_lines(sorted(seeds))
+
+        # Reset variables that are recomputed or no longer defined by any line,
+        # so a line that now fails leaves them undefined like a full calculation
+        reset_vars = {self._records[idx].defines for idx in affected_lines if self._records[idx].defines}
+        if any(graph.get_define_count(v) > 1 for v in reset_vars):
+            return self.process_full(new_text)
+        # A line reading a variable defined more than once sees whichever
+        # definition the full evaluation order runs before it
+        if any(graph.get_define_count(v) > 1 for idx in affected_lines for v in graph.get_line_uses(idx)):
+            return self.process_full(new_text)
+        reset_vars.update(v for v in stale_vars if graph.get_define_count(v) == 0)
+        for var_name in reset_vars:
+            if var_name in self._preset_vars:
+                calc.variables[var_name] = self._preset_vars[var_name]
             else:
-                self._calculator.results.append((None, label, extra_info, bit_info, use_bitmap, hex_info))
-
-        # Build new LineResult list
-        line_results = []
-        for i, input_line in enumerate(all_lines):
-            input_line_stripped = input_line.strip()
-            vars_defined = _detect_variables_defined(input_line_stripped)
-            vars_used = _detect_variables_used(input_line_stripped, vars_defined)
-
-            result_value = None
-            is_error = False
-            error_message = None
-            output_line = input_line_stripped
-
-            if i < len(self._calculator.results):
-                result_info = self._calculator.results[i]
-                if result_info is not None:
-                    result, label, extra_info, bit_info, use_bitmap, hex_info = result_info
-                    result_value = result
-                    if result is None and extra_info and ('错误' in str(extra_info) or '变量未定义' in str(extra_info)):
-                        is_error = True
-                        error_message = extra_info
-                        output_line = f"{input_line_stripped}  # {extra_info}"
-                    elif result is not None:
-                        if hex_info:
-                            result_str = hex_info
-                        elif isinstance(result, int):
-                            result_str = str(result)
-                        elif isinstance(result, float):
-                            if result == int(result):
-                                result_str = str(int(result))
-                            else:
-                                result_str = f"{result:.2f}"
-                        else:
-                            result_str = str(result)
-                        
-                        if extra_info and not is_error:
-                            output_line = f"{input_line_stripped}  = {result_str}  # {extra_info}"
+                calc.variables.pop(var_name, None)
+
+        # Same ordering and cycle detection as a full calculation; circular
+        # lines outside the affected ones keep their circular result
+        affected_ids = {graph.line_id(idx) for idx in affected_lines}
+        self._circular_ids = {line_id for line_id in self._circular_ids if graph.index_of(line_id) is not None}
+        blocked = {graph.index_of(line_id) for line_id in self._circular_ids - affected_ids}
+        eval_order, circular_lines = calc._dependency_order(
+            self._records, affected_lines, graph.get_var_definition_line, blocked)
+
+        # Re-evaluate affected lines in dependency order
+        self._pending_ids = affected_ids
+        for idx in eval_order:
+            if cancel_event is not None and cancel_event.is_set():
+                raise CalculationCancelled()
+            record = self._records[idx]
+            if record.is_blank or record.is_func_def:
+                calc.results[idx] = None
+                continue
+            calc.results[idx] = calc._evaluate_record(record)
+        for idx in circular_lines:
+            calc.results[idx] = calc._circular_result(self._records[idx])
+        self._circular_ids = (self._circular_ids - affected_ids) | {graph.line_id(idx) for idx in circular_lines}
+        calc.circular_lines = blocked | circular_lines
+        for idx in affected_lines:
+            self._last_results[idx] = self._make_line_result(idx, self._lines[idx], self._records[idx])
+        self._pending_ids = set()
+
+        return self._last_results
+
+    def _build_line_results(self, lines: list[str], records: list[CompiledLine]) -> list[LineResult]:
+        """Build LineResult objects from the calculator's results and line records
+
+        Args:
+            lines: Input lines (same order as records).
+            records: CompiledLine record per line (defines/uses).
+        """
+        return [self._make_line_result(i, line, records[i] if i < len(records) else compile_line(line))
+                for i, line in enumerate(lines)]
+
+    def _make_line_result(self, i: int, input_line: str, record: CompiledLine) -> LineResult:
+        """Build the LineResult of line i from calculator.results[i] and its record"""
+        input_line_stripped = input_line.strip()
+
+        # Variables from the line record (self-reference is not a usage here)
+        vars_defined = [record.defines] if record.defines else []
+        vars_used = sorted(self._calculator._line_uses(record) - set(vars_defined))
+
+        # Get result from calculator
+        result_value = None
+        is_error = False
+        error_message = None
+        output_line = input_line_stripped
+
+        if i < len(self._calculator.results):
+            result_info = self._calculator.results[i]
+            if result_info is not None:
+                result, label, extra_info, bit_info, use_bitmap, hex_info = result_info
+                result_value = result
+                if result is None and extra_info and ('错误' in str(extra_info) or '变量未定义' in str(extra_info)):
+                    is_error = True
+                    error_message = extra_info
+                    output_line = f"{input_line_stripped}  # {extra_info}"
+                elif result is not None:
+                    # Format output line
+                    if hex_info:
+                        result_str = hex_info
+                    elif isinstance(result, int):
+                        result_str = str(result)
+                    elif isinstance(result, float):
+                        if result == int(result):
+                            result_str = str(int(result))
                         else:
-                            output_line = f"{input_line_stripped}  = {result_str}"
-
-            lr = LineResult(
-                line_index=i,
-                input_line=input_line_stripped,
-                output_line=output_line,
-                result_value=result_value,
-                variables_defined=vars_defined,
-                variables_used=vars_used,
-                is_error=is_error,
-                error_message=error_message,
-            )
-            line_results.append(lr)
-
-        # Update dependency graph
-        for line_idx in affected_lines:
-            if line_idx < len(line_results):
-                self._dep_graph.update_line(line_idx, line_results[line_idx])
-
-        # Also update any newly changed lines that weren't in the old graph
-        for line_idx in changed_lines:
-            if line_idx < len(line_results) and line_idx not in affected_lines:
-                self._dep_graph.update_line(line_idx, line_results[line_idx])
+                            result_str = f"{result:.2f}"
+                    else:
+                        result_str = str(result)
 
-        self._last_results = line_results
-        self._last_text = new_text
-        return line_results
+                    if extra_info and not is_error:
+                        output_line = f"{input_line_stripped}  = {result_str}  # {extra_info}"
+                    else:
+                        output_line = f"{input_line_stripped}  = {result_str}"
+
+        return LineResult(
+            line_index=i,
+            input_line=input_line_stripped,
+            output_line=output_line,
+            result_value=result_value,
+            variables_defined=vars_defined,
+            variables_used=vars_used,
+            is_error=is_error,
+            error_message=error_message,
+        )
 
     def get_dependencies(self, line_index: int) -> set[int]:
         """获取指定行依赖的所有行号
@@ -518,12 +836,7 @@ class IncrementalCalcEngine:
         Returns:
             Set of line indices that depend on this line.
         """
-        defined_vars = self._dep_graph.get_line_defines(line_index)
-        dependents = set()
-        for other_line, used_vars in self._dep_graph._uses.items():
-            if other_line != line_index and used_vars & defined_vars:
-                dependents.add(other_line)
-        return dependents
+        return self._dep_graph.get_dependents(line_index)
 
     def preview_line(self, line_text: str) -> Optional[LineResult]:
         """预览单行计算结果（不修改状态）
@@ -585,8 +898,9 @@ class IncrementalCalcEngine:
         else:
             output_line = f"{line_text}  = {result_str}"
 
-        vars_defined = _detect_variables_defined(line_text)
-        vars_used = _detect_variables_used(line_text, vars_defined)
+        record = compile_line(line_text)
+        vars_defined = [record.defines] if record.defines else []
+        vars_used = sorted(record.uses - set(vars_defined))
 
         return LineResult(
             line_index=-1,  # Preview doesn't have a real line index
@@ -26,51 +26,128 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
-import re
 import sys
 import argparse
 import datetime
 import calendar
-from enum import Enum
+from dataclasses import dataclass
 
 from version import VERSION
+from calc_grammar import (
+    is_reserved_keyword,
+    IDENT_RE, HEX_NUMBER_RE, BIN_NUMBER_RE, DECIMAL_RE,
+    DATE_LITERAL_RE, TIME_LITERAL_RE, DATE_DURATION_RE, TIME_DURATION_RE, DATE_TIME_SPLIT_RE,
+    FUNC_CALL_RE, WORKDAY_RE,
+)
+from calc_parser import (
+    OutputFormat, CalcError, CompiledLine, compile_line, compile_text,
+    normalize_comma_numbers, add_implicit_multiplication,
+)
+# Re-exported: detect_output_format() was defined here before calc_parser existed
+from calc_parser import detect_output_format  # noqa: F401
+from calc_parallel import evaluate_parallel, shutdown_executors
+from calc_cache import LineResultCache
+from calc_functions import (
+    FunctionCallCache, CallBudgetExceeded, compile_function, split_call,
+    DEFAULT_MAX_CALL_DEPTH, DEFAULT_MAX_CALL_STEPS, MAX_EXPANSION_LENGTH,
+)
+
+_NO_RESULT = object()
+
+
+class _Undefined:
+    """Fingerprint value of a variable that is not defined
+
+    Unpickles to the module singleton, so cache keys built in a worker
+    process match the ones built here.
+    """
+    __slots__ = ()
 
+    def __reduce__(self):
+        return '_UNDEFINED'
 
-class OutputFormat(Enum):
-    """Output format for calculation results"""
-    DECIMAL = 'decimal'
-    HEXADECIMAL = 'hex'
-    BINARY = 'binary'
+    def __repr__(self):
+        return '<undefined>'
 
 
-def detect_output_format(expression: str, has_explicit_hex_func: bool) -> OutputFormat:
-    """根据表达式中的字面量自动检测输出格式
-    
-    Priority:
-    1. Explicit hex() function → HEXADECIMAL
-    2. Expression contains 0x literal → HEXADECIMAL
-    3. Expression contains 0b literal → BINARY
-    4. No special literals → DECIMAL
+_UNDEFINED = _Undefined()
+
+
+@dataclass(frozen=True)
+class OutputChange:
+    """输出变更：从 start 行起删除 delete_count 行，并在该位置插入 lines
+
+    Line numbers count output lines (a bitmap result spans several). A list
+    of changes applies in order, each relative to the previous result.
     """
-    if has_explicit_hex_func:
-        return OutputFormat.HEXADECIMAL
-    has_hex = bool(re.search(r'0[xX][0-9a-fA-F]+', expression))
-    has_bin = bool(re.search(r'0[bB][01]+', expression))
-    if has_hex:
-        return OutputFormat.HEXADECIMAL
-    if has_bin:
-        return OutputFormat.BINARY
-    return OutputFormat.DECIMAL
+    start: int
+    delete_count: int
+    lines: tuple = ()
+
+
+def _diff_output_blocks(old_blocks, new_blocks):
+    """Changed output line ranges between two format_output() block lists"""
+    old_count, new_count = len(old_blocks), len(new_blocks)
+    prefix = 0
+    while prefix < old_count and prefix < new_count and old_blocks[prefix] == new_blocks[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < old_count - prefix and suffix < new_count - prefix
+           and old_blocks[old_count - 1 - suffix] == new_blocks[new_count - 1 - suffix]):
+        suffix += 1
+    if prefix == old_count and prefix == new_count:
+        return []
+
+    start = sum(len(block) for block in new_blocks[:prefix])
+    old_middle = old_blocks[prefix:old_count - suffix]
+    new_middle = new_blocks[prefix:new_count - suffix]
+    if len(old_middle) != len(new_middle):
+        # Lines inserted or removed: replace the whole changed range
+        return [OutputChange(start, sum(len(block) for block in old_middle),
+                             tuple(text for block in new_middle for text in block))]
+
+    # Same line count (edits, re-padding): one change per run of changed lines
+    changes = []
+    run_start = run_old = None
+    run_lines = []
+    for old_block, new_block in zip(old_middle, new_middle):
+        if old_block != new_block:
+            if run_start is None:
+                run_start, run_old, run_lines = start, 0, []
+            run_old += len(old_block)
+            run_lines.extend(new_block)
+        elif run_start is not None:
+            changes.append(OutputChange(run_start, run_old, tuple(run_lines)))
+            run_start = None
+        start += len(new_block)
+    if run_start is not None:
+        changes.append(OutputChange(run_start, run_old, tuple(run_lines)))
+    return changes
 
 
 class CalculatorPaperAdvanced:
     def __init__(self, language='zh'):
         self.lines = []
         self.results = []
+        self.line_records = []  # CompiledLine per line from the last process_text()
+        self.circular_lines = set()  # Line indices with circular dependencies from the last process_text()
         self.variables = {}
         self.functions = {}  # User-defined functions: {name: (params, body_expr)}
+        self.function_cache = FunctionCallCache()  # Memoized user function calls (LRU)
+        self._function_snapshot = {}  # Definitions the memoized calls were computed with
+        self._function_closures = {}  # {call names: (free variables, uses bitwise)}
+        self.max_call_depth = DEFAULT_MAX_CALL_DEPTH  # Nested user function frames per line
+        self.max_call_steps = DEFAULT_MAX_CALL_STEPS  # User function calls per line
+        self._call_steps = 0
+        self.result_cache = LineResultCache()  # Line results reused across recalculations (LRU)
+        self._format_cache = {}  # Rendered output per (language, line, result) of the last format_output()
+        self._output_blocks = []  # Output lines per input line from the last format_output()
         self.bit_display_mode = None  # 'little' or 'big' or None
         self.language = language  # 'zh' or 'en'
+
+        # Parallel evaluation of independent lines (1 = always serial)
+        self.parallel_workers = 1
+        self.parallel_min_lines = 1000  # Smaller sheets are evaluated serially
         
         # Undo/redo history
         self.history = []  # History states
@@ -132,7 +209,7 @@ class CalculatorPaperAdvanced:
     def _normalize_comma_numbers(self, expr):
         """Normalize comma-separated numbers like 59,200 → 59200.
         Matches patterns like 1,000 or 1,234,567 but not standalone commas."""
-        return re.sub(r'(\d{1,3}(?:,\d{3})+)(?!\w)', lambda m: m.group(1).replace(',', ''), expr)
+        return normalize_comma_numbers(expr)
 
     @staticmethod
     def format_comma_number(value):
@@ -149,48 +226,61 @@ class CalculatorPaperAdvanced:
         return str(value)
 
     def parse_line(self, line):
-        """Parse a single line expression"""
-        line = line.strip()
-        if not line or line.startswith('#'):
-            return None, None, None, None, False, None
-
-        # Remove inline comments
-        original_expr = line
-        if '#' in line:
-            line = line.split('#')[0].strip()
-
-        # Normalize comma-separated numbers (e.g. 59,200 → 59200)
-        line = self._normalize_comma_numbers(line)
+        """Parse a single line expression
 
-        # Check if hex function is used (standalone only, cannot be assigned or used in expressions)
-        use_hex_func = False
-
-        # Check if bitmap function is used (standalone only, cannot be assigned or used in expressions)
-        use_bitmap = False
-        bitmap_endian = None
-        bitmap_width = None
+        The text analysis (built-in wrappers, label, literal formats and the
+        expression AST) comes from compile_line() and is cached by line text,
+        so recalculating an unchanged line only evaluates its AST.
+        """
+        return self._evaluate_line(compile_line(line))
 
-        # Check if comma function is used (standalone only, formats result with comma separators)
-        use_comma_func = False
+    def _evaluate_record(self, compiled):
+        """Evaluate a line record, reusing the result of an identical earlier evaluation
 
-        hex_pattern = r'^hex\s*\(\s*(.+)\s*\)$'
-        hex_func_match = re.match(hex_pattern, line, re.IGNORECASE)
+        The result of an expression line depends only on its text, the values
+        of the variables it uses and the language, so it is looked up in
+        result_cache by those. Lines referring to user functions are always
+        evaluated (their calls are memoized by function_cache instead).
 
-        # Support nested parentheses, e.g. bitmap(swap(x), 1)
-        # 3rd parameter is optional width
-        bitmap_pattern = r'^bitmap\s*\(\s*(.+?)(?:\s*,\s*([01]))?(?:\s*,\s*(\d+))?\s*\)$'
-        bitmap_match = re.match(bitmap_pattern, line, re.IGNORECASE)
+        Returns the same 6-tuple as parse_line().
+        """
+        key = self._result_key(compiled)
+        if key is None:
+            return self._evaluate_line(compiled)
+
+        cached = self.result_cache.get(key, None)
+        if cached is None:
+            cached = self._evaluate_line(compiled)
+            self.result_cache.put(key, cached)
+        elif cached[0] is not None and cached[1]:
+            # Replay the assignment made by the evaluation
+            self.variables[cached[1]] = cached[0]
+        return cached
+
+    def _result_key(self, compiled):
+        """result_cache key of a line record in the current state, or None if not cacheable"""
+        if compiled.kind in ('empty', 'comment', 'global', 'func_def') or (
+                self.functions and not compiled.uses.isdisjoint(self.functions)):
+            return None
+        # Sorted names: frozenset order depends on the hash seed, and keys are
+        # also built in worker processes
+        variables = self.variables
+        values = tuple([(name, variables.get(name, _UNDEFINED)) for name in sorted(compiled.uses)])
+        types = tuple([(name, type(value)) for name, value in values])
+        return (self.language, compiled.text, values, types)
 
-        comma_pattern = r'^comma\s*\(\s*(.+)\s*\)$'
-        comma_func_match = re.match(comma_pattern, line, re.IGNORECASE)
+    def _evaluate_line(self, compiled):
+        """Evaluate a line record from compile_line()
 
-        # Check if global() declaration is used (marks a variable for cross-session sharing)
-        global_pattern = r'^global\s*\(\s*([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\)$'
-        global_func_match = re.match(global_pattern, line)
+        Returns the same 6-tuple as parse_line().
+        """
+        kind = compiled.kind
+        if compiled.is_blank:
+            return None, None, None, None, False, None
 
-        if global_func_match:
+        if kind == 'global':
             # global() is a declaration, not an expression - return the variable's or function's value if it exists
-            var_name = global_func_match.group(1)
+            var_name = compiled.name
             if var_name in self.variables:
                 return self.variables[var_name], None, None, None, False, None
             elif var_name in self.functions:
@@ -199,104 +289,52 @@ class CalculatorPaperAdvanced:
             else:
                 return None, None, None, None, False, None
 
-        # Check for user-defined function definition: func(x, y) = expr
-        func_def_pattern = r'^([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\(\s*([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*(?:\s*,\s*[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)*)\s*\)\s*=\s*(.+)$'
-        func_def_match = re.match(func_def_pattern, line)
-        if func_def_match:
-            func_name = func_def_match.group(1)
-            params_str = func_def_match.group(2)
-            body_expr = func_def_match.group(3).strip()
+        # User-defined function definition: func(x, y) = expr
+        if kind == 'func_def':
             # Don't allow overriding built-in functions
-            if func_name.lower() in ('swap', 'bitmap', 'hex', 'comma', 'global', 'workday'):
+            if compiled.error == 'builtin_conflict':
                 err_msg = "函数名与内置函数冲突" if self.language == 'zh' else "Function name conflicts with built-in function"
                 return None, None, f"错误: {err_msg}", None, False, None
-            params = [p.strip() for p in params_str.split(',')]
             # Check for duplicate parameter names
-            if len(params) != len(set(params)):
+            if compiled.error == 'duplicate_params':
                 err_msg = "函数参数名重复" if self.language == 'zh' else "Duplicate parameter names"
                 return None, None, f"错误: {err_msg}", None, False, None
-            # Handle implicit multiplication in function body (e.g. 3x → 3*x)
-            body_expr = self._add_implicit_multiplication(body_expr)
-            self.functions[func_name] = (params, body_expr)
+            self.functions[compiled.name] = (list(compiled.params), compiled.body)
             return None, None, None, None, False, None
 
-        if hex_func_match:
-            use_hex_func = True
-            value_expr = hex_func_match.group(1).strip()
-            line = value_expr
-            label = None
-            is_assignment = False
-
-        elif bitmap_match:
-            use_bitmap = True
-            value_expr = bitmap_match.group(1).strip()
-            endian_param = bitmap_match.group(2)
-            width_param = bitmap_match.group(3)
-            
-            # Set temporary byte order
-            if endian_param == '1':
-                bitmap_endian = 'big'
-            else:  # '0' or None
-                bitmap_endian = 'little'
-            
-            # Set bit width
-            if width_param is not None:
-                bitmap_width = int(width_param)
-                if bitmap_width <= 0:
-                    return None, None, f"错误: bitmap 宽度参数必须是正整数", None, False, None
-            
-            # Keep only the value expression for evaluation
-            line = value_expr
-            label = None
-            is_assignment = False
-
-        elif comma_func_match:
-            use_comma_func = True
-            value_expr = comma_func_match.group(1).strip()
-            line = value_expr
-            label = None
-            is_assignment = False
+        # hex(), bitmap() and comma() are standalone only (cannot be assigned or used in expressions)
+        use_hex_func = kind == 'hex'
+        use_bitmap = kind == 'bitmap'
+        use_comma_func = kind == 'comma'
+        bitmap_endian = compiled.bitmap_endian
+        bitmap_width = compiled.bitmap_width
+        label = compiled.label
+        line = compiled.source
 
-        else:
-            # Check if there is a label (e.g.: rent = 1000)
-            label = None
-            expr = line
-            is_assignment = False
-
-            if '=' in line:
-                parts = line.split('=', 1)
-                left = parts[0].strip()
-                right = parts[1].strip()
-
-                # Check if left side is a variable name (no operators)
-                if re.match(r'^[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*$', left):
-                    label = left
-                    expr = right
-                    is_assignment = True
-                    line = expr
+        if compiled.error == 'bitmap_width':
+            return None, None, f"错误: bitmap 宽度参数必须是正整数", None, False, None
 
         # Reserved keyword check (during variable assignment)
-        if label and self._is_reserved_keyword(label):
+        if compiled.error == 'reserved_label':
             err_msg = "变量名与保留关键字冲突" if self.language == 'zh' else "Variable name conflicts with reserved keyword"
             return None, None, f"错误: {err_msg}", None, False, None
 
         # Check for workday() function call
-        workday_args = self._parse_workday_call(line)
-        if workday_args is not None and not use_bitmap and not use_hex_func:
+        workday_args = None
+        if compiled.is_workday and not use_bitmap and not use_hex_func:
+            workday_args = self._parse_workday_call(line)
+        if workday_args is not None:
             try:
                 start_date, num_days, extra_holidays = workday_args
                 result_date, holidays_skipped = self._evaluate_workday(start_date, num_days, extra_holidays)
                 # Build comment with skipped holidays
                 comment = None
                 if holidays_skipped:
+                    holiday_strs = [self._format_date_result(h) for h in holidays_skipped]
                     if self.language == 'zh':
-                        holiday_strs = [self._format_date_result(h) for h in holidays_skipped]
                         comment = "跳过: " + ", ".join(holiday_strs)
                     else:
-                        holiday_strs = [self._format_date_result(h) for h in holidays_skipped]
                         comment = "skipped: " + ", ".join(holiday_strs)
-                # Result is Dxx (total calendar days from start)
-                total_days = abs((result_date - start_date).days)
                 result = result_date
                 if label:
                     self.variables[label] = result
@@ -304,26 +342,18 @@ class CalculatorPaperAdvanced:
             except Exception as e:
                 return None, label, f"错误: {str(e)}", None, False, None
 
-        # Detect if expression contains date/time/duration literals
-        date_time_pattern = r'(?:^|(?<=[\s+\-]))(?:Y\d{8}|T\d{6}|[MWD]\d+|[hms]\d+)(?:$|(?=[\s+\-]))'
-        has_date_time = bool(re.search(r'Y\d{8}|T\d{6}|(?<![a-zA-Z0-9_\u4e00-\u9fa5])[MWD]\d+(?![a-zA-Z0-9_\u4e00-\u9fa5])|(?<![a-zA-Z0-9_\u4e00-\u9fa5])[hms]\d+(?![a-zA-Z0-9_\u4e00-\u9fa5])', line))
-        # Also check if any variable holds a date/time value
-        has_date_time_var = False
+        # Detect if expression contains date/time/duration literals,
+        # or references a variable holding a date/time value
+        has_date_time = compiled.has_date_time_literal
         if not has_date_time:
-            # Check if any referenced variable holds a date/time value
-            var_pattern = r'\b([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\b'
-            for m in re.finditer(var_pattern, line):
-                var_name = m.group(1)
-                if var_name.lower() not in ['swap', 'bitmap', 'hex', 'workday', 'global'] and var_name in self.variables:
-                    val = self.variables[var_name]
-                    if isinstance(val, (datetime.date, datetime.time)):
-                        has_date_time = True
-                        has_date_time_var = True
-                        break
+            for var_name in compiled.date_var_names:
+                if isinstance(self.variables.get(var_name), (datetime.date, datetime.time)):
+                    has_date_time = True
+                    break
 
         if has_date_time and not use_bitmap and not use_hex_func:
             try:
-                result = self._evaluate_date_time_line(line)
+                result = self._evaluate_date_time_line(line, compiled.date_time_tokens)
                 # Save variable
                 if label:
                     self.variables[label] = result
@@ -332,52 +362,47 @@ class CalculatorPaperAdvanced:
                 if isinstance(result, (int, float)) and not isinstance(result, bool):
                     # Check if this is a time subtraction (result in seconds) or date subtraction (result in days)
                     # Heuristic: if expression involves time literals/variables, it's seconds
-                    is_time_diff = bool(re.search(r'T\d{6}', line))
-                    if not is_time_diff:
-                        # Check variables for time values
-                        var_pattern = r'\b([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\b'
-                        for m_var in re.finditer(var_pattern, line):
-                            vn = m_var.group(1)
-                            if vn in self.variables and isinstance(self.variables[vn], datetime.time):
-                                is_time_diff = True
-                                break
+                    is_time_diff = compiled.has_time_literal or any(
+                        isinstance(self.variables.get(vn), datetime.time)
+                        for vn in compiled.date_var_names
+                    )
                     comment = self._format_duration_comment(result, is_time=is_time_diff)
                 return result, label, comment, None, False, None
             except Exception as e:
                 return None, label, f"错误: {str(e)}", None, False, None
 
-        # Check if original expression contains hex or binary (before variable substitution)
-        has_hex_bin = bool(re.search(r'0[xXbB][0-9a-fA-F]+', line))
+        # If expression contains bitwise ops or hex/binary, use hex format for variable substitution
+        has_hex_bin = compiled.has_hex_bin
+        use_hex_in_comment = has_hex_bin or compiled.has_bitwise_text
 
         try:
-            # Check if expression contains bitwise operators
-            has_bitwise = any(op in line for op in ['<<', '>>', '&', '|', '^', '~'])
-
-            # If expression contains bitwise ops or hex/binary, use hex format for variable substitution
-            use_hex_in_comment = has_hex_bin or has_bitwise
-
-            # Substitute variables
-            expr_with_vars, undefined_vars = self._replace_variables(line, use_hex_format=use_hex_in_comment)
-
-            # If there are undefined variables, check if they might be function calls
-            # before reporting error
+            # Report undefined variables before evaluating
+            undefined_vars = [v for v in compiled.names
+                              if v not in self.variables and v not in self.functions]
             if undefined_vars:
-                # Check if any undefined var is actually a function name being called
-                remaining_undefined = [v for v in undefined_vars if v not in self.functions]
-                if remaining_undefined:
-                    return None, label, f"变量未定义: {', '.join(remaining_undefined)}", None, False, None
-
-            # Expand user-defined function calls
-            expr_with_vars = self._expand_function_calls(expr_with_vars)
-
-            # Second pass: substitute variables that may have been introduced by function expansion
-            if self.functions:
-                expr_with_vars, undefined_vars2 = self._replace_variables(expr_with_vars, use_hex_format=use_hex_in_comment)
-                if undefined_vars2:
-                    return None, label, f"变量未定义: {', '.join(undefined_vars2)}", None, False, None
-
-            # Evaluate expression
-            result = self.evaluate(expr_with_vars, has_hex_bin)
+                return None, label, f"变量未定义: {', '.join(undefined_vars)}", None, False, None
+
+            if self.functions and not compiled.call_names.isdisjoint(self.functions):
+                # User-defined functions are called by value (compiled once, results memoized)
+                self._sync_functions()
+                free_names, uses_bitwise = self._function_closure(compiled.call_names)
+                undefined_vars = [v for v in free_names if v not in self.variables and v not in self.functions]
+                if undefined_vars:
+                    return None, label, f"变量未定义: {', '.join(undefined_vars)}", None, False, None
+                if compiled.parse_error:
+                    raise CalcError(compiled.parse_error)
+                self._call_steps = 0
+                result = self._run_program(compiled.program,
+                                           compiled.has_bitwise or compiled.has_hex_bin or uses_bitwise)
+                expr_with_vars = self._render_expression(compiled, use_hex_in_comment)
+                try:
+                    expr_with_vars = self._render_function_calls(expr_with_vars, use_hex_in_comment)
+                except CallBudgetExceeded:
+                    pass  # Expansion too long to show, keep the calls
+            else:
+                # Evaluate the cached AST directly against the variables
+                result = self._evaluate_compiled(compiled)
+                expr_with_vars = self._render_expression(compiled, use_hex_in_comment)
 
             # Save variable (only for non-bitmap/hex/comma calls)
             if label and not use_bitmap and not use_hex_func and not use_comma_func:
@@ -395,7 +420,7 @@ class CalculatorPaperAdvanced:
                     int_result = int(result)
                     if int_result == result:  # Ensure it's an integer value
                         # Detect leading zero bit width from original expression
-                        input_bit_width = self._detect_input_bit_width(value_expr)
+                        input_bit_width = self._detect_input_bit_width(line)
                         bit_info = self._generate_bit_display(int_result, bitmap_endian, bitmap_width, input_bit_width)
 
             # Generate hex display info
@@ -412,7 +437,7 @@ class CalculatorPaperAdvanced:
 
             # Auto-detect output format based on expression literals
             if not use_hex_func and not use_comma_func and not use_bitmap:
-                output_format = detect_output_format(line, False)
+                output_format = compiled.output_format
                 if output_format == OutputFormat.HEXADECIMAL:
                     if isinstance(result, (int, float)) and result >= 0:
                         int_result = int(result)
@@ -430,176 +455,249 @@ class CalculatorPaperAdvanced:
         except Exception as e:
             return None, label, f"错误: {str(e)}", None, False, None
 
-    def _replace_variables(self, expr, use_hex_format=False):
-        """Replace variables in the expression
+    def _format_variable_value(self, val, use_hex_format=False):
+        """Format a variable value for display in a substituted expression"""
+        # If variable is date/time type, format as literal
+        if isinstance(val, datetime.date) and not isinstance(val, datetime.datetime):
+            return self._format_date_result(val)
+        if isinstance(val, datetime.time):
+            return self._format_date_result(val)
+        # If hex format needed and value is integer
+        if use_hex_format and isinstance(val, (int, float)):
+            int_val = int(val)
+            if int_val == val and int_val >= 0:
+                return f"0x{int_val:X}"
+
+        # Otherwise use decimal format
+        if isinstance(val, int):
+            return str(val)
+        elif isinstance(val, float) and val == int(val):
+            # If float with integer value, convert to int
+            return str(int(val))
+        return str(val)
+
+    def _render_expression(self, compiled, use_hex_format=False):
+        """Rebuild the line text with variable values substituted"""
+        parts = []
+        for literal, name in compiled.display:
+            parts.append(literal)
+            if name is None:
+                continue
+            if name in self.functions or name not in self.variables:
+                parts.append(name)
+            else:
+                parts.append(self._format_variable_value(self.variables[name], use_hex_format))
+        return ''.join(parts)
+
+    def _resolve_variable(self, name):
+        """Look up a variable value for AST evaluation"""
+        val = self.variables.get(name)
+        if isinstance(val, bool) or not isinstance(val, (int, float)):
+            # Non-numeric values (dates, function names, keywords) are not valid operands
+            raise CalcError("包含非法字符")
+        if isinstance(val, float) and val == int(val):
+            return int(val)
+        return val
+
+    def _call_function(self, name, args, resolve=None, depth=0):
+        """Evaluate a function call inside a compiled expression
 
         Args:
-            expr: Expression string
-            use_hex_format: Whether to display variable values in hex format
+            name: Function name
+            args: Compiled argument programs
+            resolve: Variable lookup of the calling frame (global variables by default)
+            depth: Number of user function frames around the call
         """
-        # First protect hex and binary literals
-        # Replace them with placeholders
-        hex_bin_pattern = r'0[xXbB][0-9a-fA-F]+'
-        protected = []
-
-        def protect_hex_bin(match):
-            protected.append(match.group(0))
-            return f'__PROTECTED_{len(protected)-1}__'
-
-        expr_protected = re.sub(hex_bin_pattern, protect_hex_bin, expr)
-
-        # Find all possible variable names (Chinese, English, digits, underscores)
-        # But exclude swap and bitmap function names
-        pattern = r'\b([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\b'
-
-        undefined_vars = []
-
-        def replace_func(match):
-            var_name = match.group(1)
-            # Skip placeholders and function names
-            if var_name.startswith('__PROTECTED_') or var_name.lower() in ['swap', 'bitmap', 'hex', 'comma', 'global']:
-                return var_name
-            # Skip user-defined function names (they will be expanded later)
-            if var_name in self.functions:
-                return var_name
-            # Skip date/time/duration literals (reserved keyword pattern)
-            if self._is_reserved_keyword(var_name):
-                return var_name
+        if resolve is None:
+            resolve = self._resolve_variable
+        call = lambda callee, callee_args: self._call_function(callee, callee_args, resolve, depth)
+        if name in self.functions:
+            # Call by value: each argument is evaluated once in the caller's frame
+            return self._call_user_function(name, [arg(resolve, call) for arg in args], depth + 1)
+        if name != 'swap':
+            raise CalcError("包含非法字符")
+        if len(args) != 1:
+            raise CalcError("swap() 函数错误: swap() 只能用于整数")
+        try:
+            inner = args[0](resolve, call)
+            return self.swap_endian(inner)
+        except CalcError as e:
+            raise CalcError(f"swap() 函数错误: {e}")
+        except Exception as e:
+            raise CalcError(f"swap() 函数错误: {str(e)}")
+
+    def _user_function(self, name):
+        """Compiled form of the user function currently named name"""
+        params, body = self.functions[name]
+        return compile_function(name, tuple(params), body)
+
+    def _sync_functions(self):
+        """Drop memoized calls when any function was defined, redefined or removed"""
+        if self.functions != self._function_snapshot:
+            self._function_snapshot = dict(self.functions)
+            self._function_closures = {}
+            self.function_cache.clear()
+
+    def _line_uses(self, compiled):
+        """Variables a line reads, including the globals read by the user functions it calls"""
+        if not self.functions or compiled.call_names.isdisjoint(self.functions):
+            return compiled.uses
+        self._sync_functions()
+        return compiled.uses | set(self._function_closure(compiled.call_names)[0])
+
+    def _function_closure(self, call_names):
+        """Global variables read and bitwise use of the functions reachable from call_names
 
-            if var_name in self.variables:
-                val = self.variables[var_name]
-                # If variable is date/time type, format as literal
-                if isinstance(val, datetime.date) and not isinstance(val, datetime.datetime):
-                    return self._format_date_result(val)
-                if isinstance(val, datetime.time):
-                    return self._format_date_result(val)
-                # If hex format needed and value is integer
-                if use_hex_format and isinstance(val, (int, float)):
-                    int_val = int(val)
-                    if int_val == val and int_val >= 0:
-                        return f"0x{int_val:X}"
-
-                # Otherwise use decimal format
-                if isinstance(val, int):
-                    return str(val)
-                elif isinstance(val, float) and val == int(val):
-                    # If float with integer value, convert to int
-                    return str(int(val))
-                return str(val)
-            else:
-                undefined_vars.append(var_name)
-                return var_name
+        Returns:
+            (free variable names in first-use order, whether any body uses bitwise operators)
+        """
+        key = call_names
+        cached = self._function_closures.get(key)
+        if cached is not None:
+            return cached
+        free_names = []
+        uses_bitwise = False
+        seen = set()
+        pending = sorted(n for n in call_names if n in self.functions)
+        while pending:
+            name = pending.pop(0)
+            if name in seen:
+                continue
+            seen.add(name)
+            func = self._user_function(name)
+            uses_bitwise = uses_bitwise or func.has_bitwise
+            for word in func.names:
+                if word in self.functions:
+                    pending.append(word)
+                elif word not in free_names:
+                    free_names.append(word)
+        cached = self._function_closures[key] = (tuple(free_names), uses_bitwise)
+        return cached
+
+    def _call_user_function(self, name, values, depth):
+        """Run a user function on argument values, memoized by (function, arguments)"""
+        func = self._user_function(name)
+        if len(values) != len(func.params):
+            err_msg = f"函数 {name} 需要 {len(func.params)} 个参数，但传入了 {len(values)} 个" if self.language == 'zh' else f"Function {name} expects {len(func.params)} arguments, got {len(values)}"
+            raise CalcError(err_msg)
+        if depth > self.max_call_depth:
+            err_msg = f"函数 {name} 调用层数超过 {self.max_call_depth}" if self.language == 'zh' else f"Function {name} nested deeper than {self.max_call_depth} calls"
+            raise CallBudgetExceeded(err_msg)
+        self._call_steps += 1
+        if self._call_steps > self.max_call_steps:
+            err_msg = f"函数调用次数超过 {self.max_call_steps}" if self.language == 'zh' else f"More than {self.max_call_steps} function calls"
+            raise CallBudgetExceeded(err_msg)
+        if func.error:
+            raise CalcError(func.error)
+
+        # Results also depend on the global variables the body (and its callees) reads
+        free_names = self._function_closure(frozenset([name]))[0]
+        free_values = tuple(self.variables.get(v) for v in free_names)
+        key = (name, tuple(values), tuple(map(type, values)),
+               free_values, tuple(map(type, free_values)))
+        result = self.function_cache.get(key, _NO_RESULT)
+        if result is not _NO_RESULT:
+            return result
 
-        result = re.sub(pattern, replace_func, expr_protected)
+        frame = dict(zip(func.params, values))
+        resolve_global = self._resolve_variable
 
-        # Restore hex and binary literals
-        for i, literal in enumerate(protected):
-            result = result.replace(f'__PROTECTED_{i}__', literal)
+        def resolve(var):
+            if var in frame:
+                return frame[var]
+            return resolve_global(var)
 
-        return result, undefined_vars
+        call = lambda callee, callee_args: self._call_function(callee, callee_args, resolve, depth)
+        result = func.program(resolve, call)
+        self.function_cache.put(key, result)
+        return result
 
-    def _expand_function_calls(self, expr):
-        """Expand user-defined function calls in the expression.
-        
-        e.g. if func(x,y) = 3*x + 5*y, then func(1, 2) → (3*1+5*2)
+    def _evaluate_compiled(self, compiled):
+        """Evaluate a compiled line's expression program"""
+        if compiled.parse_error:
+            raise CalcError(compiled.parse_error)
+        return self._run_program(compiled.program, compiled.has_bitwise or compiled.has_hex_bin)
+
+    def _run_program(self, program, force_int):
+        """Run a compiled expression and normalize the result type
+
+        Args:
+            program: Closure from calc_parser.compile_expression()
+            force_int: Return an integer (bitwise operations or hex/binary literals)
         """
-        if not self.functions:
-            return expr
-        
-        max_iterations = 20  # Prevent infinite recursion
-        iteration = 0
-        
-        while iteration < max_iterations:
-            # Match function calls: name(arg1, arg2, ...)
-            # Need to handle nested parentheses in arguments
-            func_call_pattern = r'([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\('
-            match = re.search(func_call_pattern, expr)
+        try:
+            result = program(self._resolve_variable, self._call_function)
+            # Force integer result for bitwise operations or hex/binary literals
+            if force_int:
+                return int(result)
+            # If float with integer value, convert to int
+            if isinstance(result, float) and result.is_integer():
+                return int(result)
+            return float(result)
+        except CalcError:
+            raise
+        except ZeroDivisionError:
+            raise ValueError("除数不能为零")
+        except Exception as e:
+            raise ValueError(f"计算错误: {str(e)}")
+
+    def _render_function_calls(self, expr, use_hex_format=False, depth=0):
+        """Show user function calls expanded for the output comment
+
+        e.g. if func(x,y) = 3*x + 5*y, then func(1, 2) → (3*(1) + 5*(2)).
+        Only used for display; the value comes from _call_user_function().
+        Expansions are memoized alongside the call results.
+
+        Raises:
+            CallBudgetExceeded: An expansion is longer than MAX_EXPANSION_LENGTH
+                (nested calls can grow the text exponentially).
+        """
+        parts = []
+        pos = 0
+        while True:
+            match = FUNC_CALL_RE.search(expr, pos)
             if not match:
                 break
-            
-            func_name = match.group(1)
-            
-            # Skip built-in functions
-            if func_name.lower() in ('swap', 'bitmap', 'hex', 'comma', 'global', 'workday'):
-                # Skip past this match and continue searching
-                # Find the closing paren to skip the whole call
-                depth = 1
-                i = match.end()
-                while i < len(expr) and depth > 0:
-                    if expr[i] == '(':
-                        depth += 1
-                    elif expr[i] == ')':
-                        depth -= 1
-                    i += 1
-                # Can't expand further in this simple pass, break
-                break
-            
-            if func_name not in self.functions:
-                break
-            
-            # Find the matching closing parenthesis
-            start_paren = match.end() - 1  # position of '('
-            depth = 1
-            pos = match.end()
-            while pos < len(expr) and depth > 0:
-                if expr[pos] == '(':
-                    depth += 1
-                elif expr[pos] == ')':
-                    depth -= 1
-                pos += 1
-            
-            if depth != 0:
-                break  # Unmatched parentheses
-            
-            # Extract arguments string (between the parentheses)
-            args_str = expr[match.end():pos - 1]
-            
-            # Split arguments by comma, respecting nested parentheses
-            args = []
-            current_arg = ''
-            depth = 0
-            for ch in args_str:
-                if ch == '(' :
-                    depth += 1
-                    current_arg += ch
-                elif ch == ')':
-                    depth -= 1
-                    current_arg += ch
-                elif ch == ',' and depth == 0:
-                    args.append(current_arg.strip())
-                    current_arg = ''
+            name = match.group(1)
+            args, end = ([], -1)
+            if name in self.functions and depth < self.max_call_depth:
+                args, end = split_call(expr, match.end() - 1)
+            func = self._user_function(name) if end >= 0 else None
+            if func is None or len(args) != len(func.params):
+                parts.append(expr[pos:match.end()])
+                pos = match.end()
+                continue
+
+            args = tuple(self._render_function_calls(arg, use_hex_format, depth) for arg in args)
+            free_names = self._function_closure(frozenset([name]))[0]
+            key = ('display', name, args, use_hex_format, tuple(self.variables.get(v) for v in free_names))
+            expanded = self.function_cache.get(key, None)
+            if expanded is not None:
+                parts.append(expr[pos:match.start()])
+                parts.append(expanded)
+                pos = end
+                continue
+
+            body = []
+            for literal, word in func.display:
+                body.append(literal)
+                if word is None:
+                    continue
+                if word in func.params:
+                    body.append(args[func.params.index(word)])
+                elif word in self.functions or word not in self.variables:
+                    body.append(word)
                 else:
-                    current_arg += ch
-            if current_arg.strip():
-                args.append(current_arg.strip())
-            
-            params, body = self.functions[func_name]
-            
-            if len(args) != len(params):
-                err_msg = f"函数 {func_name} 需要 {len(params)} 个参数，但传入了 {len(args)} 个" if self.language == 'zh' else f"Function {func_name} expects {len(params)} arguments, got {len(args)}"
-                raise ValueError(err_msg)
-            
-            # Substitute parameters in body with argument values
-            expanded = body
-            # Replace parameters with argument values (wrap args in parens for safety)
-            # Sort params by length descending to avoid partial replacement
-            param_arg_pairs = sorted(zip(params, args), key=lambda x: len(x[0]), reverse=True)
-            for param, arg in param_arg_pairs:
-                # Use word boundary replacement to avoid partial matches
-                expanded = re.sub(
-                    r'(?<![a-zA-Z0-9_\u4e00-\u9fa5])' + re.escape(param) + r'(?![a-zA-Z0-9_\u4e00-\u9fa5])',
-                    f'({arg})',
-                    expanded
-                )
-            
-            # Handle implicit multiplication in expanded body (e.g. 3(1) → 3*(1))
-            expanded = self._add_implicit_multiplication(expanded)
-            
-            # Replace the function call in the expression with the expanded body (wrapped in parens)
-            expr = expr[:match.start()] + '(' + expanded + ')' + expr[pos:]
-            iteration += 1
-        
-        return expr
+                    body.append(self._format_variable_value(self.variables[word], use_hex_format))
+            expanded = '(' + self._render_function_calls(''.join(body), use_hex_format, depth + 1) + ')'
+            if len(expanded) > MAX_EXPANSION_LENGTH:
+                raise CallBudgetExceeded(expanded[:40])
+            self.function_cache.put(key, expanded)
+            parts.append(expr[pos:match.start()])
+            parts.append(expanded)
+            pos = end
+        parts.append(expr[pos:])
+        return ''.join(parts)
 
     def _add_implicit_multiplication(self, expr):
         """Add explicit multiplication operators where implicit multiplication is used.
@@ -609,52 +707,7 @@ class CalculatorPaperAdvanced:
         - (x)(y) → (x)*(y)
         - 2x → 2*x (number followed by variable)
         """
-        # Protect hex and binary literals first
-        hex_bin_pattern = r'0[xXbB][0-9a-fA-F]+'
-        protected = []
-        
-        def protect(match):
-            protected.append(match.group(0))
-            # Use a placeholder that won't trigger implicit mult rules
-            return f'\x00IMPL{len(protected)-1}\x00'
-        
-        expr = re.sub(hex_bin_pattern, protect, expr)
-        
-        # Number followed by opening paren: 3( → 3*(
-        expr = re.sub(r'(\d)\s*\(', r'\1*(', expr)
-        # Closing paren followed by opening paren: )( → )*(
-        expr = re.sub(r'\)\s*\(', r')*(', expr)
-        # Number followed by variable: 3x → 3*x
-        expr = re.sub(r'(\d)([a-zA-Z_\u4e00-\u9fa5])', r'\1*\2', expr)
-        # Closing paren followed by number or variable: )2 → )*2, )x → )*x
-        expr = re.sub(r'\)\s*(\d)', r')*\1', expr)
-        expr = re.sub(r'\)\s*([a-zA-Z_\u4e00-\u9fa5])', r')*\1', expr)
-        
-        # Restore protected literals
-        for i, literal in enumerate(protected):
-            expr = expr.replace(f'\x00IMPL{i}\x00', literal)
-        
-        return expr
-
-    def _convert_percentage(self, expression):
-        """Convert percentages to decimals"""
-        pattern = r'(\d+\.?\d*)%'
-
-        def replace_func(match):
-            number = match.group(1)
-            return str(float(number) / 100)
-
-        return re.sub(pattern, replace_func, expression)
-
-    def _convert_hex_bin(self, expression):
-        """Convert hex and binary numbers"""
-        # Hex: 0x... or 0X...
-        expression = re.sub(r'0[xX]([0-9a-fA-F]+)', lambda m: str(int(m.group(1), 16)), expression)
-
-        # Binary: 0b... or 0B...
-        expression = re.sub(r'0[bB]([01]+)', lambda m: str(int(m.group(1), 2)), expression)
-
-        return expression
+        return add_implicit_multiplication(expr)
 
     def evaluate(self, expression, has_hex_bin=False):
         """Evaluate the expression"""
@@ -665,61 +718,12 @@ class CalculatorPaperAdvanced:
         if not expression:
             raise ValueError("表达式为空")
 
-        # Convert percentages
-        expression = self._convert_percentage(expression)
+        # Parse and compile once per distinct expression text (no eval())
+        program = compile_text(expression)
 
-        # Convert hex and binary
-        expression = self._convert_hex_bin(expression)
-        
-        # Process swap() function calls (recursive, from inside out)
-        max_iterations = 10  # Prevent infinite loops
-        iteration = 0
-        while 'swap(' in expression.lower() and iteration < max_iterations:
-            swap_pattern = r'swap\s*\(\s*([^()]+)\s*\)'
-            match = re.search(swap_pattern, expression, flags=re.IGNORECASE)
-            if not match:
-                break
-            
-            inner_expr = match.group(1)
-            # Evaluate inner expression
-            try:
-                inner_value = eval(inner_expr)
-                # Perform byte order swap
-                swapped = self.swap_endian(inner_value)
-                # Replace entire swap(...) with result
-                expression = expression[:match.start()] + str(swapped) + expression[match.end():]
-            except Exception as e:
-                raise ValueError(f"swap() 函数错误: {str(e)}")
-            
-            iteration += 1
-
-        # Check if expression contains bitwise operators
+        # Bitwise operators force an integer result
         has_bitwise = any(op in expression for op in ['<<', '>>', '&', '|', '^', '~'])
-
-        # Use Python's eval for calculation
-        # Allowed characters: digits, operators, parentheses
-        allowed_chars = set('0123456789+-*/(). ')
-        if has_bitwise:
-            allowed_chars.update(['<', '>', '&', '|', '^', '~'])
-
-        if not all(c in allowed_chars for c in expression):
-            raise ValueError("包含非法字符")
-
-        try:
-            result = eval(expression)
-            # If bitwise ops or hex/binary used, force integer return
-            if has_bitwise or has_hex_bin:
-                return int(result)
-            # If result is an integer value, return integer
-            if isinstance(result, float) and result == int(result):
-                return int(result)
-            return float(result)
-        except ZeroDivisionError:
-            raise ValueError("除数不能为零")
-        except SyntaxError:
-            raise ValueError("表达式语法错误")
-        except Exception as e:
-            raise ValueError(f"计算错误: {str(e)}")
+        return self._run_program(program, has_bitwise or has_hex_bin)
 
     def _align_to_boundary(self, bits):
         """Align bit count to the nearest 8/16/32/64 boundary
@@ -746,7 +750,7 @@ class CalculatorPaperAdvanced:
         """Parse Yyyyymmdd date literal, e.g. Y20260410 -> datetime.date(2026, 4, 10)"""
         if not isinstance(token, str):
             return None
-        match = re.match(r'^Y(\d{8})$', token)
+        match = DATE_LITERAL_RE.match(token)
         if not match:
             return None
         digits = match.group(1)
@@ -764,7 +768,7 @@ class CalculatorPaperAdvanced:
         """Parse Thhmmss time literal, e.g. T143000 -> datetime.time(14, 30, 0)"""
         if not isinstance(token, str):
             return None
-        match = re.match(r'^T(\d{6})$', token)
+        match = TIME_LITERAL_RE.match(token)
         if not match:
             return None
         digits = match.group(1)
@@ -783,7 +787,7 @@ class CalculatorPaperAdvanced:
         """Parse uppercase date duration literal Mxx/Wxx/Dxx, returns {'type': ..., 'value': int} or None"""
         if not isinstance(token, str):
             return None
-        match = re.match(r'^([MWD])(\d+)$', token)
+        match = DATE_DURATION_RE.match(token)
         if not match:
             return None
         prefix = match.group(1)
@@ -797,7 +801,7 @@ class CalculatorPaperAdvanced:
         """Parse lowercase time duration literal hxx/mxx/sxx, returns {'type': ..., 'value': int} or None"""
         if not isinstance(token, str):
             return None
-        match = re.match(r'^([hms])(\d+)$', token)
+        match = TIME_DURATION_RE.match(token)
         if not match:
             return None
         prefix = match.group(1)
@@ -872,9 +876,7 @@ class CalculatorPaperAdvanced:
         """Check if identifier is a reserved keyword (Y/T/M/W/D/h/m/s followed by digits, or function names)"""
         if not isinstance(name, str):
             return False
-        if name.lower() in ('workday', 'comma'):
-            return True
-        return bool(re.match(r'^[YTMWDhms]\d+$', name))
+        return is_reserved_keyword(name)
 
     def _evaluate_date_expr(self, left, op, right):
         """Evaluate date expression: date+duration, date-duration, date-date"""
@@ -971,22 +973,26 @@ class CalculatorPaperAdvanced:
         if tdur is not None:
             return tdur
         # Try variable reference
-        if re.match(r'^[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*$', token):
+        if IDENT_RE.match(token):
             if token in self.variables:
                 return self.variables[token]
             raise ValueError(f"变量未定义: {token}" if self.language == 'zh' else f"Undefined variable: {token}")
         # Try numeric literal - return as number (will be caught by type checking)
-        if re.match(r'^\d+(\.\d+)?$', token):
+        if DECIMAL_RE.match(token):
             val = float(token) if '.' in token else int(token)
             return val
         raise ValueError(f"无法解析: {token}" if self.language == 'zh' else f"Cannot parse: {token}")
 
-    def _evaluate_date_time_line(self, expr):
-        """Parse and evaluate a date/time expression like 'Y20260410 + D10' or 'start + h3 + m30'."""
-        expr = expr.strip()
-        # Tokenize: split by + and - while keeping the operators
-        # We need to handle chained operations like: start + h3 + m30
-        tokens = re.split(r'\s*(\+|\-)\s*', expr)
+    def _evaluate_date_time_line(self, expr, tokens=None):
+        """Parse and evaluate a date/time expression like 'Y20260410 + D10' or 'start + h3 + m30'.
+
+        tokens may be passed in pre-split (see CompiledLine.date_time_tokens).
+        """
+        if tokens is None:
+            expr = expr.strip()
+            # Tokenize: split by + and - while keeping the operators
+            # We need to handle chained operations like: start + h3 + m30
+            tokens = DATE_TIME_SPLIT_RE.split(expr)
         # tokens is like ['Y20260410', '+', 'D10'] or ['start', '+', 'h3', '+', 'm30']
         
         if not tokens:
@@ -1112,7 +1118,7 @@ class CalculatorPaperAdvanced:
         """Parse workday(start, days[, extra_holidays]) function call.
         Returns (start_date, num_days, extra_holidays_str) or None if not a workday call."""
         # Match workday(...) with flexible inner content
-        match = re.match(r'^workday\s*\(\s*(.+)\s*\)$', line, re.IGNORECASE)
+        match = WORKDAY_RE.match(line)
         if not match:
             return None
         inner = match.group(1).strip()
@@ -1165,13 +1171,13 @@ class CalculatorPaperAdvanced:
         # Here we only handle direct literals
         
         # Check hex literal
-        hex_match = re.match(r'^0[xX]([0-9a-fA-F]+)$', expr)
+        hex_match = HEX_NUMBER_RE.match(expr)
         if hex_match:
             hex_digits = hex_match.group(1)
             return len(hex_digits) * 4  # 4 bits per hex char
         
         # Check binary literal
-        bin_match = re.match(r'^0[bB]([01]+)$', expr)
+        bin_match = BIN_NUMBER_RE.match(expr)
         if bin_match:
             bin_digits = bin_match.group(1)
             return len(bin_digits)
@@ -1312,138 +1318,29 @@ class CalculatorPaperAdvanced:
 
         return '\n'.join(result_lines)
 
-    def _collect_definitions(self, lines: list[str]) -> list[dict]:
+    def _collect_definitions(self, lines: list[str]) -> list[CompiledLine]:
         """第一遍扫描：收集每行的变量定义和引用信息。
         
-        Scans all lines to identify:
-        - Which variable each line defines (assignment left-hand side)
-        - Which variables each line references (identifiers in expressions)
-        - Whether the line is a comment, empty, or function definition
+        Classifies every line once with compile_line(). The returned records
+        carry everything later phases need:
+        - defines: variable defined on this line (assignment left-hand side)
+        - uses: variable names referenced in the expression
+        - is_comment / is_empty / is_func_def, built-in call type, literal
+          formats and the compiled expression program
         
         Args:
             lines: List of input line strings.
             
         Returns:
-            List of dicts with keys:
-            - 'defines': str or None (variable name defined on this line)
-            - 'uses': set[str] (variable names referenced in expression)
-            - 'is_comment': bool
-            - 'is_empty': bool
-            - 'is_func_def': bool
+            List of CompiledLine records, one per input line.
         """
-        # Patterns matching existing parse_line() logic
-        func_def_pattern = re.compile(
-            r'^([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\(\s*'
-            r'([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*'
-            r'(?:\s*,\s*[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)*)\s*\)\s*=\s*(.+)$'
-        )
-        assignment_pattern = re.compile(
-            r'^([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*=\s*(.+)$'
-        )
-        variable_ref_pattern = re.compile(
-            r'\b([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\b'
-        )
-        # Built-in function names that are not variable references
-        builtin_names = frozenset([
-            'swap', 'bitmap', 'hex', 'comma', 'workday', 'global',
-            'True', 'False', 'None',
-        ])
-        # Function-style call pattern (standalone calls like hex(...), bitmap(...))
-        func_call_pattern = re.compile(
-            r'^(hex|bitmap|comma|workday|global)\s*\(', re.IGNORECASE
-        )
-
-        result = []
-        for line in lines:
-            stripped = line.strip()
-
-            # Empty line
-            if not stripped:
-                result.append({
-                    'defines': None,
-                    'uses': set(),
-                    'is_comment': False,
-                    'is_empty': True,
-                    'is_func_def': False,
-                })
-                continue
-
-            # Comment line
-            if stripped.startswith('#'):
-                result.append({
-                    'defines': None,
-                    'uses': set(),
-                    'is_comment': True,
-                    'is_empty': False,
-                    'is_func_def': False,
-                })
-                continue
-
-            # Remove inline comments for analysis
-            expr_line = stripped
-            if '#' in expr_line:
-                expr_line = expr_line.split('#')[0].strip()
-
-            # Function definition: func(x, y) = expr
-            func_match = func_def_pattern.match(expr_line)
-            if func_match:
-                result.append({
-                    'defines': None,
-                    'uses': set(),
-                    'is_comment': False,
-                    'is_empty': False,
-                    'is_func_def': True,
-                })
-                continue
-
-            # Standalone built-in function calls (hex(...), bitmap(...), etc.)
-            # These don't define variables but may reference them
-            is_builtin_call = bool(func_call_pattern.match(expr_line))
-
-            # Check for assignment: variable_name = expression
-            defines = None
-            expr_part = expr_line  # The expression to scan for variable references
-
-            if not is_builtin_call:
-                assign_match = assignment_pattern.match(expr_line)
-                if assign_match:
-                    var_name = assign_match.group(1)
-                    # Validate it's not a reserved keyword
-                    if (var_name not in builtin_names and
-                            not self._is_reserved_keyword(var_name)):
-                        defines = var_name
-                        expr_part = assign_match.group(2)  # Only scan RHS for uses
-
-            # Collect variable references from the expression part
-            uses = set()
-            for m in variable_ref_pattern.finditer(expr_part):
-                name = m.group(1)
-                # Skip built-in names, reserved keywords, hex/bin literals
-                if name in builtin_names:
-                    continue
-                if self._is_reserved_keyword(name):
-                    continue
-                if re.match(r'^0[xXbB]', name):
-                    continue
-                # Note: do NOT exclude 'defines' here — self-reference (a = a + 1)
-                # needs to be detected as circular dependency by _topological_sort()
-                uses.add(name)
-
-            result.append({
-                'defines': defines,
-                'uses': uses,
-                'is_comment': False,
-                'is_empty': False,
-                'is_func_def': False,
-            })
-
-        return result
+        return [compile_line(line) for line in lines]
 
-    def _topological_sort(self, line_infos: list[dict]) -> tuple[list[int], set[int]]:
+    def _topological_sort(self, line_infos: list[CompiledLine]) -> tuple[list[int], set[int]]:
         """对赋值行和表达式行进行拓扑排序。
 
         基于 _collect_definitions() 的结果构建依赖图，使用 Kahn 算法（BFS）
-        进行拓扑排序，并检测循环依赖。
+        进行拓扑排序，并检测循环依赖（见 _dependency_order()）。
 
         Args:
             line_infos: _collect_definitions() 返回的行信息列表。
@@ -1453,85 +1350,89 @@ class CalculatorPaperAdvanced:
             - eval_order: 按依赖顺序排列的行索引列表
             - circular_lines: 存在循环依赖的行索引集合
         """
-        from collections import deque
-
         # Identify lines that participate in the dependency graph
         # Exclude comment lines, empty lines, and function definition lines
         active_lines = []
         for i, info in enumerate(line_infos):
-            if info['is_comment'] or info['is_empty'] or info['is_func_def']:
+            if info.is_blank or info.is_func_def:
                 continue
             active_lines.append(i)
 
         # Build a mapping: variable_name -> line_index that defines it
         var_to_line = {}
         for i in active_lines:
-            defines = line_infos[i]['defines']
+            defines = line_infos[i].defines
             if defines is not None:
                 var_to_line[defines] = i
 
-        # Build adjacency list (dependencies): graph[A] = set of lines A depends on
-        # If line A uses variable X defined on line B, then A depends on B (edge A → B)
-        graph = {i: set() for i in active_lines}
-        # Also track in-degree for Kahn's algorithm
-        in_degree = {i: 0 for i in active_lines}
+        return self._dependency_order(line_infos, active_lines, var_to_line.get)
 
-        for i in active_lines:
-            uses = line_infos[i]['uses']
-            for var_name in uses:
-                if var_name in var_to_line:
-                    dep_line = var_to_line[var_name]
-                    if dep_line != i:
-                        # A depends on B: edge from A to B in dependency sense
-                        # For Kahn's: we need "B must come before A"
-                        # So in the "must come before" graph: edge B → A
-                        # We track: graph[i] contains lines that i depends on
-                        graph[i].add(dep_line)
-                    else:
-                        # Self-reference: a = a + 1
-                        # This creates a self-loop → circular dependency
-                        graph[i].add(i)
+    def _dependency_order(self, line_infos: list[CompiledLine], line_indices: list[int],
+                          definition_line, blocked=frozenset()) -> tuple[list[int], set[int]]:
+        """按依赖顺序排列给定的行（Kahn 算法），并找出循环依赖的行。
 
-        # Build reverse adjacency list for Kahn's algorithm
-        # reverse_graph[B] = set of lines that depend on B
-        reverse_graph = {i: set() for i in active_lines}
-        for i in active_lines:
-            for dep in graph[i]:
-                if dep in reverse_graph:
-                    reverse_graph[dep].add(i)
-                    in_degree[i] += 1
+        Line A depends on line B when A reads a variable B defines, directly
+        or through the user functions it calls (see _line_uses()). Only
+        dependencies among line_indices order lines; other lines count as
+        already evaluated. Lines on a cycle (including a = a + 1), and lines
+        depending on them or on a line in blocked, are circular. Shared by
+        process_text() and the incremental engine.
 
-        # Kahn's algorithm (BFS topological sort)
-        queue = deque()
-        for i in active_lines:
-            if in_degree[i] == 0:
-                queue.append(i)
+        Args:
+            line_infos: Line records, indexed by line number.
+            line_indices: Lines to order.
+            definition_line: Maps a variable name to the index of the line
+                defining it, or None.
+            blocked: Circular lines outside line_indices.
+
+        Returns:
+            (eval_order, circular_lines)
+        """
+        from collections import deque
 
+        members = set(line_indices)
+        # dependents[B] = lines that must come after B, in line order (so the
+        # result does not depend on set iteration); in_degree[A] = unmet
+        # dependencies of A
+        dependents = {i: [] for i in line_indices}
+        in_degree = {i: 0 for i in line_indices}
+        for i in line_indices:
+            dep_lines = set()
+            for var_name in self._line_uses(line_infos[i]):
+                dep_line = definition_line(var_name)
+                if dep_line in members:
+                    # A self-reference is a self-loop and never gets resolved
+                    if dep_line not in dep_lines:
+                        dep_lines.add(dep_line)
+                        dependents[dep_line].append(i)
+                        in_degree[i] += 1
+                elif dep_line in blocked:
+                    in_degree[i] += 1  # Never resolved: depends on a circular line
+
+        queue = deque(i for i in line_indices if in_degree[i] == 0)
         eval_order = []
         while queue:
             node = queue.popleft()
             eval_order.append(node)
-            # For each line that depends on this node
-            for dependent in reverse_graph[node]:
+            for dependent in dependents[node]:
                 in_degree[dependent] -= 1
                 if in_degree[dependent] == 0:
                     queue.append(dependent)
 
-        # Detect circular dependencies: lines not in eval_order have cycles
-        processed = set(eval_order)
-        circular_lines = set()
-        for i in active_lines:
-            if i not in processed:
-                circular_lines.add(i)
-
+        # Lines not in eval_order have cycles (or depend on one)
+        circular_lines = members.difference(eval_order)
         return eval_order, circular_lines
 
-    def _evaluate_in_order(self, lines: list[str], line_infos: list[dict],
+    def _circular_result(self, info: CompiledLine) -> tuple:
+        """Result of a line with a circular dependency (same 6-tuple as parse_line())"""
+        return None, info.defines, "错误: 循环依赖", None, False, None
+
+    def _evaluate_in_order(self, lines: list[str], line_infos: list[CompiledLine],
                            eval_order: list[int], circular_lines: set[int]):
         """按拓扑序计算表达式，将结果存入 self.results。
 
-        For each line index in eval_order, calls self.parse_line() to compute
-        the result. For lines in circular_lines, generates a circular dependency
+        For each line index in eval_order, evaluates the line's record from
+        _collect_definitions() (no re-parsing of the text). For lines in circular_lines, generates a circular dependency
         error message. Comment lines, empty lines, and function definition lines
         get None results.
 
@@ -1551,22 +1452,18 @@ class CalculatorPaperAdvanced:
         for i, line in enumerate(lines):
             self.lines[i] = line.strip()
 
+        # Independent groups of lines on a process pool (large sheets only)
+        if (self.parallel_workers > 1 and len(eval_order) >= self.parallel_min_lines
+                and evaluate_parallel(self, line_infos, eval_order, self.parallel_workers)):
+            eval_order = []
+
         # Evaluate lines in topological order
         for idx in eval_order:
-            line = lines[idx]
-            result, label, extra_info, bit_info, use_bitmap, hex_info = self.parse_line(line)
-
-            if result is not None:
-                self.results[idx] = (result, label, extra_info, bit_info, use_bitmap, hex_info)
-            else:
-                self.results[idx] = (None, label, extra_info, bit_info, use_bitmap, hex_info)
+            self.results[idx] = self._evaluate_record(line_infos[idx])
 
         # Mark circular dependency lines with error
         for idx in circular_lines:
-            info = line_infos[idx]
-            label = info['defines']
-            error_msg = "错误: 循环依赖"
-            self.results[idx] = (None, label, error_msg, None, False, None)
+            self.results[idx] = self._circular_result(line_infos[idx])
 
         # Comment lines, empty lines, and function definition lines keep None results
         # (already initialized to None above)
@@ -1592,19 +1489,21 @@ class CalculatorPaperAdvanced:
 
         lines = text.strip().split('\n')
 
-        # Phase 1: Collect all definitions and build dependency info
+        # Phase 1: Classify every line once (definitions, uses, compiled expression)
         line_infos = self._collect_definitions(lines)
+        self.line_records = line_infos
 
         # Phase 1.5: Process function definitions first so they are registered
         # before other lines that may call them
-        for i, info in enumerate(line_infos):
-            if info['is_func_def']:
-                self.parse_line(lines[i])
+        for info in line_infos:
+            if info.is_func_def:
+                self._evaluate_line(info)
 
         # Phase 2: Topological sort to determine evaluation order
         eval_order, circular_lines = self._topological_sort(line_infos)
 
         # Phase 3: Evaluate in dependency order
+        self.circular_lines = circular_lines
         self._evaluate_in_order(lines, line_infos, eval_order, circular_lines)
 
         # Save current state to history
@@ -1661,107 +1560,140 @@ class CalculatorPaperAdvanced:
         return self.history_index < len(self.history) - 1
 
     def format_output(self):
-        """Format the output results"""
-        output = []
-        max_line_len = max(len(line) for line in self.lines) if self.lines else 0
+        """Format the output results
 
+        Each line is rendered once per (line text, result) and cached; only
+        the padding before the result column is rebuilt on every call, so a
+        changed alignment column costs a string concatenation per line.
+        """
+        max_line_len = max(map(len, self.lines)) if self.lines else 0
+        previous = self._format_cache
+        cache = self._format_cache = {}  # Keeps only the lines of this output
+        language = self.language
+        blocks = []
         for line, result_info in zip(self.lines, self.results):
-            # Empty line
-            if not line:
-                output.append('')
-                continue
-
-            # Comment line
-            if line.startswith('#'):
-                output.append(line)
-                continue
-
-            # No result info
-            if result_info is None:
-                output.append(line)
-                continue
+            key = (language, line, result_info)
+            rendered = previous.get(key)
+            if rendered is None:
+                rendered = self._format_line(line, result_info)
+            cache[key] = rendered
+            first, padded, extra = rendered
+            if padded:
+                first = f"{line}{' ' * (max_line_len - len(line) + 2)}{first}"
+            blocks.append((first,) + extra)
+        self._output_blocks = blocks
+        return '\n'.join([text for block in blocks for text in block])
+
+    @property
+    def output_blocks(self):
+        """Output lines per input line of the last format_output() (read-only)
+
+        Every format_output() call creates a new list, so the object also
+        identifies which output a caller has shown.
+        """
+        return self._output_blocks
 
-            result, label, extra_info, bit_info, use_bitmap, hex_info = result_info
+    def format_output_changes(self, since=None):
+        """Format the output and report the output lines changed since the previous call
 
-            if result is None:
-                # Calculation failed or special command, show info
-                if extra_info:
-                    output.append(f"{line}  # {extra_info}")
-                else:
-                    output.append(line)
-            else:
-                # Format number
-                if hex_info:
-                    # hex() function: display hex
-                    result_str = hex_info
-                elif isinstance(result, datetime.date) and not isinstance(result, datetime.datetime):
-                    result_str = self._format_date_result(result)
-                    # Add full date annotation: X年X月X日 周X
-                    weekday_names_zh = ['星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日']
-                    weekday_names_en = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-                    if self.language == 'zh':
-                        week_num = result.isocalendar()[1]
-                        date_comment = f"{result.year}年{result.month}月{result.day}日 第{week_num}周{weekday_names_zh[result.weekday()]}"
-                    else:
-                        week_num = result.isocalendar()[1]
-                        date_comment = f"{result.year}-{result.month:02d}-{result.day:02d} W{week_num} {weekday_names_en[result.weekday()]}"
-                    if extra_info:
-                        extra_info = f"{date_comment}, {extra_info}"
-                    else:
-                        extra_info = date_comment
-                elif isinstance(result, datetime.time):
-                    result_str = self._format_date_result(result)
-                    # Add full time annotation: X时X分X秒
-                    if self.language == 'zh':
-                        parts = []
-                        if result.hour: parts.append(f"{result.hour}时")
-                        if result.minute: parts.append(f"{result.minute}分")
-                        if result.second: parts.append(f"{result.second}秒")
-                        time_comment = ''.join(parts) if parts else '0时'
-                    else:
-                        time_comment = f"{result.hour:02d}:{result.minute:02d}:{result.second:02d}"
-                    if extra_info:
-                        extra_info = f"{time_comment}, {extra_info}"
-                    else:
-                        extra_info = time_comment
-                elif isinstance(result, int):
-                    # Integer
-                    if use_bitmap:
-                        # bitmap function: show decimal only
-                        result_str = str(result)
-                    else:
-                        # No bitmap: show decimal only
-                        result_str = str(result)
-                elif isinstance(result, str):
-                    # String result (e.g. from global() on a function)
-                    result_str = result
-                elif result == int(result):
-                    result_str = str(int(result))
-                else:
-                    result_str = f"{result:.2f}"
+        Args:
+            since: output_blocks of an earlier call to diff against instead
+                of the previous call's, e.g. the output a view actually shows
+                when some formatted results were never displayed.
 
-                padding = ' ' * (max_line_len - len(line) + 2)
+        Returns:
+            (output, changes): output is the text of format_output(); changes
+            is a list of OutputChange that, applied in order, turn the output
+            lines of the previous format_output() call (or of since) into the
+            new ones.
+        """
+        old_blocks = self._output_blocks if since is None else since
+        output = self.format_output()
+        return output, _diff_output_blocks(old_blocks, self._output_blocks)
 
-                # bitmap call: don't show assignment, only result
-                if use_bitmap:
-                    # If variable substitution occurred, show substituted expression
-                    if extra_info:
-                        output.append(f"{line}{padding}= {result_str}  # {extra_info}")
-                    else:
-                        output.append(f"{line}{padding}= {result_str}")
-                else:
-                    # Normal calculation, show assignment
-                    if extra_info:
-                        output.append(f"{line}{padding}= {result_str}  # {extra_info}")
-                    else:
-                        output.append(f"{line}{padding}= {result_str}")
+    def _format_line(self, line, result_info):
+        """Render one line of output without the padding before the result column
 
-                # If bit display info exists, append to output
-                if bit_info:
-                    output.append(bit_info)
+        Returns:
+            (first, padded, extra_lines): if padded, the first output line is
+            line + padding + first; otherwise it is first. extra_lines are the
+            following output lines (bitmap display).
+        """
+        # Empty line
+        if not line:
+            return '', False, ()
+
+        # Comment line
+        if line.startswith('#'):
+            return line, False, ()
+
+        # No result info
+        if result_info is None:
+            return line, False, ()
+
+        result, label, extra_info, bit_info, use_bitmap, hex_info = result_info
+
+        if result is None:
+            # Calculation failed or special command, show info
+            if extra_info:
+                return f"{line}  # {extra_info}", False, ()
+            return line, False, ()
+
+        # Format number
+        if hex_info:
+            # hex() function: display hex
+            result_str = hex_info
+        elif isinstance(result, datetime.date) and not isinstance(result, datetime.datetime):
+            result_str = self._format_date_result(result)
+            # Add full date annotation: X年X月X日 周X
+            weekday_names_zh = ['星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日']
+            weekday_names_en = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+            if self.language == 'zh':
+                week_num = result.isocalendar()[1]
+                date_comment = f"{result.year}年{result.month}月{result.day}日 第{week_num}周{weekday_names_zh[result.weekday()]}"
+            else:
+                week_num = result.isocalendar()[1]
+                date_comment = f"{result.year}-{result.month:02d}-{result.day:02d} W{week_num} {weekday_names_en[result.weekday()]}"
+            if extra_info:
+                extra_info = f"{date_comment}, {extra_info}"
+            else:
+                extra_info = date_comment
+        elif isinstance(result, datetime.time):
+            result_str = self._format_date_result(result)
+            # Add full time annotation: X时X分X秒
+            if self.language == 'zh':
+                parts = []
+                if result.hour: parts.append(f"{result.hour}时")
+                if result.minute: parts.append(f"{result.minute}分")
+                if result.second: parts.append(f"{result.second}秒")
+                time_comment = ''.join(parts) if parts else '0时'
+            else:
+                time_comment = f"{result.hour:02d}:{result.minute:02d}:{result.second:02d}"
+            if extra_info:
+                extra_info = f"{time_comment}, {extra_info}"
+            else:
+                extra_info = time_comment
+        elif isinstance(result, int):
+            # Integer (bitmap calls also show decimal only)
+            result_str = str(result)
+        elif isinstance(result, str):
+            # String result (e.g. from global() on a function)
+            result_str = result
+        elif result == int(result):
+            result_str = str(int(result))
+        else:
+            result_str = f"{result:.2f}"
 
-        return '\n'.join(output)
+        # Normal calculation shows the assignment; bitmap calls show the result
+        # the same way (with the substituted expression if any)
+        if extra_info:
+            first = f"= {result_str}  # {extra_info}"
+        else:
+            first = f"= {result_str}"
 
+        # If bit display info exists, it follows on its own lines
+        extra = tuple(bit_info.split('\n')) if bit_info else ()
+        return first, True, extra
 
 def main():
     """Main function"""
@@ -1811,11 +1743,15 @@ Examples (示例):
 
     parser.add_argument('-l', '--lang', choices=['zh', 'en'], default='en',
                         help='Language / 语言 (zh: 中文, en: English)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Worker processes for large sheets, 1 = serial / 大型计算表的并行进程数，1 为串行')
     parser.add_argument('-v', '--version', action='version',
                         version=f'CalcPaper v{VERSION}')
 
     args = parser.parse_args()
     language = args.lang
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
 
     # Display different interface based on language
     if language == 'en':
@@ -2016,6 +1952,14 @@ hex(swap(网络数据))
         print("\n" + "=" * 80)
         print("现在请输入你的计算内容（输入 'calc' 开始计算）:\n")
 
+    try:
+        _interactive_loop(language, args.jobs)
+    finally:
+        shutdown_executors()
+
+
+def _interactive_loop(language, jobs):
+    """Read lines until exit; 'calc' calculates them with jobs worker processes"""
     calculator = CalculatorPaperAdvanced(language=language)
     lines = []
 
@@ -2038,6 +1982,7 @@ hex(swap(网络数据))
                 if lines:
                     text = '\n'.join(lines)
                     calculator = CalculatorPaperAdvanced(language=language)
+                    calculator.parallel_workers = jobs
                     calculator.process_text(text)
                     print("\n" + "=" * 80)
                     result_title = "Calculation Result:" if language == 'en' else "计算结果:"
@@ -27,7 +27,6 @@ from tkinter import messagebox, filedialog
 import json
 import os
 import sys
-import re
 import subprocess
 import threading
 import urllib.request
@@ -41,8 +40,16 @@ except ImportError:
     sys.exit(1)
 
 from calc_paper import CalculatorPaperAdvanced
+from calc_grammar import (
+    BUILTIN_FUNCTIONS, IDENT_RE, IDENT_CHAR_RE, IDENT_START_RE, RESERVED_KEYWORD_RE,
+    GLOBAL_CALL_RE, LINE_ASSIGNMENT_RE, LINE_FUNC_DEF_RE, OUTPUT_EXPR_RE,
+)
 from calc_session import SessionManager, GlobalVariableStore, Session
+from calc_incremental import IncrementalCalcEngine, LineChangeTracker, CalculationCancelled
+from calc_parallel import shutdown_executors
 from calc_history import GitHistoryStore
+from calc_syntax import SyntaxHighlighter
+from calc_virtual_text import VirtualTextWidget
 from version import VERSION
 
 # Config file path
@@ -359,6 +366,29 @@ class CalculatorGUIAdvanced:
 
         # GUI-specific state
         self.last_saved_input = ""
+        self._input_edited = False
+
+        # Incremental calculation: engine over self.calculator, fed with the
+        # input lines changed since the last calculation
+        self.calc_engine = None
+        self._engine_language = None
+        self._engine_lines_exact = False
+        self._line_tracker = LineChangeTracker()
+        # The engine is used by one thread at a time (Tk thread or live worker)
+        self._engine_lock = threading.Lock()
+
+        # Live recalculation: debounce timer, running worker, its cancel event
+        self._live_timer = None
+        self._live_thread = None
+        self._live_pending = False
+        self._live_cancel = threading.Event()
+
+        # Output pane: the calculator output_blocks the widget shows (None if
+        # it shows anything else), and its line count. Passes are diffed
+        # against these blocks, so a formatted pass that was never shown
+        # cannot shift later patches.
+        self._shown_blocks = None
+        self._output_line_count = 0
 
         # Create widgets
         self.create_widgets()
@@ -395,6 +425,9 @@ class CalculatorGUIAdvanced:
         # Bind input modification event
         self.input_text.bind('<<Modified>>', self.on_input_modified)
 
+        # Track changed input lines through the widget's edit callbacks
+        self.input_text.bind_edit(self._on_input_edit)
+
         # Save on window close
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
@@ -459,6 +492,9 @@ class CalculatorGUIAdvanced:
             'data_dir': DEFAULT_DATA_DIR,
             'shortcuts': DEFAULT_SHORTCUTS.copy(),
             'appearance_mode': 'system',
+            'live_calculation': False,
+            'live_calculation_delay': 300,
+            'parallel_workers': 1,
         }
 
         # Migration from old exe-directory layout
@@ -514,6 +550,9 @@ class CalculatorGUIAdvanced:
         self._saved_position = config.get('window_position')
         self.shortcuts = config['shortcuts']
         self.appearance_mode = config.get('appearance_mode', 'system')
+        self.live_calculation = bool(config['live_calculation'])
+        self.live_calculation_delay = max(int(config['live_calculation_delay']), 50)
+        self.parallel_workers = max(int(config['parallel_workers']), 1)
 
         # Apply appearance mode
         ctk.set_appearance_mode(self.appearance_mode)
@@ -549,6 +588,9 @@ class CalculatorGUIAdvanced:
             'data_dir': self.data_dir,
             'shortcuts': self.shortcuts,
             'appearance_mode': self.appearance_mode,
+            'live_calculation': self.live_calculation,
+            'live_calculation_delay': self.live_calculation_delay,
+            'parallel_workers': self.parallel_workers,
         }
         try:
             os.makedirs(self.data_dir, exist_ok=True)
@@ -587,7 +629,8 @@ class CalculatorGUIAdvanced:
             session = self.session_manager.get_session(self._current_session_id)
             session.input_text = self.input_text.get("1.0", "end-1c")
             session.output_text = self.output_text.get("1.0", "end-1c")
-            session.variables = dict(session.calculator.variables) if hasattr(session.calculator, 'variables') else {}
+            with self._engine_lock:
+                session.variables = dict(session.calculator.variables) if hasattr(session.calculator, 'variables') else {}
         except (KeyError, Exception):
             pass
 
@@ -615,6 +658,7 @@ class CalculatorGUIAdvanced:
         self._refresh_history_tab()
 
     def on_close(self):
+        self._cancel_live_calculation()
         self.save_config()
         # Save current session state and persist all sessions
         self._save_current_session_state()
@@ -625,6 +669,8 @@ class CalculatorGUIAdvanced:
                 self.session_manager.active_tab_index = i
                 break
         self.save_session()
+        self.history_store.close()
+        shutdown_executors()
         self.root.destroy()
 
     # ==================== Update Check (GanttPilot style) ====================
@@ -1270,6 +1316,9 @@ class CalculatorGUIAdvanced:
 
     def _activate_session(self, session_id):
         """Activate a session: load its content into the editor."""
+        # Replacing the input below happens with <<Modified>> unbound, so a
+        # running live pass is not cancelled by the edit itself
+        self._cancel_live_calculation()
         try:
             session = self.session_manager.get_session(session_id)
         except KeyError:
@@ -1293,11 +1342,12 @@ class CalculatorGUIAdvanced:
         self.input_text.bind('<<Modified>>', self.on_input_modified)
 
         # Load output text
+        self._shown_blocks = None
         self.output_text.configure(state=tk.NORMAL)
         self.output_text.delete("1.0", tk.END)
         if session.output_text:
             self.output_text.insert("1.0", session.output_text)
-            self.apply_syntax_highlighting()
+        self.apply_syntax_highlighting()
         self.output_text.configure(state=tk.DISABLED)
 
         self.last_saved_input = session.input_text
@@ -1385,7 +1435,9 @@ class CalculatorGUIAdvanced:
         import datetime
         variables = {}
         if hasattr(self, 'calculator') and hasattr(self.calculator, 'variables'):
-            variables = self.calculator.variables
+            # A live pass may be updating the variables on its worker thread
+            with self._engine_lock:
+                variables = dict(self.calculator.variables)
 
         # Get global variables
         global_vars = self.global_store.get_all() if hasattr(self, 'global_store') else {}
@@ -1459,7 +1511,8 @@ class CalculatorGUIAdvanced:
         
         local_funcs = {}
         if hasattr(self, 'calculator') and hasattr(self.calculator, 'functions'):
-            local_funcs = self.calculator.functions
+            with self._engine_lock:
+                local_funcs = dict(self.calculator.functions)
 
         global_funcs = self.global_store.get_all_functions() if hasattr(self, 'global_store') else {}
 
@@ -1737,12 +1790,11 @@ class CalculatorGUIAdvanced:
         input_container.grid_rowconfigure(0, weight=1)
         input_container.grid_columnconfigure(0, weight=1)
 
-        self.input_text = tk.Text(input_container, wrap=tk.WORD, font=("Consolas", self.font_size),
-                                   undo=True, relief=tk.FLAT, padx=8, pady=8, bd=0, highlightthickness=0)
-        input_sb = tk.Scrollbar(input_container, orient=tk.VERTICAL, command=self.input_text.yview)
-        self.input_text.configure(yscrollcommand=input_sb.set)
+        # Virtualized editor: large logs only load the visible lines into Tk
+        self.input_text = VirtualTextWidget(input_container, wrap=tk.WORD, font=("Consolas", self.font_size),
+                                            undo=True, relief=tk.FLAT, padx=8, pady=8, bd=0,
+                                            highlightthickness=0, fg_color="transparent")
         self.input_text.grid(row=0, column=0, sticky="nsew", padx=(6, 0), pady=6)
-        input_sb.grid(row=0, column=1, sticky="ns", pady=6)
 
         # Output text area
         output_container = ctk.CTkFrame(editor_tab, corner_radius=8)
@@ -1753,9 +1805,15 @@ class CalculatorGUIAdvanced:
         self.output_text = tk.Text(output_container, wrap=tk.WORD, font=("Consolas", self.font_size),
                                     state=tk.DISABLED, relief=tk.FLAT, padx=8, pady=8, bd=0, highlightthickness=0)
         output_sb = tk.Scrollbar(output_container, orient=tk.VERTICAL, command=self.output_text.yview)
-        self.output_text.configure(yscrollcommand=output_sb.set)
         self.output_text.grid(row=0, column=0, sticky="nsew", padx=(6, 0), pady=6)
         output_sb.grid(row=0, column=1, sticky="ns", pady=6)
+        # Only the visible output lines are tagged; the rest as they scroll into view
+        self.output_highlighter = SyntaxHighlighter(self.output_text, pane='output', lazy=True)
+
+        def on_output_scroll(first, last):
+            output_sb.set(first, last)
+            self.output_highlighter.highlight_visible()
+        self.output_text.configure(yscrollcommand=on_output_scroll)
 
         # Tab: Variables (shows defined variables)
         vars_tab_name = "Variables" if self.language == 'en' else "变量"
@@ -1892,6 +1950,34 @@ class CalculatorGUIAdvanced:
                                               command=lambda val: self._preview_appearance(val))
         appear_menu.pack(anchor="w", pady=(0, 12))
 
+        # ===== Live Calculation =====
+        live_label = ctk.CTkLabel(scroll, text="Live Calculation" if self.language == 'en' else "实时计算",
+                                   font=ctk.CTkFont(size=13, weight="bold"))
+        live_label.pack(anchor="w", pady=(0, 4))
+
+        live_hint = "Recalculate changed lines in the background while typing." if self.language == 'en' \
+            else "输入时在后台重算变化的行。"
+        ctk.CTkLabel(scroll, text=live_hint, text_color="gray").pack(anchor="w", pady=(0, 4))
+
+        live_var = tk.BooleanVar(value=self.live_calculation)
+        ctk.CTkSwitch(scroll, text="Enabled" if self.language == 'en' else "启用",
+                      variable=live_var).pack(anchor="w", pady=(0, 12))
+
+        # ===== Parallel Workers =====
+        workers_label = ctk.CTkLabel(scroll, text="Parallel Workers" if self.language == 'en' else "并行进程数",
+                                      font=ctk.CTkFont(size=13, weight="bold"))
+        workers_label.pack(anchor="w", pady=(0, 4))
+
+        workers_hint = "Processes for full calculations of large sheets (1 = serial)." if self.language == 'en' \
+            else "大型计算表全量计算时使用的进程数（1 = 串行）。"
+        ctk.CTkLabel(scroll, text=workers_hint, text_color="gray").pack(anchor="w", pady=(0, 4))
+
+        cpus = os.cpu_count() or 1
+        worker_choices = sorted({n for n in (1, 2, 4, 8) if n <= cpus} | {cpus, self.parallel_workers})
+        workers_var = tk.StringVar(value=str(self.parallel_workers))
+        ctk.CTkOptionMenu(scroll, values=[str(n) for n in worker_choices], variable=workers_var,
+                          width=80).pack(anchor="w", pady=(0, 12))
+
         # ===== Data Directory =====
         dir_label = ctk.CTkLabel(scroll, text="Data Directory" if self.language == 'en' else "数据目录",
                                   font=ctk.CTkFont(size=13, weight="bold"))
@@ -1990,6 +2076,12 @@ class CalculatorGUIAdvanced:
                 else:
                     messagebox.showwarning("Warning", "Invalid directory path")
                     return
+            # Live calculation
+            self.live_calculation = live_var.get()
+            if not self.live_calculation:
+                self._cancel_live_calculation()
+            # Parallel workers (used from the next calculation)
+            self.parallel_workers = int(workers_var.get())
             # Shortcuts
             for action_name, entry in entries.items():
                 self.shortcuts[action_name] = entry.get().strip()
@@ -2005,6 +2097,7 @@ class CalculatorGUIAdvanced:
                 entry.delete(0, tk.END)
                 entry.insert(0, DEFAULT_SHORTCUTS.get(action_name, ''))
             appear_var.set("system")
+            live_var.set(False)
 
         def _close():
             dialog.destroy()
@@ -2025,30 +2118,28 @@ class CalculatorGUIAdvanced:
     def calculate(self):
         self._switch_to_editor()
         try:
-            input_content = self.input_text.get("1.0", tk.END).strip()
+            raw_content = self.input_text.get("1.0", "end-1c")
+            input_content = raw_content.strip()
             if not input_content:
                 self.status_var.set("Please enter calculation content" if self.language == 'en' else "请输入计算内容")
                 return
 
-            # Use the current session's calculator
-            self.calculator = CalculatorPaperAdvanced(language=self.language)
-
-            # Pass global variables as preset (lower priority than local assignments)
-            global_vars = self.global_store.get_all()
-            global_funcs = self.global_store.get_all_functions()
-            self.calculator.process_text(input_content, preset_variables=global_vars, preset_functions=global_funcs)
-            output = self.calculator.format_output()
+            # Recalculate the lines changed since the last calculation
+            # (global variables/functions are preset by the engine); a
+            # running live pass is cancelled and waited for
+            self._cancel_live_calculation()
+            base = self._shown_blocks
+            with self._engine_lock:
+                self._prepare_calculation(raw_content, input_content)(None)
+                output, changes = self.calculator.format_output_changes(base)
+                blocks = self.calculator.output_blocks
 
             # Check for global() function calls and update global store
             self._process_global_declarations(input_content)
 
-            self.output_text.configure(state=tk.NORMAL)
-            self.output_text.delete("1.0", tk.END)
-            self.output_text.insert("1.0", output)
-            self.apply_syntax_highlighting()
-            self.output_text.configure(state=tk.DISABLED)
+            self._show_output(output, changes, base, blocks)
 
-            self.status_var.set("Calculation completed" if self.language == 'en' else "计算完成")
+            self.status_var.set(self._calculation_status("Calculation completed" if self.language == 'en' else "计算完成"))
             self.save_gui_state(input_content, output)
             self.last_saved_input = input_content
             self.update_undo_redo_buttons()
@@ -2071,12 +2162,174 @@ class CalculatorGUIAdvanced:
             messagebox.showerror(title, str(e))
             self.status_var.set(f"Error: {e}" if self.language == 'en' else f"错误: {e}")
 
+    def _prepare_calculation(self, raw_content, input_content):
+        """Choose the engine call for the current input; returns job(cancel_event).
+
+        Runs on the Tk thread with the engine idle: it reads the line
+        tracker and the engine's lines. The returned job only touches the
+        engine, so it may run on the live worker thread.
+
+        The line tracker's edit script is used when widget lines map one to
+        one onto calculation lines (no surrounding blank lines); otherwise
+        the engine diffs the texts. A new calculator (session switch) or a
+        language change starts a full calculation.
+        """
+        engine = self.calc_engine
+        if (engine is None or engine.calculator is not self.calculator
+                or self._engine_language != self.language):
+            # Line results cached by the session's previous calculator stay valid
+            result_cache = self.calculator.result_cache
+            self.calculator = CalculatorPaperAdvanced(language=self.language)
+            self.calculator.result_cache = result_cache
+            engine = self.calc_engine = IncrementalCalcEngine(self.calculator, self.global_store)
+            self._engine_language = self.language
+            job = lambda cancel: engine.process_full(input_content)
+        else:
+            script = None
+            if self._engine_lines_exact and raw_content == input_content:
+                script = self._line_tracker.edit_script(engine.lines, input_content.split('\n'))
+            if script is not None:
+                job = lambda cancel: engine.process_edits(script, cancel_event=cancel)
+            else:
+                last_text = engine.last_text
+                job = lambda cancel: engine.process_incremental(last_text, input_content, [], cancel_event=cancel)
+        self.calculator.parallel_workers = self.parallel_workers
+        self._line_tracker.reset()
+        self._engine_lines_exact = raw_content == input_content
+        return job
+
+    def _calculation_status(self, message):
+        """Status bar text for a finished calculation, with line cache hits/misses"""
+        cache = self.calculator.result_cache
+        if self.language == 'en':
+            return f"{message} · cache {cache.hits} hits / {cache.misses} misses"
+        return f"{message} · 缓存命中 {cache.hits} / 未命中 {cache.misses}"
+
+    def _show_output(self, output, changes=None, base=None, blocks=None):
+        """Show calculation output, patching only the changed lines when possible.
+
+        changes come from format_output_changes(base) and turn the output of
+        the base blocks into blocks; they are applied only if the widget
+        still shows base, otherwise the whole text is replaced.
+        """
+        self.output_text.configure(state=tk.NORMAL)
+        if changes is not None and base is not None and base is self._shown_blocks:
+            self._patch_output(changes)
+        else:
+            self.output_text.delete("1.0", tk.END)
+            self.output_text.insert("1.0", output)
+            self.apply_syntax_highlighting()
+            self._output_line_count = output.count('\n') + 1 if output else 0
+        self._shown_blocks = blocks
+        self.output_text.configure(state=tk.DISABLED)
+
+    def _patch_output(self, changes):
+        """Replace the changed output line ranges and re-tag only those lines."""
+        text = self.output_text
+        count = self._output_line_count
+        for change in changes:
+            start, removed, lines = change.start, change.delete_count, change.lines
+            new_text = '\n'.join(lines)
+            if removed and lines:
+                text.delete(f"{start + 1}.0", f"{start + removed}.end")
+                text.insert(f"{start + 1}.0", new_text)
+            elif lines:
+                if start < count:
+                    text.insert(f"{start + 1}.0", new_text + '\n')
+                elif count:
+                    text.insert("end-1c", '\n' + new_text)
+                else:
+                    text.insert("1.0", new_text)
+            elif removed:
+                if start + removed < count:
+                    text.delete(f"{start + 1}.0", f"{start + removed + 1}.0")
+                elif start:
+                    text.delete(f"{start}.end", f"{start + removed}.end")
+                else:
+                    text.delete("1.0", "end-1c")
+            count += len(lines) - removed
+            self.output_highlighter.replace_lines(start, removed, lines)
+        self._output_line_count = count
+        self.output_highlighter.highlight_visible()
+
+    # ==================== Live Calculation ====================
+
+    def _schedule_live_calculation(self):
+        """Debounce live recalculation; a newer edit cancels the running pass."""
+        if self._live_timer is not None:
+            self.root.after_cancel(self._live_timer)
+        self._live_cancel.set()
+        self._live_timer = self.root.after(self.live_calculation_delay, self._start_live_calculation)
+
+    def _start_live_calculation(self):
+        """Start a background pass over the current input (Tk thread)."""
+        self._live_timer = None
+        if self._live_thread is not None:
+            # Previous pass is still stopping; restart when it reports back
+            self._live_pending = True
+            return
+        raw_content = self.input_text.get("1.0", "end-1c")
+        input_content = raw_content.strip()
+        if not input_content:
+            return
+
+        job = self._prepare_calculation(raw_content, input_content)
+        calculator = self.calculator
+        session_id = self._current_session_id
+        cancel = self._live_cancel = threading.Event()
+        # Diff against what the pane shows: if this pass is dropped after
+        # formatting, the next one still patches the displayed output
+        base = self._shown_blocks
+
+        def worker():
+            output = changes = blocks = error = None
+            try:
+                with self._engine_lock:
+                    job(cancel)
+                    output, changes = calculator.format_output_changes(base)
+                    blocks = calculator.output_blocks
+            except CalculationCancelled:
+                pass
+            except Exception as e:
+                error = e
+            try:
+                self.root.after(0, lambda: self._finish_live_calculation(
+                    cancel, session_id, output, changes, base, blocks, error))
+            except (RuntimeError, tk.TclError):
+                pass  # Window closed while the pass was running
+
+        self._live_thread = threading.Thread(target=worker, daemon=True)
+        self._live_thread.start()
+
+    def _finish_live_calculation(self, cancel, session_id, output, changes, base, blocks, error):
+        """Show the result of a live pass unless a newer edit or another session superseded it (Tk thread)."""
+        self._live_thread = None
+        if not cancel.is_set() and session_id == self._current_session_id:
+            if error is not None:
+                self.status_var.set(f"Error: {error}" if self.language == 'en' else f"错误: {error}")
+            elif output is not None:
+                self._show_output(output, changes, base, blocks)
+                self.status_var.set(self._calculation_status("Live calculation updated" if self.language == 'en' else "实时计算已更新"))
+        if self._live_pending and self._live_timer is None:
+            self._live_pending = False
+            self._start_live_calculation()
+
+    def _cancel_live_calculation(self):
+        """Stop live recalculation: drop the pending timer and cancel a running pass.
+
+        The worker is not joined (its root.after() call needs the Tk thread);
+        callers that use the engine next wait on self._engine_lock instead.
+        """
+        if self._live_timer is not None:
+            self.root.after_cancel(self._live_timer)
+            self._live_timer = None
+        self._live_pending = False
+        self._live_cancel.set()
+
     def _process_global_declarations(self, input_content):
         """Process global() function calls and update the global variable store."""
-        import re
         # Match global(variable_name) calls
-        pattern = re.compile(r'\bglobal\s*\(\s*([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\)')
-        matches = pattern.findall(input_content)
+        matches = GLOBAL_CALL_RE.findall(input_content)
         for var_name in matches:
             if var_name in self.calculator.variables:
                 self.global_store.set(var_name, self.calculator.variables[var_name])
@@ -2085,69 +2338,32 @@ class CalculatorGUIAdvanced:
                 self.global_store.set_function(var_name, params, body)
 
     def apply_syntax_highlighting(self):
-        for tag in self.output_text.tag_names():
-            self.output_text.tag_remove(tag, "1.0", tk.END)
-
+        """Re-highlight the whole output pane with the current theme and font size."""
         mode = ctk.get_appearance_mode()
-        if mode == "Dark":
-            self.output_text.tag_config("comment", foreground="#6A9955")
-            self.output_text.tag_config("result", foreground="#4EC9B0", font=("Consolas", self.font_size, "bold"))
-            self.output_text.tag_config("error", foreground="#F44747")
-            self.output_text.tag_config("total", foreground="#569CD6", font=("Consolas", self.font_size, "bold"))
-            self.output_text.tag_config("endian", foreground="#C586C0", font=("Consolas", self.font_size, "bold"))
-            self.output_text.tag_config("bit_info", foreground="#9CDCFE", font=("Consolas", max(self.font_size - 1, 8)))
-            self.output_text.tag_config("hex_result", foreground="#CE9178", font=("Consolas", self.font_size, "bold"))
-        else:
-            self.output_text.tag_config("comment", foreground="#008000")
-            self.output_text.tag_config("result", foreground="#098658", font=("Consolas", self.font_size, "bold"))
-            self.output_text.tag_config("error", foreground="#CD3131")
-            self.output_text.tag_config("total", foreground="#0000FF", font=("Consolas", self.font_size, "bold"))
-            self.output_text.tag_config("endian", foreground="#AF00DB", font=("Consolas", self.font_size, "bold"))
-            self.output_text.tag_config("bit_info", foreground="#001080", font=("Consolas", max(self.font_size - 1, 8)))
-            self.output_text.tag_config("hex_result", foreground="#A31515", font=("Consolas", self.font_size, "bold"))
-
-        content = self.output_text.get("1.0", tk.END)
-        lines = content.split('\n')
-
-        for i, line in enumerate(lines, 1):
-            line_start = f"{i}.0"
-            line_end = f"{i}.end"
-
-            if line.strip().startswith('#'):
-                self.output_text.tag_add("comment", line_start, line_end)
-            elif '错误:' in line or '变量未定义:' in line:
-                self.output_text.tag_add("error", line_start, line_end)
-            elif line.strip().startswith('总计:'):
-                self.output_text.tag_add("total", line_start, line_end)
-            elif line.strip().startswith('-'):
-                self.output_text.tag_add("comment", line_start, line_end)
-            elif 'endian:' in line.lower():
-                self.output_text.tag_add("endian", line_start, line_end)
-            elif any(kw in line for kw in ['十六进制:', '二进制:', '位数:', '位索引',
-                                            'Hexadecimal:', 'Binary:', 'Bits:', 'Bit indices']):
-                self.output_text.tag_add("bit_info", line_start, line_end)
-            elif 'hex(' in line.lower() and '=' in line:
-                eq_pos = line.find('=')
-                if eq_pos > 0:
-                    self.output_text.tag_add("hex_result", f"{i}.{eq_pos}", line_end)
-            elif '=' in line and not line.strip().startswith('#'):
-                eq_pos = line.find('=')
-                if eq_pos > 0:
-                    self.output_text.tag_add("result", f"{i}.{eq_pos}", line_end)
+        self.output_highlighter.set_theme('dark' if mode == "Dark" else 'light')
+        bold = ("Consolas", self.font_size, "bold")
+        for tag in ("result", "total", "endian", "hex_result"):
+            self.output_text.tag_config(tag, font=bold)
+        self.output_text.tag_config("bit_info", font=("Consolas", max(self.font_size - 1, 8)))
+
+        self.output_highlighter.highlight_full(self.output_text.get("1.0", "end-1c"))
 
     # ==================== Clear/Example/File ====================
 
     def clear_all(self):
         self._switch_to_editor()
         self.input_text.delete("1.0", tk.END)
+        self._shown_blocks = None
         self.output_text.configure(state=tk.NORMAL)
         self.output_text.delete("1.0", tk.END)
+        self.output_highlighter.highlight_full("")
         self.output_text.configure(state=tk.DISABLED)
         self.last_saved_input = ""
         self.status_var.set("Cleared" if self.language == 'en' else "已清空")
 
     def load_example(self):
         self._switch_to_editor()
+        self._cancel_live_calculation()
         if self.language == 'en':
             example = """# Advanced CalcPaper Example
 
@@ -2271,6 +2487,7 @@ comma(1234567)
 
     def open_file(self):
         self._switch_to_editor()
+        self._cancel_live_calculation()
         title = "Open File" if self.language == 'en' else "打开文件"
         filename = filedialog.askopenfilename(title=title, filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
         if filename:
@@ -2306,16 +2523,16 @@ comma(1234567)
                 first_eq = stripped.index('=')
                 left = stripped[:first_eq].strip()
                 right_part = stripped[first_eq+1:].strip()
-                is_assignment = bool(re.match(r'^[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*$', left))
+                is_assignment = bool(IDENT_RE.match(left))
                 if is_assignment:
-                    match = re.match(r'^(.+?)\s{2,}=\s', right_part)
+                    match = OUTPUT_EXPR_RE.match(right_part)
                     if match:
                         original_expr = match.group(1).strip()
                         cleaned.append(f"{left} = {original_expr}")
                     else:
                         cleaned.append(stripped)
                 else:
-                    match = re.match(r'^(.+?)\s{2,}=\s', stripped)
+                    match = OUTPUT_EXPR_RE.match(stripped)
                     if match:
                         original_expr = match.group(1).strip()
                         cleaned.append(original_expr)
@@ -2365,14 +2582,28 @@ comma(1234567)
             if hasattr(self, '_save_timer'):
                 self.root.after_cancel(self._save_timer)
             self._save_timer = self.root.after(500, self.auto_save_input)
+            if self.live_calculation:
+                self._schedule_live_calculation()
 
     def auto_save_input(self):
-        current_input = self.input_text.get("1.0", "end-1c")
-        if current_input != self.last_saved_input:
-            self.last_saved_input = current_input
+        # Only read the buffer back when the edit hooks saw a change
+        if not self._input_edited:
+            return
+        self._input_edited = False
+        self.last_saved_input = self.input_text.get("1.0", "end-1c")
+
+    def _on_input_edit(self, edit):
+        """Record the lines touched by an input edit (typing, paste, undo, loads)"""
+        self._input_edited = True
+        first = edit.start[0]
+        if edit.removed:
+            self._line_tracker.delete(first, first + edit.removed.count('\n'))
+        if edit.inserted:
+            self._line_tracker.insert(first, edit.inserted.count('\n'))
 
     def undo(self):
         self._switch_to_editor()
+        self._cancel_live_calculation()
         if self._current_session_id is None:
             return
         try:
@@ -2386,6 +2617,7 @@ comma(1234567)
             self.input_text.delete("1.0", tk.END)
             self.input_text.insert("1.0", inp)
             self.last_saved_input = inp
+            self._shown_blocks = None
             self.output_text.configure(state=tk.NORMAL)
             self.output_text.delete("1.0", tk.END)
             self.output_text.insert("1.0", out)
@@ -2398,6 +2630,7 @@ comma(1234567)
 
     def redo(self):
         self._switch_to_editor()
+        self._cancel_live_calculation()
         if self._current_session_id is None:
             return
         try:
@@ -2411,6 +2644,7 @@ comma(1234567)
             self.input_text.delete("1.0", tk.END)
             self.input_text.insert("1.0", inp)
             self.last_saved_input = inp
+            self._shown_blocks = None
             self.output_text.configure(state=tk.NORMAL)
             self.output_text.delete("1.0", tk.END)
             self.output_text.insert("1.0", out)
@@ -2441,11 +2675,9 @@ comma(1234567)
     def _get_defined_variables(self):
         content = self.input_text.get("1.0", "end-1c")
         variables = []
-        pattern = re.compile(r'^([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*=', re.MULTILINE)
-        reserved_pattern = re.compile(r'^[YTMWDhms]\d+$')
-        for match in pattern.finditer(content):
+        for match in LINE_ASSIGNMENT_RE.finditer(content):
             name = match.group(1)
-            if not reserved_pattern.match(name):
+            if not RESERVED_KEYWORD_RE.match(name):
                 if name not in variables:
                     variables.append(name)
         return variables
@@ -2455,10 +2687,9 @@ comma(1234567)
         content = self.input_text.get("1.0", "end-1c")
         functions = []
         # Match function definitions: func(x, y) = expr
-        pattern = re.compile(r'^([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\([^)]+\)\s*=', re.MULTILINE)
-        for match in pattern.finditer(content):
+        for match in LINE_FUNC_DEF_RE.finditer(content):
             name = match.group(1)
-            if name.lower() not in ('swap', 'bitmap', 'hex', 'comma', 'global', 'workday'):
+            if name.lower() not in BUILTIN_FUNCTIONS:
                 if name not in functions:
                     functions.append(name)
         # Add global functions
@@ -2482,13 +2713,13 @@ comma(1234567)
             i = len(line_text) - 1
             while i >= 0:
                 ch = line_text[i]
-                if re.match(r'[a-zA-Z0-9_\u4e00-\u9fa5]', ch):
+                if IDENT_CHAR_RE.match(ch):
                     i -= 1
                 else:
                     break
             word_start = i + 1
             prefix = line_text[word_start:]
-            if prefix and re.match(r'[a-zA-Z_\u4e00-\u9fa5]', prefix[0]):
+            if prefix and IDENT_START_RE.match(prefix[0]):
                 start_pos = f"{line}.{word_start}"
                 return (prefix, start_pos)
             return (None, None)
@@ -2544,8 +2775,8 @@ comma(1234567)
             try:
                 bbox = self.input_text.bbox(tk.INSERT)
                 if bbox:
-                    x = self.input_text.winfo_rootx() + bbox[0]
-                    y = self.input_text.winfo_rooty() + bbox[1] + bbox[3]
+                    x = self.input_text.text_widget.winfo_rootx() + bbox[0]
+                    y = self.input_text.text_widget.winfo_rooty() + bbox[1] + bbox[3]
                     self.autocomplete.show(all_candidates, x, y)
                 else:
                     self.autocomplete.hide()
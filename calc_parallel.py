@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Parallel Evaluation of Independent Lines
+
+This module provides:
+- split_components: Splits the evaluated lines of a sheet into groups that
+  share no variables (weakly-connected components of the line/variable graph).
+- plan_batches: Deterministically packs components into one batch per worker.
+- evaluate_parallel: Evaluates the batches on a concurrent.futures process
+  pool and merges the results back into the calculator.
+
+Lines in different components never read or write the same variable, so
+evaluating each component in topological order on its own gives exactly the
+results of a serial pass.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+from calc_grammar import WORD_RE, RESERVED_NAMES, is_reserved_keyword
+from calc_parser import CompiledLine, compile_line
+
+# Process pools by worker count, started on first use and reused
+_executors: dict[int, ProcessPoolExecutor] = {}
+
+
+def get_executor(workers: int) -> ProcessPoolExecutor:
+    """获取（必要时创建）指定工作进程数的进程池"""
+    executor = _executors.get(workers)
+    if executor is None:
+        executor = _executors[workers] = ProcessPoolExecutor(max_workers=workers)
+    return executor
+
+
+def shutdown_executors() -> None:
+    """关闭所有进程池"""
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+
+
+def _function_names(functions: dict[str, tuple[list[str], str]]) -> dict[str, set[str]]:
+    """Names referenced by each function body (parameters excluded)"""
+    names = {}
+    for name, (params, body) in functions.items():
+        names[name] = {n for n in WORD_RE.findall(body)
+                       if n not in params and n not in RESERVED_NAMES and not is_reserved_keyword(n)}
+    return names
+
+
+def _line_names(info: CompiledLine, function_names: dict[str, set[str]]) -> set[str]:
+    """Variables a line defines or may read, including through called functions"""
+    names = set(info.uses)
+    if info.defines:
+        names.add(info.defines)
+    # Free names of called functions are read when the call is expanded
+    pending = [n for n in names if n in function_names]
+    seen = set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for ref in function_names[name]:
+            names.add(ref)
+            if ref in function_names:
+                pending.append(ref)
+    return names
+
+
+def split_components(line_infos: list[CompiledLine], eval_order: list[int],
+                     functions: dict[str, tuple[list[str], str]]) -> list[list[int]]:
+    """将待计算行划分为互不共享变量的分组
+    
+    Lines are joined with every variable they define or use; a line calling
+    a user-defined function is also joined with the names the function body
+    reads (transitively through other functions). Each component keeps the
+    relative order of eval_order, and components are ordered by their first
+    line in eval_order.
+    
+    Args:
+        line_infos: Line records from _collect_definitions().
+        eval_order: Line indices in dependency order.
+        functions: User-defined functions {name: (params, body)}.
+        
+    Returns:
+        List of components, each a list of line indices in evaluation order.
+    """
+    parent: dict[Any, Any] = {}
+
+    def find(node):
+        root = node
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    function_names = _function_names(functions) if functions else {}
+    for idx in eval_order:
+        line_root = find(('line', idx))
+        for name in _line_names(line_infos[idx], function_names):
+            name_root = find(('var', name))
+            if name_root != line_root:
+                parent[name_root] = line_root
+
+    components: dict[Any, list[int]] = {}
+    for idx in eval_order:
+        components.setdefault(find(('line', idx)), []).append(idx)
+    return list(components.values())
+
+
+def plan_batches(components: list[list[int]], workers: int) -> list[list[list[int]]]:
+    """把分组分配到至多 workers 个批次（按行数均衡，结果确定）
+    
+    Components are taken largest first (ties by position) and each goes to
+    the batch with the fewest lines so far (ties by batch number).
+    """
+    batches: list[list[list[int]]] = [[] for _ in range(min(workers, len(components)))]
+    sizes = [0] * len(batches)
+    for pos in sorted(range(len(components)), key=lambda p: (-len(components[p]), p)):
+        target = min(range(len(batches)), key=lambda b: (sizes[b], b))
+        batches[target].append(components[pos])
+        sizes[target] += len(components[pos])
+    return batches
+
+
+def _evaluate_batch(language: str, functions: dict, variables: dict,
+                    lines: list[str]) -> tuple[list[tuple], list, dict]:
+    """Worker: evaluate lines in order on a fresh calculator (runs in a pool process)
+
+    Also returns each line's result_cache key (None if not cacheable), taken
+    before the line is evaluated, so the caller can fill its cache.
+    """
+    from calc_paper import CalculatorPaperAdvanced
+
+    calc = CalculatorPaperAdvanced(language=language)
+    calc.functions = functions
+    calc.variables = variables
+    results = []
+    keys = []
+    for line in lines:
+        compiled = compile_line(line)
+        keys.append(calc._result_key(compiled))
+        results.append(calc._evaluate_line(compiled))
+    return results, keys, calc.variables
+
+
+def evaluate_parallel(calculator, line_infos: list[CompiledLine], eval_order: list[int],
+                      workers: int) -> bool:
+    """在进程池中并行计算互相独立的分组，并把结果合并回计算器
+    
+    Workers re-compile the line text (calculator.lines) since compiled
+    programs are closures and cannot be sent to another process.
+    Fills calculator.results for every line of eval_order and updates
+    calculator.variables exactly as a serial pass over eval_order would
+    (including key order); results of cacheable lines are stored in
+    calculator.result_cache under the keys the workers computed. Returns False without changing anything when
+    the lines form a single component or the pool cannot be used; the
+    caller then evaluates serially.
+    
+    Args:
+        calculator: The CalculatorPaperAdvanced being evaluated.
+        line_infos: Line records from _collect_definitions().
+        eval_order: Line indices in dependency order.
+        workers: Number of worker processes.
+    """
+    components = split_components(line_infos, eval_order, calculator.functions)
+    if len(components) < 2:
+        return False
+    batches = plan_batches(components, workers)
+
+    function_names = _function_names(calculator.functions) if calculator.functions else {}
+    jobs = []
+    for batch in batches:
+        order = [idx for component in batch for idx in component]
+        names = set()
+        for idx in order:
+            names.update(_line_names(line_infos[idx], function_names))
+        # Only the preset values the batch can read are sent to the worker
+        variables = {n: v for n, v in calculator.variables.items() if n in names}
+        jobs.append((order, variables))
+
+    try:
+        executor = get_executor(workers)
+        futures = [executor.submit(_evaluate_batch, calculator.language, calculator.functions, variables,
+                                   [calculator.lines[idx] for idx in order])
+                   for order, variables in jobs]
+        outputs = [future.result() for future in futures]
+    except Exception:
+        # Broken pool, unpicklable value, no process support, ...
+        shutdown_executors()
+        return False
+
+    final_vars = {}
+    cache = calculator.result_cache
+    for (order, _), (results, keys, variables) in zip(jobs, outputs):
+        for idx, result, key in zip(order, results, keys):
+            calculator.results[idx] = result
+            if key is not None:
+                cache.put(key, result)
+        final_vars.update(variables)
+
+    # Serial insertion order: preset variables first, then by first successful assignment
+    merged = {n: final_vars.get(n, v) for n, v in calculator.variables.items()}
+    for idx in eval_order:
+        name = line_infos[idx].defines
+        if name in final_vars and name not in merged and calculator.results[idx][0] is not None:
+            merged[name] = final_vars[name]
+    calculator.variables = merged
+    return True
@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - Line Tokenizer, Expression Parser and Compiled Line Cache
+
+This module provides:
+- Tokenizer and recursive-descent parser turning an arithmetic expression
+  into a small typed AST (Num / Var / Unary / Binary / Percent / Call).
+- CompiledLine: everything CalculatorPaperAdvanced.parse_line() needs to
+  know about a line that depends only on its text (kind, label, built-in
+  wrapper arguments, literal formats, display template, parsed AST).
+- compile_expression(): turns an AST into nested Python closures, so an
+  expression is evaluated without eval() and without re-parsing its text.
+- compile_line(): builds a CompiledLine once and caches it by line text, so
+  recalculating a sheet whose text did not change skips all regex work.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+import re
+import operator
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from calc_grammar import (
+    BUILTIN_FUNCTIONS, RESERVED_NAMES, IDENT_START_CHARS, is_reserved_keyword,
+    ASSIGNMENT_RE, BUILTIN_CALL_RE,
+    IDENT_RE, WORD_RE, HEX_BIN_RE, HEX_LITERAL_RE, BIN_LITERAL_RE, COMMA_NUMBER_RE,
+    DATE_TIME_SEARCH_RE, TIME_SEARCH_RE, DATE_TIME_SPLIT_RE,
+    FUNC_DEF_RE, GLOBAL_DECL_RE, HEX_FUNC_RE, BITMAP_RE, COMMA_FUNC_RE, WORKDAY_RE,
+    EXPR_TOKEN_RE, DISPLAY_RE, BITWISE_OPERATORS,
+)
+
+
+class OutputFormat(Enum):
+    """Output format for calculation results"""
+    DECIMAL = 'decimal'
+    HEXADECIMAL = 'hex'
+    BINARY = 'binary'
+
+
+
+
+def detect_output_format(expression: str, has_explicit_hex_func: bool) -> OutputFormat:
+    """根据表达式中的字面量自动检测输出格式
+    
+    Priority:
+    1. Explicit hex() function → HEXADECIMAL
+    2. Expression contains 0x literal → HEXADECIMAL
+    3. Expression contains 0b literal → BINARY
+    4. No special literals → DECIMAL
+    """
+    if has_explicit_hex_func:
+        return OutputFormat.HEXADECIMAL
+    if HEX_LITERAL_RE.search(expression):
+        return OutputFormat.HEXADECIMAL
+    if BIN_LITERAL_RE.search(expression):
+        return OutputFormat.BINARY
+    return OutputFormat.DECIMAL
+
+
+class CalcError(ValueError):
+    """Evaluation error whose message is shown to the user as-is."""
+
+
+# ========== AST ==========
+
+class Node:
+    """Base class of expression AST nodes."""
+    __slots__ = ()
+
+
+class Num(Node):
+    """Numeric literal. fmt is 'dec', 'hex' or 'bin'."""
+    __slots__ = ('value', 'fmt')
+
+    def __init__(self, value, fmt='dec'):
+        self.value = value
+        self.fmt = fmt
+
+
+class Var(Node):
+    """Variable reference."""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Unary(Node):
+    """Prefix operator: '-', '+' or '~'."""
+    __slots__ = ('op', 'operand')
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+
+class Binary(Node):
+    """Infix operator."""
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class Percent(Node):
+    """Postfix percentage: 15% → 0.15"""
+    __slots__ = ('operand',)
+
+    def __init__(self, operand):
+        self.operand = operand
+
+
+class Call(Node):
+    """Function call: swap(x) or a user-defined f(a, b)."""
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+BITWISE_OPS = frozenset(['<<', '>>', '&', '|', '^'])
+
+BINARY_FUNCS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '//': operator.floordiv,
+    '**': operator.pow,
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+}
+
+UNARY_FUNCS = {
+    '-': operator.neg,
+    '+': operator.pos,
+    '~': operator.invert,
+}
+
+
+# ========== Tokenizer ==========
+
+def tokenize(expr: str) -> list[tuple[str, Any]]:
+    """Split an expression into (kind, value) tokens.
+
+    Kinds are 'num' (value is a Num node), 'ident' and 'op'.
+
+    Raises:
+        CalcError: If the expression contains a character outside the grammar.
+    """
+    tokens = []
+    pos = 0
+    length = len(expr)
+    match = EXPR_TOKEN_RE.match
+    while pos < length:
+        m = match(expr, pos)
+        if m is None:
+            raise CalcError("包含非法字符")
+        kind = m.lastgroup
+        text = m.group()
+        pos = m.end()
+        if kind == 'ws':
+            continue
+        if kind == 'ident' and tokens and tokens[-1][0] == 'num' and expr[m.start() - 1] not in ' \t':
+            # Letters glued to a number (2x, 1e5) are not part of the grammar
+            raise CalcError("包含非法字符")
+        if kind == 'num':
+            value = float(text) if '.' in text else int(text)
+            tokens.append(('num', Num(value)))
+        elif kind == 'hex':
+            tokens.append(('num', Num(int(text[2:], 16), 'hex')))
+        elif kind == 'bin':
+            tokens.append(('num', Num(int(text[2:], 2), 'bin')))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+# ========== Parser ==========
+
+# Binary operator precedence (higher binds tighter), same as Python
+_PRECEDENCE = {
+    '|': 1,
+    '^': 2,
+    '&': 3,
+    '<<': 4, '>>': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '//': 6,
+}
+
+class _Parser:
+    """Precedence-climbing parser over the token list of one expression."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def expect(self, value):
+        kind, text = self.next()
+        if kind != 'op' or text != value:
+            raise SyntaxError(value)
+
+    def parse(self):
+        if not self.tokens:
+            raise CalcError("表达式为空")
+        node = self.parse_binary(1)
+        if self.pos != len(self.tokens):
+            raise SyntaxError(self.peek())
+        return node
+
+    def parse_binary(self, min_prec):
+        left = self.parse_unary()
+        while True:
+            kind, text = self.peek()
+            prec = _PRECEDENCE.get(text) if kind == 'op' else None
+            if prec is None or prec < min_prec:
+                return left
+            self.pos += 1
+            right = self.parse_binary(prec + 1)
+            left = Binary(text, left, right)
+
+    def parse_unary(self):
+        kind, text = self.peek()
+        if kind == 'op' and text in UNARY_FUNCS:
+            self.pos += 1
+            return Unary(text, self.parse_unary())
+        return self.parse_power()
+
+    def parse_power(self):
+        base = self.parse_postfix()
+        kind, text = self.peek()
+        if kind == 'op' and text == '**':
+            self.pos += 1
+            # Right associative, and the exponent may carry a sign: 2 ** -1
+            return Binary('**', base, self.parse_unary())
+        return base
+
+    def parse_postfix(self):
+        node = self.parse_primary()
+        while self.peek() == ('op', '%'):
+            self.pos += 1
+            node = Percent(node)
+        return node
+
+    def parse_primary(self):
+        kind, value = self.next()
+        if kind == 'num':
+            return value
+        if kind == 'ident':
+            if self.peek() == ('op', '('):
+                self.pos += 1
+                return Call(value, self.parse_args())
+            return Var(value)
+        if kind == 'op' and value == '(':
+            node = self.parse_binary(1)
+            self.expect(')')
+            return node
+        raise SyntaxError(value)
+
+    def parse_args(self):
+        args = []
+        if self.peek() == ('op', ')'):
+            self.pos += 1
+            return args
+        while True:
+            args.append(self.parse_binary(1))
+            kind, text = self.next()
+            if kind == 'op' and text == ')':
+                return args
+            if kind != 'op' or text != ',':
+                raise SyntaxError(text)
+
+
+def parse_expression(expr: str) -> Node:
+    """Parse an arithmetic expression into an AST.
+
+    Raises:
+        CalcError: "表达式为空", "包含非法字符" or "表达式语法错误".
+    """
+    tokens = tokenize(expr)
+    try:
+        return _Parser(tokens).parse()
+    except SyntaxError:
+        raise CalcError("表达式语法错误")
+
+
+def walk(node: Node):
+    """Yield every node of the tree (pre-order)."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        if isinstance(current, Binary):
+            stack.append(current.right)
+            stack.append(current.left)
+        elif isinstance(current, (Unary, Percent)):
+            stack.append(current.operand)
+        elif isinstance(current, Call):
+            stack.extend(reversed(current.args))
+
+
+def compile_expression(node: Node) -> Callable[[Callable, Callable], Any]:
+    """Compile an AST into a closure evaluated as program(resolve, call).
+
+    The returned program takes two callbacks:
+        resolve(name): maps a variable name to its numeric value.
+        call(name, args): evaluates a function call; args are compiled
+            programs of the argument expressions (not yet evaluated).
+
+    Sub-trees without variables or calls are folded to constants when they
+    evaluate cleanly; errors such as 1/0 are left for evaluation time.
+
+    Raises:
+        CalcError: "表达式过于复杂" if the tree is too deep to compile.
+    """
+    try:
+        return _compile(node)[0]
+    except RecursionError:
+        raise CalcError("表达式过于复杂")
+
+
+def _constant(value):
+    return (lambda resolve, call: value), True, value
+
+
+def _fold(program, constant):
+    """Evaluate a constant sub-program once, keeping it lazy if it raises."""
+    if not constant:
+        return program, False, None
+    try:
+        value = program(None, None)
+    except Exception:
+        return program, False, None
+    return _constant(value)
+
+
+def _compile(node: Node):
+    """Return (program, is_constant, constant_value) for node."""
+    if isinstance(node, Num):
+        return _constant(node.value)
+    if isinstance(node, Var):
+        name = node.name
+        return (lambda resolve, call: resolve(name)), False, None
+    if isinstance(node, Binary):
+        func = BINARY_FUNCS[node.op]
+        left, left_const, left_value = _compile(node.left)
+        right, right_const, right_value = _compile(node.right)
+        if right_const:
+            program = lambda resolve, call: func(left(resolve, call), right_value)
+        elif left_const:
+            program = lambda resolve, call: func(left_value, right(resolve, call))
+        else:
+            program = lambda resolve, call: func(left(resolve, call), right(resolve, call))
+        return _fold(program, left_const and right_const)
+    if isinstance(node, Unary):
+        func = UNARY_FUNCS[node.op]
+        operand, constant, _ = _compile(node.operand)
+        return _fold(lambda resolve, call: func(operand(resolve, call)), constant)
+    if isinstance(node, Percent):
+        operand, constant, _ = _compile(node.operand)
+        return _fold(lambda resolve, call: float(operand(resolve, call)) / 100, constant)
+    name = node.name
+    args = [_compile(arg)[0] for arg in node.args]
+    return (lambda resolve, call: call(name, args)), False, None
+
+
+@lru_cache(maxsize=4096)
+def compile_text(expr: str) -> Callable[[Callable, Callable], Any]:
+    """Parse and compile an expression string, cached by text.
+
+    Raises:
+        CalcError: If the expression cannot be parsed.
+    """
+    return compile_expression(parse_expression(expr))
+
+
+# ========== Text helpers shared with CalculatorPaperAdvanced ==========
+
+def normalize_comma_numbers(expr: str) -> str:
+    """Normalize comma-separated numbers like 59,200 → 59200."""
+    if ',' not in expr:
+        return expr
+    return COMMA_NUMBER_RE.sub(lambda m: m.group(1).replace(',', ''), expr)
+
+
+_IMPLICIT_MUL_RULES = [
+    # Number followed by opening paren: 3( → 3*(
+    (re.compile(r'(\d)\s*\('), r'\1*('),
+    # Closing paren followed by opening paren: )( → )*(
+    (re.compile(r'\)\s*\('), r')*('),
+    # Number followed by variable: 3x → 3*x
+    (re.compile(r'(\d)([' + IDENT_START_CHARS + r'])'), r'\1*\2'),
+    # Closing paren followed by number or variable: )2 → )*2, )x → )*x
+    (re.compile(r'\)\s*(\d)'), r')*\1'),
+    (re.compile(r'\)\s*([' + IDENT_START_CHARS + r'])'), r')*\1'),
+]
+
+
+def add_implicit_multiplication(expr: str) -> str:
+    """Add explicit multiplication operators where implicit multiplication is used.
+
+    Handles patterns like:
+    - 3(x) → 3*(x)
+    - (x)(y) → (x)*(y)
+    - 2x → 2*x (number followed by variable)
+    """
+    # Protect hex and binary literals first
+    protected = []
+
+    def protect(match):
+        protected.append(match.group(0))
+        # Use a placeholder that won't trigger implicit mult rules
+        return f'\x00IMPL{len(protected)-1}\x00'
+
+    expr = HEX_BIN_RE.sub(protect, expr)
+    for pattern, replacement in _IMPLICIT_MUL_RULES:
+        expr = pattern.sub(replacement, expr)
+
+    # Restore protected literals
+    for i, literal in enumerate(protected):
+        expr = expr.replace(f'\x00IMPL{i}\x00', literal)
+    return expr
+
+
+# ========== Compiled line ==========
+
+@dataclass(frozen=True)
+class CompiledLine:
+    """Text-only analysis of one input line, shared by every recalculation.
+
+    Records are cached by compile_line() and shared, so they are immutable.
+
+    This is the single per-line record used by all phases: dependency
+    collection (defines/uses), topological sort, evaluation (program) and
+    the incremental engine.
+
+    kind is one of:
+    - 'empty': empty line
+    - 'comment': comment line (starts with #)
+    - 'global': global(name) declaration
+    - 'func_def': user function definition (func_* fields)
+    - 'hex' / 'bitmap' / 'comma': standalone built-in wrapper around source
+    - 'expr': plain expression, optionally assigned to label
+    """
+    kind: str
+    text: str = ''                      # Normalized line: inline comment removed, comma numbers joined
+    source: str = ''                    # Expression text actually evaluated
+    label: Optional[str] = None
+    # Function definitions / global declarations
+    name: Optional[str] = None
+    params: tuple[str, ...] = ()
+    body: str = ''
+    error: Optional[str] = None         # 'builtin_conflict' / 'duplicate_params' / 'reserved_label' / 'bitmap_width'
+    # Dependency information
+    defines: Optional[str] = None       # Variable assigned by this line
+    uses: frozenset = frozenset()       # Variables referenced (may include defines for a = a + 1)
+    builtin: Optional[str] = None       # Standalone built-in call: 'hex', 'bitmap', 'comma', 'workday', 'global'
+    # bitmap() arguments
+    bitmap_endian: Optional[str] = None
+    bitmap_width: Optional[int] = None
+    # Literal and operator information
+    has_hex_bin: bool = False
+    has_bitwise_text: bool = False
+    output_format: OutputFormat = OutputFormat.DECIMAL
+    is_workday: bool = False
+    has_date_time_literal: bool = False
+    has_time_literal: bool = False
+    date_time_tokens: tuple[str, ...] = ()
+    date_var_names: tuple[str, ...] = ()
+    # Display template: ((literal_prefix, variable_name_or_None), ...)
+    display: tuple[tuple[str, Optional[str]], ...] = ()
+    names: tuple[str, ...] = ()  # Variable references in order, with repeats
+    # Parsed expression
+    expr: Optional[Node] = None
+    parse_error: Optional[str] = None
+    program: Optional[Callable[[Callable, Callable], Any]] = None
+    call_names: frozenset = frozenset()
+    has_bitwise: bool = False
+
+
+    @property
+    def is_empty(self) -> bool:
+        return self.kind == 'empty'
+
+    @property
+    def is_comment(self) -> bool:
+        return self.kind == 'comment'
+
+    @property
+    def is_blank(self) -> bool:
+        """Empty or comment line (nothing to evaluate)"""
+        return self.kind == 'empty' or self.kind == 'comment'
+
+    @property
+    def is_func_def(self) -> bool:
+        return self.kind == 'func_def'
+
+
+EMPTY_LINE = CompiledLine(kind='empty')
+COMMENT_LINE = CompiledLine(kind='comment')
+
+
+def _collect_uses(text: str) -> frozenset:
+    """Variable names referenced in text (built-ins and date/time keywords excluded)"""
+    return frozenset(name for name in WORD_RE.findall(text)
+                     if name not in RESERVED_NAMES and not is_reserved_keyword(name))
+
+
+def _build_display(source: str) -> tuple[tuple, tuple[str, ...]]:
+    """Split source into literal text and substitutable variable names."""
+    display = []
+    names = []
+    last = 0
+    for m in DISPLAY_RE.finditer(source):
+        name = m.group(1)
+        if name is None:
+            continue
+        if name.lower() in BUILTIN_FUNCTIONS or is_reserved_keyword(name):
+            continue
+        display.append((source[last:m.start()], name))
+        names.append(name)
+        last = m.end()
+    display.append((source[last:], None))
+    return tuple(display), tuple(names)
+
+
+@lru_cache(maxsize=16384)
+def compile_line(line: str) -> CompiledLine:
+    """Analyse one input line. Results are cached by line text.
+
+    Mirrors the decision order of CalculatorPaperAdvanced.parse_line():
+    global() declaration, function definition, hex()/bitmap()/comma()
+    wrappers, assignment, then the expression itself.
+    """
+    line = line.strip()
+    if not line:
+        return EMPTY_LINE
+    if line.startswith('#'):
+        return COMMENT_LINE
+
+    # Remove inline comments
+    if '#' in line:
+        line = line.split('#')[0].strip()
+
+    # Normalize comma-separated numbers (e.g. 59,200 → 59200)
+    line = normalize_comma_numbers(line)
+
+    builtin_match = BUILTIN_CALL_RE.match(line)
+    builtin = builtin_match.group(1).lower() if builtin_match else None
+
+    global_match = GLOBAL_DECL_RE.match(line)
+    if global_match:
+        return CompiledLine(kind='global', name=global_match.group(1),
+                            builtin=builtin, uses=_collect_uses(line))
+
+    func_def_match = FUNC_DEF_RE.match(line)
+    if func_def_match:
+        func_name = func_def_match.group(1)
+        params = tuple(p.strip() for p in func_def_match.group(2).split(','))
+        error = None
+        if func_name.lower() in BUILTIN_FUNCTIONS:
+            error = 'builtin_conflict'
+        elif len(params) != len(set(params)):
+            error = 'duplicate_params'
+        # Handle implicit multiplication in function body (e.g. 3x → 3*x)
+        body = add_implicit_multiplication(func_def_match.group(3).strip())
+        return CompiledLine(kind='func_def', name=func_name, params=params,
+                            body=body, error=error)
+
+    # Fields are collected first: CompiledLine is frozen because the cached
+    # record is shared by every caller
+    fields = {'kind': 'expr', 'text': line, 'builtin': builtin}
+
+    # Dependency information: standalone built-in calls never define a variable
+    expr_part = line
+    if builtin is None:
+        assign_match = ASSIGNMENT_RE.match(line)
+        if assign_match:
+            var_name = assign_match.group(1)
+            if var_name not in RESERVED_NAMES and not is_reserved_keyword(var_name):
+                fields['defines'] = var_name
+                expr_part = assign_match.group(2)  # Only scan RHS for uses
+    # Note: do NOT exclude 'defines' here — self-reference (a = a + 1)
+    # needs to be detected as circular dependency by _topological_sort()
+    fields['uses'] = _collect_uses(expr_part)
+    hex_match = HEX_FUNC_RE.match(line)
+    bitmap_match = BITMAP_RE.match(line)
+    comma_match = COMMA_FUNC_RE.match(line)
+    if hex_match:
+        fields['kind'] = 'hex'
+        line = hex_match.group(1).strip()
+    elif bitmap_match:
+        fields['kind'] = 'bitmap'
+        fields['bitmap_endian'] = 'big' if bitmap_match.group(2) == '1' else 'little'
+        if bitmap_match.group(3) is not None:
+            fields['bitmap_width'] = int(bitmap_match.group(3))
+            if fields['bitmap_width'] <= 0:
+                fields['error'] = 'bitmap_width'
+        line = bitmap_match.group(1).strip()
+    elif comma_match:
+        fields['kind'] = 'comma'
+        line = comma_match.group(1).strip()
+    elif '=' in line:
+        # Check if there is a label (e.g.: rent = 1000)
+        left, right = line.split('=', 1)
+        left = left.strip()
+        if IDENT_RE.match(left):
+            fields['label'] = left
+            line = right.strip()
+            if is_reserved_keyword(left):
+                fields['error'] = 'reserved_label'
+
+    fields['source'] = line
+    fields['is_workday'] = bool(WORKDAY_RE.match(line))
+
+    # Date/time literal detection; variables holding dates are checked at evaluation
+    fields['has_date_time_literal'] = bool(DATE_TIME_SEARCH_RE.search(line))
+    fields['has_time_literal'] = bool(TIME_SEARCH_RE.search(line))
+    fields['date_var_names'] = tuple(name for name in WORD_RE.findall(line)
+                                     if name.lower() not in BUILTIN_FUNCTIONS)
+    fields['date_time_tokens'] = tuple(DATE_TIME_SPLIT_RE.split(line))
+
+    # Literal formats and operator flags
+    fields['has_hex_bin'] = bool(HEX_BIN_RE.search(line))
+    fields['has_bitwise_text'] = any(op in line for op in BITWISE_OPERATORS)
+    fields['output_format'] = detect_output_format(line, False)
+
+    fields['display'], fields['names'] = _build_display(line)
+
+    try:
+        fields['expr'] = expr = parse_expression(line)
+        fields['program'] = compile_expression(expr)
+    except CalcError as e:
+        fields['parse_error'] = str(e)
+    else:
+        nodes = list(walk(expr))
+        fields['call_names'] = frozenset(n.name for n in nodes if isinstance(n, Call))
+        fields['has_bitwise'] = any(
+            (isinstance(n, Binary) and n.op in BITWISE_OPS) or
+            (isinstance(n, Unary) and n.op == '~')
+            for n in nodes
+        )
+    return CompiledLine(**fields)
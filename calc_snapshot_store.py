@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CalcPaper - In-Memory Snapshot Store Module
+
+Bounded storage for history snapshots when Git is unavailable. Each
+snapshot is kept as a line-level delta against the previous snapshot of
+the same session, with a full keyframe every few snapshots. Once the byte
+budget is exceeded the oldest snapshots are evicted.
+
+Copyright (C) 2026 matthewzu <xiaofeng_zu@163.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+from __future__ import annotations
+
+import difflib
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Optional, Union
+
+DEFAULT_BYTE_BUDGET = 32 * 1024 * 1024
+DEFAULT_KEYFRAME_INTERVAL = 32
+
+# Changed regions up to this many lines (old and new) are matched line by
+# line; larger ones are stored as a plain replacement
+MATCH_LIMIT = 1000
+
+# Approximate CPython cost of a stored line (str header + list slot) and of
+# a copy operation; sizes are estimates used for the budget, not exact
+_LINE_COST = 56
+_OP_COST = 64
+
+# A delta is a list of operations: (start, end) copies lines old[start:end],
+# a list of strings inserts those lines
+DeltaOp = Union[tuple[int, int], list[str]]
+
+
+def line_delta(old: list[str], new: list[str]) -> list[DeltaOp]:
+    """Compute operations that rebuild new from old (see apply_line_delta)."""
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    old_end = len(old) - suffix
+    new_end = len(new) - suffix
+
+    ops: list[DeltaOp] = []
+    if prefix:
+        ops.append((0, prefix))
+    if new_end > prefix:
+        if prefix < old_end and old_end - prefix <= MATCH_LIMIT and new_end - prefix <= MATCH_LIMIT:
+            matcher = difflib.SequenceMatcher(None, old[prefix:old_end], new[prefix:new_end],
+                                              autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == "equal":
+                    ops.append((prefix + i1, prefix + i2))
+                elif j2 > j1:
+                    ops.append(new[prefix + j1:prefix + j2])
+        else:
+            ops.append(new[prefix:new_end])
+    if suffix:
+        ops.append((old_end, len(old)))
+    return ops
+
+
+def apply_line_delta(old: list[str], ops: list[DeltaOp]) -> list[str]:
+    """Rebuild the new lines from old and the operations of line_delta()."""
+    new: list[str] = []
+    for op in ops:
+        if isinstance(op, tuple):
+            new.extend(old[op[0]:op[1]])
+        else:
+            new.extend(op)
+    return new
+
+
+def _lines_cost(lines: list[str]) -> int:
+    return sum(len(line) for line in lines) + _LINE_COST * len(lines)
+
+
+def _delta_cost(ops: list[DeltaOp]) -> int:
+    return sum(_OP_COST if isinstance(op, tuple) else _lines_cost(op) for op in ops)
+
+
+@dataclass
+class _Snapshot:
+    """A stored snapshot: full lines (keyframe) or deltas against prev."""
+    session_id: str
+    prev: Optional[str]
+    keyframe: bool
+    input: list   # list[str] for keyframes, list[DeltaOp] otherwise
+    output: list
+    size: int
+
+
+class SnapshotStore:
+    """Session snapshots stored as line deltas within a byte budget.
+
+    The latest snapshot of each session is also kept as plain text (counted
+    in the budget) and is never evicted, so change checks and new deltas do
+    not rebuild anything.
+    """
+
+    def __init__(self, byte_budget: int = DEFAULT_BYTE_BUDGET,
+                 keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        """Create an empty store.
+
+        Args:
+            byte_budget: Approximate bytes the snapshots may use before the
+                oldest ones are evicted.
+            keyframe_interval: Store a full snapshot every this many
+                snapshots of a session.
+        """
+        if byte_budget <= 0:
+            raise ValueError(f"快照内存预算必须为正数: {byte_budget}")
+        if keyframe_interval < 1:
+            raise ValueError(f"关键帧间隔必须至少为 1: {keyframe_interval}")
+        self.byte_budget = byte_budget
+        self.keyframe_interval = keyframe_interval
+        self.evicted = 0
+        self._snapshots: OrderedDict[str, _Snapshot] = OrderedDict()  # oldest first
+        self._chains: dict[str, deque[str]] = {}  # session_id -> keys, oldest first
+        self._latest: dict[str, tuple[str, str]] = {}
+        self._since_keyframe: dict[str, int] = {}
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._snapshots
+
+    @property
+    def bytes_used(self) -> int:
+        """Approximate bytes held by the stored snapshots."""
+        return self._bytes
+
+    def add(self, key: str, session_id: str, input_text: str, output_text: str) -> list[str]:
+        """Store a snapshot as the newest of its session.
+
+        Returns:
+            Keys of the snapshots evicted to stay within the budget.
+        """
+        input_lines = input_text.split("\n")
+        output_lines = output_text.split("\n")
+        latest = self._latest.get(session_id)
+        chain = self._chains.setdefault(session_id, deque())
+        keyframe_cost = _lines_cost(input_lines) + _lines_cost(output_lines)
+
+        since = self._since_keyframe.get(session_id, 0) + 1
+        snapshot = None
+        if latest is not None and since < self.keyframe_interval:
+            input_ops = line_delta(latest[0].split("\n"), input_lines)
+            output_ops = line_delta(latest[1].split("\n"), output_lines)
+            delta_cost = _delta_cost(input_ops) + _delta_cost(output_ops)
+            if delta_cost < keyframe_cost:
+                snapshot = _Snapshot(session_id, chain[-1], False, input_ops, output_ops, delta_cost)
+        if snapshot is None:
+            since = 0
+            snapshot = _Snapshot(session_id, chain[-1] if chain else None, True,
+                                 input_lines, output_lines, keyframe_cost)
+
+        if latest is not None:
+            self._bytes -= len(latest[0]) + len(latest[1])
+        self._latest[session_id] = (input_text, output_text)
+        self._bytes += len(input_text) + len(output_text) + snapshot.size
+        self._since_keyframe[session_id] = since
+        self._snapshots[key] = snapshot
+        chain.append(key)
+        return self._evict()
+
+    def get(self, key: str) -> Optional[tuple[str, str]]:
+        """Rebuild (input, output) of a snapshot, or None if unknown or evicted."""
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            return None
+        chain = self._chains[snapshot.session_id]
+        if chain[-1] == key:
+            return self._latest[snapshot.session_id]
+        path = [snapshot]
+        while not path[-1].keyframe:
+            path.append(self._snapshots[path[-1].prev])
+        base = path.pop()
+        input_lines, output_lines = base.input, base.output
+        for delta in reversed(path):
+            input_lines = apply_line_delta(input_lines, delta.input)
+            output_lines = apply_line_delta(output_lines, delta.output)
+        return "\n".join(input_lines), "\n".join(output_lines)
+
+    def latest(self, session_id: str) -> Optional[tuple[str, str]]:
+        """(input, output) of the newest snapshot of a session, if any."""
+        return self._latest.get(session_id)
+
+    def previous(self, key: str) -> Optional[str]:
+        """Key of the stored snapshot before key in the same session."""
+        snapshot = self._snapshots.get(key)
+        return snapshot.prev if snapshot is not None else None
+
+    def _evict(self) -> list[str]:
+        """Drop the oldest snapshots (never a session's latest) until within budget."""
+        evicted = []
+        if self._bytes <= self.byte_budget:
+            return evicted
+        for key in list(self._snapshots):
+            if self._bytes <= self.byte_budget:
+                break
+            snapshot = self._snapshots[key]
+            chain = self._chains[snapshot.session_id]
+            if len(chain) == 1:
+                continue
+            # The oldest snapshot of a session is always a keyframe; the next
+            # one becomes the session's first and is turned into a keyframe
+            chain.popleft()
+            del self._snapshots[key]
+            self._bytes -= snapshot.size
+            following = self._snapshots[chain[0]]
+            following.prev = None
+            if not following.keyframe:
+                following.input = apply_line_delta(snapshot.input, following.input)
+                following.output = apply_line_delta(snapshot.output, following.output)
+                following.keyframe = True
+                self._bytes -= following.size
+                following.size = _lines_cost(following.input) + _lines_cost(following.output)
+                self._bytes += following.size
+            evicted.append(key)
+        self.evicted += len(evicted)
+        return evicted
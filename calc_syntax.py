@@ -6,17 +6,27 @@ Incremental syntax highlighting engine for CalcPaper expressions.
 
 Supports highlighting: comments, variables, numbers, operators, functions,
 datetime literals, global variables, errors, results, and bitmap displays.
+
+The 'output' pane mode classifies whole lines of the formatted output pane
+(results, errors, totals, bitmap details). Token spans are cached per line
+text, so re-highlighting unchanged lines does not tokenize them again.
+In lazy mode only the visible lines (plus a margin) are tagged; the rest
+are tagged by highlight_visible() as they scroll into view.
 """
 
 from __future__ import annotations
 
 import re
-from dataclasses import dataclass
-from typing import Optional
+from typing import Iterable, NamedTuple, Optional
+
+from calc_cache import LRUCache
+from calc_grammar import (
+    BUILTIN_FUNCTIONS, RESERVED_KEYWORD_RE,
+    HIGHLIGHT_FUNC_DEF_RE, HIGHLIGHT_ASSIGNMENT_RE, HIGHLIGHT_TOKEN_RE,
+)
 
 
-@dataclass
-class Token:
+class Token(NamedTuple):
     """A syntax token with type, text content, and position."""
     type: str
     text: str
@@ -58,27 +68,41 @@ LIGHT_THEME = {
     'bitmap': '#AF00DB',
 }
 
-# Regex patterns for tokenization
-_FUNCTION_NAMES = r'(?:hex|bitmap|comma|swap|workday|global)'
-_FUNCTION_PATTERN = re.compile(
-    r'\b(' + _FUNCTION_NAMES + r')\s*\(', re.IGNORECASE
-)
-# User-defined function definition pattern: name(params) = body
-_USER_FUNC_DEF_PATTERN = re.compile(
-    r'^(\s*)([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*\(\s*([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*(?:\s*,\s*[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)*)\s*\)\s*='
-)
-_NUMBER_PATTERN = re.compile(
-    r'0[xX][0-9a-fA-F]+|0[bB][01]+|\d+\.?\d*'
-)
-_DATETIME_PATTERN = re.compile(
-    r'(?<![a-zA-Z0-9_\u4e00-\u9fa5])([YT]\d+|[MWDhms]\d+)(?![a-zA-Z0-9_\u4e00-\u9fa5])'
-)
-_OPERATOR_PATTERN = re.compile(
-    r'<<|>>|[+\-*/%=&|^~]'
-)
-_IDENTIFIER_PATTERN = re.compile(
-    r'[a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*'
-)
+# Tags of the 'output' pane mode, one per formatted output line
+OUTPUT_PANE_TAGS = ['comment', 'result', 'error', 'total', 'endian', 'bit_info', 'hex_result']
+
+OUTPUT_PANE_DARK_THEME = {
+    'comment': '#6A9955',
+    'result': '#4EC9B0',
+    'error': '#F44747',
+    'total': '#569CD6',
+    'endian': '#C586C0',
+    'bit_info': '#9CDCFE',
+    'hex_result': '#CE9178',
+}
+
+OUTPUT_PANE_LIGHT_THEME = {
+    'comment': '#008000',
+    'result': '#098658',
+    'error': '#CD3131',
+    'total': '#0000FF',
+    'endian': '#AF00DB',
+    'bit_info': '#001080',
+    'hex_result': '#A31515',
+}
+
+# Default number of tokenized lines kept per highlighter
+DEFAULT_TOKEN_CACHE_SIZE = 16384
+
+# Lines tagged above and below the visible range in lazy mode
+VISIBLE_MARGIN = 100
+
+_BIT_INFO_KEYWORDS = ('十六进制:', '二进制:', '位数:', '位索引',
+                      'Hexadecimal:', 'Binary:', 'Bits:', 'Bit indices')
+
+# Output-line patterns (input-line patterns come from calc_grammar)
+_RESULT_EQ_PATTERN = re.compile(r'  =\s')
+_BIT_INDEX_LINE_PATTERN = re.compile(r'^\s*\d+(\s+\d+)+\s*$')
 
 
 class SyntaxHighlighter:
@@ -86,7 +110,9 @@ class SyntaxHighlighter:
 
     TOKEN_TYPES = TOKEN_TYPES
 
-    def __init__(self, text_widget=None, theme: str = 'dark', global_vars: set = None):
+    def __init__(self, text_widget=None, theme: str = 'dark', global_vars: set = None,
+                 pane: str = 'editor', cache_size: int = DEFAULT_TOKEN_CACHE_SIZE,
+                 lazy: bool = False):
         """Initialize the syntax highlighter.
 
         Args:
@@ -94,13 +120,33 @@ class SyntaxHighlighter:
                          Can be None for tokenize-only usage.
             theme: Color theme, either 'dark' or 'light'.
             global_vars: Set of variable names that are global.
+            pane: 'editor' for expression tokens, 'output' for whole-line
+                  tags of the formatted output pane.
+            cache_size: Number of tokenized lines to keep (0 disables the cache).
+            lazy: Tag only the visible lines plus VISIBLE_MARGIN; call
+                  highlight_visible() when the view scrolls.
         """
         self._widget = text_widget
         self._theme = theme
-        self._colors = DARK_THEME.copy() if theme == 'dark' else LIGHT_THEME.copy()
+        self._pane = pane
+        self._tags = OUTPUT_PANE_TAGS if pane == 'output' else TOKEN_TYPES
+        self._colors = self._theme_colors(theme)
         self._global_vars = global_vars if global_vars is not None else set()
+        self.cache = LRUCache(cache_size)
+        self._lazy = lazy
+        self._lines: list = []            # Widget lines (lazy mode)
+        self._tagged = bytearray()        # 1 if the line's tags are current (lazy mode)
         if self._widget is not None:
             self._configure_tags()
+            # VirtualTextWidget loads lines into its window on scroll, without tags
+            if lazy and hasattr(self._widget, 'bind_render'):
+                self._widget.bind_render(self._on_render)
+
+    def _theme_colors(self, theme: str) -> dict:
+        """Tag colors of the given theme for this pane."""
+        if self._pane == 'output':
+            return (OUTPUT_PANE_DARK_THEME if theme == 'dark' else OUTPUT_PANE_LIGHT_THEME).copy()
+        return DARK_THEME.copy() if theme == 'dark' else LIGHT_THEME.copy()
 
     def _configure_tags(self):
         """Configure text widget tags with current theme colors."""
@@ -116,10 +162,18 @@ class SyntaxHighlighter:
             theme: 'dark' or 'light'
         """
         self._theme = theme
-        self._colors = DARK_THEME.copy() if theme == 'dark' else LIGHT_THEME.copy()
+        self._colors = self._theme_colors(theme)
         if self._widget is not None:
             self._configure_tags()
 
+    def set_global_vars(self, global_vars: set) -> None:
+        """Replace the set of global variable names.
+
+        Cached tokens depend on it, so the token cache is cleared.
+        """
+        self._global_vars = set(global_vars)
+        self.cache.clear()
+
     def tokenize_line(self, line: str, is_output: bool = False) -> list:
         """Tokenize a single line into a list of Token objects.
 
@@ -136,45 +190,49 @@ class SyntaxHighlighter:
         if not line:
             return []
 
-        # Track which character positions have been assigned a token type
-        # We'll collect typed spans, then fill gaps with plain text tokens
-        spans = []  # list of (start, end, type)
-
-        if is_output:
-            spans = self._tokenize_output_line(line)
-        else:
-            spans = self._tokenize_input_line(line)
-
-        # Sort spans by start position
-        spans.sort(key=lambda s: s[0])
-
-        # Remove overlapping spans (first one wins)
-        filtered = []
-        last_end = 0
-        for start, end, ttype in spans:
-            if start < last_end:
-                continue
-            filtered.append((start, end, ttype))
-            last_end = end
-
         # Build token list, filling gaps with None-type tokens
+        make = Token._make
         tokens = []
         pos = 0
-        for start, end, ttype in filtered:
+        for start, end, ttype in self.line_spans(line, is_output):
             if pos < start:
                 # Gap - plain text (no specific type, use 'operator' as default for whitespace/parens)
-                gap_text = line[pos:start]
-                tokens.append(Token(type='operator', text=gap_text, start=pos, end=start))
-            tokens.append(Token(type=ttype, text=line[start:end], start=start, end=end))
+                tokens.append(make(('operator', line[pos:start], pos, start)))
+            tokens.append(make((ttype, line[start:end], start, end)))
             pos = end
         if pos < len(line):
-            gap_text = line[pos:]
-            tokens.append(Token(type='operator', text=gap_text, start=pos, end=len(line)))
+            tokens.append(make(('operator', line[pos:], pos, len(line))))
 
         return tokens
 
+    def line_spans(self, line: str, is_output: bool = False) -> tuple:
+        """Sorted, non-overlapping (start, end, type) spans of a line, cached by text.
+
+        In the 'output' pane mode is_output is ignored: each line gets at
+        most one span from _tokenize_pane_line().
+        """
+        key = line if self._pane == 'output' else (line, is_output)
+        spans = self.cache.get(key, None)
+        if spans is not None:
+            return spans
+
+        # Each tokenizer returns non-overlapping spans in line order
+        if self._pane == 'output':
+            spans = self._tokenize_pane_line(line)
+        elif is_output:
+            spans = self._tokenize_output_line(line)
+        else:
+            spans = self._tokenize_input_line(line)
+
+        spans = tuple(spans)
+        self.cache.put(key, spans)
+        return spans
+
     def _tokenize_input_line(self, line: str) -> list:
-        """Tokenize an input line (expression)."""
+        """Tokenize an input line (expression) in one left-to-right pass.
+
+        Returns non-overlapping (start, end, type) spans in line order.
+        """
         spans = []
 
         # Check for full-line comment
@@ -185,89 +243,40 @@ class SyntaxHighlighter:
             # Leading whitespace
             return spans
 
-        # Check for inline comment
+        # Check for inline comment: only tokenize the part before it
         comment_pos = self._find_comment_pos(line)
-        if comment_pos is not None:
-            spans.append((comment_pos, len(line), 'comment'))
-            # Only tokenize the part before the comment
-            active_line = line[:comment_pos]
-        else:
-            active_line = line
-
-        # Detect assignment target (variable on left side of =)
-        assignment_var = None
-        assignment_end = 0
+        active_line = line[:comment_pos] if comment_pos is not None else line
 
-        # Check for user-defined function definition: name(params) = body
-        func_def_match = _USER_FUNC_DEF_PATTERN.match(active_line)
+        # Function definition name or assignment target (variable on left side of =)
+        pos = 0
+        func_def_match = HIGHLIGHT_FUNC_DEF_RE.match(active_line)
         if func_def_match:
-            # Highlight function name
-            func_start = func_def_match.start(2)
-            func_end = func_def_match.end(2)
-            spans.append((func_start, func_end, 'function'))
-            assignment_end = func_end
+            spans.append((func_def_match.start(2), func_def_match.end(2), 'function'))
+            pos = func_def_match.end(2)
         else:
-            eq_match = re.match(
-                r'^(\s*)([a-zA-Z_\u4e00-\u9fa5][a-zA-Z0-9_\u4e00-\u9fa5]*)\s*=(?!=)',
-                active_line
-            )
+            eq_match = HIGHLIGHT_ASSIGNMENT_RE.match(active_line)
             if eq_match:
-                var_start = eq_match.start(2)
-                var_end = eq_match.end(2)
                 var_name = eq_match.group(2)
-                # Check if it's a global variable
-                if var_name in self._global_vars:
-                    spans.append((var_start, var_end, 'global_var'))
-                else:
-                    spans.append((var_start, var_end, 'variable'))
-                assignment_var = var_name
-                assignment_end = var_end
-
-        # Find functions
-        for m in _FUNCTION_PATTERN.finditer(active_line):
-            func_start = m.start(1)
-            func_end = m.end(1)
-            spans.append((func_start, func_end, 'function'))
-
-        # Find datetime literals
-        for m in _DATETIME_PATTERN.finditer(active_line):
-            spans.append((m.start(1), m.end(1), 'datetime'))
-
-        # Find numbers
-        for m in _NUMBER_PATTERN.finditer(active_line):
-            # Skip if inside a datetime literal or function name
-            start = m.start()
-            # Check if this number is part of a datetime literal
-            if self._is_inside_datetime(active_line, start, m.end()):
-                continue
-            spans.append((start, m.end(), 'number'))
-
-        # Find operators
-        for m in _OPERATOR_PATTERN.finditer(active_line):
-            spans.append((m.start(), m.end(), 'operator'))
-
-        # Find identifiers (variables referenced in expression, not the assignment target)
-        for m in _IDENTIFIER_PATTERN.finditer(active_line):
-            ident_start = m.start()
-            ident_end = m.end()
-            ident = m.group(0)
-
-            # Skip if it's the assignment target variable
-            if assignment_var and ident_start == eq_match.start(2):
-                continue
-
-            # Skip function names (already handled)
-            if ident.lower() in ('hex', 'bitmap', 'comma', 'swap', 'workday', 'global'):
-                continue
-
-            # Skip datetime literals
-            if re.match(r'^[YTMWDhms]\d+$', ident):
-                continue
-
-            # Check if it's a global variable
-            if ident in self._global_vars:
-                spans.append((ident_start, ident_end, 'global_var'))
+                ttype = 'global_var' if var_name in self._global_vars else 'variable'
+                spans.append((eq_match.start(2), eq_match.end(2), ttype))
+                pos = eq_match.end(2)
+
+        global_vars = self._global_vars
+        append = spans.append
+        for m in HIGHLIGHT_TOKEN_RE.finditer(active_line, pos):
+            ttype = m.lastgroup
+            if ttype == 'ident':
+                # Only global variables are highlighted among referenced names
+                ident = m.group()
+                if (ident not in global_vars or ident.lower() in BUILTIN_FUNCTIONS
+                        or RESERVED_KEYWORD_RE.match(ident)):
+                    continue
+                ttype = 'global_var'
+            start, end = m.span()
+            append((start, end, ttype))
 
+        if comment_pos is not None:
+            spans.append((comment_pos, len(line), 'comment'))
         return spans
 
     def _tokenize_output_line(self, line: str) -> list:
@@ -287,65 +296,64 @@ class SyntaxHighlighter:
         # Check for result lines
         # CalcPaper output format: "expression  = result" (double space before =)
         # Find the result = sign (preceded by two or more spaces)
-        result_eq = re.search(r'  =\s', line)
+        result_eq = _RESULT_EQ_PATTERN.search(line)
         if result_eq:
+            # Tokenize the expression part before the result
+            spans = self._tokenize_input_line(line[:result_eq.start()])
             result_start = result_eq.start() + 2  # position of the '='
             spans.append((result_start, len(line), 'result'))
-            # Tokenize the expression part before the result
-            expr_part = line[:result_eq.start()]
-            expr_spans = self._tokenize_input_line(expr_part)
-            spans.extend(expr_spans)
             return spans
 
         # Fallback: find any = sign
         eq_pos = line.find('=')
         if eq_pos >= 0:
-            result_start = eq_pos
-            spans.append((result_start, len(line), 'result'))
-            expr_part = line[:eq_pos]
-            expr_spans = self._tokenize_input_line(expr_part)
-            spans.extend(expr_spans)
+            spans = self._tokenize_input_line(line[:eq_pos])
+            spans.append((eq_pos, len(line), 'result'))
             return spans
 
         return spans
 
+    def _tokenize_pane_line(self, line: str) -> list:
+        """Tokenize a line of the output pane: one tag from its start column to the end."""
+        stripped = line.strip()
+        if stripped.startswith('#'):
+            return [(0, len(line), 'comment')]
+        if '错误:' in line or '变量未定义:' in line:
+            return [(0, len(line), 'error')]
+        if stripped.startswith('总计:'):
+            return [(0, len(line), 'total')]
+        if stripped.startswith('-'):
+            return [(0, len(line), 'comment')]
+        if 'endian:' in line.lower():
+            return [(0, len(line), 'endian')]
+        if any(kw in line for kw in _BIT_INFO_KEYWORDS):
+            return [(0, len(line), 'bit_info')]
+        eq_pos = line.find('=')
+        if eq_pos > 0:
+            return [(eq_pos, len(line), 'hex_result' if 'hex(' in line.lower() else 'result')]
+        return []
+
     def _is_bitmap_line(self, line: str) -> bool:
         """Check if a line is a bitmap display line."""
         # Bitmap lines typically contain box-drawing characters and bit values
         if '│' in line or '┌' in line or '└' in line or '├' in line:
             return True
         # Also check for bit index lines like "  7   6   5   4   3   2   1   0"
-        if re.match(r'^\s*\d+(\s+\d+)+\s*$', line):
+        if _BIT_INDEX_LINE_PATTERN.match(line):
             return True
         return False
 
     def _find_comment_pos(self, line: str) -> Optional[int]:
         """Find the position of an inline comment (# not inside a string)."""
-        # Simple approach: find # that's not part of a hex literal
-        for i, ch in enumerate(line):
-            if ch == '#':
-                # Check if it's part of a hex literal (unlikely in CalcPaper)
-                return i
-        return None
-
-    def _is_inside_datetime(self, line: str, num_start: int, num_end: int) -> bool:
-        """Check if a number match is part of a datetime literal."""
-        # Look backwards from num_start for a datetime prefix
-        if num_start > 0:
-            prefix_char = line[num_start - 1]
-            if prefix_char in 'YTMWDhms':
-                # Check that the prefix char is the start of a datetime literal
-                if num_start >= 2:
-                    before_prefix = line[num_start - 2]
-                    if not (before_prefix.isalnum() or before_prefix == '_'):
-                        return True
-                else:
-                    return True
-        return False
+        # Simple approach: the first # (CalcPaper has no string literals)
+        pos = line.find('#')
+        return pos if pos >= 0 else None
 
     def highlight_full(self, text: str) -> None:
         """Apply syntax highlighting to the entire text in the widget.
 
+        In lazy mode only the visible lines plus VISIBLE_MARGIN are tagged.
+
         Args:
             text: The full text content to highlight.
         """
@@ -353,56 +361,122 @@ class SyntaxHighlighter:
             return
 
         # Remove all existing tags
-        for tag in TOKEN_TYPES:
+        for tag in self._tags:
             self._widget.tag_remove(tag, '1.0', 'end')
 
         lines = text.split('\n')
+        if self._lazy:
+            self._lines = lines
+            self._tagged = bytearray(len(lines))
+            self.highlight_visible()
+            return
         for i, line in enumerate(lines):
-            line_num = i + 1  # Tkinter uses 1-based line numbers
-            # Determine if this is an output line (heuristic: check for result patterns)
-            is_output = self._is_output_line(line)
-            tokens = self.tokenize_line(line, is_output=is_output)
-            for token in tokens:
-                if token.type in TOKEN_TYPES and token.type != 'operator':
-                    start_idx = f"{line_num}.{token.start}"
-                    end_idx = f"{line_num}.{token.end}"
-                    self._widget.tag_add(token.type, start_idx, end_idx)
-
-    def highlight_lines(self, line_indices: list) -> None:
+            self._tag_line(i + 1, line)  # Tkinter uses 1-based line numbers
+
+    def highlight_lines(self, line_indices: Iterable[int], lines: Optional[list] = None) -> None:
         """Incrementally re-highlight specific lines.
 
         Only the specified lines are re-processed, making this efficient
-        for incremental updates after text changes.
+        for incremental updates after text changes; unchanged line texts
+        are not tokenized again.
 
         Args:
-            line_indices: List of 0-based line indices to re-highlight.
+            line_indices: 0-based line indices to re-highlight.
+            lines: Texts of those lines, in the same order, if already known
+                   (e.g. the lines of an output change); otherwise they are
+                   read from the widget.
         """
         if self._widget is None:
             return
 
-        for line_idx in line_indices:
+        line_indices = list(line_indices)
+        if lines is None:
+            lines = [None] * len(line_indices)
+        for line_idx, line_text in zip(line_indices, lines):
             line_num = line_idx + 1  # Convert to 1-based
             start = f"{line_num}.0"
             end = f"{line_num}.end"
 
             # Remove existing tags for this line
-            for tag in TOKEN_TYPES:
+            for tag in self._tags:
                 self._widget.tag_remove(tag, start, end)
 
             # Get the line content from the widget
-            try:
-                line_text = self._widget.get(start, end)
-            except Exception:
-                continue
-
-            # Tokenize and apply tags
-            is_output = self._is_output_line(line_text)
-            tokens = self.tokenize_line(line_text, is_output=is_output)
-            for token in tokens:
-                if token.type in TOKEN_TYPES and token.type != 'operator':
-                    start_idx = f"{line_num}.{token.start}"
-                    end_idx = f"{line_num}.{token.end}"
-                    self._widget.tag_add(token.type, start_idx, end_idx)
+            if line_text is None:
+                try:
+                    line_text = self._widget.get(start, end)
+                except Exception:
+                    continue
+            self._tag_line(line_num, line_text)
+            if self._lazy and line_idx < len(self._lines):
+                self._lines[line_idx] = line_text
+                self._tagged[line_idx] = 1
+
+    def replace_lines(self, start: int, delete_count: int, lines: list) -> None:
+        """Follow an edit that replaced delete_count lines at start with lines.
+
+        Outside lazy mode the new lines are tagged at once; in lazy mode
+        they are tagged when visible (see highlight_visible()).
+        """
+        if not self._lazy:
+            if lines:
+                self.highlight_lines(range(start, start + len(lines)), lines)
+            return
+        self._lines[start:start + delete_count] = lines
+        self._tagged[start:start + delete_count] = bytes(len(lines))
+
+    def highlight_visible(self, visible_range: Optional[tuple] = None) -> None:
+        """Tag the untagged lines of the visible range plus VISIBLE_MARGIN (lazy mode).
+
+        Args:
+            visible_range: (first, last) 0-based lines with last exclusive;
+                           by default the widget's get_visible_range().
+        """
+        if self._widget is None or not self._lazy or not self._lines:
+            return
+        first, last = visible_range if visible_range is not None else self._visible_range()
+        first = max(0, first - VISIBLE_MARGIN)
+        last = min(len(self._lines), last + VISIBLE_MARGIN)
+        i = self._tagged.find(0, first, last)
+        while i >= 0:
+            line_num = i + 1
+            for tag in self._tags:
+                self._widget.tag_remove(tag, f"{line_num}.0", f"{line_num}.end")
+            self._tag_line(line_num, self._lines[i])
+            self._tagged[i] = 1
+            i = self._tagged.find(0, i + 1, last)
+
+    def _visible_range(self) -> tuple:
+        """Visible (first, last) lines of the widget, last exclusive."""
+        if hasattr(self._widget, 'get_visible_range'):
+            return self._widget.get_visible_range()
+        # Plain Tk Text widget
+        try:
+            top = int(self._widget.index("@0,0").split('.')[0]) - 1
+            bottom = int(self._widget.index(f"@0,{self._widget.winfo_height()}").split('.')[0])
+            return top, bottom
+        except Exception:
+            return 0, 0
+
+    def _on_render(self, first: int, last: int) -> None:
+        """Lines [first, last) were (re)loaded by a VirtualTextWidget, without tags (lazy mode)."""
+        total = self._widget.total_lines
+        if len(self._lines) != total:
+            # Content was edited: resync all lines
+            self._lines = self._widget.get_content().split('\n')
+            self._tagged = bytearray(total)
+        else:
+            for i in range(first, last):
+                self._lines[i] = self._widget.get(f"{i + 1}.0", f"{i + 1}.end")
+            self._tagged[first:last] = bytes(last - first)
+        self.highlight_visible()
+
+    def _tag_line(self, line_num: int, line: str) -> None:
+        """Add the tags of one line (1-based line number)."""
+        is_output = self._pane == 'editor' and self._is_output_line(line)
+        for start, end, ttype in self.line_spans(line, is_output):
+            if ttype != 'operator':
+                self._widget.tag_add(ttype, f"{line_num}.{start}", f"{line_num}.{end}")
 
     def _is_output_line(self, line: str) -> bool:
         """Heuristic to determine if a line is an output line."""
@@ -0,0 +1,405 @@
+"""
+行级文本缓冲区 - PieceTable / TextBuffer / UndoStack
+
+为可编辑的 VirtualTextWidget 保存全文：
+- PieceTable: 行级 piece table，编辑只追加新行并拆分少量片段，不复制整个行列表
+- TextBuffer: 在 PieceTable 上提供 Tk Text 风格的 (line, col) 编辑与索引解析
+- UndoStack: 按编辑组记录 TextEdit，支持撤销/重做（与 Tk 的 autoseparators 行为一致）
+
+行号与列号均为 0-based；Tk 的 "1.0" 索引由调用方转换。
+"""
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+# 片段数超过此值时把文档压缩回单一原始缓冲区
+COMPACT_PIECES = 4096
+# 默认最多保留的撤销组数
+DEFAULT_UNDO_LIMIT = 1000
+
+
+class PieceTable:
+    """行级 piece table
+
+    The document is a list of pieces (buffer, first, count) pointing into two
+    append-only line buffers: the original lines and the lines added by
+    edits. Replacing k lines appends k new lines and splits at most two
+    pieces, so typing in a 200k-line document never copies the whole list.
+    Line starts of the pieces are rebuilt lazily for bisect lookups.
+    """
+
+    def __init__(self, lines: Optional[list[str]] = None):
+        original = list(lines) if lines is not None else []
+        self._buffers: tuple[list[str], list[str]] = (original, [])
+        self._pieces: list[tuple[int, int, int]] = [(0, 0, len(original))] if original else []
+        self._starts: Optional[list[int]] = None
+        self._length = len(original)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[str]:
+        for buf, first, count in self._pieces:
+            yield from self._buffers[buf][first:first + count]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return self.lines(0, self._length)[index]
+            return self.lines(start, stop)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("行号超出范围")
+        k = self._locate(index)
+        buf, first, _ = self._pieces[k]
+        return self._buffers[buf][first + index - self._starts[k]]
+
+    @property
+    def piece_count(self) -> int:
+        """当前片段数"""
+        return len(self._pieces)
+
+    def lines(self, start: int, end: int) -> list[str]:
+        """返回行 [start, end) 的列表"""
+        start = max(0, start)
+        end = min(end, self._length)
+        if start >= end:
+            return []
+        result = []
+        k = self._locate(start)
+        offset = start - self._starts[k]
+        while len(result) < end - start:
+            buf, first, count = self._pieces[k]
+            take = min(count - offset, end - start - len(result))
+            result.extend(self._buffers[buf][first + offset:first + offset + take])
+            k += 1
+            offset = 0
+        return result
+
+    def replace_lines(self, start: int, delete_count: int, new_lines: list[str]) -> list[str]:
+        """用 new_lines 替换行 [start, start + delete_count)，返回被删除的行"""
+        start = max(0, min(start, self._length))
+        end = min(self._length, start + max(0, delete_count))
+        i = self._split(start)
+        j = self._split(end)
+        removed = []
+        for buf, first, count in self._pieces[i:j]:
+            removed.extend(self._buffers[buf][first:first + count])
+
+        inserted = []
+        if new_lines:
+            added = self._buffers[1]
+            piece = (1, len(added), len(new_lines))
+            added.extend(new_lines)
+            # Typing extends the previous added piece instead of creating a new one
+            if i > 0 and self._pieces[i - 1][0] == 1 and sum(self._pieces[i - 1][1:]) == piece[1]:
+                i -= 1
+                piece = (1, self._pieces[i][1], self._pieces[i][2] + piece[2])
+            inserted = [piece]
+        self._pieces[i:j] = inserted
+        self._length += len(new_lines) - len(removed)
+        self._starts = None
+        if len(self._pieces) > COMPACT_PIECES or len(self._buffers[1]) > 2 * self._length + COMPACT_PIECES:
+            self.compact()
+        return removed
+
+    def compact(self) -> None:
+        """把当前内容合并为单一原始缓冲区（释放被替换的旧行）"""
+        self.__init__(list(self))
+
+    def _locate(self, index: int) -> int:
+        """包含第 index 行的片段下标"""
+        if self._starts is None:
+            starts = []
+            total = 0
+            for piece in self._pieces:
+                starts.append(total)
+                total += piece[2]
+            self._starts = starts
+        return bisect_right(self._starts, index) - 1
+
+    def _split(self, index: int) -> int:
+        """确保有片段从第 index 行开始，返回该片段下标（index == 长度时返回片段数）"""
+        if index >= self._length:
+            return len(self._pieces)
+        k = self._locate(index)
+        offset = index - self._starts[k]
+        if offset == 0:
+            return k
+        buf, first, count = self._pieces[k]
+        self._pieces[k:k + 1] = [(buf, first, offset), (buf, first + offset, count - offset)]
+        self._starts.insert(k + 1, self._starts[k] + offset)
+        return k + 1
+
+
+def text_end(start: tuple[int, int], text: str) -> tuple[int, int]:
+    """从 start 插入 text 后的结束位置"""
+    newlines = text.count('\n')
+    if not newlines:
+        return (start[0], start[1] + len(text))
+    return (start[0] + newlines, len(text) - text.rfind('\n') - 1)
+
+
+@dataclass(frozen=True)
+class TextEdit:
+    """一次文本替换：在 start 处把 removed 替换为 inserted"""
+    start: tuple[int, int]
+    removed: str
+    inserted: str
+
+    @property
+    def old_end(self) -> tuple[int, int]:
+        """被替换文本的结束位置（编辑前）"""
+        return text_end(self.start, self.removed)
+
+    @property
+    def new_end(self) -> tuple[int, int]:
+        """插入文本的结束位置（编辑后）"""
+        return text_end(self.start, self.inserted)
+
+    @property
+    def kind(self) -> str:
+        """'insert'、'delete' 或 'replace'"""
+        if not self.removed:
+            return 'insert'
+        return 'delete' if not self.inserted else 'replace'
+
+    def inverse(self) -> TextEdit:
+        """撤销本次编辑的编辑"""
+        return TextEdit(self.start, self.inserted, self.removed)
+
+
+class UndoStack:
+    """撤销/重做栈
+
+    Edits are grouped between separators; undo() and redo() return the
+    edits to apply for one group. With autoseparators, a separator is
+    inserted when the edit kind changes or the edit does not continue the
+    previous one, which matches how Tk groups typing and deletions.
+    """
+
+    def __init__(self, limit: int = DEFAULT_UNDO_LIMIT, enabled: bool = True):
+        self.limit = limit
+        self.enabled = enabled
+        self.autoseparators = True
+        self._undo: list[list[TextEdit]] = []
+        self._redo: list[list[TextEdit]] = []
+        self._open = False  # Whether the last undo group still accepts edits
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def reset(self) -> None:
+        """清空撤销与重做记录"""
+        self._undo.clear()
+        self._redo.clear()
+        self._open = False
+
+    def separator(self) -> None:
+        """结束当前编辑组"""
+        self._open = False
+
+    def push(self, edit: TextEdit) -> None:
+        """记录一次编辑（清空重做记录）"""
+        if not self.enabled:
+            return
+        self._redo.clear()
+        if self._open and self.autoseparators and not self._continues(self._undo[-1][-1], edit):
+            self._open = False
+        if self._open:
+            self._undo[-1].append(edit)
+        else:
+            self._undo.append([edit])
+            self._open = True
+            if len(self._undo) > self.limit:
+                del self._undo[0]
+
+    def undo(self) -> list[TextEdit]:
+        """弹出最近一组编辑，返回按顺序应用即可撤销它们的编辑列表"""
+        self._open = False
+        if not self._undo:
+            return []
+        group = self._undo.pop()
+        self._redo.append(group)
+        return [edit.inverse() for edit in reversed(group)]
+
+    def redo(self) -> list[TextEdit]:
+        """重新应用最近撤销的一组编辑"""
+        self._open = False
+        if not self._redo:
+            return []
+        group = self._redo.pop()
+        self._undo.append(group)
+        return list(group)
+
+    @staticmethod
+    def _continues(last: TextEdit, edit: TextEdit) -> bool:
+        if last.kind != edit.kind or edit.kind == 'replace':
+            return False
+        if edit.kind == 'insert':
+            return edit.start == last.new_end
+        # Backspace ends where the last deletion started; Delete stays in place
+        return edit.old_end == last.start or edit.start == last.start
+
+
+_INDEX_BASE_RE = re.compile(r'\s*(\d+)\.(\d+|end)|\s*([^\s+\-]+)')
+_INDEX_MODIFIER_RE = re.compile(
+    r'\s*(?:([+-])\s*(\d+)\s*(chars|char|c|lines|line|l)\b|(linestart|lineend))')
+
+
+class TextBuffer:
+    """可编辑的行文本
+
+    Stores the document in a PieceTable (always at least one line) and
+    applies Tk-style (line, col) replacements, recording each one on the
+    undo stack.
+    """
+
+    def __init__(self, lines: Optional[list[str]] = None, undo_limit: int = DEFAULT_UNDO_LIMIT):
+        self.lines = PieceTable(lines or [''])
+        self.undo_stack = UndoStack(undo_limit)
+
+    def set_lines(self, lines: list[str]) -> None:
+        """替换全部内容（不记录撤销）"""
+        self.lines = PieceTable(lines or [''])
+
+    def end(self) -> tuple[int, int]:
+        """最后一个字符之后的位置"""
+        last = len(self.lines) - 1
+        return (last, len(self.lines[last]))
+
+    def clamp(self, line: int, col: int) -> tuple[int, int]:
+        """把位置限制在文档范围内"""
+        if line < 0:
+            return (0, 0)
+        if line >= len(self.lines):
+            return self.end()
+        return (line, max(0, min(col, len(self.lines[line]))))
+
+    def get(self, start: tuple[int, int], end: tuple[int, int]) -> str:
+        """返回 [start, end) 之间的文本"""
+        start, end = self.clamp(*start), self.clamp(*end)
+        if end <= start:
+            return ''
+        if start[0] == end[0]:
+            return self.lines[start[0]][start[1]:end[1]]
+        lines = self.lines.lines(start[0], end[0] + 1)
+        lines[-1] = lines[-1][:end[1]]
+        lines[0] = lines[0][start[1]:]
+        return '\n'.join(lines)
+
+    def replace(self, start: tuple[int, int], end: tuple[int, int], text: str,
+                record: bool = True) -> TextEdit:
+        """把 [start, end) 替换为 text，返回对应的 TextEdit"""
+        start, end = self.clamp(*start), self.clamp(*end)
+        if end < start:
+            end = start
+        old = self.lines.lines(start[0], end[0] + 1)
+        new_lines = (old[0][:start[1]] + text + old[-1][end[1]:]).split('\n')
+        self.lines.replace_lines(start[0], len(old), new_lines)
+        joined = '\n'.join(old)
+        edit = TextEdit(start, joined[start[1]:len(joined) - len(old[-1]) + end[1]], text)
+        if record:
+            self.undo_stack.push(edit)
+        return edit
+
+    def apply(self, edit: TextEdit) -> TextEdit:
+        """应用 undo()/redo() 返回的编辑（不记录撤销）"""
+        return self.replace(edit.start, edit.old_end, edit.inserted, record=False)
+
+    def undo(self) -> list[TextEdit]:
+        """撤销一组编辑，返回实际应用的编辑"""
+        return [self.apply(edit) for edit in self.undo_stack.undo()]
+
+    def redo(self) -> list[TextEdit]:
+        """重做一组编辑，返回实际应用的编辑"""
+        return [self.apply(edit) for edit in self.undo_stack.redo()]
+
+    def index(self, expr: str, marks: Optional[dict[str, tuple[int, int]]] = None,
+              allow_end: bool = False) -> tuple[int, int]:
+        """解析 Tk Text 索引表达式，返回 0-based (line, col)
+
+        Supports "N.M", "N.end", "end", mark names from marks (e.g. insert),
+        followed by "+/- N chars|lines" and "linestart"/"lineend" modifiers.
+        "end" is the position after the final newline Tk keeps, so "end-1c"
+        is the end of the last line. With allow_end that position is
+        returned as (line count, 0) instead of being clamped to end().
+        """
+        m = _INDEX_BASE_RE.match(expr)
+        if not m:
+            raise ValueError(f"无效的文本索引: {expr!r}")
+        if m.group(1):
+            line = int(m.group(1)) - 1
+            if line >= len(self.lines):
+                line, col = len(self.lines), 0
+            elif line < 0:
+                line, col = 0, 0
+            else:
+                col = len(self.lines[line]) if m.group(2) == 'end' else int(m.group(2))
+        elif m.group(3) == 'end':
+            line, col = len(self.lines), 0
+        elif marks and m.group(3) in marks:
+            line, col = marks[m.group(3)]
+        else:
+            raise ValueError(f"无效的文本索引: {expr!r}")
+
+        pos = m.end()
+        while pos < len(expr):
+            mod = _INDEX_MODIFIER_RE.match(expr, pos)
+            if not mod:
+                if expr[pos:].strip():
+                    raise ValueError(f"无效的文本索引: {expr!r}")
+                break
+            pos = mod.end()
+            line, col = self.clamp_virtual(line, col)
+            if mod.group(4) == 'linestart':
+                col = 0
+            elif mod.group(4) == 'lineend':
+                col = self._line_length(line)
+            elif mod.group(3)[0] == 'l':
+                step = int(mod.group(2)) * (1 if mod.group(1) == '+' else -1)
+                line = max(0, min(line + step, len(self.lines) - 1))
+                col = min(col, len(self.lines[line]))
+            elif mod.group(1) == '+':
+                line, col = self._forward(line, col, int(mod.group(2)))
+            else:
+                line, col = self._backward(line, col, int(mod.group(2)))
+        return self.clamp_virtual(line, col) if allow_end else self.clamp(line, col)
+
+    def clamp_virtual(self, line: int, col: int) -> tuple[int, int]:
+        """同 clamp()，但保留 "end"（最后换行符之后）这一位置"""
+        if line >= len(self.lines):
+            return (len(self.lines), 0)
+        return self.clamp(line, col)
+
+    def _line_length(self, line: int) -> int:
+        return len(self.lines[line]) if line < len(self.lines) else 0
+
+    def _forward(self, line: int, col: int, count: int) -> tuple[int, int]:
+        while line < len(self.lines):
+            remaining = len(self.lines[line]) - col
+            if count <= remaining:
+                return (line, col + count)
+            count -= remaining + 1
+            line, col = line + 1, 0
+        return (len(self.lines), 0)
+
+    def _backward(self, line: int, col: int, count: int) -> tuple[int, int]:
+        while count > col:
+            if line == 0:
+                return (0, 0)
+            count -= col + 1
+            line -= 1
+            col = len(self.lines[line])
+        return (line, col - count)
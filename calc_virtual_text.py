@@ -2,23 +2,47 @@
 虚拟化文本渲染组件 - VirtualTextWidget
 
 仅渲染可视区域内容，支持超过 10000 行文本而不产生明显性能下降。
-提供与标准 Tkinter Text 组件兼容的接口。
+提供与标准 Tkinter Text 组件兼容的接口，输出显示与输入编辑均可使用。
 """
 
 from __future__ import annotations
 
+from contextlib import contextmanager
+
 import tkinter as tk
 import customtkinter as ctk
 
+from calc_text_buffer import TextBuffer, TextEdit
+
+# 直接转发给内部 Text 组件的配置项
+TEXT_KEYS = ['font', 'wrap', 'state', 'relief', 'padx', 'pady', 'bd', 'highlightthickness',
+             'bg', 'fg', 'background', 'foreground', 'insertbackground', 'selectbackground']
+
+
+def shift_position(pos: tuple[int, int], edit: TextEdit) -> tuple[int, int]:
+    """编辑后 pos 的新位置（与 Tk 的 insert 标记一样，位于编辑点时随插入右移）"""
+    old_end = edit.old_end
+    if pos < edit.start:
+        return pos
+    if pos < old_end:
+        return edit.start
+    new_end = edit.new_end
+    if pos[0] == old_end[0]:
+        return (new_end[0], new_end[1] + pos[1] - old_end[1])
+    return (pos[0] + new_end[0] - old_end[0], pos[1])
+
 
 class VirtualTextWidget(ctk.CTkFrame):
     """虚拟化渲染的文本组件，仅渲染可视区域内容。
 
     核心优化策略：
-    - 在内存中维护完整的行列表（self._lines）
-    - 内部 Text 组件仅加载可视窗口 + 缓冲区的行
-    - 滚动时动态更新 Text 组件内容
-    - 对外提供与 tk.Text 兼容的 insert/delete/get 接口
+    - 全文保存在 TextBuffer（行级 piece table）中，self._lines 为其行序列
+    - 内部 Text 组件仅加载可视窗口 + 缓冲区的行（标准模式下窗口即全文）
+    - 滚动时仅在窗口边缘增删行，跳转较远时才整体重新渲染
+    - 连续的滚轮事件按帧合并为一次渲染
+    - 内部 Text 的 Tcl 命令被代理：键盘输入、粘贴、剪切等编辑先换算为全文位置
+      写入缓冲区，撤销/重做与修改标志由缓冲区的 UndoStack 维护
+    - 对外提供与 tk.Text 兼容的 insert/delete/get/index/edit_* 接口
 
     适用于输出显示（只读模式）和大文件编辑场景。
     小文件（< VIRTUAL_THRESHOLD 行）直接使用标准模式。
@@ -30,6 +54,8 @@ class VirtualTextWidget(ctk.CTkFrame):
     BUFFER_LINES = 20
     # 默认可视行数估算
     DEFAULT_VISIBLE_LINES = 50
+    # 合并滚动事件的帧间隔（毫秒）
+    FRAME_MS = 16
 
     def __init__(self, parent, **kwargs):
         """初始化虚拟文本组件。
@@ -44,37 +70,67 @@ class VirtualTextWidget(ctk.CTkFrame):
                 - padx, pady: 内边距
                 - bd: 边框宽度
                 - highlightthickness: 高亮边框厚度
+                - bg, fg, insertbackground, selectbackground: 颜色
                 - undo: 是否启用撤销
+                - autoseparators: 是否自动分隔撤销组
         """
         # Extract text widget kwargs
         text_kwargs = {}
-        text_keys = ['font', 'wrap', 'state', 'relief', 'padx', 'pady',
-                     'bd', 'highlightthickness', 'undo']
-        for key in text_keys:
+        for key in TEXT_KEYS:
             if key in kwargs:
                 text_kwargs[key] = kwargs.pop(key)
+        undo = kwargs.pop('undo', False)
+        autoseparators = kwargs.pop('autoseparators', True)
 
         # Initialize CTkFrame
         super().__init__(parent, **kwargs)
 
         # Internal state
-        self._lines: list[str] = ['']  # All content lines (always at least one empty line)
+        self._buffer = TextBuffer()  # All content lines (always at least one line)
+        self._buffer.undo_stack.enabled = bool(undo)
+        self._buffer.undo_stack.autoseparators = bool(autoseparators)
+        self._modified = False
         self._virtual_mode = False  # Whether virtualization is active
+        self._mode_check_scheduled = False
         self._scroll_offset = 0  # First visible line index (0-based)
         self._visible_lines_count = self.DEFAULT_VISIBLE_LINES
-        self._cursor_line = 0  # Virtual cursor line (0-based)
-        self._cursor_col = 0  # Virtual cursor column (0-based)
         self._font = text_kwargs.get('font', ('Consolas', 12))
         self._state = text_kwargs.get('state', tk.NORMAL)
+        # Cursor position while its line is scrolled out of the loaded window
+        self._parked_cursor = None
+        # <<SelectAll>> selects the whole document, not only the loaded window
+        self._select_all = False
+
+        # Track if we need to update visible area: wheel/scrollbar events
+        # only set _scroll_target, one render per frame applies it
+        self._render_scheduled = False
+        self._scroll_target = 0
+
+        # Lines loaded into the internal Text widget: [_window_start, _window_start + _window_lines)
+        self._window_start = 0
+        self._window_lines = 1
+        # Called with (first, last) after lines are (re)loaded into the window
+        self._render_callbacks = []
+        # Called with the TextEdit after every change to the content
+        self._edit_callbacks = []
 
         # Layout
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(0, weight=1)
 
-        # Internal Text widget - renders only visible portion in virtual mode
-        self._text = tk.Text(self, **text_kwargs)
+        # Internal Text widget - renders only visible portion in virtual mode.
+        # Its own undo stack is off: edits are recorded on self._buffer
+        self._text = tk.Text(self, undo=False, **text_kwargs)
         self._text.grid(row=0, column=0, sticky="nsew")
 
+        # Route the inner widget's Tcl command through _proxy, so Tk's own
+        # bindings (typing, paste, cut, undo) edit the full-document buffer
+        self._orig_cmd = self._text._w + '_orig'
+        self.tk.call('rename', self._text._w, self._orig_cmd)
+        self.tk.createcommand(self._text._w, self._proxy)
+        # Keep Tk's modified flag set so it never fires <<Modified>> itself
+        self._call('edit', 'modified', 1)
+
         # Scrollbar
         self._scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL)
         self._scrollbar.grid(row=0, column=1, sticky="ns")
@@ -88,34 +144,42 @@ class VirtualTextWidget(ctk.CTkFrame):
         self._text.bind('<Button-4>', self._on_mousewheel_linux)
         self._text.bind('<Button-5>', self._on_mousewheel_linux)
 
+        # Document-wide selection and cursor jumps
+        self._text.bind('<<SelectAll>>', self._on_select_all)
+        self._text.bind('<Control-Home>', lambda event: self._on_document_edge(False))
+        self._text.bind('<Control-End>', lambda event: self._on_document_edge(True))
+
         # Bind resize to recalculate visible lines
         self._text.bind('<Configure>', self._on_configure)
 
-        # Track if we need to update visible area
-        self._render_scheduled = False
-
     # ========== Public API: Content Management ==========
 
+    @property
+    def _lines(self):
+        """全部内容行（TextBuffer 的 PieceTable，支持 len/下标/切片/迭代）"""
+        return self._buffer.lines
+
     def set_content(self, lines: list[str]) -> None:
         """设置全部内容（不立即全量渲染，仅在虚拟模式下渲染可视区域）。
 
+        撤销记录被清空，光标移到文首。
+
         Args:
             lines: 文本行列表，每行不含换行符
         """
-        if not lines:
-            lines = ['']
-        self._lines = list(lines)
+        self._buffer.set_lines(list(lines))
+        self._buffer.undo_stack.reset()
 
         # Decide whether to use virtual mode
         self._virtual_mode = len(self._lines) > self.VIRTUAL_THRESHOLD
 
-        # Reset scroll position
+        # Reset scroll position (dropping a scroll still waiting for its frame)
         self._scroll_offset = 0
-        self._cursor_line = 0
-        self._cursor_col = 0
+        self._render_scheduled = False
+        self._select_all = False
 
         # Render
-        self.render_visible()
+        self._render((0, 0))
 
     def get_content(self) -> str:
         """获取全部文本内容。
@@ -123,9 +187,6 @@ class VirtualTextWidget(ctk.CTkFrame):
         Returns:
             完整文本内容，行之间以换行符连接
         """
-        if not self._virtual_mode:
-            # In standard mode, read directly from text widget
-            return self._text.get("1.0", "end-1c")
         return '\n'.join(self._lines)
 
     def get_visible_range(self) -> tuple[int, int]:
@@ -163,50 +224,39 @@ class VirtualTextWidget(ctk.CTkFrame):
             self._text.see(f"{tk_line}.0")
             return
 
-        # Clamp to valid range
-        max_offset = max(0, len(self._lines) - self._visible_lines_count)
-        self._scroll_offset = max(0, min(line_index, max_offset))
-        self.render_visible()
+        self._scroll_to(line_index)
 
     def render_visible(self) -> None:
-        """渲染可视区域内容。
+        """渲染可视区域内容（保持光标位置）。
 
         在虚拟模式下，仅将可视窗口 + 缓冲区的行加载到 Text 组件中。
         在标准模式下，加载全部内容。
         """
-        # Save current state and temporarily enable editing
-        was_disabled = self._state == tk.DISABLED
-        if was_disabled:
-            self._text.configure(state=tk.NORMAL)
+        self._render(self._cursor_position())
 
-        self._text.delete("1.0", tk.END)
+    def bind_render(self, callback) -> None:
+        """注册渲染回调：行被（重新）加载到窗口后调用，这些行的标签已被清除。
 
-        if not self._virtual_mode:
-            # Standard mode: load all content
-            content = '\n'.join(self._lines)
-            if content:
-                self._text.insert("1.0", content)
-        else:
-            # Virtual mode: load only visible + buffer
-            start = max(0, self._scroll_offset - self.BUFFER_LINES)
-            end = min(len(self._lines),
-                      self._scroll_offset + self._visible_lines_count + self.BUFFER_LINES)
-
-            visible_content = '\n'.join(self._lines[start:end])
-            if visible_content:
-                self._text.insert("1.0", visible_content)
+        Args:
+            callback: callback(first, last)，参数为新加载的全文行范围 [first, last)
+                      （如 SyntaxHighlighter 的重新着色）
+        """
+        self._render_callbacks.append(callback)
 
-            # Scroll internal text to show the correct portion
-            if self._scroll_offset > start:
-                offset_in_widget = self._scroll_offset - start
-                self._text.yview_moveto(0)
-                self._text.see(f"{offset_in_widget + 1}.0")
+    def bind_edit(self, callback) -> None:
+        """注册编辑回调：每次内容变化（键盘输入、粘贴、撤销、接口调用）后调用。
 
-            # Update scrollbar position
-            self._update_scrollbar()
+        Args:
+            callback: callback(edit)，edit 为全文坐标的 TextEdit
+                      （如 LineChangeTracker 的行变化记录）
+        """
+        self._edit_callbacks.append(callback)
 
-        if was_disabled:
-            self._text.configure(state=tk.DISABLED)
+    def _notify_render(self, first: int, last: int) -> None:
+        """通知渲染回调：行 [first, last) 已加载到窗口。"""
+        if first < last:
+            for callback in self._render_callbacks:
+                callback(first, last)
 
     # ========== Public API: Tkinter Text Compatible Interface ==========
 
@@ -217,55 +267,9 @@ class VirtualTextWidget(ctk.CTkFrame):
             index: Tkinter Text 索引格式 (如 "1.0", "end", "insert")
             text: 要插入的文本
         """
-        if not self._virtual_mode:
-            # Standard mode: delegate directly
-            was_disabled = self._state == tk.DISABLED
-            if was_disabled:
-                self._text.configure(state=tk.NORMAL)
-            self._text.insert(index, text)
-            if was_disabled:
-                self._text.configure(state=tk.DISABLED)
-            # Sync internal lines from widget
-            self._sync_lines_from_widget()
-            return
-
-        # Virtual mode: update internal buffer
-        line_idx, col_idx = self._parse_index(index)
-
-        # Split the text to insert into lines
-        new_lines = text.split('\n')
-
-        if len(new_lines) == 1:
-            # Single line insert
-            if line_idx < len(self._lines):
-                line = self._lines[line_idx]
-                self._lines[line_idx] = line[:col_idx] + new_lines[0] + line[col_idx:]
-            else:
-                self._lines.append(new_lines[0])
-        else:
-            # Multi-line insert
-            if line_idx < len(self._lines):
-                current_line = self._lines[line_idx]
-                before = current_line[:col_idx]
-                after = current_line[col_idx:]
-
-                # First fragment
-                first_line = before + new_lines[0]
-                # Last fragment
-                last_line = new_lines[-1] + after
-                # Middle lines
-                middle_lines = new_lines[1:-1]
-
-                # Replace current line with split result
-                self._lines[line_idx:line_idx + 1] = [first_line] + middle_lines + [last_line]
-            else:
-                self._lines.extend(new_lines)
-
-        # Check if we should switch to virtual mode
-        if len(self._lines) > self.VIRTUAL_THRESHOLD and not self._virtual_mode:
-            self._virtual_mode = True
-
-        self.render_visible()
+        if text:
+            pos = self._parse_index(index)
+            self._replace(pos, pos, text)
 
     def delete(self, start: str, end: str = None) -> None:
         """兼容 Tkinter Text 的删除接口。
@@ -274,60 +278,13 @@ class VirtualTextWidget(ctk.CTkFrame):
             start: 起始索引
             end: 结束索引（如果为 None，删除单个字符）
         """
-        if not self._virtual_mode:
-            # Standard mode: delegate directly
-            was_disabled = self._state == tk.DISABLED
-            if was_disabled:
-                self._text.configure(state=tk.NORMAL)
-            if end is None:
-                self._text.delete(start)
-            else:
-                self._text.delete(start, end)
-            if was_disabled:
-                self._text.configure(state=tk.DISABLED)
-            self._sync_lines_from_widget()
-            return
-
-        # Virtual mode: update internal buffer
-        start_line, start_col = self._parse_index(start)
-
+        start_pos = self._parse_index(start)
         if end is None:
-            # Delete single character
-            if start_line < len(self._lines):
-                line = self._lines[start_line]
-                if start_col < len(line):
-                    self._lines[start_line] = line[:start_col] + line[start_col + 1:]
-                elif start_line + 1 < len(self._lines):
-                    # Join with next line
-                    self._lines[start_line] = line + self._lines[start_line + 1]
-                    del self._lines[start_line + 1]
+            end_pos = self._buffer.index(f"{start_pos[0] + 1}.{start_pos[1]} + 1c")
         else:
-            end_line, end_col = self._parse_index(end)
-
-            if start_line == end_line:
-                # Same line deletion
-                if start_line < len(self._lines):
-                    line = self._lines[start_line]
-                    self._lines[start_line] = line[:start_col] + line[end_col:]
-            else:
-                # Multi-line deletion
-                if start_line < len(self._lines):
-                    before = self._lines[start_line][:start_col]
-                    after = ''
-                    if end_line < len(self._lines):
-                        after = self._lines[end_line][end_col:]
-
-                    self._lines[start_line:end_line + 1] = [before + after]
-
-        # Ensure at least one line
-        if not self._lines:
-            self._lines = ['']
-
-        # Check if we can switch back to standard mode
-        if len(self._lines) <= self.VIRTUAL_THRESHOLD and self._virtual_mode:
-            self._virtual_mode = False
-
-        self.render_visible()
+            end_pos = self._parse_index(end)
+        if start_pos < end_pos:
+            self._replace(start_pos, end_pos, '')
 
     def get(self, start: str, end: str = None) -> str:
         """兼容 Tkinter Text 的获取接口。
@@ -337,89 +294,86 @@ class VirtualTextWidget(ctk.CTkFrame):
             end: 结束索引
 
         Returns:
-            指定范围内的文本
+            指定范围内的文本（结束索引为 "end" 时与 Tk 一样带末尾换行符）
         """
-        if not self._virtual_mode:
-            # Standard mode: delegate directly
-            if end is None:
-                return self._text.get(start)
-            return self._text.get(start, end)
-
-        # Virtual mode: read from internal buffer
-        start_line, start_col = self._parse_index(start)
-
+        start_pos = self._parse_index(start)
         if end is None:
-            # Get single character
-            if start_line < len(self._lines):
-                line = self._lines[start_line]
-                if start_col < len(line):
-                    return line[start_col]
-                elif start_line + 1 < len(self._lines):
-                    return '\n'
+            end_pos = self._buffer.index(f"{start_pos[0] + 1}.{start_pos[1]} + 1c", allow_end=True)
+        else:
+            end_pos = self._parse_index(end, allow_end=True)
+        if end_pos <= start_pos:
             return ''
+        text = self._buffer.get(start_pos, end_pos)
+        if end_pos[0] == len(self._lines):
+            text += '\n'
+        return text
 
-        end_line, end_col = self._parse_index(end)
+    # ========== Public API: Undo and Modified Flag ==========
 
-        if start_line == end_line:
-            # Same line
-            if start_line < len(self._lines):
-                return self._lines[start_line][start_col:end_col]
-            return ''
+    def edit_modified(self, flag: bool = None):
+        """获取或设置修改标志（变化时生成 <<Modified>> 事件）。"""
+        if flag is None:
+            return self._modified
+        self._set_modified(bool(flag))
 
-        # Multi-line
-        result_parts = []
-        for i in range(start_line, min(end_line + 1, len(self._lines))):
-            if i == start_line:
-                result_parts.append(self._lines[i][start_col:])
-            elif i == end_line:
-                result_parts.append(self._lines[i][:end_col])
-            else:
-                result_parts.append(self._lines[i])
+    def edit_undo(self) -> bool:
+        """撤销最近一组编辑，没有可撤销的编辑时返回 False。"""
+        return self._apply_edits(self._buffer.undo_stack.undo())
 
-        return '\n'.join(result_parts)
+    def edit_redo(self) -> bool:
+        """重做最近撤销的一组编辑，没有可重做的编辑时返回 False。"""
+        return self._apply_edits(self._buffer.undo_stack.redo())
+
+    def edit_separator(self) -> None:
+        """结束当前撤销组。"""
+        self._buffer.undo_stack.separator()
+
+    def edit_reset(self) -> None:
+        """清空撤销与重做记录。"""
+        self._buffer.undo_stack.reset()
 
     # ========== Public API: Cursor and Selection ==========
 
     def get_cursor_position(self) -> tuple[int, int]:
-        """获取虚拟光标位置。
+        """获取光标位置（全文坐标）。
 
         Returns:
             (line, col) 元组，均为 0-based
         """
-        if not self._virtual_mode:
-            try:
-                pos = self._text.index(tk.INSERT)
-                parts = pos.split('.')
-                return (int(parts[0]) - 1, int(parts[1]))
-            except tk.TclError:
-                return (self._cursor_line, self._cursor_col)
-        return (self._cursor_line, self._cursor_col)
+        return self._cursor_position()
 
     def set_cursor_position(self, line: int, col: int) -> None:
-        """设置虚拟光标位置。
+        """设置光标位置，必要时滚动使其可见。
 
         Args:
             line: 行号（0-based）
             col: 列号（0-based）
         """
-        # Clamp values
-        line = max(0, min(line, len(self._lines) - 1))
-        col = max(0, min(col, len(self._lines[line]) if line < len(self._lines) else 0))
-
-        self._cursor_line = line
-        self._cursor_col = col
-
-        if not self._virtual_mode:
-            try:
-                tk_line = line + 1
-                self._text.mark_set(tk.INSERT, f"{tk_line}.{col}")
-            except tk.TclError:
-                pass
-        else:
+        pos = self._buffer.clamp(line, col)
+        if self._virtual_mode:
             # Ensure cursor is visible
             start, end = self.get_visible_range()
-            if line < start or line >= end:
-                self.scroll_to_line(max(0, line - self._visible_lines_count // 2))
+            if pos[0] < start or pos[0] >= end:
+                self.scroll_to_line(max(0, pos[0] - self._visible_lines_count // 2))
+        self._place_cursor(pos)
+
+    def get_selection(self):
+        """获取选区（全文坐标）。
+
+        Returns:
+            ((line, col), (line, col)) 起止位置，没有选区时返回 None
+        """
+        if self._select_all:
+            return ((0, 0), self._buffer.end())
+        ranges = self.tk.splitlist(self._call('tag', 'ranges', 'sel'))
+        if not ranges:
+            return None
+        return (self._inner_position(str(ranges[0])), self._inner_position(str(ranges[-1])))
+
+    def select_all(self) -> None:
+        """选中全文（包括未加载到窗口的行）。"""
+        self._select_all = True
+        self._call('tag', 'add', 'sel', '1.0', 'end')
 
     # ========== Public API: Configuration ==========
 
@@ -427,17 +381,18 @@ class VirtualTextWidget(ctk.CTkFrame):
         """配置组件属性，支持字体变更等。
 
         Args:
-            **kwargs: 配置参数，支持 font, state, wrap 等
+            **kwargs: 配置参数，支持 font, state, wrap, undo, 颜色等
         """
-        text_keys = ['font', 'wrap', 'state', 'relief', 'padx', 'pady',
-                     'bd', 'highlightthickness']
-
         text_kwargs = {}
         frame_kwargs = {}
 
         for key, value in kwargs.items():
-            if key in text_keys:
+            if key in TEXT_KEYS:
                 text_kwargs[key] = value
+            elif key == 'undo':
+                self._buffer.undo_stack.enabled = bool(value)
+            elif key == 'autoseparators':
+                self._buffer.undo_stack.autoseparators = bool(value)
             else:
                 frame_kwargs[key] = value
 
@@ -461,6 +416,8 @@ class VirtualTextWidget(ctk.CTkFrame):
             return self._font
         if key == 'state':
             return self._state
+        if key == 'undo':
+            return self._buffer.undo_stack.enabled
         try:
             return self._text.cget(key)
         except tk.TclError:
@@ -469,19 +426,27 @@ class VirtualTextWidget(ctk.CTkFrame):
     # ========== Public API: Additional Text Widget Compatibility ==========
 
     def index(self, index: str) -> str:
-        """将索引转换为规范化的 'line.col' 格式。"""
-        if not self._virtual_mode:
-            return self._text.index(index)
-
+        """将索引转换为规范化的 'line.col' 格式（全文行号）。"""
         line, col = self._parse_index(index)
         return f"{line + 1}.{col}"
 
     def see(self, index: str) -> None:
         """确保指定索引可见。"""
-        line, _ = self._parse_index(index)
-        start, end = self.get_visible_range()
-        if line < start or line >= end:
-            self.scroll_to_line(max(0, line - self._visible_lines_count // 2))
+        line, col = self._parse_index(index)
+        if self._virtual_mode:
+            start, end = self.get_visible_range()
+            if line < start or line >= end:
+                self.scroll_to_line(max(0, line - self._visible_lines_count // 2))
+        rel = self._window_index(f"{line + 1}.{col}")
+        if rel is not None:
+            self._call('see', rel)
+
+    def bbox(self, index: str):
+        """返回索引处字符的 (x, y, width, height)，不在已加载窗口内时返回 None。"""
+        rel = self._window_index(index)
+        if rel is None:
+            return None
+        return self._text.bbox(rel)
 
     def mark_set(self, mark_name: str, index: str) -> None:
         """设置标记位置。"""
@@ -492,20 +457,27 @@ class VirtualTextWidget(ctk.CTkFrame):
             self._text.mark_set(mark_name, index)
 
     def tag_add(self, tag_name: str, start: str, end: str = None) -> None:
-        """添加标签（用于语法高亮等）。"""
-        if not self._virtual_mode:
-            if end is None:
-                self._text.tag_add(tag_name, start)
-            else:
-                self._text.tag_add(tag_name, start, end)
+        """添加标签（用于语法高亮等）。
+
+        索引按全文行号解释，仅对已加载窗口内的行生效。
+        """
+        start = self._window_index(start)
+        if start is None:
+            return
+        if end is None:
+            self._text.tag_add(tag_name, start)
+        else:
+            self._text.tag_add(tag_name, start, self._window_index(end, clamp=True))
 
     def tag_remove(self, tag_name: str, start: str, end: str = None) -> None:
-        """移除标签。"""
-        if not self._virtual_mode:
-            if end is None:
+        """移除标签（范围裁剪到已加载窗口）。"""
+        if end is None:
+            start = self._window_index(start)
+            if start is not None:
                 self._text.tag_remove(tag_name, start)
-            else:
-                self._text.tag_remove(tag_name, start, end)
+        else:
+            self._text.tag_remove(tag_name, self._window_index(start, clamp=True),
+                                  self._window_index(end, clamp=True))
 
     def tag_configure(self, tag_name: str, **kwargs) -> None:
         """配置标签样式。"""
@@ -517,22 +489,9 @@ class VirtualTextWidget(ctk.CTkFrame):
             self._text.yview(*args)
         else:
             if args:
-                if args[0] == 'moveto':
-                    fraction = float(args[1])
-                    total = len(self._lines)
-                    self._scroll_offset = int(fraction * total)
-                    self._scroll_offset = max(0, min(self._scroll_offset,
-                                                     total - self._visible_lines_count))
-                    self.render_visible()
-                elif args[0] == 'scroll':
-                    amount = int(args[1])
-                    unit = args[2] if len(args) > 2 else 'units'
-                    if unit == 'pages':
-                        amount *= self._visible_lines_count
-                    self._scroll_offset += amount
-                    self._scroll_offset = max(0, min(self._scroll_offset,
-                                                     len(self._lines) - self._visible_lines_count))
-                    self.render_visible()
+                target = self._yview_target(*args)
+                if target is not None:
+                    self._scroll_to(target)
 
     def xview(self, *args) -> None:
         """X 轴视图控制（委托给内部 Text）。"""
@@ -561,86 +520,410 @@ class VirtualTextWidget(ctk.CTkFrame):
 
     # ========== Internal Methods ==========
 
-    def _parse_index(self, index: str) -> tuple[int, int]:
-        """解析 Tkinter Text 索引为 (line, col) 元组（0-based）。
+    def _call(self, *args):
+        """直接调用内部 Text 的原始 Tcl 命令（绕过 _proxy）。"""
+        return self.tk.call((self._orig_cmd,) + args)
+
+    @contextmanager
+    def _writable(self):
+        """临时允许修改内部 Text（只读状态下渲染内容）。"""
+        was_disabled = self._state == tk.DISABLED
+        if was_disabled:
+            self._call('configure', '-state', tk.NORMAL)
+        try:
+            yield
+        finally:
+            if was_disabled:
+                self._call('configure', '-state', tk.DISABLED)
+
+    def _parse_index(self, index: str, allow_end: bool = False) -> tuple[int, int]:
+        """解析 Tkinter Text 索引为全文 (line, col) 元组（0-based）。
 
         支持的格式：
-        - "line.col" (如 "1.0")
+        - "line.col" (如 "1.0")、"line.end"
         - "end" / "end-1c"
-        - "insert"
-        - "line.end"
+        - "insert"、"sel.first"、"sel.last"
+        - "@x,y"（按内部 Text 的显示位置）
+        - 以上后接 "+/- N chars|lines"、"linestart"、"lineend"
 
         Args:
             index: Tkinter Text 索引字符串
+            allow_end: 为 True 时 "end" 返回 (总行数, 0)（最后换行符之后）
 
         Returns:
             (line, col) 元组，均为 0-based
         """
-        if index == "end" or index == tk.END:
-            return (len(self._lines) - 1, len(self._lines[-1]) if self._lines else 0)
-
-        if index == "end-1c":
-            if self._lines:
-                last_line = len(self._lines) - 1
-                last_col = len(self._lines[last_line])
-                if last_col > 0:
-                    return (last_line, last_col - 1)
-                elif last_line > 0:
-                    return (last_line - 1, len(self._lines[last_line - 1]))
+        index = str(index)
+        if index.startswith('@'):
+            return self._inner_position(index)
+        marks = {'insert': self._cursor_position()}
+        if 'sel.' in index:
+            selection = self.get_selection()
+            if selection is None:
+                raise tk.TclError('text doesn\'t contain any characters tagged with "sel"')
+            marks['sel.first'], marks['sel.last'] = selection
+        try:
+            return self._buffer.index(index, marks, allow_end=allow_end)
+        except ValueError as e:
+            raise tk.TclError(str(e)) from e
+
+    def _window_index(self, index: str, clamp: bool = False):
+        """将全文索引转换为内部 Text 组件（已加载窗口）的索引。
+
+        Args:
+            index: 全文的 Tkinter Text 索引
+            clamp: 为 True 时窗口外的索引裁剪到窗口首尾，否则返回 None
+        """
+        line, col = self._parse_index(index)
+        line -= self._window_start
+        if line < 0:
+            return "1.0" if clamp else None
+        if line >= self._window_lines:
+            return "end" if clamp else None
+        return f"{line + 1}.{col}"
+
+    def _inner_position(self, index: str) -> tuple[int, int]:
+        """内部 Text 的索引对应的全文位置（"end" 视为窗口最后一个字符之后）。"""
+        if self._call('compare', index, '>=', 'end'):
+            index = 'end-1c'
+        line, col = str(self._call('index', index)).split('.')
+        return self._buffer.clamp(self._window_start + int(line) - 1, int(col))
+
+    def _cursor_position(self) -> tuple[int, int]:
+        """光标的全文位置。"""
+        if self._parked_cursor is not None:
+            return self._parked_cursor
+        try:
+            return self._inner_position(tk.INSERT)
+        except tk.TclError:
             return (0, 0)
 
-        if index == "insert" or index == tk.INSERT:
-            return (self._cursor_line, self._cursor_col)
+    def _place_cursor(self, pos: tuple[int, int]) -> None:
+        """把光标放到全文位置 pos；所在行未加载时先记下，加载后再放回。"""
+        pos = self._buffer.clamp(*pos)
+        line = pos[0] - self._window_start
+        if 0 <= line < self._window_lines:
+            self._call('mark', 'set', tk.INSERT, f"{line + 1}.{pos[1]}")
+            self._parked_cursor = None
+        else:
+            self._parked_cursor = pos
 
-        # Handle "line.col" format
-        if '.' in index:
-            parts = index.split('.')
-            try:
-                line = int(parts[0]) - 1  # Convert from 1-based to 0-based
-                line = max(0, min(line, len(self._lines) - 1))
-
-                col_str = parts[1]
-                if col_str == "end":
-                    col = len(self._lines[line]) if line < len(self._lines) else 0
-                else:
-                    col = int(col_str)
-                    if line < len(self._lines):
-                        col = max(0, min(col, len(self._lines[line])))
-                    else:
-                        col = 0
-
-                return (line, col)
-            except (ValueError, IndexError):
-                return (0, 0)
-
-        return (0, 0)
-
-    def _sync_lines_from_widget(self) -> None:
-        """从内部 Text 组件同步内容到 _lines 缓冲区（标准模式使用）。"""
-        content = self._text.get("1.0", "end-1c")
-        self._lines = content.split('\n') if content else ['']
+    def _replace(self, start: tuple[int, int], end: tuple[int, int], text: str,
+                 record: bool = True) -> TextEdit:
+        """把全文 [start, end) 替换为 text，同步到内部 Text 并通知编辑回调。
+
+        编辑位于已加载窗口内时直接修改内部 Text（Tk 的标记与选区随之移动），
+        否则（窗口外，或插入大量行）更新缓冲区后围绕光标重新渲染。
+        """
+        start, end = self._buffer.clamp(*start), self._buffer.clamp(*end)
+        window_end = self._window_start + self._window_lines
+        in_window = (self._window_start <= start[0] and end[0] < window_end
+                     and text.count('\n') <= self.VIRTUAL_THRESHOLD)
+        cursor = None if in_window else self._cursor_position()
+        edit = self._buffer.replace(start, end, text, record)
+
+        if in_window:
+            rel = f"{start[0] - self._window_start + 1}.{start[1]}"
+            with self._writable():
+                if edit.removed:
+                    self._call('delete', rel, f"{end[0] - self._window_start + 1}.{end[1]}")
+                if text:
+                    self._call('insert', rel, text)
+            self._window_lines += edit.new_end[0] - edit.old_end[0]
+            if self._parked_cursor is not None:
+                self._parked_cursor = shift_position(self._parked_cursor, edit)
+            self._notify_render(start[0], edit.new_end[0] + 1)
+            self._schedule_mode_check()
+        else:
+            self._virtual_mode = len(self._lines) > self.VIRTUAL_THRESHOLD
+            cursor = shift_position(cursor, edit)
+            if self._virtual_mode:
+                start_line, end_line = self.get_visible_range()
+                if not start_line <= cursor[0] < end_line:
+                    self._scroll_offset = cursor[0] - self._visible_lines_count // 2
+                self._scroll_offset = self._clamp_offset(self._scroll_offset)
+            self._render(cursor)
+
+        self._set_modified(True)
+        for callback in self._edit_callbacks:
+            callback(edit)
+        return edit
+
+    def _apply_edits(self, edits: list[TextEdit]) -> bool:
+        """应用撤销/重做返回的编辑，光标放在最后一处编辑之后。"""
+        if not edits:
+            return False
+        for edit in edits:
+            applied = self._replace(edit.start, edit.old_end, edit.inserted, record=False)
+        self.set_cursor_position(*applied.new_end)
+        self.see(tk.INSERT)
+        return True
+
+    def _set_modified(self, flag: bool) -> None:
+        """设置修改标志，变化时与 Tk 一样生成 <<Modified>> 事件。
+
+        事件与 Tk 一样排入事件队列：先解绑、替换内容、再绑定的调用方
+        在重新绑定后仍会收到该事件并清除修改标志。
+        """
+        if flag != self._modified:
+            self._modified = flag
+            self._text.event_generate('<<Modified>>', when='tail')
+
+    def _proxy(self, *args):
+        """内部 Text 的 Tcl 命令代理。
+
+        Tk 绑定发出的 insert/delete/replace 换算为全文位置后经 _replace 应用；
+        edit 子命令使用本组件的撤销栈与修改标志；其余命令原样转发。
+        Tcl 错误不能抛回 Tk 的事件循环，出错时返回空字符串（同 Tk 绑定中的 catch）。
+        """
+        try:
+            op = args[0] if args else ''
+            if op in ('insert', 'delete', 'replace'):
+                if self._state != tk.DISABLED:
+                    self._proxy_edit(op, args[1:])
+                return ''
+            if op == 'edit':
+                return self._proxy_edit_command(args[1:])
+            if op == 'tag' and args[1:2] in (('add',), ('remove',)) and args[2:3] == ('sel',):
+                self._select_all = False
+            elif op == 'get' and self._select_all and args[1:] == ('sel.first', 'sel.last'):
+                return self.get_content()
+            elif op == 'mark' and args[1:3] == ('set', tk.INSERT):
+                self._parked_cursor = None
+            return self._call(*args)
+        except tk.TclError:
+            return ''
+
+    def _proxy_edit(self, op: str, args: tuple) -> None:
+        """把内部 Text 上的 insert/delete/replace 换算为全文编辑。"""
+        if self._select_all and op == 'delete' and args[:2] == ('sel.first', 'sel.last'):
+            self._select_all = False
+            self._replace((0, 0), self._buffer.end(), '')
+            return
+        if self._parked_cursor is not None:
+            # Typing with the cursor scrolled away: bring it back first
+            self.set_cursor_position(*self._parked_cursor)
+        start = self._inner_position(args[0])
+        if op == 'insert':
+            end, text = start, ''.join(args[1::2])
+        elif op == 'delete' and len(args) < 2:
+            end, text = self._inner_position(f"{args[0]}+1c"), ''
+        else:
+            end = self._inner_position(args[1])
+            text = ''.join(args[2::2]) if op == 'replace' else ''
+        if end < start:
+            end = start
+        if start < end or text:
+            self._replace(start, end, text)
+
+    def _proxy_edit_command(self, args: tuple):
+        """处理 edit modified/undo/redo/separator/reset/canundo/canredo。"""
+        sub = args[0] if args else ''
+        stack = self._buffer.undo_stack
+        if sub == 'modified':
+            if len(args) > 1:
+                self._set_modified(self.tk.getboolean(args[1]))
+                return ''
+            return int(self._modified)
+        if sub == 'undo':
+            self.edit_undo()
+        elif sub == 'redo':
+            self.edit_redo()
+        elif sub == 'separator':
+            stack.separator()
+        elif sub == 'reset':
+            stack.reset()
+        elif sub == 'canundo':
+            return int(stack.can_undo)
+        elif sub == 'canredo':
+            return int(stack.can_redo)
+        return ''
+
+    def _on_select_all(self, event=None):
+        """<<SelectAll>>：选中全文。"""
+        self.select_all()
+        return "break"
+
+    def _on_document_edge(self, end: bool):
+        """Ctrl+Home / Ctrl+End：虚拟模式下跳到全文首尾而不是窗口首尾。"""
+        if not self._virtual_mode:
+            return None
+        self._call('tag', 'remove', 'sel', '1.0', 'end')
+        self._select_all = False
+        self.set_cursor_position(*(self._buffer.end() if end else (0, 0)))
+        self._call('see', tk.INSERT)
+        return "break"
+
+    def _schedule_mode_check(self) -> None:
+        """行数跨过 VIRTUAL_THRESHOLD 时，在空闲时切换模式（不打断当前的 Tk 绑定）。"""
+        if self._mode_check_scheduled:
+            return
+        if self._virtual_mode != (len(self._lines) > self.VIRTUAL_THRESHOLD):
+            self._mode_check_scheduled = True
+            self.after_idle(self._check_mode)
+
+    def _check_mode(self) -> None:
+        """按当前行数切换标准/虚拟模式，保持首行与光标。"""
+        self._mode_check_scheduled = False
+        virtual = len(self._lines) > self.VIRTUAL_THRESHOLD
+        if virtual == self._virtual_mode:
+            return
+        try:
+            top = self._inner_position("@0,0")[0]
+        except tk.TclError:
+            top = self._scroll_offset
+        self._virtual_mode = virtual
+        self._scroll_offset = self._clamp_offset(top)
+        self.render_visible()
+        if not virtual:
+            self._call('yview', f"{top + 1}.0")
+
+    def _render(self, cursor: tuple[int, int]) -> None:
+        """重新加载窗口内容并把光标放到 cursor。"""
+        self._render_scheduled = False
+        with self._writable():
+            self._call('delete', "1.0", tk.END)
+
+            if not self._virtual_mode:
+                # Standard mode: load all content
+                content = '\n'.join(self._lines)
+                if content:
+                    self._call('insert', "1.0", content)
+                self._window_start, self._window_lines = 0, len(self._lines)
+            else:
+                # Virtual mode: load only visible + buffer
+                start = max(0, self._scroll_offset - self.BUFFER_LINES)
+                end = min(len(self._lines),
+                          self._scroll_offset + self._visible_lines_count + self.BUFFER_LINES)
+
+                visible_content = '\n'.join(self._lines[start:end])
+                if visible_content:
+                    self._call('insert', "1.0", visible_content)
+                self._window_start, self._window_lines = start, end - start
+
+        self._place_cursor(cursor)
+        if self._virtual_mode:
+            # Scroll internal text to show the correct portion
+            self._call('yview', f"{self._scroll_offset - self._window_start + 1}.0")
+
+            # Update scrollbar position
+            self._update_scrollbar()
+
+        self._notify_render(self._window_start, self._window_start + self._window_lines)
+
+    def _yview_target(self, *args):
+        """yview('moveto', f) / yview('scroll', n, unit) 对应的目标首行，无法识别时返回 None。"""
+        if args[0] == 'moveto':
+            return int(float(args[1]) * len(self._lines))
+        if args[0] == 'scroll':
+            amount = int(args[1])
+            unit = args[2] if len(args) > 2 else 'units'
+            if unit == 'pages':
+                amount *= self._visible_lines_count
+            return self._pending_offset() + amount
+        return None
 
     def _on_scrollbar(self, *args) -> None:
-        """处理滚动条事件。"""
+        """处理滚动条事件（虚拟模式下按帧合并）。"""
         if not self._virtual_mode:
             self._text.yview(*args)
         else:
-            self.yview(*args)
+            target = self._yview_target(*args)
+            if target is not None:
+                self._request_scroll(target)
+
+    def _clamp_offset(self, offset: int) -> int:
+        """将首行限制在 [0, 总行数 - 可视行数] 内。"""
+        max_offset = max(0, len(self._lines) - self._visible_lines_count)
+        return max(0, min(offset, max_offset))
+
+    def _pending_offset(self) -> int:
+        """尚未渲染的滚动目标（没有时为当前首行）。"""
+        return self._scroll_target if self._render_scheduled else self._scroll_offset
+
+    def _request_scroll(self, offset: int) -> None:
+        """记录滚动目标，在下一帧统一渲染（合并连续的滚轮/滚动条事件）。"""
+        self._scroll_target = self._clamp_offset(offset)
+        if not self._render_scheduled:
+            self._render_scheduled = True
+            self.after(self.FRAME_MS, self._flush_scroll)
+
+    def _flush_scroll(self) -> None:
+        """应用本帧合并后的滚动目标。"""
+        if not self._render_scheduled:
+            return
+        self._render_scheduled = False
+        if self._virtual_mode:
+            self._scroll_to(self._scroll_target)
+
+    def _scroll_to(self, offset: int) -> None:
+        """滚动到首行 offset：窗口与新位置重叠时只在边缘增删行，否则整体重新渲染。
+
+        有选区时窗口只扩展不裁剪，拖动选择或 Shift+方向键选中的行不会丢失。
+        """
+        self._render_scheduled = False
+        offset = self._clamp_offset(offset)
+        start = max(0, offset - self.BUFFER_LINES)
+        end = min(len(self._lines), offset + self._visible_lines_count + self.BUFFER_LINES)
+        old_start = self._window_start
+        old_end = old_start + self._window_lines
+        cursor = self._cursor_position()
+        self._scroll_offset = offset
+        if start >= old_end or end <= old_start or old_end > len(self._lines):
+            self._render(cursor)
+            return
+        if self._call('tag', 'nextrange', 'sel', '1.0'):
+            start, end = min(start, old_start), max(end, old_end)
+        if (start, end) == (old_start, old_end):
+            self._call('yview', f"{offset - start + 1}.0")
+            self._update_scrollbar()
+            return
+
+        with self._writable():
+            # Top edge: drop lines scrolled past, or load the lines above
+            if start > old_start:
+                self._call('delete', "1.0", f"{start - old_start + 1}.0")
+            elif start < old_start:
+                self._call('insert', "1.0", '\n'.join(self._lines[start:old_start]) + '\n')
+            # Bottom edge (the window now begins at start)
+            if end < old_end:
+                self._call('delete', f"{end - start}.end", "end-1c")
+            elif end > old_end:
+                self._call('insert', "end-1c", '\n' + '\n'.join(self._lines[old_end:end]))
+
+        self._window_start, self._window_lines = start, end - start
+        self._place_cursor(cursor)
+        self._call('yview', f"{offset - start + 1}.0")
+        self._update_scrollbar()
+        self._notify_render(start, old_start)
+        self._notify_render(old_end, end)
 
     def _on_text_scroll(self, first, last) -> None:
-        """处理 Text 组件滚动事件（更新滚动条位置）。"""
+        """处理 Text 组件滚动事件（更新滚动条位置）。
+
+        虚拟模式下，光标移动或拖动选择使内部 Text 滚到窗口边缘附近时，
+        同步首行并在边缘加载更多行。
+        """
         if not self._virtual_mode:
             self._scrollbar.set(first, last)
-        else:
-            # In virtual mode, calculate scrollbar position from offset
-            self._update_scrollbar()
+            return
+        if not self._render_scheduled:
+            try:
+                top = self._inner_position("@0,0")[0]
+            except tk.TclError:
+                top = self._scroll_offset
+            self._scroll_offset = top
+            window_end = self._window_start + self._window_lines
+            margin = self.BUFFER_LINES // 2
+            if ((self._window_start > 0 and top - self._window_start < margin)
+                    or (window_end < len(self._lines)
+                        and window_end - top - self._visible_lines_count < margin)):
+                self._request_scroll(top)
+        # In virtual mode, calculate scrollbar position from offset
+        self._update_scrollbar()
 
     def _update_scrollbar(self) -> None:
         """更新滚动条位置以反映虚拟滚动状态。"""
-        if not self._lines:
-            self._scrollbar.set(0, 1)
-            return
-
         total = len(self._lines)
         if total <= self._visible_lines_count:
             self._scrollbar.set(0, 1)
@@ -659,10 +942,7 @@ class VirtualTextWidget(ctk.CTkFrame):
         delta = -1 * (event.delta // 120)
         scroll_amount = delta * 3  # Scroll 3 lines per wheel notch
 
-        self._scroll_offset += scroll_amount
-        self._scroll_offset = max(0, min(self._scroll_offset,
-                                         max(0, len(self._lines) - self._visible_lines_count)))
-        self.render_visible()
+        self._request_scroll(self._pending_offset() + scroll_amount)
         return "break"
 
     def _on_mousewheel_linux(self, event) -> None:
@@ -675,10 +955,7 @@ class VirtualTextWidget(ctk.CTkFrame):
         else:
             delta = 3
 
-        self._scroll_offset += delta
-        self._scroll_offset = max(0, min(self._scroll_offset,
-                                         max(0, len(self._lines) - self._visible_lines_count)))
-        self.render_visible()
+        self._request_scroll(self._pending_offset() + delta)
         return "break"
 
     def _on_configure(self, event) -> None:
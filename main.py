@@ -8,6 +8,7 @@ Usage:
     CalcPaper              # Launch GUI (default)
     CalcPaper --cli        # Launch CLI
     CalcPaper --cli -l zh  # Launch Chinese CLI
+    CalcPaper --cli -j 4   # Launch CLI, large sheets on 4 worker processes
     CalcPaper --version    # Show version
 """
 
@@ -23,10 +24,14 @@ if sys.version_info < (3, 7):
     sys.exit(1)
 
 import argparse
+import multiprocessing
 from version import VERSION
 
 
 def main():
+    # Process-pool workers re-enter this script in frozen builds
+    multiprocessing.freeze_support()
+
     parser = argparse.ArgumentParser(
         description='CalcPaper - Smart Calculator for Programmers / 计算稿纸',
         formatter_class=argparse.RawDescriptionHelpFormatter
@@ -35,6 +40,8 @@ def main():
                         help='Launch CLI mode / 启动命令行模式')
     parser.add_argument('--lang', '-l', choices=['zh', 'en'], default=None,
                         help='Language / 语言 (zh: 中文, en: English)')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='CLI worker processes for large sheets / 命令行模式下大型计算表的并行进程数')
     parser.add_argument('--version', '-v', action='version',
                         version=f'CalcPaper v{VERSION}')
 
@@ -46,6 +53,8 @@ def main():
         sys.argv = ['calc_paper']
         if args.lang:
             sys.argv.extend(['--lang', args.lang])
+        if args.jobs is not None:
+            sys.argv.extend(['--jobs', str(args.jobs)])
         cli_main()
     else:
         # GUI mode (default)
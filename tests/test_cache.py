@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_cache (line result cache reused across recalculations).
+
+Validates:
+- Unchanged lines with unchanged inputs are served from the cache
+- Cached assignments still define their variables
+- A changed input value, language or user function bypasses stale entries
+- LRU eviction bounds the table
+- Keys pair values with variable names independently of the hash seed
+"""
+
+import sys
+import os
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_cache import LineResultCache, LRUCache
+from calc_paper import CalculatorPaperAdvanced
+from calc_incremental import IncrementalCalcEngine
+from calc_session import GlobalVariableStore
+
+
+SHEET = 'price = 12.5\nqty = 4\ntotal = price * qty\nhex(0xF0 | 1)\nnote = total + missing'
+
+
+class TestLineResultCache:
+    """Tests for CalculatorPaperAdvanced.result_cache."""
+
+    def setup_method(self):
+        self.calc = CalculatorPaperAdvanced()
+
+    def test_recalculation_hits(self):
+        self.calc.process_text(SHEET)
+        first = self.calc.format_output()
+        assert (self.calc.result_cache.hits, self.calc.result_cache.misses) == (0, 5)
+        self.calc.process_text(SHEET)
+        assert self.calc.result_cache.hits == 5
+        assert self.calc.format_output() == first
+        assert self.calc.variables['total'] == 50
+
+    def test_changed_input_misses(self):
+        self.calc.process_text(SHEET)
+        self.calc.process_text(SHEET.replace('qty = 4', 'qty = 5'))
+        assert self.calc.variables['total'] == 62.5
+        # price and hex() lines are reused; qty, total and note are recomputed
+        assert self.calc.result_cache.hits == 2
+
+    def test_inline_comment_shares_entry(self):
+        self.calc.process_text('a = 1 + 2')
+        self.calc.process_text('a = 1 + 2  # three')
+        assert self.calc.result_cache.hits == 1
+
+    def test_language_is_part_of_key(self):
+        self.calc.process_text('f(x, x) = x')
+        self.calc.process_text('r = 1 / 0')
+        self.calc.set_language('en')
+        self.calc.process_text('r = 1 / 0')
+        assert self.calc.result_cache.hits == 0
+
+    def test_function_lines_are_not_cached(self):
+        self.calc.process_text('f(x) = x + 1\nr = f(1)')
+        self.calc.process_text('f(x) = x + 2\nr = f(1)')
+        assert self.calc.variables['r'] == 3
+        assert self.calc.result_cache.hits == 0
+
+    def test_incremental_engine_uses_cache(self):
+        engine = IncrementalCalcEngine(self.calc, GlobalVariableStore())
+        engine.process_full('a = 1\nb = a * 2')
+        engine.process_incremental('a = 1\nb = a * 2', 'a = 2\nb = a * 2', [0])
+        engine.process_incremental('a = 2\nb = a * 2', 'a = 1\nb = a * 2', [0])
+        assert self.calc.variables['b'] == 2
+        assert self.calc.result_cache.hits == 2
+
+    def test_key_does_not_depend_on_hash_seed(self):
+        code = ('from calc_paper import CalculatorPaperAdvanced, compile_line\n'
+                'calc = CalculatorPaperAdvanced()\n'
+                'calc.variables.update(a=1, b=2.5, c=3)\n'
+                'print(repr(calc._result_key(compile_line("r = a * b - c + d"))))')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        keys = {subprocess.run([sys.executable, '-c', code], cwd=root, check=True,
+                               capture_output=True, text=True,
+                               env=dict(os.environ, PYTHONHASHSEED=str(seed))).stdout
+                for seed in range(4)}
+        assert len(keys) == 1
+
+
+class TestLRUCache:
+    """Tests for the shared LRU table."""
+
+    def test_eviction_order(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        assert cache.get('b', None) is None
+        assert len(cache) == 2
+
+    def test_line_cache_is_bounded(self):
+        calc = CalculatorPaperAdvanced()
+        calc.result_cache = LineResultCache(maxsize=3)
+        calc.process_text('\n'.join(f'v{i} = {i}' for i in range(10)))
+        assert len(calc.result_cache) == 3
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_functions (compiled user functions and the call result LRU).
+
+Validates:
+- compile_function() compiles a definition once and reports its free names
+- Cached compile_function() results are immutable
+- FunctionCallCache LRU eviction, hit/miss counters and resizing
+- Call-by-value evaluation matches the expanded expression display
+- Lines are ordered by the global variables their function calls read
+- Memoized results are reused and invalidated on redefinition or when a
+  global variable read by the function changes value or type
+"""
+
+import dataclasses
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from calc_functions import FunctionCallCache, compile_function, split_call
+from calc_paper import CalculatorPaperAdvanced
+
+
+class TestCompileFunction:
+    """Tests for compile_function()."""
+
+    def test_program_and_names(self):
+        func = compile_function('h', ('x',), 'x * k + g(x)')
+        assert func.error is None
+        assert func.names == ('k', 'g')
+        assert func.call_names == frozenset(['g'])
+        assert func.program({'x': 2, 'k': 3}.__getitem__, lambda name, args: 1) == 7
+
+    def test_cached_by_definition(self):
+        assert compile_function('f', ('x',), 'x + 1') is compile_function('f', ('x',), 'x + 1')
+        assert compile_function('f', ('x',), 'x + 1') is not compile_function('f', ('x',), 'x + 2')
+
+    def test_cached_functions_are_immutable(self):
+        func = compile_function('f', ('x',), 'x + k')
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            func.error = 'changed'
+        assert func.display == (('(', 'x'), (') + ', 'k'), ('', None))
+
+    def test_parameter_implicit_multiplication(self):
+        func = compile_function('f', ('x',), 'x(2)')
+        assert func.program({'x': 5}.__getitem__, None) == 10
+
+    def test_parse_error_is_kept(self):
+        assert compile_function('f', ('x',), 'x +').error == "表达式语法错误"
+
+    def test_bitwise_flag(self):
+        assert compile_function('m', ('x',), 'x & 0xF').has_bitwise is True
+        assert compile_function('m', ('x',), 'x * 2').has_bitwise is False
+
+
+class TestFunctionCallCache:
+    """Tests for the call result LRU."""
+
+    def test_lru_eviction(self):
+        cache = FunctionCallCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert cache.get('b', None) is None
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_disabled_and_resize(self):
+        cache = FunctionCallCache(maxsize=0)
+        cache.put('a', 1)
+        assert len(cache) == 0
+        cache.resize(3)
+        for key in 'abc':
+            cache.put(key, key)
+        cache.resize(1)
+        assert len(cache) == 1 and cache.get('c') == 'c'
+
+    def test_split_call(self):
+        assert split_call('f(1, g(2, 3)) + 1', 1) == (['1', 'g(2, 3)'], 13)
+        assert split_call('f()', 1) == ([], 3)
+        assert split_call('f(1', 1) == ([], -1)
+
+
+class TestUserFunctionCalls:
+    """Tests for call-by-value evaluation in CalculatorPaperAdvanced."""
+
+    def setup_method(self):
+        self.calc = CalculatorPaperAdvanced()
+
+    def test_expanded_display(self):
+        self.calc.process_text('f(x, y) = 3x + 5*y\ng(n) = f(n, n) * 2\nb = 11\nd = g(b) + f(1,2)')
+        result, _, expr, _, _, _ = self.calc.results[3]
+        assert result == 189
+        assert expr == '((3*((11)) + 5*((11))) * 2) + (3*(1) + 5*(2))'
+
+    def test_arguments_are_values(self):
+        self.calc.process_text('sq(x) = x**2\na = -3\nr = sq(a)')
+        assert self.calc.variables['r'] == 9
+
+    def test_repeated_calls_are_memoized(self):
+        lines = ['f(x) = x * x + 1'] + [f'v{i} = f({i % 5})' for i in range(50)]
+        self.calc.process_text('\n'.join(lines))
+        assert self.calc.variables['v7'] == 5
+        calls = [key for key in self.calc.function_cache._entries if key[0] == 'f']
+        assert len(calls) == 5
+        assert self.calc.function_cache.hits >= 45
+
+    def test_redefinition_invalidates(self):
+        self.calc.process_text('f(x) = x + 1\nr = f(1)')
+        assert self.calc.variables['r'] == 2
+        self.calc.process_text('f(x) = x + 10\nr = f(1)')
+        assert self.calc.variables['r'] == 11
+
+    def test_callee_redefinition_invalidates_caller(self):
+        self.calc.process_text('g(x) = x + 1\nf(x) = g(x) * 2\nr = f(1)')
+        assert self.calc.variables['r'] == 4
+        self.calc.process_text('g(x) = x + 2\nf(x) = g(x) * 2\nr = f(1)')
+        assert self.calc.variables['r'] == 6
+
+    def test_global_variable_change_is_not_stale(self):
+        self.calc.process_text('h(x) = x * k\nk = 3\nr = h(2)')
+        assert self.calc.variables['r'] == 6
+        self.calc.process_text('h(x) = x * k\nk = 4\nr = h(2)')
+        assert self.calc.variables['r'] == 8
+
+    def test_global_variable_type_is_part_of_the_key(self):
+        # Equal values of different types (2 == 2.0) get separate memo entries
+        self.calc.process_text('h(x) = x * k\nk = 2\nr = h(3)')
+        for value in (2, 2.0):
+            self.calc.variables['k'] = value
+            assert self.calc._call_user_function('h', [3], 0) == 6
+        calls = [key for key in self.calc.function_cache._entries if key[0] == 'h']
+        assert len(calls) == 2
+
+    def test_free_variable_defined_later(self):
+        # Lines are ordered by the globals their calls read, like forward references
+        self.calc.process_text('f(n) = n + c\ne = f(b)\nb = 1\nc = d * 2\nd = 1')
+        assert self.calc.variables['e'] == 3
+
+    def test_free_variable_self_reference_is_circular(self):
+        self.calc.process_text('f(n) = n + a\na = f(1)')
+        assert self.calc.results[1][2] == "错误: 循环依赖"
+
+    def test_undefined_free_variable(self):
+        self.calc.process_text('h(x) = x * k\nr = h(2)')
+        assert self.calc.results[1][2] == "变量未定义: k"
+
+    def test_recursion_is_rejected(self):
+        self.calc.process_text('f(n) = f(n)\nr = f(1)')
+        assert self.calc.results[1][0] is None
+        assert "20" in self.calc.results[1][2]
+
+
+class TestCallBudget:
+    """Tests for the per-line call depth and step budget."""
+
+    def setup_method(self):
+        self.calc = CalculatorPaperAdvanced()
+
+    def test_many_calls_on_one_line(self):
+        calls = ' + '.join(f'f({i})' for i in range(60))
+        self.calc.process_text(f'f(x) = x + 1\nr = {calls}')
+        assert self.calc.variables['r'] == sum(range(1, 61))
+        assert self.calc._call_steps == 60
+
+    def test_nested_calls_are_linear(self):
+        # Each level doubles the expanded text but costs one call
+        nested = 'd(' * 18 + '1' + ')' * 18
+        self.calc.process_text(f'd(x) = x + x\nr = {nested}')
+        assert self.calc.variables['r'] == 2 ** 18
+        assert self.calc._call_steps == 18
+        # The expansion is too long to show, so the calls are shown instead
+        assert self.calc.results[1][2] is None
+
+    def test_depth_limit_is_configurable(self):
+        # Nested arguments are evaluated in the caller's frame; only bodies nest frames
+        nested = 'd(' * 5 + '0' + ')' * 5
+        text = f'a(x) = b(x) + 1\nb(x) = c(x) + 1\nc(x) = d(x) + 1\nd(x) = x + 1\nr = a(0)\ns = b(0)\nt = {nested}'
+        self.calc.max_call_depth = 3
+        self.calc.process_text(text)
+        assert self.calc.variables['s'] == 3
+        assert self.calc.variables['t'] == 5
+        assert 'r' not in self.calc.variables
+        assert self.calc.results[4][2] == "错误: 函数 d 调用层数超过 3"
+
+    def test_step_limit(self):
+        self.calc.max_call_steps = 10
+        self.calc.language = 'en'
+        calls = ' + '.join(f'f({i})' for i in range(11))
+        self.calc.process_text(f'f(x) = x\nr = {calls}\ns = f(1) + f(2)')
+        assert self.calc.results[1][2] == "错误: More than 10 function calls"
+        assert self.calc.variables['s'] == 3
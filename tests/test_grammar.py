@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_grammar shared lexical patterns.
+
+Validates:
+- Identifier grammar (English, Chinese, underscores, no leading digit)
+- Reserved date/time keywords
+- Whole-word matching used for parameter substitution
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_grammar import (
+    is_identifier, is_reserved_keyword, whole_word_re,
+    WORD_RE, ASSIGNMENT_RE, LINE_ASSIGNMENT_RE, HIGHLIGHT_DATETIME_RE,
+)
+
+
+class TestIdentifiers:
+    """Tests for the identifier grammar."""
+
+    def test_identifiers(self):
+        assert is_identifier('rent')
+        assert is_identifier('_tmp1')
+        assert is_identifier('房租')
+        assert is_identifier('总计2')
+        assert not is_identifier('2x')
+        assert not is_identifier('a b')
+        assert not is_identifier('')
+
+    def test_word_scan(self):
+        assert WORD_RE.findall('总计 = 房租 + food * 2') == ['总计', '房租', 'food']
+
+    def test_assignment(self):
+        match = ASSIGNMENT_RE.match('房租 = 3500')
+        assert match.groups() == ('房租', '3500')
+        assert LINE_ASSIGNMENT_RE.findall('a = 1\n1 + 2\nb= a') == ['a', 'b']
+
+
+class TestReservedKeywords:
+    """Tests for date/time literal keywords."""
+
+    def test_reserved(self):
+        for name in ('Y20260410', 'T143000', 'D10', 'h3', 'workday', 'COMMA'):
+            assert is_reserved_keyword(name)
+        for name in ('Day', 'h', 'x1', 'hex'):
+            assert not is_reserved_keyword(name)
+
+    def test_datetime_highlight_boundaries(self):
+        spans = [m.group(1) for m in HIGHLIGHT_DATETIME_RE.finditer('start + h3 + xD10')]
+        assert spans == ['h3']
+
+
+class TestWholeWord:
+    """Tests for whole_word_re()."""
+
+    def test_does_not_match_inside_identifiers(self):
+        pattern = whole_word_re('x')
+        assert pattern.sub('(1)', 'x + xx + 3*x + 变量x') == '(1) + xx + 3*(1) + 变量x'
+
+    def test_cached(self):
+        assert whole_word_re('rate') is whole_word_re('rate')
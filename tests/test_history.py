@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_history (GitHistoryStore backends).
+
+Validates:
+- The in-process "objects" backend writes commits git itself accepts
+  (and leaves the work tree alone)
+- History, restore and diff read back what was committed
+- Unchanged snapshots are not committed again
+- The "cli" backend keeps other sessions when mixed with the objects backend
+- Change checks compare blob digests seeded from HEAD, not the work tree
+- History pages come from the commit index, which re-syncs from Git
+- The commit queue coalesces bursts per session and flushes on close
+- The in-memory fallback evicts its oldest snapshots beyond the budget
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+import calc_history
+from calc_history import GitHistoryStore
+from calc_history_index import INDEX_FILE_NAME
+
+requires_git = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def _open_store(path, backend="objects"):
+    store = GitHistoryStore(path, backend=backend)
+    store._init_thread.join()
+    return store
+
+
+def _git(path, *args):
+    return subprocess.run(["git"] + list(args), cwd=path, capture_output=True, text=True).stdout
+
+
+@requires_git
+class TestObjectsBackend:
+    """Tests for the in-process object store backend."""
+
+    def setup_method(self):
+        self.path = tempfile.mkdtemp()
+        self.store = _open_store(self.path)
+
+    def teardown_method(self):
+        self.store.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_commit_is_valid_git(self):
+        first = self.store.commit("s1", "a = 1", "a = 1   = 1", message="first")
+        second = self.store.commit("s2", "价格 = 2", "价格 = 2   = 2", message="second")
+        assert _git(self.path, "rev-parse", "HEAD").strip() == second
+        assert _git(self.path, "rev-parse", "HEAD^").strip() == first
+        assert _git(self.path, "show", "HEAD:s1/session.txt") == "a = 1"
+        assert subprocess.run(["git", "fsck", "--strict"], cwd=self.path,
+                              capture_output=True).returncode == 0
+        assert not os.path.exists(os.path.join(self.path, "s1"))
+        # Only the index is behind HEAD; git reset brings it up to date
+        assert "??" not in _git(self.path, "status", "--porcelain")
+        _git(self.path, "reset", "-q")
+        assert _git(self.path, "status", "--porcelain", "--untracked-files=no") == \
+            " D s1/output.txt\n D s1/session.txt\n D s2/output.txt\n D s2/session.txt\n"
+
+    def test_history_restore_and_diff(self):
+        self.store.commit("s1", "a = 1\nb = 2", "")
+        self.store.commit("s2", "other", "")
+        last = self.store.commit("s1", "a = 1\nb = 3", "b = 3")
+        history = self.store.get_history("s1")
+        assert [entry.commit_hash for entry in history][0] == last
+        assert len(history) == 2
+        assert self.store.restore(last) == ("a = 1\nb = 3", "b = 3")
+        diff = self.store.get_diff(last)
+        assert ("delete", "b = 2") in [(line.type, line.content) for line in diff.lines]
+        assert ("add", "b = 3") in [(line.type, line.content) for line in diff.lines]
+
+    def test_unchanged_not_committed(self):
+        assert self.store.commit("s1", "x = 1", "x = 1") is not None
+        assert self.store.commit("s1", "x = 1", "x = 1") is None
+
+    def test_cli_backend_keeps_other_sessions(self):
+        self.store.commit("s1", "a = 1", "")
+        cli = _open_store(self.path, backend="cli")
+        cli.commit("s2", "b = 2", "")
+        self.store.commit("s1", "a = 2", "")
+        assert _git(self.path, "ls-tree", "-r", "--name-only", "HEAD").split() == [
+            "s1/output.txt", "s1/session.txt", "s2/output.txt", "s2/session.txt"]
+
+
+@requires_git
+class TestChangeDigests:
+    """Tests for the committed-content digests behind has_changes()."""
+
+    def setup_method(self):
+        self.path = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    @pytest.mark.parametrize("backend", ["objects", "cli"])
+    def test_seeded_from_head(self, backend):
+        store = _open_store(self.path)
+        store.commit("s1", "a = 1", "a = 1   = 1")
+        store.close()
+        # The objects backend writes no work tree files to consult
+        assert not os.path.exists(os.path.join(self.path, "s1"))
+        reopened = _open_store(self.path, backend=backend)
+        assert not reopened.has_changes("s1", "a = 1", "a = 1   = 1")
+        assert reopened.has_changes("s1", "a = 1", "")
+        assert reopened.has_changes("s2", "", "")
+        reopened.close()
+
+    def test_updated_on_commit(self):
+        store = _open_store(self.path)
+        assert store.commit("s1", "x", "") is not None
+        assert store._committed_digests["s1"] == store._snapshot_digest("x", "")
+        assert _git(self.path, "rev-parse", "HEAD:s1/session.txt").strip() == \
+            store._committed_digests["s1"][0]
+        store.close()
+
+
+@requires_git
+class TestHistoryIndex:
+    """Tests for the SQLite commit index behind get_history()."""
+
+    def setup_method(self):
+        self.path = tempfile.mkdtemp()
+        self.store = _open_store(self.path)
+        for i in range(12):
+            self.store.commit("s1" if i % 3 else "s2", f"a = {i}", "价" * i, message=f"c{i}")
+
+    def teardown_method(self):
+        self.store.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _log_history(self, session_id, limit, offset):
+        index, self.store._index = self.store._index, None
+        try:
+            return self.store.get_history(session_id, limit, offset)
+        finally:
+            self.store._index = index
+
+    def test_paging_matches_git_log(self):
+        assert self.store.count_history("s1") == 8
+        page = self.store.get_history("s1", 3, 2)
+        assert [e.message for e in page] == ["c8", "c7", "c5"]
+        assert [(e.commit_hash, e.timestamp, e.message) for e in page] == \
+            [(e.commit_hash, e.timestamp, e.message) for e in self._log_history("s1", 3, 2)]
+        assert (page[0].input_size, page[0].output_size) == (5, 24)
+
+    def test_rebuilt_from_git(self):
+        expected = self.store.get_history("s2", 10)
+        self.store.close()
+        os.remove(os.path.join(self.path, ".git", INDEX_FILE_NAME))
+        _git(self.path, "reset", "-q", "--soft", "HEAD~1")
+        self.store = _open_store(self.path)
+        # The dropped commit (c11) belonged to s1
+        assert self.store.get_history("s2", 10) == expected
+        assert self.store.count_history("s1") == 7
+        self.store.commit("s2", "new", "")
+        assert self.store.count_history("s2") == 5
+
+
+class TestCommitQueue:
+    """Tests for the background commit queue (memory fallback keeps them git-free)."""
+
+    def setup_method(self):
+        self.store = GitHistoryStore(tempfile.mkdtemp())
+        self.store._init_thread.join()
+        self.store._git_available = False
+
+    def teardown_method(self):
+        self.store.close()
+
+    def test_burst_is_coalesced(self):
+        for i in range(50):
+            self.store.submit("s1", f"a = {i}", f"a = {i}   = {i}")
+        self.store.submit("s2", "b = 1", "")
+        assert self.store.queue_depth >= 1
+        assert self.store.flush(timeout=10)
+        assert self.store.queue_depth == 0
+        history = self.store.get_history("s1")
+        assert len(history) == 1 and self.store.count_history("s1") == 1
+        assert self.store.restore(history[0].commit_hash) == ("a = 49", "a = 49   = 49")
+        stats = self.store.queue_stats()
+        assert stats.committed == 2 and stats.coalesced == 49
+        assert stats.max_latency_ms >= stats.last_latency_ms > 0
+
+    def test_idle_session_is_written(self, monkeypatch):
+        monkeypatch.setattr(calc_history, "COMMIT_COALESCE_SECONDS", 0.01)
+        self.store.submit("s1", "x = 1", "")
+        deadline = time.monotonic() + 5
+        while self.store.queue_depth and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(self.store.get_history("s1")) == 1
+
+    def test_close_flushes(self):
+        self.store.submit("s1", "x = 1", "")
+        self.store.submit("s1", "x = 1", "")
+        self.store.close()
+        assert len(self.store.get_history("s1")) == 1
+        assert self.store.queue_stats().coalesced == 1
+        with pytest.raises(ValueError):
+            self.store.submit("s1", "x = 2", "")
+
+
+class TestMemoryFallback:
+    """Tests for history without Git."""
+
+    def setup_method(self):
+        self.store = GitHistoryStore(tempfile.mkdtemp(), memory_budget=4096)
+        self.store._init_thread.join()
+        self.store._git_available = False
+
+    def test_commit_diff_restore(self):
+        first = self.store.commit("s1", "a = 1\nb = 2", "")
+        self.store.commit("s2", "c = 3", "")
+        second = self.store.commit("s1", "a = 1\nb = 3", "b = 3")
+        assert self.store.commit("s1", "a = 1\nb = 3", "b = 3") is None
+        assert self.store.restore(second) == ("a = 1\nb = 3", "b = 3")
+        diff = self.store.get_diff(second)
+        assert diff.parent_hash == first
+        assert ("add", "b = 3") in [(line.type, line.content) for line in diff.lines]
+
+    def test_budget_evicts_oldest(self):
+        hashes = [self.store.commit("s1", f"x = {i}\n" * 20, "") for i in range(200)]
+        history = self.store.get_history("s1", 1000)
+        assert 1 < len(history) < 200
+        assert [e.commit_hash for e in history] == hashes[::-1][:len(history)]
+        assert self.store.restore(hashes[0]) == ("", "")
+        assert self.store.restore(hashes[-1]) == ("x = 199\n" * 20, "")
+
+
+class TestBackendOption:
+    """Tests for backend selection."""
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            GitHistoryStore(tempfile.mkdtemp(), backend="svn")
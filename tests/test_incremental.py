@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for IncrementalCalcEngine.process_incremental().
+
+Validates:
+- Only dirty lines and their transitive dependents are re-evaluated
+- Line insertion/deletion shifts cached results instead of rebuilding
+- Edit scripts (insert at / delete range) are applied without re-evaluating moved lines
+- Editor insert/delete operations recorded by LineChangeTracker become edit scripts
+- A cancelled pass is completed by the next incremental call
+- Circular dependencies and globals read through called functions are
+  resolved exactly as in a full recalculation
+- Results always match a full recalculation of the new text
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+
+import pytest
+from hypothesis import given, strategies as st
+
+from calc_paper import CalculatorPaperAdvanced
+from calc_incremental import (
+    IncrementalCalcEngine, DependencyGraph, LineChangeTracker, LineEdit, LineResult, CalculationCancelled,
+)
+from calc_session import GlobalVariableStore
+
+
+def _make_engine(global_store=None):
+    return IncrementalCalcEngine(CalculatorPaperAdvanced(), global_store or GlobalVariableStore())
+
+
+def _snapshot(engine, results):
+    return ([(r.line_index, r.output_line, r.result_value, r.variables_defined, r.variables_used)
+             for r in results], dict(engine._calculator.variables))
+
+
+def _assert_matches_full(engine, results, new_text, global_store=None):
+    reference = _make_engine(global_store)
+    expected = reference.process_full(new_text)
+    assert _snapshot(engine, results) == _snapshot(reference, expected)
+
+
+class _CountingCalculator(CalculatorPaperAdvanced):
+    """Calculator that records which lines were evaluated."""
+
+    def __init__(self):
+        super().__init__()
+        self.evaluated = []
+
+    def _evaluate_line(self, compiled):
+        self.evaluated.append(compiled.source)
+        return super()._evaluate_line(compiled)
+
+
+class TestProcessIncremental:
+    """Targeted incremental edits."""
+
+    def setup_method(self):
+        self.calc = _CountingCalculator()
+        self.engine = IncrementalCalcEngine(self.calc, GlobalVariableStore())
+
+    def test_only_affected_lines_are_evaluated(self):
+        old_text = 'a = 1\nb = a + 1\nc = 10\nd = c * 2\ne = b + 1'
+        self.engine.process_full(old_text)
+        self.calc.evaluated.clear()
+
+        new_text = 'a = 5\nb = a + 1\nc = 10\nd = c * 2\ne = b + 1'
+        results = self.engine.process_incremental(old_text, new_text, [0])
+
+        assert sorted(self.calc.evaluated) == ['5', 'a + 1', 'b + 1']
+        assert [r.result_value for r in results] == [5.0, 6.0, 10.0, 20.0, 7.0]
+        _assert_matches_full(self.engine, results, new_text)
+
+    def test_insert_line_shifts_results(self):
+        old_text = 'a = 1\nb = 2\nc = a + b'
+        self.engine.process_full(old_text)
+        self.calc.evaluated.clear()
+
+        new_text = 'a = 1\nx = 7\nb = 2\nc = a + b'
+        results = self.engine.process_incremental(old_text, new_text, [1])
+
+        assert self.calc.evaluated == ['7']
+        assert [r.line_index for r in results] == [0, 1, 2, 3]
+        _assert_matches_full(self.engine, results, new_text)
+
+    def test_delete_definition_invalidates_users(self):
+        old_text = 'a = 1\nb = a + 1\nc = 3'
+        self.engine.process_full(old_text)
+
+        new_text = 'b = a + 1\nc = 3'
+        results = self.engine.process_incremental(old_text, new_text, [])
+
+        assert results[0].is_error
+        assert 'a' not in self.calc.variables
+        _assert_matches_full(self.engine, results, new_text)
+
+    def test_previous_results_are_not_mutated(self):
+        old_text = 'a = 1\nb = 2'
+        first = self.engine.process_full(old_text)
+        snapshot = [(r.line_index, r.output_line) for r in first]
+
+        self.engine.process_incremental(old_text, 'z = 0\na = 1\nb = 3', [0, 2])
+        assert [(r.line_index, r.output_line) for r in first] == snapshot
+
+    def test_variable_read_by_called_function(self):
+        old_text = 'f(a) = a + x\nx = 1\nt = f(2)'
+        self.engine.process_full(old_text)
+
+        new_text = 'f(a) = a + x\nx = 5\nt = f(2)'
+        results = self.engine.process_incremental(old_text, new_text, [1])
+        assert results[2].result_value == 7
+        _assert_matches_full(self.engine, results, new_text)
+
+    def test_line_depending_on_circular_line(self):
+        old_text = 'a = a + a\nb = 1'
+        self.engine.process_full(old_text)
+
+        new_text = 'e = 2 + a\na = a + a\nb = 1'
+        results = self.engine.process_incremental(old_text, new_text, [0])
+        assert results[0].error_message == '错误: 循环依赖'
+        _assert_matches_full(self.engine, results, new_text)
+
+    def test_function_reads_variable_defined_later(self):
+        old_text = 'f(n) = n + c\ne = f(b)\nb = 1\nc = d * 2\nd = 1'
+        assert self.engine.process_full(old_text)[1].result_value == 3
+
+        new_text = 'f(n) = n + c\ne = f(b)\nb = 4\nc = d * 2\nd = 1'
+        results = self.engine.process_incremental(old_text, new_text, [2])
+        assert results[1].result_value == 6
+        _assert_matches_full(self.engine, results, new_text)
+
+    def test_global_variable_change(self):
+        store = GlobalVariableStore()
+        store.set('rate', 2)
+        engine = _make_engine(store)
+        old_text = 'x = rate * 10\ny = 1'
+        engine.process_full(old_text)
+
+        store.set('rate', 3)
+        new_text = 'x = rate * 10\ny = 2'
+        results = engine.process_incremental(old_text, new_text, [1])
+        assert results[0].result_value == 30
+        _assert_matches_full(engine, results, new_text, store)
+
+
+class TestDependencyGraphIndex:
+    """The reverse index stays consistent with the forward maps."""
+
+    def setup_method(self):
+        self.graph = DependencyGraph()
+        self.graph.build([
+            LineResult(0, 'a = 1', '', 1, ['a'], []),
+            LineResult(1, 'b = a + 1', '', 2, ['b'], ['a']),
+            LineResult(2, 'c = b + a', '', 4, ['c'], ['a', 'b']),
+            LineResult(3, 'd = 5', '', 5, ['d'], []),
+        ])
+
+    def test_transitive_and_direct(self):
+        assert self.graph.get_affected_lines([0]) == [0, 1, 2]
+        assert self.graph.get_affected_lines([3]) == [3]
+        assert self.graph.get_dependents(0) == {1, 2}
+        assert self.graph.get_users({'b', 'd'}) == {2}
+
+    def test_update_line_maintains_index(self):
+        self.graph.update_line(2, LineResult(2, 'c = d', '', 5, ['c'], ['d']))
+        assert self.graph.get_dependents(0) == {1}
+        assert self.graph.get_dependents(3) == {2}
+        assert self.graph.get_users({'b'}) == set()
+
+    def test_splice_shifts_users(self):
+        # Insert two lines before line 1
+        self.graph.splice(1, 0, 2)
+        assert self.graph.get_dependents(0) == {3, 4}
+        assert self.graph.get_affected_lines([0]) == [0, 3, 4]
+
+    def test_splice_forgets_replaced_ids(self):
+        old_id = self.graph.line_id(1)
+        self.graph.splice(1, 1, 1)
+        assert self.graph.index_of(old_id) is None
+        assert self.graph.index_of(self.graph.line_id(1)) == 1
+
+
+class TestProcessEdits:
+    """Edit scripts applied to the last calculated text."""
+
+    def setup_method(self):
+        self.calc = _CountingCalculator()
+        self.engine = IncrementalCalcEngine(self.calc, GlobalVariableStore())
+        self.engine.process_full('a = 1\nb = a + 1\nc = 3')
+        self.calc.evaluated.clear()
+
+    def test_insert_at_top(self):
+        results = self.engine.process_edits([LineEdit.insert(0, ['x = 2', 'y = x * 3'])])
+
+        assert sorted(self.calc.evaluated) == ['2', 'x * 3']
+        assert [r.line_index for r in results] == [0, 1, 2, 3, 4]
+        assert results[4].output_line == 'c = 3  = 3'
+        _assert_matches_full(self.engine, results, 'x = 2\ny = x * 3\na = 1\nb = a + 1\nc = 3')
+
+    def test_script_of_several_edits(self):
+        edits = [LineEdit.delete(0), LineEdit.insert(2, ['a = 5']), LineEdit(0, 1, ('b = a * 2',))]
+        results = self.engine.process_edits(edits)
+
+        assert [r.input_line for r in results] == ['b = a * 2', 'c = 3', 'a = 5']
+        assert 'c = 3' not in self.calc.evaluated
+        _assert_matches_full(self.engine, results, 'b = a * 2\nc = 3\na = 5')
+
+    def test_variable_read_by_called_function(self):
+        text = 'f(n) = n + x\ng(n) = f(n) * 2\nx = 1\nt = g(2)\nu = 4'
+        self.engine.process_full(text)
+        self.calc.evaluated.clear()
+
+        results = self.engine.process_edits([LineEdit(2, 1, ('x = 5',))])
+        assert results[3].result_value == 14
+        assert '4' not in self.calc.evaluated
+        _assert_matches_full(self.engine, results, 'f(n) = n + x\ng(n) = f(n) * 2\nx = 5\nt = g(2)\nu = 4')
+
+    def test_circular_line_outside_the_edit(self):
+        self.engine.process_full('a = a + a\nb = 1')
+        results = self.engine.process_edits([LineEdit.insert(0, ['e = 2 + a'])])
+        assert results[0].error_message == '错误: 循环依赖'
+        _assert_matches_full(self.engine, results, 'e = 2 + a\na = a + a\nb = 1')
+
+        # Breaking the cycle later re-evaluates the line that depended on it
+        results = self.engine.process_edits([LineEdit(1, 1, ('a = 3',))])
+        assert results[0].result_value == 5
+        _assert_matches_full(self.engine, results, 'e = 2 + a\na = 3\nb = 1')
+
+    def test_edit_out_of_range(self):
+        with pytest.raises(ValueError):
+            self.engine.process_edits([LineEdit.delete(2, 5)])
+
+    def test_line_ids_survive_insertion(self):
+        graph = self.engine.dependency_graph
+        line_id = graph.line_id(2)
+        self.engine.process_edits([LineEdit.insert(0, ['z = 0'])])
+        assert graph.index_of(line_id) == 3
+        assert graph.get_var_definition_line('c') == 3
+
+
+# Text typed into the editor model
+_TYPED = ['1', '\n', 'a', ' + b', '\ne = c\n', 'x = 2\n', '#', '']
+
+
+class TestCancellation:
+    """Cancelling a pass between line evaluations."""
+
+    def setup_method(self):
+        self.calc = _CountingCalculator()
+        self.engine = IncrementalCalcEngine(self.calc, GlobalVariableStore())
+        self.engine.process_full('a = 1\nb = a + 1\nc = b + 1\nd = c + 1')
+        self.calc.evaluated.clear()
+
+    def test_cancel_midway_then_resume(self):
+        cancel = threading.Event()
+        evaluate = self.calc._evaluate_line
+
+        def evaluate_then_cancel(compiled):
+            cancel.set()   # a newer edit arrives while the first line is evaluated
+            return evaluate(compiled)
+
+        self.calc._evaluate_line = evaluate_then_cancel
+        with pytest.raises(CalculationCancelled):
+            self.engine.process_edits([LineEdit(0, 1, ('a = 10',))], cancel_event=cancel)
+        assert self.calc.evaluated == ['10']
+        assert self.engine.last_text == 'a = 10\nb = a + 1\nc = b + 1\nd = c + 1'
+
+        self.calc._evaluate_line = evaluate
+        results = self.engine.process_edits([LineEdit(3, 1, ('d = c + 2',))])
+        assert [r.result_value for r in results] == [10, 11, 12, 14]
+        _assert_matches_full(self.engine, results, 'a = 10\nb = a + 1\nc = b + 1\nd = c + 2')
+
+
+class _Buffer:
+    """Plain-string model of the GUI text widget reporting edits to a tracker."""
+
+    def __init__(self, text, tracker):
+        self.text = text
+        self.tracker = tracker
+
+    def _offset(self, line, col):
+        lines = self.text.split('\n')
+        line = min(line, len(lines) - 1)
+        return sum(len(l) + 1 for l in lines[:line]) + min(col, len(lines[line]))
+
+    def _line_of(self, offset):
+        return self.text.count('\n', 0, offset)
+
+    def insert(self, line, col, chars):
+        offset = self._offset(line, col)
+        self.tracker.insert(self._line_of(offset), chars.count('\n'))
+        self.text = self.text[:offset] + chars + self.text[offset:]
+
+    def delete(self, line1, col1, line2, col2):
+        start, end = self._offset(line1, col1), self._offset(line2, col2)
+        if end < start:
+            return
+        self.tracker.delete(self._line_of(start), self._line_of(end))
+        self.text = self.text[:start] + self.text[end:]
+
+
+class TestLineChangeTracker:
+    """Editor operations turned into edit scripts."""
+
+    def setup_method(self):
+        self.calc = _CountingCalculator()
+        self.engine = IncrementalCalcEngine(self.calc, GlobalVariableStore())
+        self.tracker = LineChangeTracker()
+        self.buffer = _Buffer('a = 1\nb = a + 1\nc = 3', self.tracker)
+        self.engine.process_full(self.buffer.text)
+        self.calc.evaluated.clear()
+
+    def _recalculate(self):
+        script = self.tracker.edit_script(self.engine.lines, self.buffer.text.split('\n'))
+        assert script is not None
+        results = self.engine.process_edits(script)
+        self.tracker.reset()
+        _assert_matches_full(self.engine, results, self.buffer.text)
+        return results
+
+    def test_typing_a_new_line(self):
+        self.buffer.insert(0, 5, '\nx = 9')
+        results = self._recalculate()
+
+        assert self.calc.evaluated == ['9']
+        assert [r.input_line for r in results] == ['a = 1', 'x = 9', 'b = a + 1', 'c = 3']
+
+    def test_joining_lines(self):
+        self.buffer.delete(1, 9, 2, 0)
+        self.buffer.insert(1, 9, ' + ')
+        results = self._recalculate()
+        assert results[1].input_line == 'b = a + 1 + c = 3'
+        assert len(results) == 2
+
+    def test_variable_read_by_called_function(self):
+        self.buffer.text = 'f(n) = n * a\na = 1\nb = f(3)\nc = b + 1'
+        self.engine.process_full(self.buffer.text)
+        self.tracker.reset()
+
+        self.buffer.delete(1, 4, 1, 5)
+        self.buffer.insert(1, 4, '2')
+        results = self._recalculate()
+        assert [r.result_value for r in results[1:]] == [2, 6, 7]
+        assert 'b' in self.engine.dependency_graph.get_line_uses(3)
+        assert 'a' in results[2].variables_used
+
+    def test_no_changes(self):
+        assert not self.tracker.has_changes
+        assert self.tracker.edit_script(self.engine.lines, self.engine.lines) == []
+
+    def test_unrecorded_edit_is_detected(self):
+        self.buffer.text = 'a = 2\nb = a + 1\nc = 3'   # bypasses the tracker
+        assert self.tracker.edit_script(self.engine.lines, self.buffer.text.split('\n')) is None
+        self.tracker.invalidate()
+        assert self.tracker.edit_script(self.engine.lines, self.engine.lines) is None
+
+    @given(st.lists(st.tuples(st.booleans(), st.integers(0, 4), st.integers(0, 12),
+                              st.integers(0, 4), st.integers(0, 12), st.sampled_from(_TYPED)),
+                    min_size=1, max_size=6))
+    def test_random_editing(self, operations):
+        tracker = LineChangeTracker()
+        engine = _make_engine()
+        buffer = _Buffer('a = 1\nb = a + 1\nc = b * 2\nd = 4', tracker)
+        engine.process_full(buffer.text)
+
+        for is_insert, line1, col1, line2, col2, chars in operations:
+            if is_insert:
+                buffer.insert(line1, col1, chars)
+            else:
+                buffer.delete(line1, col1, line2, col2)
+        new_lines = buffer.text.split('\n')
+        script = tracker.edit_script(engine.lines, new_lines)
+        assert script is not None
+        if buffer.text.strip() and buffer.text == buffer.text.strip():
+            results = engine.process_edits(script)
+            _assert_matches_full(engine, results, buffer.text)
+
+
+# Lines drawn from a small vocabulary so edits create, break and move dependencies
+_LINES = [
+    'a = 1', 'a = 2', 'b = a + 1', 'c = b * 2', 'd = c - a', 'e = x + 1',
+    'x = 0x10', 'y = x | 1', 'z = a / 0', '# note', '', 'a + b',
+    'f(n) = n * 2', 'g = f(3)', 'h = h + 1', 'hex(y)', 'k = m', 'm = k',
+    'p(n) = n + a', 'q = p(1)', 'a = a + a', 'u = h * 2', 't = p(b)', 'r(n) = n * w', 'w = r(2) + b',
+]
+
+
+class TestIncrementalMatchesFull:
+    """Property: an incremental update equals a full recalculation."""
+
+    @given(
+        old=st.lists(st.sampled_from(_LINES), min_size=1, max_size=12),
+        edits=st.lists(st.tuples(st.integers(0, 2), st.integers(0, 20), st.sampled_from(_LINES)),
+                       min_size=1, max_size=4),
+    )
+    def test_random_edits(self, old, edits):
+        engine = _make_engine()
+        old_text = '\n'.join(old)
+        engine.process_full(old_text)
+
+        for op, pos, line in edits:
+            new = list(old)
+            pos = pos % (len(new) + 1)
+            if op == 0 and pos < len(new):
+                new[pos] = line
+            elif op == 1:
+                new.insert(pos, line)
+            elif pos < len(new) and len(new) > 1:
+                del new[pos]
+            new_text = '\n'.join(new)
+            changed = [pos] if op != 2 else []
+            results = engine.process_incremental(old_text, new_text, changed)
+            _assert_matches_full(engine, results, new_text)
+            old, old_text = new, new_text
+
+    @given(
+        old=st.lists(st.sampled_from(_LINES), min_size=1, max_size=12),
+        edits=st.lists(st.tuples(st.integers(0, 20), st.integers(0, 2), st.lists(st.sampled_from(_LINES), max_size=3)),
+                       min_size=1, max_size=4),
+    )
+    def test_random_edit_scripts(self, old, edits):
+        engine = _make_engine()
+        old_text = '\n'.join(old)
+        engine.process_full(old_text)
+
+        script = []
+        lines = old_text.strip().split('\n') if old_text.strip() else []
+        for pos, delete_count, inserted in edits:
+            pos = pos % (len(lines) + 1)
+            delete_count = min(delete_count, len(lines) - pos)
+            script.append(LineEdit(pos, delete_count, tuple(inserted)))
+            lines[pos:pos + delete_count] = inserted
+        results = engine.process_edits(script)
+        _assert_matches_full(engine, results, '\n'.join(lines))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for incremental CalculatorPaperAdvanced.format_output().
+
+Validates:
+- Cached per-line rendering gives the same text after results change
+- format_output_changes() reports only the changed output line ranges
+- Applying the reported changes to the previous output gives the new output
+- Changes can be taken against the output a view shows, skipping dropped passes
+- The GUI keeps patching correctly when a finished live pass is discarded
+- A live pass finishing after a session switch leaves the new session's output alone
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from calc_paper import CalculatorPaperAdvanced, OutputChange
+
+
+def _apply(lines, changes):
+    lines = list(lines)
+    for change in changes:
+        lines[change.start:change.start + change.delete_count] = change.lines
+    return lines
+
+
+class TestFormatOutputChanges:
+    """Tests for format_output_changes()."""
+
+    def setup_method(self):
+        self.calc = CalculatorPaperAdvanced()
+
+    def test_first_call_reports_everything(self):
+        self.calc.process_text('a = 1\nb = a + 1')
+        output, changes = self.calc.format_output_changes()
+        assert changes == [OutputChange(0, 0, tuple(output.split('\n')))]
+
+    def test_unchanged_output(self):
+        self.calc.process_text('a = 1\nb = a + 1')
+        self.calc.format_output_changes()
+        self.calc.process_text('a = 1\nb = a + 1')
+        assert self.calc.format_output_changes()[1] == []
+
+    def test_changed_results_only(self):
+        self.calc.process_text('a = 1\nb = 2\nc = a + 1')
+        self.calc.format_output_changes()
+        self.calc.process_text('a = 5\nb = 2\nc = a + 1')
+        output, changes = self.calc.format_output_changes()
+        lines = output.split('\n')
+        assert changes == [OutputChange(0, 1, (lines[0],)), OutputChange(2, 1, (lines[2],))]
+
+    def test_alignment_change_repads(self):
+        self.calc.process_text('a = 1\nb = 2')
+        self.calc.format_output_changes()
+        self.calc.process_text('a = 1\nb = 2\nlonger_name = 3')
+        output, changes = self.calc.format_output_changes()
+        assert output.split('\n')[0] == 'a = 1            = 1'
+        assert _apply(['a = 1  = 1', 'b = 2  = 2'], changes) == output.split('\n')
+
+    def test_bitmap_lines_are_counted(self):
+        self.calc.process_text('x = 1\nbitmap(0xF0)\ny = 2')
+        before = self.calc.format_output_changes()[0].split('\n')
+        self.calc.process_text('x = 1\nbitmap(0xF1)\ny = 3')
+        output, changes = self.calc.format_output_changes()
+        assert _apply(before, changes) == output.split('\n')
+        assert changes[0].start == 1
+
+    def test_changes_since_shown_output(self):
+        # A live pass is formatted but dropped (cancelled after it finished);
+        # the next pass must patch the output the pane still shows
+        self.calc.process_text('a = 1\nb = a + 1\nc = 3')
+        shown_text = self.calc.format_output_changes()[0]
+        shown = self.calc.output_blocks
+        self.calc.process_text('a = 2\nb = a + 1\nc = 3\nd = 4')
+        self.calc.format_output_changes()
+        self.calc.process_text('a = 2\nb = a + 1\nc = 5')
+        output, changes = self.calc.format_output_changes(shown)
+        assert _apply(shown_text.split('\n'), changes) == output.split('\n')
+        assert self.calc.output_blocks is not shown
+
+    @settings(max_examples=60, deadline=None)
+    @given(st.lists(st.lists(st.sampled_from([
+        'a = 1', 'a = 2', 'b = a * 3', 'long_variable_name = a + b', '# note', '',
+        'bitmap(a)', 'Y20250101 + D3', 'c = b / 7', 'd = missing + 1',
+    ]), min_size=1, max_size=8), min_size=2, max_size=5))
+    def test_changes_rebuild_output(self, sheets):
+        calc = CalculatorPaperAdvanced()
+        previous = []
+        for sheet in sheets:
+            calc.process_text('\n'.join(sheet))
+            output, changes = calc.format_output_changes()
+            assert _apply(previous, changes) == output.split('\n')
+            fresh = CalculatorPaperAdvanced()
+            fresh.process_text('\n'.join(sheet))
+            assert fresh.format_output() == output
+            previous = output.split('\n')
+
+
+class _Pane:
+    """Output widget model: full replacement via delete/insert, patches via _patch_output."""
+
+    def __init__(self):
+        self.lines = []
+        self.full_renders = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def delete(self, start, end):
+        self.lines = []
+
+    def insert(self, index, text):
+        self.lines = text.split('\n')
+        self.full_renders += 1
+
+
+class _LiveGUI:
+    """The output-pane part of the GUI, without Tk."""
+
+    def __init__(self, gui_class):
+        self._show_output = gui_class._show_output.__get__(self)
+        self._finish_live_calculation = gui_class._finish_live_calculation.__get__(self)
+        self._calculation_status = gui_class._calculation_status.__get__(self)
+        self.calculator = CalculatorPaperAdvanced()
+        self.language = 'en'
+        self.output_text = _Pane()
+        self.status_var = type('StatusVar', (), {'set': lambda self, value: None})()
+        self._current_session_id = 'first'
+        self._shown_blocks = None
+        self._output_line_count = 0
+        self._live_thread = self._live_timer = None
+        self._live_pending = False
+
+    def apply_syntax_highlighting(self):
+        pass
+
+    def _patch_output(self, changes):
+        self.output_text.lines = _apply(self.output_text.lines, changes)
+
+    def run_pass(self, text, cancel_after_finish=False, switch_to=None):
+        """A live pass as the worker runs it, then its Tk-thread completion."""
+        session_id = self._current_session_id
+        base = self._shown_blocks
+        self.calculator.process_text(text)
+        output, changes = self.calculator.format_output_changes(base)
+        cancel = threading.Event()
+        if cancel_after_finish:
+            cancel.set()   # a newer edit arrived before the result was shown
+        if switch_to is not None:
+            # Another session was activated while the pass was running
+            self._current_session_id = switch_to
+            self._shown_blocks = None
+        self._finish_live_calculation(cancel, session_id, output, changes, base,
+                                      self.calculator.output_blocks, None)
+        return output
+
+
+class TestLiveOutputPatching:
+    """Discarded live passes must not corrupt the patched output pane."""
+
+    def test_cancel_after_worker_finished(self):
+        gui_module = pytest.importorskip("calc_paper_gui")
+        gui = _LiveGUI(gui_module.CalculatorGUIAdvanced)
+        gui.run_pass('a = 1\nb = a + 1\nc = 3')
+        gui.run_pass('a = 2\nb = a + 1\nx = 9\nc = 3', cancel_after_finish=True)
+        output = gui.run_pass('a = 2\nb = a + 1\nc = 4')
+        assert gui.output_text.lines == output.split('\n')
+        assert gui.output_text.full_renders == 1
+
+    def test_pass_of_previous_session_is_dropped(self):
+        gui_module = pytest.importorskip("calc_paper_gui")
+        gui = _LiveGUI(gui_module.CalculatorGUIAdvanced)
+        gui.run_pass('a = 1')
+        shown = list(gui.output_text.lines)
+        gui.run_pass('a = 2\nb = a * 3', switch_to='second')
+        assert gui.output_text.lines == shown
+        assert gui._shown_blocks is None
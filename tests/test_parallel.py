@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_parallel: component splitting and parallel evaluation.
+
+Validates:
+- Lines sharing a variable (directly or through a function body) stay together
+- Batches are balanced and deterministic
+- A parallel pass gives the same results and variables as a serial pass
+- A parallel pass fills the line result cache like a serial pass
+- Cache entries made by spawned workers (other hash seeds) stay correct
+"""
+
+import sys
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hypothesis import given, settings, strategies as st
+
+from calc_paper import CalculatorPaperAdvanced
+import calc_parallel
+from calc_parallel import split_components, plan_batches, shutdown_executors
+
+
+SHEET = """rate = 3
+f(x) = x * rate
+a = 1
+b = a + 1
+c = f(2)
+mask = 0xF0 | 0x0F
+hex(mask)
+bitmap(0x12, 1, 8)
+start = Y20260410
+end = start + D10
+workday(Y20260410, D5)
+d = b * 2
+z = unknown + 1
+p = q + 1
+q = p + 1
+a = 7
+# comment
+
+total = d + 1"""
+
+
+def _components(text, calc=None):
+    calc = calc or CalculatorPaperAdvanced()
+    calc.process_text(text)
+    eval_order, _ = calc._topological_sort(calc.line_records)
+    return split_components(calc.line_records, eval_order, calc.functions)
+
+
+def _state(calc):
+    return calc.results, list(calc.variables.items())
+
+
+class TestSplitComponents:
+    """Tests for split_components()."""
+
+    def test_independent_chains(self):
+        components = _components('a = 1\nb = a + 1\nx = 5\ny = x * 2\nc = b + 1')
+        assert sorted(map(sorted, components)) == [[0, 1, 4], [2, 3]]
+
+    def test_function_body_joins_components(self):
+        components = _components('k = 2\nf(x) = x * k\ny = f(3)\nz = 1')
+        assert sorted(map(sorted, components)) == [[0, 2], [3]]
+
+    def test_order_follows_eval_order(self):
+        calc = CalculatorPaperAdvanced()
+        calc.process_text('b = a + 1\na = 1\nc = 9')
+        eval_order, _ = calc._topological_sort(calc.line_records)
+        components = split_components(calc.line_records, eval_order, calc.functions)
+        assert [1, 0] in components
+
+
+class TestPlanBatches:
+    """Tests for plan_batches()."""
+
+    def test_balanced_and_deterministic(self):
+        components = [[0, 1, 2, 3], [4], [5, 6], [7], [8, 9]]
+        batches = plan_batches(components, 2)
+        assert batches == plan_batches(components, 2)
+        assert sorted(sum(len(c) for c in batch) for batch in batches) == [5, 5]
+
+    def test_fewer_components_than_workers(self):
+        assert len(plan_batches([[0], [1]], 8)) == 2
+
+
+class TestParallelEvaluation:
+    """Parallel and serial passes agree."""
+
+    def teardown_method(self):
+        shutdown_executors()
+
+    def test_matches_serial(self):
+        serial = CalculatorPaperAdvanced()
+        serial.process_text(SHEET, preset_variables={'g': 5})
+
+        parallel = CalculatorPaperAdvanced()
+        parallel.parallel_workers = 2
+        parallel.parallel_min_lines = 0
+        parallel.process_text(SHEET, preset_variables={'g': 5})
+
+        assert _state(parallel) == _state(serial)
+        assert parallel.format_output() == serial.format_output()
+
+    @settings(max_examples=30, deadline=None)
+    @given(st.lists(st.sampled_from([
+        'a = 1', 'a = 2', 'b = a + 1', 'c = b * 2', 'x = 0x10', 'y = x | 1', 'k = m', 'm = k',
+        'f(n) = n * a', 'g = f(3)', 'h = h + 1', 'hex(y)', 'z = a / 0', 'd = Y20260101 + D3', '',
+    ]), min_size=1, max_size=15))
+    def test_random_sheets_match_serial(self, lines):
+        text = '\n'.join(lines)
+        serial = CalculatorPaperAdvanced()
+        serial.process_text(text)
+        parallel = CalculatorPaperAdvanced()
+        parallel.parallel_workers = 3
+        parallel.parallel_min_lines = 0
+        parallel.process_text(text)
+        assert _state(parallel) == _state(serial)
+
+    def test_fills_result_cache(self):
+        def rerun_hits(workers):
+            calc = CalculatorPaperAdvanced()
+            calc.parallel_workers = workers
+            calc.parallel_min_lines = 0
+            calc.process_text(SHEET, preset_variables={'g': 5})
+            calc.parallel_workers = 1
+            hits = calc.result_cache.hits
+            calc.process_text(SHEET, preset_variables={'g': 5})
+            return calc.result_cache.hits - hits, len(calc.result_cache), calc.format_output()
+
+        serial = rerun_hits(1)
+        assert serial[0] > 0
+        assert rerun_hits(2) == serial
+
+    def test_spawned_workers_fill_cache_correctly(self, monkeypatch):
+        # Spawned workers start with their own hash seed (the Windows/macOS default)
+        monkeypatch.setenv('PYTHONHASHSEED', '12345')
+        calc_parallel._executors[2] = ProcessPoolExecutor(
+            max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+        sheet = '\n'.join(f'a{i} = {{a}}\nb{i} = {{b}}\nr{i} = a{i} - 2 * b{i} + c{i}\nc{i} = 0'
+                          for i in range(6))
+        calc = CalculatorPaperAdvanced()
+        calc.parallel_workers = 2
+        calc.parallel_min_lines = 0
+        calc.process_text(sheet.format(a=1, b=3))
+        calc.parallel_workers = 1
+        calc.process_text(sheet.format(a=3, b=1))
+        assert calc.result_cache.hits > 0
+
+        serial = CalculatorPaperAdvanced()
+        serial.process_text(sheet.format(a=3, b=1))
+        assert _state(calc) == _state(serial)
+
+    def test_small_sheet_stays_serial(self, monkeypatch):
+        import calc_paper
+
+        def fail(*args):
+            raise AssertionError('parallel path used')
+
+        monkeypatch.setattr(calc_paper, 'evaluate_parallel', fail)
+        calc = CalculatorPaperAdvanced()
+        calc.parallel_workers = 4
+        calc.process_text('a = 1\nb = 2')
+        assert calc.variables == {'a': 1, 'b': 2}
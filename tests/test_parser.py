@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_parser (expression tokenizer, AST and compiled line cache).
+
+Validates:
+- Operator precedence and associativity match Python
+- Percent, hex/binary literals and bitwise operators
+- Syntax and illegal-character errors
+- compile_line() classification and caching
+- Cached compile_line() records are immutable
+- parse_line() evaluating the cached AST
+"""
+
+import dataclasses
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from calc_parser import CalcError, compile_expression, compile_line, compile_text, parse_expression
+from calc_paper import CalculatorPaperAdvanced
+
+
+def _eval(expr, variables=None):
+    variables = variables or {}
+    return compile_expression(parse_expression(expr))(variables.__getitem__, None)
+
+
+class TestParseExpression:
+    """Tests for parse_expression() + compile_expression()."""
+
+    def test_precedence(self):
+        assert _eval('1 + 2 * 3') == 7
+        assert _eval('(1 + 2) * 3') == 9
+        assert _eval('1 << 2 + 1') == 8
+        assert _eval('6 & 3 | 8') == 10
+
+    def test_power_is_right_associative(self):
+        assert _eval('2 ** 3 ** 2') == 512
+        assert _eval('-2 ** 2') == -4
+        assert _eval('2 ** -1') == 0.5
+
+    def test_percent(self):
+        assert _eval('50%') == 0.5
+        assert _eval('200 * 10%') == 20.0
+
+    def test_hex_and_binary_literals(self):
+        assert _eval('0xFF + 0b11') == 258
+        assert _eval('~0x0F & 0xFF') == 0xF0
+
+    def test_variables(self):
+        assert _eval('a * b', {'a': 3, 'b': 4}) == 12
+
+    def test_syntax_errors(self):
+        for expr in ('1 +', '(1 + 2', '1 2', '3(4)'):
+            with pytest.raises(CalcError, match="表达式语法错误"):
+                parse_expression(expr)
+
+    def test_illegal_characters(self):
+        for expr in ('1 $ 2', '2x', '1e5'):
+            with pytest.raises(CalcError, match="包含非法字符"):
+                parse_expression(expr)
+
+    def test_constant_errors_deferred_to_evaluation(self):
+        program = compile_text('1 / 0 + 1')
+        with pytest.raises(ZeroDivisionError):
+            program(None, None)
+
+    def test_compiled_program_is_reusable(self):
+        program = compile_text('a * 2 + 1')
+        assert program({'a': 1}.__getitem__, None) == 3
+        assert program({'a': 5}.__getitem__, None) == 11
+        assert compile_text('a * 2 + 1') is program
+
+
+class TestCompileLine:
+    """Tests for compile_line() classification."""
+
+    def test_blank_and_comment(self):
+        assert compile_line('').kind == 'empty'
+        assert compile_line('  # note').kind == 'comment'
+
+    def test_assignment(self):
+        compiled = compile_line('total = price * qty  # comment')
+        assert compiled.kind == 'expr'
+        assert compiled.label == 'total'
+        assert compiled.source == 'price * qty'
+        assert compiled.names == ('price', 'qty')
+
+    def test_wrappers(self):
+        assert compile_line('hex(255)').kind == 'hex'
+        assert compile_line('comma(1000)').kind == 'comma'
+        bitmap = compile_line('bitmap(0xFF, 1, 16)')
+        assert bitmap.kind == 'bitmap'
+        assert bitmap.bitmap_endian == 'big'
+        assert bitmap.bitmap_width == 16
+
+    def test_function_definition(self):
+        compiled = compile_line('f(x, y) = 2x + y')
+        assert compiled.kind == 'func_def'
+        assert compiled.params == ('x', 'y')
+        assert compiled.body == '2*x + y'
+
+    def test_cached_by_text(self):
+        assert compile_line('a = 1 + 2') is compile_line('a = 1 + 2')
+
+    def test_cached_records_are_immutable(self):
+        compiled = compile_line('a = b + c')
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            compiled.uses = frozenset()
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            compile_line('').kind = 'expr'
+        assert isinstance(compiled.names, tuple) and isinstance(compiled.display, tuple)
+
+
+class TestParseLineCompiled:
+    """parse_line() results with the compiled evaluator."""
+
+    def setup_method(self):
+        self.calc = CalculatorPaperAdvanced()
+
+    def test_result_types(self):
+        assert self.calc.parse_line('a = 10 / 2')[0] == 5
+        assert isinstance(self.calc.parse_line('1 + 2')[0], float)
+        assert isinstance(self.calc.parse_line('0x1 + 2')[0], int)
+        assert isinstance(self.calc.parse_line('1 / 3')[0], float)
+
+    def test_substituted_expression(self):
+        self.calc.parse_line('x = 0x10')
+        result = self.calc.parse_line('y = x | 1')
+        assert result[0] == 17
+        assert result[2] == '0x10 | 1'
+
+    def test_undefined_variables(self):
+        result = self.calc.parse_line('a + b')
+        assert result[2] == '变量未定义: a, b'
+
+    def test_too_deep_expression(self):
+        result = self.calc.parse_line('r = ' + ' + '.join(['1'] * 2000))
+        assert result[0] is None
+        assert result[2] == '错误: 表达式过于复杂'
+
+    def test_division_by_zero(self):
+        result = self.calc.parse_line('1 / 0')
+        assert result[2] == '错误: 除数不能为零'
+
+    def test_swap(self):
+        assert self.calc.parse_line('swap(0x1234)')[0] == 0x3412
+
+    def test_evaluate_string(self):
+        assert self.calc.evaluate('2*(3+4)') == 14.0
+        assert self.calc.evaluate('swap(0x1234)', True) == 0x3412
+        assert self.calc.evaluate('10%') == 0.1
+        with pytest.raises(ValueError, match="除数不能为零"):
+            self.calc.evaluate('1/0')
+        with pytest.raises(ValueError, match="包含非法字符"):
+            self.calc.evaluate('__import__')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_snapshot_store (in-memory history fallback).
+
+Validates:
+- Line deltas rebuild the new lines from the old ones
+- Snapshots read back exactly through keyframes and delta chains
+- Oldest-first eviction keeps the store within its byte budget
+- The latest snapshot of every session survives eviction
+"""
+
+import sys
+import os
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from calc_snapshot_store import SnapshotStore, apply_line_delta, line_delta
+
+
+class TestLineDelta:
+    """Tests for line_delta / apply_line_delta."""
+
+    def test_round_trip(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            old = [str(rng.randint(0, 5)) for _ in range(rng.randint(0, 20))]
+            new = [str(rng.randint(0, 5)) for _ in range(rng.randint(0, 20))]
+            assert apply_line_delta(old, line_delta(old, new)) == new
+
+    def test_local_edit_copies_the_rest(self):
+        old = [f'line {i}' for i in range(1000)]
+        new = old[:500] + ['changed'] + old[501:]
+        assert line_delta(old, new) == [(0, 500), ['changed'], (501, 1000)]
+
+
+class TestSnapshotStore:
+    """Tests for SnapshotStore storage and eviction."""
+
+    def _edit_series(self, store, count, sessions=("s1", "s2")):
+        expected = {}
+        lines = {sid: [f'{sid}_{k} = {k}' for k in range(40)] for sid in sessions}
+        for i in range(count):
+            sid = sessions[i % len(sessions)]
+            lines[sid][i % 40] = f'{sid}_{i % 40} = {i}'
+            snapshot = ('\n'.join(lines[sid]), f'= {i}')
+            expected[f'k{i}'] = snapshot
+            for key in store.add(f'k{i}', sid, *snapshot):
+                del expected[key]
+        return expected
+
+    def test_read_back(self):
+        store = SnapshotStore(keyframe_interval=8)
+        expected = self._edit_series(store, 100)
+        assert len(expected) == 100
+        for key, snapshot in expected.items():
+            assert store.get(key) == snapshot
+        assert store.previous('k5') == 'k3'
+        assert store.get('missing') is None
+
+    def test_deltas_are_smaller(self):
+        deltas = SnapshotStore()
+        keyframes = SnapshotStore(keyframe_interval=1)
+        self._edit_series(deltas, 100)
+        self._edit_series(keyframes, 100)
+        assert deltas.bytes_used * 5 < keyframes.bytes_used
+
+    def test_eviction(self):
+        store = SnapshotStore(byte_budget=20000, keyframe_interval=4)
+        expected = self._edit_series(store, 500)
+        assert store.evicted > 0 and len(expected) == len(store) < 500
+        assert store.bytes_used <= 20000
+        # Oldest first: what remains is a suffix of each session's snapshots
+        assert min(int(key[1:]) for key in expected) > 0
+        for key, snapshot in expected.items():
+            assert store.get(key) == snapshot
+            assert store.previous(key) is None or store.previous(key) in store
+
+    def test_latest_kept_over_budget(self):
+        store = SnapshotStore(byte_budget=10)
+        store.add('a', 's1', 'x' * 100, '')
+        store.add('b', 's2', 'y' * 100, '')
+        assert store.add('c', 's1', 'z' * 100, '') == ['a']
+        assert store.latest('s1') == ('z' * 100, '')
+        assert store.get('b') == ('y' * 100, '')
+
+    def test_invalid_options(self):
+        with pytest.raises(ValueError):
+            SnapshotStore(byte_budget=0)
+        with pytest.raises(ValueError):
+            SnapshotStore(keyframe_interval=0)
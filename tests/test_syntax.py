@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_syntax (token cache and output pane highlighting).
+
+Validates:
+- Input lines are tokenized in one pass; digits inside names are not numbers
+- Tokens still cover the whole line when served from the cache
+- Unchanged lines are not tokenized again by highlight_full/highlight_lines
+- Output pane lines get one tag from their start column
+- highlight_lines tags the given line texts without reading the widget
+- Lazy mode tags only the visible lines plus a margin, then more on scroll
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_paper import CalculatorPaperAdvanced
+from calc_syntax import SyntaxHighlighter, VISIBLE_MARGIN
+
+
+class FakeText:
+    """Records tag_add calls; get() is not supported."""
+
+    def __init__(self):
+        self.tags = []
+
+    def tag_configure(self, tag, **options):
+        pass
+
+    def tag_remove(self, tag, start, end):
+        pass
+
+    def tag_add(self, tag, start, end):
+        self.tags.append((tag, start, end))
+
+    def get(self, start, end):
+        raise AssertionError("line texts were given")
+
+
+class TestTokenCache:
+    """Tests for SyntaxHighlighter.line_spans() caching."""
+
+    def setup_method(self):
+        self.hl = SyntaxHighlighter(global_vars={'rate'})
+
+    def test_cached_tokens_cover_line(self):
+        line = 'total = price * rate  # note'
+        first = self.hl.tokenize_line(line)
+        second = self.hl.tokenize_line(line)
+        assert first == second
+        assert ''.join(t.text for t in second) == line
+        assert (self.hl.cache.hits, self.hl.cache.misses) == (1, 1)
+
+    def test_single_pass_tokens(self):
+        line = 'total = v1 + hex(0xFF) * D3 << rate  # 12'
+        typed = [(t.type, t.text) for t in self.hl.tokenize_line(line) if t.type != 'operator']
+        assert typed == [('variable', 'total'), ('function', 'hex'), ('number', '0xFF'),
+                         ('datetime', 'D3'), ('global_var', 'rate'), ('comment', '# 12')]
+        operators = [t.text for t in self.hl.tokenize_line(line) if t.type == 'operator']
+        assert ' v1 ' in operators and '<<' in operators
+
+    def test_tokens_are_tuples(self):
+        token = self.hl.tokenize_line('x = 1')[0]
+        assert token == ('variable', 'x', 0, 1)
+        assert token.type == 'variable'
+
+    def test_input_and_output_cached_separately(self):
+        line = 'a = 1  = 1'
+        assert self.hl.line_spans(line, True) != self.hl.line_spans(line, False)
+
+    def test_global_vars_clear_cache(self):
+        assert ('global_var' in [t.type for t in self.hl.tokenize_line('x = rate')])
+        self.hl.set_global_vars(set())
+        assert len(self.hl.cache) == 0
+        assert 'global_var' not in [t.type for t in self.hl.tokenize_line('x = rate')]
+
+    def test_repeated_highlight_tokenizes_nothing(self):
+        widget = FakeText()
+        hl = SyntaxHighlighter(widget)
+        text = 'a = 1\nb = a + 2\n# note'
+        hl.highlight_full(text)
+        misses = hl.cache.misses
+        tags = list(widget.tags)
+        widget.tags.clear()
+        hl.highlight_full(text)
+        assert hl.cache.misses == misses
+        assert widget.tags == tags
+
+
+class TestOutputPane:
+    """Tests for the 'output' pane mode used by the GUI output text."""
+
+    def setup_method(self):
+        self.widget = FakeText()
+        self.hl = SyntaxHighlighter(self.widget, pane='output')
+
+    def test_line_tags(self):
+        calc = CalculatorPaperAdvanced()
+        calc.process_text('x = 0xF0\nbitmap(x)\nhex(255)\ne = q + 1\n# c')
+        lines = calc.format_output().split('\n')
+        types = [[s[2] for s in self.hl.line_spans(line)] for line in lines]
+        assert types[0] == ['result']
+        assert types[1] == ['result']
+        assert types[2] == ['bit_info']
+        assert ['hex_result'] in types
+        assert ['error'] in types
+        assert types[-1] == ['comment']
+        start = self.hl.line_spans(lines[0])[0][0]
+        assert lines[0][start] == '='
+
+    def test_highlight_lines_with_texts(self):
+        self.hl.highlight_lines(range(3, 5), ['a = 1   = 1', '# note'])
+        assert self.widget.tags == [('result', '4.2', '4.11'), ('comment', '5.0', '5.6')]
+
+    def test_changed_lines_hit_cache(self):
+        calc = CalculatorPaperAdvanced()
+        calc.process_text('a = 1\nb = a * 2\nc = b + 1')
+        output, _ = calc.format_output_changes()
+        self.hl.highlight_full(output)
+        misses = self.hl.cache.misses
+        calc.process_text('a = 2\nb = a * 2\nc = b + 1')
+        output, changes = calc.format_output_changes()
+        for change in changes:
+            self.hl.highlight_lines(range(change.start, change.start + len(change.lines)), change.lines)
+        assert self.hl.cache.misses - misses == 3
+        calc.process_text('a = 1\nb = a * 2\nc = b + 1')
+        output, changes = calc.format_output_changes()
+        for change in changes:
+            self.hl.highlight_lines(range(change.start, change.start + len(change.lines)), change.lines)
+        assert self.hl.cache.misses - misses == 3
+
+
+class ViewText(FakeText):
+    """FakeText with a scrollable visible range."""
+
+    def __init__(self, first=0, last=40):
+        super().__init__()
+        self.view = (first, last)
+
+    def get_visible_range(self):
+        return self.view
+
+
+class TestLazyHighlighting:
+    """Tests for lazy (viewport-only) highlighting."""
+
+    def setup_method(self):
+        self.widget = ViewText()
+        self.hl = SyntaxHighlighter(self.widget, pane='output', lazy=True)
+        self.text = '\n'.join(f'v{i} = {i}   = {i}' for i in range(50000))
+
+    def tagged_lines(self):
+        return sorted(int(start.split('.')[0]) - 1 for _, start, _ in self.widget.tags)
+
+    def test_only_visible_lines_tagged(self):
+        self.hl.highlight_full(self.text)
+        assert self.tagged_lines() == list(range(0, 40 + VISIBLE_MARGIN))
+        assert self.hl.cache.misses == 40 + VISIBLE_MARGIN
+
+    def test_scrolling_tags_new_lines_once(self):
+        self.hl.highlight_full(self.text)
+        self.widget.tags.clear()
+        self.widget.view = (30000, 30040)
+        self.hl.highlight_visible()
+        assert self.tagged_lines() == list(range(30000 - VISIBLE_MARGIN, 30040 + VISIBLE_MARGIN))
+        self.widget.tags.clear()
+        self.hl.highlight_visible()
+        assert self.widget.tags == []
+
+    def test_replace_lines_shifts_untagged(self):
+        self.hl.highlight_full('a = 1   = 1\nb = 2   = 2')
+        self.widget.tags.clear()
+        self.hl.replace_lines(0, 1, ['# x', '# y'])
+        assert self.widget.tags == []
+        self.hl.highlight_visible()
+        assert self.widget.tags == [('comment', '1.0', '1.3'), ('comment', '2.0', '2.3')]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for calc_text_buffer (line store behind the editable VirtualTextWidget).
+
+Validates:
+- PieceTable matches a plain line list after random line replacements
+- Repeated edits on one line keep the piece count small
+- TextBuffer replacements, reads and Tk-style index expressions
+- UndoStack groups typing, separates kinds, and undo/redo restore the text
+"""
+
+import sys
+import os
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calc_text_buffer import PieceTable, TextBuffer, TextEdit, UndoStack
+
+
+class TestPieceTable:
+    """Tests for PieceTable line storage."""
+
+    def test_matches_list(self):
+        rng = random.Random(7)
+        ref = [f'line {i}' for i in range(50)]
+        table = PieceTable(ref)
+        for step in range(500):
+            start = rng.randint(0, len(ref))
+            count = rng.randint(0, 3)
+            new = [f'new {step}.{k}' for k in range(rng.randint(0, 3))]
+            assert table.replace_lines(start, count, new) == ref[start:start + count]
+            ref[start:start + count] = new
+            assert len(table) == len(ref)
+            assert list(table) == ref
+        assert table[5:9] == ref[5:9]
+        assert table[-1] == ref[-1]
+
+    def test_typing_on_one_line(self):
+        table = PieceTable([f'line {i}' for i in range(200000)])
+        text = ''
+        for ch in 'total = 1 + 2':
+            text += ch
+            table.replace_lines(100000, 1, [text])
+        assert table[100000] == 'total = 1 + 2'
+        assert table[99999] == 'line 99999' and table[100001] == 'line 100001'
+        assert table.piece_count == 3
+
+    def test_compact(self):
+        table = PieceTable(['a', 'b', 'c'])
+        table.replace_lines(1, 1, ['x', 'y'])
+        table.compact()
+        assert table.piece_count == 1
+        assert list(table) == ['a', 'x', 'y', 'c']
+
+
+class TestTextBuffer:
+    """Tests for TextBuffer editing and index parsing."""
+
+    def setup_method(self):
+        self.buf = TextBuffer(['hello world', 'second', 'third'])
+
+    def test_replace_across_lines(self):
+        edit = self.buf.replace((0, 5), (1, 3), ',\nnew ')
+        assert list(self.buf.lines) == ['hello,', 'new ond', 'third']
+        assert edit == TextEdit((0, 5), ' world\nsec', ',\nnew ')
+        assert edit.new_end == (1, 4)
+
+    def test_get(self):
+        assert self.buf.get((0, 6), (1, 3)) == 'world\nsec'
+        assert self.buf.get((2, 0), (9, 0)) == 'third'
+
+    def test_index(self):
+        assert self.buf.index('end') == (2, 5)
+        assert self.buf.index('end', allow_end=True) == (3, 0)
+        assert self.buf.index('end-1c') == (2, 5)
+        assert self.buf.index('1.end + 1c') == (1, 0)
+        assert self.buf.index('2.0 - 1 chars') == (0, 11)
+        assert self.buf.index('insert + 1 lines', {'insert': (0, 9)}) == (1, 6)
+        assert self.buf.index('2.3 lineend') == (1, 6)
+        assert self.buf.index('99.0') == (2, 5)
+
+    def test_invalid_index(self):
+        try:
+            self.buf.index('nowhere')
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+    def test_undo_redo(self):
+        for ch in 'abc':
+            self.buf.replace(self.buf.end(), self.buf.end(), ch)
+        self.buf.replace((0, 0), (0, 6), '')
+        assert self.buf.get((0, 0), self.buf.end()) == 'world\nsecond\nthirdabc'
+        self.buf.undo()
+        assert list(self.buf.lines) == ['hello world', 'second', 'thirdabc']
+        self.buf.undo()
+        assert list(self.buf.lines) == ['hello world', 'second', 'third']
+        assert not self.buf.undo_stack.can_undo
+        self.buf.redo()
+        assert list(self.buf.lines) == ['hello world', 'second', 'thirdabc']
+
+
+class TestUndoStack:
+    """Tests for UndoStack grouping."""
+
+    def setup_method(self):
+        self.stack = UndoStack()
+
+    def test_typing_is_one_group(self):
+        for col, ch in enumerate('abc'):
+            self.stack.push(TextEdit((0, col), '', ch))
+        assert len(self.stack.undo()) == 3
+        assert not self.stack.can_undo
+
+    def test_separators(self):
+        self.stack.push(TextEdit((0, 0), '', 'a'))
+        self.stack.push(TextEdit((0, 5), '', 'b'))      # not contiguous
+        self.stack.push(TextEdit((0, 5), 'b', ''))      # kind changes
+        self.stack.separator()
+        self.stack.push(TextEdit((0, 4), 'x', ''))
+        groups = 0
+        while self.stack.can_undo:
+            self.stack.undo()
+            groups += 1
+        assert groups == 4
+
+    def test_backspace_is_one_group(self):
+        for col in (3, 2, 1):
+            self.stack.push(TextEdit((0, col - 1), 'x', ''))
+        assert len(self.stack.undo()) == 3
+
+    def test_disabled_and_limit(self):
+        stack = UndoStack(limit=2)
+        for i in range(5):
+            stack.push(TextEdit((i, 0), '', 'x'))
+            stack.separator()
+        assert stack.undo() and stack.undo() and not stack.can_undo
+        stack.enabled = False
+        stack.push(TextEdit((0, 0), '', 'x'))
+        assert not stack.can_undo
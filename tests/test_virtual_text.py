@@ -239,3 +239,124 @@ class TestLargeContent:
         widget.set_content(lines)
         result = widget.get("500.0", "500.8")
         assert result == 'line 499'
+
+
+class TestLazyHighlighting:
+    """Test render callbacks and window-relative tags used by lazy highlighting."""
+
+    def test_tags_follow_loaded_window(self, widget):
+        widget.set_content([f'line {i}' for i in range(10000)])
+        widget.scroll_to_line(5000)
+        widget.tag_add('result', '5001.0', '5001.end')
+        widget.tag_add('result', '10.0', '10.end')  # not loaded, ignored
+        ranges = widget.text_widget.tag_ranges('result')
+        assert len(ranges) == 2
+        assert widget.text_widget.get(ranges[0], ranges[1]) == 'line 5000'
+
+    def test_highlighter_retags_after_scroll(self, widget):
+        from calc_syntax import SyntaxHighlighter
+        lines = [f'# note {i}' for i in range(10000)]
+        widget.set_content(lines)
+        highlighter = SyntaxHighlighter(widget, pane='output', lazy=True)
+        highlighter.highlight_full('\n'.join(lines))
+        widget.scroll_to_line(7000)
+        first = widget.get_visible_range()[0]
+        assert highlighter._tagged[first] == 1
+        assert highlighter._tagged[0] == 0
+        assert widget.text_widget.tag_ranges('comment')
+
+
+class TestEdgeScrolling:
+    """Test that small scrolls only update the window edges and wheel events are coalesced."""
+
+    def _window_text(self, widget):
+        start = widget._window_start
+        return '\n'.join(widget._lines[start:start + widget._window_lines])
+
+    def test_small_scroll_keeps_window_consistent(self, widget):
+        widget.set_content([f'line {i}' for i in range(100000)])
+        widget.scroll_to_line(50000)
+        for offset in (50003, 50006, 49990, 50100):
+            widget.scroll_to_line(offset)
+            assert widget.text_widget.get("1.0", "end-1c") == self._window_text(widget)
+            assert widget.get_visible_range()[0] == offset
+
+    def test_wheel_events_coalesced(self, widget):
+        widget.set_content([f'line {i}' for i in range(10000)])
+
+        class Event:
+            num = 5
+            delta = -120
+
+        for _ in range(4):
+            widget._on_mousewheel_linux(Event())
+        assert widget.get_visible_range()[0] == 0
+        widget._flush_scroll()
+        assert widget.get_visible_range()[0] == 12
+        assert widget.text_widget.get("1.0", "end-1c") == self._window_text(widget)
+
+
+class TestVirtualEditing:
+    """Test editing through the inner Text widget (Tk bindings) in virtual mode."""
+
+    def test_typing_edits_full_document(self, widget):
+        widget.set_content([f'line {i}' for i in range(200000)])
+        widget.set_cursor_position(150000, 4)
+        widget.text_widget.insert('insert', 'X')
+        widget.text_widget.insert('insert', '\n')
+        assert widget.total_lines == 200001
+        assert widget.get('150001.0', '150002.end') == 'lineX\n 150000'
+        assert widget.get_cursor_position() == (150001, 0)
+        assert widget.text_widget.get('1.0', 'end-1c') == '\n'.join(
+            widget._lines[widget._window_start:widget._window_start + widget._window_lines])
+
+    def test_undo_redo(self, widget):
+        widget.configure(undo=True)
+        widget.set_content([f'line {i}' for i in range(1000)])
+        widget.set_cursor_position(500, 0)
+        for ch in 'abc':
+            widget.text_widget.insert('insert', ch)
+        widget.text_widget.edit_undo()
+        assert widget.get('501.0', '501.end') == 'line 500'
+        widget.edit_redo()
+        assert widget.get('501.0', '501.end') == 'abcline 500'
+
+    def test_modified_event_and_edit_callback(self, widget):
+        events, edits = [], []
+        widget.set_content(['a', 'b'])
+        widget.edit_modified(False)
+        widget.bind('<<Modified>>', lambda e: events.append(widget.edit_modified()))
+        widget.bind_edit(edits.append)
+        widget.text_widget.insert('2.1', 'c\nd')
+        widget.update()
+        assert events == [True]
+        assert edits[0].start == (1, 1) and edits[0].inserted == 'c\nd'
+
+    def test_modified_event_after_rebind(self, widget):
+        # Like Tk, the event is queued, so a handler bound again after
+        # replacing the content still sees it and can reset the flag
+        events = []
+
+        def on_modified(event):
+            events.append(widget.edit_modified())
+            widget.edit_modified(False)
+
+        widget.edit_modified(False)
+        widget.update()
+        widget.unbind('<<Modified>>')
+        widget.delete('1.0', 'end')
+        widget.insert('1.0', 'x = 1')
+        widget.bind('<<Modified>>', on_modified)
+        widget.update()
+        assert events == [True, False]
+        widget.text_widget.insert('1.0', 'y')
+        widget.update()
+        assert events == [True, False, True, False]
+
+    def test_select_all_covers_unloaded_lines(self, widget):
+        widget.set_content([f'line {i}' for i in range(1000)])
+        widget.select_all()
+        assert widget.get_selection() == ((0, 0), (999, 8))
+        widget.text_widget.delete('sel.first', 'sel.last')
+        assert widget.get_content() == ''
+        assert widget.total_lines == 1